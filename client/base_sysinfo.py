@@ -2,16 +2,31 @@ import os
 import shutil
 import re
 import glob
+import signal
 import subprocess
 import logging
 import gzip
+import threading
+import time
+import traceback
+import Queue
 
 from autotest.client.shared import log, software_manager, utils_memory
 from autotest.client.shared.settings import settings
 from autotest.client import utils
 
-_LOG_INSTALLED_PACKAGES = settings.get_value('CLIENT', 'log_installed_packages',
+_LOG_INSTALLED_PACKAGES = settings.get_value('CLIENT',
+                                             'log_installed_packages',
                                              type=bool, default=False)
+_PARALLEL_LOGGABLES = settings.get_value('CLIENT',
+                                         'sysinfo_parallel_loggables',
+                                         type=int, default=4)
+_TIME_BUDGET = settings.get_value('CLIENT', 'sysinfo_time_budget', type=int,
+                                  default=0)
+
+# package databases, modified whenever packages are installed or removed
+_PACKAGE_DATABASES = ["/var/lib/rpm/Packages", "/var/lib/rpm/rpmdb.sqlite",
+                      "/var/lib/dpkg/status"]
 
 _DEFAULT_COMMANDS_TO_LOG_PER_TEST = []
 _DEFAULT_COMMANDS_TO_LOG_PER_BOOT = [
@@ -40,6 +55,42 @@ _DEFAULT_FILES_TO_LOG_AFTER_ITERATION = [
 ]
 
 
+def _hash_file(path):
+    file_hash = utils.hash('md5')
+    f = open(path, "rb")
+    try:
+        while True:
+            data = f.read(65536)
+            if not data:
+                break
+            file_hash.update(data)
+    finally:
+        f.close()
+    return file_hash.digest()
+
+
+def _remove_log(path):
+    """ Remove a log about to be written again: it may be a hard link to the
+    same log of the current boot, which must be left unchanged. """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _get_package_databases_state():
+    """ Identify the current state of the package databases, or return None
+    if there is none. """
+    state = []
+    for path in _PACKAGE_DATABASES:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        state.append((path, stat.st_ino, stat.st_size, stat.st_mtime))
+    return tuple(state) or None
+
+
 class loggable(object):
 
     """ Abstract class for representing all things "loggable" by sysinfo. """
@@ -87,8 +138,10 @@ class logfile(loggable):
 
     def run(self, logdir):
         if os.path.exists(self.path):
+            logf_path = os.path.join(logdir, self.logf)
+            _remove_log(logf_path)
             try:
-                shutil.copyfile(self.path, os.path.join(logdir, self.logf))
+                shutil.copyfile(self.path, logf_path)
             except IOError:
                 logging.info("Not logging %s (lack of permissions)",
                              self.path)
@@ -124,17 +177,37 @@ class command(loggable):
     def __hash__(self):
         return hash((self.cmd, self.logf))
 
-    def run(self, logdir):
+    def run(self, logdir, timeout=None):
+        """
+        :param timeout: Seconds after which the command is killed, if not
+                None.
+        """
         env = os.environ.copy()
         if "PATH" not in env:
             env["PATH"] = "/usr/bin:/bin"
         logf_path = os.path.join(logdir, self.logf)
+        _remove_log(logf_path)
         stdin = open(os.devnull, "r")
         stderr = open(os.devnull, "w")
         stdout = open(logf_path, "w")
         try:
-            subprocess.call(self.cmd, stdin=stdin, stdout=stdout, stderr=stderr,
-                            shell=True, env=env)
+            if timeout is None:
+                subprocess.call(self.cmd, stdin=stdin, stdout=stdout,
+                                stderr=stderr, shell=True, env=env)
+            else:
+                # in its own process group, to kill the children of the shell
+                proc = subprocess.Popen(self.cmd, stdin=stdin, stdout=stdout,
+                                        stderr=stderr, shell=True, env=env,
+                                        preexec_fn=os.setsid)
+                end_time = time.time() + timeout
+                while proc.poll() is None:
+                    if time.time() >= end_time:
+                        logging.info("Killing %s (sysinfo time budget "
+                                     "exceeded)", self.cmd)
+                        os.killpg(proc.pid, signal.SIGKILL)
+                        proc.wait()
+                        break
+                    time.sleep(0.05)
         finally:
             for f in (stdin, stdout, stderr):
                 f.close()
@@ -195,10 +268,19 @@ class base_sysinfo(object):
         self.boot_loggables.add(command("uname -a", logf="uname",
                                         log_in_keyval=True))
         self.sm = software_manager.SoftwareManager()
+        # the last list of installed packages, and the state of the package
+        # databases it was listed in
+        self._installed_packages_list = None
+        self._package_databases_state = None
+        # path of a boot level log file -> (its mtime, its hash)
+        self._boot_file_hashes = {}
 
     def __getstate__(self):
         ret = dict(self.__dict__)
         ret["sm"] = None
+        ret["_installed_packages_list"] = None
+        ret["_package_databases_state"] = None
+        ret["_boot_file_hashes"] = {}
         return ret
 
     def serialize(self):
@@ -239,6 +321,99 @@ class base_sysinfo(object):
             os.mkdir(logdir)
         return logdir
 
+    def _run_loggables(self, loggables, logdir):
+        """
+        Run loggables into logdir, up to _PARALLEL_LOGGABLES at a time.
+
+        With a _TIME_BUDGET, the loggables not started in time are skipped
+        and the commands still running after it are killed.
+        """
+        if _TIME_BUDGET:
+            end_time = time.time() + _TIME_BUDGET
+        else:
+            end_time = None
+        pending = Queue.Queue()
+        # start the commands first, they usually take longer than files
+        for log in sorted(loggables, key=lambda log: not isinstance(log,
+                                                                    command)):
+            pending.put(log)
+
+        def run_pending():
+            while True:
+                try:
+                    log = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    if end_time is None:
+                        log.run(logdir)
+                        continue
+                    remaining = end_time - time.time()
+                    if remaining <= 0:
+                        logging.info("Not logging %r (sysinfo time budget "
+                                     "exceeded)", log)
+                    elif isinstance(log, command):
+                        log.run(logdir, timeout=remaining)
+                    else:
+                        log.run(logdir)
+                except Exception, e:
+                    logging.warning("Logging %r failed: %s", log, e)
+                    for line in traceback.format_exc().splitlines():
+                        logging.debug(line)
+
+        workers = []
+        for i in xrange(min(_PARALLEL_LOGGABLES, len(loggables)) - 1):
+            worker = threading.Thread(target=run_pending)
+            worker.start()
+            workers.append(worker)
+        run_pending()
+        for worker in workers:
+            worker.join()
+
+    def _get_boot_file_hash(self, path):
+        mtime = os.path.getmtime(path)
+        if path in self._boot_file_hashes:
+            hashed_mtime, file_hash = self._boot_file_hashes[path]
+            if hashed_mtime == mtime:
+                return file_hash
+        file_hash = _hash_file(path)
+        self._boot_file_hashes[path] = (mtime, file_hash)
+        return file_hash
+
+    def _link_identical_files(self, loggables, logdir, boot_dir):
+        """
+        Replace the files logged by loggables into logdir which are
+        identical to the ones logged for the current boot by hard links to
+        them.
+        """
+        for log in loggables:
+            path = os.path.join(logdir, log.logf)
+            boot_path = os.path.join(boot_dir, log.logf)
+            try:
+                if (not os.path.isfile(path) or
+                        not os.path.isfile(boot_path) or
+                        os.path.samefile(path, boot_path) or
+                        os.path.getsize(path) != os.path.getsize(boot_path)):
+                    continue
+                if _hash_file(path) != self._get_boot_file_hash(boot_path):
+                    continue
+                link_path = path + ".link"
+                os.link(boot_path, link_path)
+                os.rename(link_path, path)
+            except (IOError, OSError), e:
+                # e.g. logdir and boot_dir in different file systems
+                logging.debug("Not linking %s to %s: %s", path, boot_path, e)
+
+    def _list_installed_packages(self):
+        """ List the installed packages, querying the package manager only
+        when its database changed since the last time. """
+        state = _get_package_databases_state()
+        if (state is None or state != self._package_databases_state or
+                self._installed_packages_list is None):
+            self._installed_packages_list = self.sm.list_all()
+            self._package_databases_state = state
+        return self._installed_packages_list
+
     @log.log_and_ignore_errors("post-reboot sysinfo error:")
     def log_per_reboot_data(self):
         """ Logging hook called whenever a job starts, and again after
@@ -247,20 +422,20 @@ class base_sysinfo(object):
         if not os.path.exists(logdir):
             os.mkdir(logdir)
 
-        for log in (self.test_loggables | self.boot_loggables):
-            log.run(logdir)
+        self._run_loggables(self.test_loggables | self.boot_loggables, logdir)
 
         if _LOG_INSTALLED_PACKAGES:
             # also log any installed packages
             installed_path = os.path.join(logdir, "installed_packages")
-            installed_packages = "\n".join(self.sm.list_all()) + "\n"
+            installed_packages = ("\n".join(self._list_installed_packages()) +
+                                  "\n")
             utils.open_write_close(installed_path, installed_packages)
 
     @log.log_and_ignore_errors("pre-test sysinfo error:")
     def log_before_each_test(self, test):
         """ Logging hook called before a test starts. """
         if _LOG_INSTALLED_PACKAGES:
-            self._installed_packages = self.sm.list_all()
+            self._installed_packages = self._list_installed_packages()
             # Also log the list of installed packaged before each test starts
             test_sysinfodir = self._get_sysinfodir(test.outputdir)
             installed_path = os.path.join(test_sysinfodir, "installed_packages")
@@ -293,9 +468,11 @@ class base_sysinfo(object):
             raise Exception('%s: whilst linking %s to %s' % (e, symlink_src,
                                                              symlink_dest))
 
-        # run all the standard logging commands
-        for log in self.test_loggables:
-            log.run(test_sysinfodir)
+        # run all the standard logging commands, and link the files that
+        # did not change since the boot
+        self._run_loggables(self.test_loggables, test_sysinfodir)
+        self._link_identical_files(self.test_loggables, test_sysinfodir,
+                                   reboot_dir)
 
         # grab any new data from the system log
         self._log_messages(test_sysinfodir)
@@ -307,7 +484,7 @@ class base_sysinfo(object):
         if _LOG_INSTALLED_PACKAGES:
             # log any changes to installed packages
             old_packages = set(self._installed_packages)
-            new_packages = set(self.sm.list_all())
+            new_packages = set(self._list_installed_packages())
             added_path = os.path.join(test_sysinfodir, "added_packages")
             added_packages = "\n".join(new_packages - old_packages) + "\n"
             utils.open_write_close(added_path, added_packages)
@@ -322,8 +499,7 @@ class base_sysinfo(object):
             iteration = test.iteration
         logdir = self._get_iteration_subdir(test, iteration)
 
-        for log in self.before_iteration_loggables:
-            log.run(logdir)
+        self._run_loggables(self.before_iteration_loggables, logdir)
 
     @log.log_and_ignore_errors("post-test siteration sysinfo error:")
     def log_after_each_iteration(self, test, iteration=None):
@@ -332,8 +508,7 @@ class base_sysinfo(object):
             iteration = test.iteration
         logdir = self._get_iteration_subdir(test, iteration)
 
-        for log in self.after_iteration_loggables:
-            log.run(logdir)
+        self._run_loggables(self.after_iteration_loggables, logdir)
 
     def _log_messages(self, logdir):
         """ Log all of the new data in the system log. """
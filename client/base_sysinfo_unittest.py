@@ -0,0 +1,136 @@
+#!/usr/bin/python
+
+"""Tests for autotest.client.base_sysinfo."""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+try:
+    import autotest.common as common
+except ImportError:
+    import common
+from autotest.client import base_sysinfo
+
+
+class stub_software_manager(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def list_all(self):
+        self.calls += 1
+        return ["pkg-1.0"]
+
+
+class test_base_sysinfo(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.sysinfo = base_sysinfo.base_sysinfo(self.tmpdir)
+        self.logdir = os.path.join(self.tmpdir, "logs")
+        os.mkdir(self.logdir)
+        self.orig_parallel = base_sysinfo._PARALLEL_LOGGABLES
+        self.orig_budget = base_sysinfo._TIME_BUDGET
+        self.orig_databases = base_sysinfo._PACKAGE_DATABASES
+
+    def tearDown(self):
+        base_sysinfo._PARALLEL_LOGGABLES = self.orig_parallel
+        base_sysinfo._TIME_BUDGET = self.orig_budget
+        base_sysinfo._PACKAGE_DATABASES = self.orig_databases
+        shutil.rmtree(self.tmpdir)
+
+    def _read(self, name):
+        return open(os.path.join(self.logdir, name)).read()
+
+    def test_run_loggables_concurrently(self):
+        base_sysinfo._PARALLEL_LOGGABLES = 4
+        base_sysinfo._TIME_BUDGET = 0
+        loggables = set(base_sysinfo.command("sleep 1; echo %d" % i,
+                                             logf="cmd%d" % i)
+                        for i in xrange(4))
+        start = time.time()
+        self.sysinfo._run_loggables(loggables, self.logdir)
+        self.assertTrue(time.time() - start < 3)
+        for i in xrange(4):
+            self.assertEqual("%d\n" % i, self._read("cmd%d" % i))
+
+    def test_run_loggables_time_budget(self):
+        base_sysinfo._PARALLEL_LOGGABLES = 1
+        base_sysinfo._TIME_BUDGET = 1
+        slow = base_sysinfo.command("echo started; sleep 30", logf="slow")
+        skipped = base_sysinfo.command("echo skipped", logf="skipped")
+        start = time.time()
+        self.sysinfo._run_loggables([slow, skipped], self.logdir)
+        self.assertTrue(time.time() - start < 10)
+        self.assertEqual("started\n", self._read("slow"))
+        self.assertFalse(os.path.exists(os.path.join(self.logdir, "skipped")))
+
+    def test_run_loggables_failure(self):
+        base_sysinfo._PARALLEL_LOGGABLES = 2
+        base_sysinfo._TIME_BUDGET = 0
+        missing = base_sysinfo.command("true", logf="missing/log")
+        other = base_sysinfo.command("echo other", logf="other")
+        self.sysinfo._run_loggables([missing, other], self.logdir)
+        self.assertEqual("other\n", self._read("other"))
+
+    def test_link_identical_files(self):
+        boot_dir = os.path.join(self.tmpdir, "boot")
+        os.mkdir(boot_dir)
+        for name, boot_data, data in (("same", "a\n", "a\n"),
+                                      ("changed", "a\n", "b\n"),
+                                      ("resized", "a\n", "ab\n")):
+            open(os.path.join(boot_dir, name), "w").write(boot_data)
+            open(os.path.join(self.logdir, name), "w").write(data)
+        loggables = [base_sysinfo.command("true", logf=name)
+                     for name in ("same", "changed", "resized", "absent")]
+        self.sysinfo._link_identical_files(loggables, self.logdir, boot_dir)
+        self.assertTrue(os.path.samefile(os.path.join(self.logdir, "same"),
+                                         os.path.join(boot_dir, "same")))
+        for name, data in (("changed", "b\n"), ("resized", "ab\n")):
+            self.assertFalse(os.path.samefile(os.path.join(self.logdir, name),
+                                              os.path.join(boot_dir, name)))
+            self.assertEqual(data, self._read(name))
+
+    def test_linked_files_rewritten(self):
+        boot_dir = os.path.join(self.tmpdir, "boot")
+        os.mkdir(boot_dir)
+        source = os.path.join(self.tmpdir, "source")
+        open(source, "w").write("a\n")
+        loggables = [base_sysinfo.command("echo a", logf="cmd"),
+                     base_sysinfo.logfile(source, logf="file")]
+        for log in loggables:
+            log.run(boot_dir)
+            log.run(self.logdir)
+        self.sysinfo._link_identical_files(loggables, self.logdir, boot_dir)
+        open(source, "w").write("b\n")
+        loggables[0].cmd = "echo b"
+        for log in loggables:
+            log.run(self.logdir)
+            self.assertEqual("b\n", self._read(log.logf))
+            self.assertEqual("a\n",
+                             open(os.path.join(boot_dir, log.logf)).read())
+
+    def test_installed_packages_cache(self):
+        database = os.path.join(self.tmpdir, "Packages")
+        open(database, "w").write("1")
+        base_sysinfo._PACKAGE_DATABASES = [database]
+        self.sysinfo.sm = stub_software_manager()
+        self.assertEqual(["pkg-1.0"], self.sysinfo._list_installed_packages())
+        self.assertEqual(["pkg-1.0"], self.sysinfo._list_installed_packages())
+        self.assertEqual(1, self.sysinfo.sm.calls)
+        open(database, "w").write("12")
+        self.sysinfo._list_installed_packages()
+        self.assertEqual(2, self.sysinfo.sm.calls)
+
+    def test_installed_packages_no_database(self):
+        base_sysinfo._PACKAGE_DATABASES = [os.path.join(self.tmpdir, "none")]
+        self.sysinfo.sm = stub_software_manager()
+        self.sysinfo._list_installed_packages()
+        self.sysinfo._list_installed_packages()
+        self.assertEqual(2, self.sysinfo.sm.calls)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -91,6 +91,8 @@ class base_client_job(base_job.base_job):
     """
 
     _WARNING_DISABLE_DELAY = 5
+    # seconds between two merges of the status logs of parallel tasks
+    _PARALLEL_LOG_MERGE_INTERVAL = 5
 
     # _record_indent is a persistent property, but only on the client
     _job_state = base_job.base_job._job_state
@@ -866,45 +868,67 @@ class base_client_job(base_job.base_job):
         logging.info("job: noop: " + text)
 
     @_run_test_complete_on_exit
-    def parallel(self, *tasklist):
-        """Run tasks in parallel"""
+    def parallel(self, *tasklist, **dargs):
+        """
+        Run tasks in parallel
 
-        pids = []
-        old_log_filename = self._logger.global_filename
-        for i, task in enumerate(tasklist):
-            assert isinstance(task, (tuple, list))
-            self._logger.global_filename = old_log_filename + (".%d" % i)
-
-            def task_func():
-                # stub out _record_indent with a process-local one
-                base_record_indent = self._record_indent
-                proc_local = self._job_state.property_factory(
-                    '_state', '_record_indent.%d' % os.getpid(),
-                    base_record_indent, namespace='client')
-                self.__class__._record_indent = proc_local
-                task[0](*task[1:])
-            pids.append(parallel.fork_start(self.resultdir, task_func))
+        :param max_procs: Maximum number of tasks running at once, all of them
+                if None (the default).  The tasks are started in order, as
+                running ones finish.
+        """
+        max_procs = dargs.pop('max_procs', None)
+        if dargs:
+            raise TypeError('parallel() got unexpected keyword arguments %s'
+                            % ', '.join(dargs))
+        if max_procs is not None and max_procs < 1:
+            raise ValueError('parallel() max_procs must be at least 1, not %r'
+                             % max_procs)
 
+        old_log_filename = self._logger.global_filename
         old_log_path = os.path.join(self.resultdir, old_log_filename)
-        old_log = open(old_log_path, "a")
+        self._logger.flush()
+        log_merger = base_job.status_log_merger(old_log_path)
+        pending = list(enumerate(tasklist))
+        procs = {}
+        task_log_paths = {}
         exceptions = []
-        for i, pid in enumerate(pids):
-            # wait for the task to finish
-            try:
-                parallel.fork_waitfor(self.resultdir, pid)
-            except Exception, e:
-                exceptions.append(e)
-            # copy the logs from the subtask into the main log
-            new_log_path = old_log_path + (".%d" % i)
-            if os.path.exists(new_log_path):
-                new_log = open(new_log_path)
-                old_log.write(new_log.read())
-                new_log.close()
-                old_log.flush()
-                os.remove(new_log_path)
-        old_log.close()
-
-        self._logger.global_filename = old_log_filename
+        try:
+            while pending or procs:
+                while pending and (max_procs is None or
+                                   len(procs) < max_procs):
+                    i, task = pending.pop(0)
+                    assert isinstance(task, (tuple, list))
+                    self._logger.global_filename = (old_log_filename +
+                                                    ".%d" % i)
+
+                    def task_func():
+                        # stub out _record_indent with a process-local one,
+                        # not backed by the job state file
+                        self.__class__._record_indent = self._record_indent
+                        task[0](*task[1:])
+                    try:
+                        pid, fd = parallel.fork_start_watched(self.resultdir,
+                                                              task_func)
+                    finally:
+                        self._logger.global_filename = old_log_filename
+                    procs[pid] = fd
+                    task_log_paths[pid] = old_log_path + ".%d" % i
+                    log_merger.add(task_log_paths[pid])
+
+                # wait for whichever task finishes first, merging the logs
+                # of the running tasks meanwhile
+                pid, status = parallel.fork_waitany(
+                    procs, timeout=self._PARALLEL_LOG_MERGE_INTERVAL)
+                if pid is None:
+                    log_merger.merge()
+                    continue
+                try:
+                    parallel.fork_check_status(self.resultdir, pid, status)
+                except Exception, e:
+                    exceptions.append(e)
+                log_merger.remove(task_log_paths.pop(pid))
+        finally:
+            log_merger.close()
 
         # handle any exceptions raised by the parallel tasks
         if exceptions:
@@ -918,6 +942,8 @@ class base_client_job(base_job.base_job):
 
     def complete(self, status):
         """Write pending TAP reports, clean up, and exit"""
+        self._logger.close()
+
         # write out TAP reports
         if self._tap.do_tap_report:
             self._tap.write()
@@ -737,6 +737,15 @@ class test_base_job(unittest.TestCase):
             expected_args = test_set[t]
             self.assertEqual(parsed_args, expected_args)
 
+    def test_parallel_max_procs_must_be_positive(self):
+        self.construct_job(True)
+        for max_procs in (0, -1):
+            self.job.harness.run_test_complete.expect_call()
+            utils_memory.drop_caches.expect_call()
+            self.assertRaises(ValueError, self.job.parallel, [dummy],
+                              max_procs=max_procs)
+        self.god.check_playback()
+
     def test_run_test_timeout_parameter_is_propagated(self):
         self.construct_job(True)
 
@@ -9,12 +9,15 @@ import pickle
 import traceback
 import gc
 import time
-from autotest.client.shared import error, utils
+import fcntl
+import select
+from autotest.client.shared import base_job, error, utils
 
 
 def fork_start(tmp, l):
     sys.stdout.flush()
     sys.stderr.flush()
+    base_job.flush_status_logs()
     pid = os.fork()
     if pid:
         # Parent
@@ -46,6 +49,7 @@ def fork_start(tmp, l):
 
                 sys.stdout.flush()
                 sys.stderr.flush()
+                base_job.flush_status_logs()
         finally:
             # clear exception information to allow garbage collection of
             # objects referenced by the exception's traceback
@@ -56,10 +60,96 @@ def fork_start(tmp, l):
         try:
             sys.stdout.flush()
             sys.stderr.flush()
+            base_job.flush_status_logs()
         finally:
             os._exit(0)
 
 
+def fork_start_watched(tmp, l):
+    """
+    Same as fork_start, but also returns a descriptor that reaches end of
+    file when the child process terminates, for fork_waitany.
+
+    :return: (pid, descriptor)
+    """
+    r, w = os.pipe()
+    # only the child holds the write end, and not the programs it executes
+    flags = fcntl.fcntl(w, fcntl.F_GETFD)
+    fcntl.fcntl(w, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+    def child():
+        os.close(r)
+        l()
+    try:
+        pid = fork_start(tmp, child)
+    finally:
+        os.close(w)
+    return pid, r
+
+
+def fork_waitany(procs, timeout=None):
+    """
+    Waits for whichever of procs terminates first, without reaping other
+    child processes as os.wait() would.
+
+    :param procs: Dictionary mapping the pids of processes started with
+            fork_start_watched to the descriptors it returned.  The
+            terminated process is removed from it and its descriptor closed.
+    :param timeout: Seconds to wait at most, forever if None.
+    :return: (pid, status) of the terminated process, or (None, None) if
+            timeout expires first.
+    """
+    if timeout is not None:
+        end_time = time.time() + timeout
+    while True:
+        for pid, fd in procs.items():
+            (child_pid, status) = os.waitpid(pid, os.WNOHANG)
+            if child_pid:
+                del procs[pid]
+                if fd is not None:
+                    os.close(fd)
+                return pid, status
+
+        if None in procs.values():
+            # a process closed its descriptor, it has to be polled
+            poll_time = 0.1
+        else:
+            # in case a grandchild process inherited a descriptor
+            poll_time = 2
+        if timeout is not None:
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                return None, None
+            poll_time = min(poll_time, remaining)
+
+        poller = select.poll()
+        pids = {}
+        for pid, fd in procs.iteritems():
+            if fd is not None:
+                poller.register(fd, select.POLLIN)
+                pids[fd] = pid
+        try:
+            events = poller.poll(poll_time * 1000)
+        except select.error:
+            # interrupted by a signal
+            continue
+        for fd, event in events:
+            # the process closed the descriptor, usually by terminating
+            os.close(fd)
+            procs[pids[fd]] = None
+
+
+def fork_check_status(tmp, pid, status):
+    """
+    Raises the exception of a terminated child process, or a TestError if
+    it failed without one.
+    """
+    _check_for_subprocess_exception(tmp, pid)
+
+    if status:
+        raise error.TestError("Test subprocess failed rc=%d" % (status))
+
+
 def _check_for_subprocess_exception(temp_dir, pid):
     ename = temp_dir + "/debug/error-%d" % pid
     if os.path.exists(ename):
@@ -84,10 +174,7 @@ def _check_for_subprocess_exception(temp_dir, pid):
 def fork_waitfor(tmp, pid):
     (pid, status) = os.waitpid(pid, 0)
 
-    _check_for_subprocess_exception(tmp, pid)
-
-    if status:
-        raise error.TestError("Test subprocess failed rc=%d" % (status))
+    fork_check_status(tmp, pid, status)
 
 
 def fork_waitfor_timed(tmp, pid, timeout):
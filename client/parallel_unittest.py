@@ -0,0 +1,66 @@
+#!/usr/bin/python
+
+"""Tests for autotest.client.parallel."""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+try:
+    import autotest.common as common
+except ImportError:
+    import common
+from autotest.client.shared import error
+from autotest.client import parallel
+
+
+class test_fork_waitany(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_first_to_finish(self):
+        procs = {}
+        slow, fd = parallel.fork_start_watched(self.tmpdir,
+                                               lambda: time.sleep(1))
+        procs[slow] = fd
+        fast, fd = parallel.fork_start_watched(self.tmpdir, lambda: None)
+        procs[fast] = fd
+
+        start = time.time()
+        self.assertEqual((fast, 0), parallel.fork_waitany(procs))
+        self.assert_(time.time() - start < 0.5)
+        self.assertEqual([slow], procs.keys())
+        self.assertEqual((None, None),
+                         parallel.fork_waitany(procs, timeout=0.1))
+        self.assertEqual((slow, 0), parallel.fork_waitany(procs))
+        self.assertEqual({}, procs)
+
+    def test_closed_descriptor(self):
+        def close_and_sleep():
+            for fd in xrange(3, 256):
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+            time.sleep(0.5)
+        pid, fd = parallel.fork_start_watched(self.tmpdir, close_and_sleep)
+        self.assertEqual((pid, 0), parallel.fork_waitany({pid: fd}))
+
+    def test_check_status(self):
+        def fail():
+            raise error.TestFail('failed')
+        pid, fd = parallel.fork_start_watched(self.tmpdir, fail)
+        pid, status = parallel.fork_waitany({pid: fd})
+        self.assertRaises(error.TestFail, parallel.fork_check_status,
+                          self.tmpdir, pid, status)
+        self.assertRaises(error.TestError, parallel.fork_check_status,
+                          self.tmpdir, pid, status)
+
+
+if __name__ == '__main__':
+    unittest.main()
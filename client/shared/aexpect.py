@@ -14,9 +14,18 @@ import fcntl
 import tempfile
 import logging
 import shutil
+import collections
+import errno
+import signal
+import socket
+import struct
+import time
 
 BASE_DIR = os.path.join('/tmp', 'aexpect')
 
+# Bytes asked for by each read from a terminal or a pipe
+_READ_SIZE = 65536
+
 
 def clean_tmp_files():
     """
@@ -98,8 +107,634 @@ def _get_reader_filename(base_dir, a_id, reader):
     return os.path.join(base_dir, a_id, "outpipe-%s" % reader)
 
 
+def _exec_command(a_id, command, env=None):
+    """
+    Run command in a subshell, replacing the current (forked) process.
+
+    :param env: Environment of the command, or None to keep the current one.
+    """
+    if len(command) > 255:
+        new_stack = None
+        if len(command) > 2000000:
+            # Stack size would probably not suffice (and no open files)
+            # (1 + len(command) * 4 / 8290304) * 8196
+            # 2MB => 8196kb, 4MB => 16392, ...
+            new_stack = (1 + len(command) / 2072576) * 8196
+            command = "ulimit -s %s\nulimit -n 819200\n%s" % (new_stack,
+                                                              command)
+        tmp_dir = os.path.join(BASE_DIR, a_id)
+        tmp_file = tempfile.mktemp(suffix='.sh',
+                                   prefix='aexpect-', dir=tmp_dir)
+        fd_cmd = open(tmp_file, "w")
+        fd_cmd.write(command)
+        fd_cmd.close()
+        args = ["/bin/bash", "-c", "source %s" % tmp_file]
+    else:
+        args = ["/bin/bash", "-c", command]
+    if env is None:
+        os.execv("/bin/bash", args)
+    else:
+        os.execve("/bin/bash", args, env)
+
+
+# The following is the multiplexing server part of the module.  A single
+# multiplexing server process runs the child processes of any number of
+# clients, see use_multiplex_server().  It provides the same files and pipes
+# as a server of its own would to each client, so clients find and attach to
+# its child processes the same way.
+
+# Bytes of output kept for each reader pipe while its client doesn't read it
+# (the oldest output is dropped beyond, the output file keeps it all)
+_READER_BUFFER_SIZE = 8 * 1024 * 1024
+
+# Seconds the multiplexing server waits for new child processes to run after
+# the last one terminated, before exiting
+_MULTIPLEX_IDLE_TIMEOUT = 60
+
+# Seconds a client waits for the multiplexing server to start its child
+# process, before running it with a server of its own
+_MULTIPLEX_REQUEST_TIMEOUT = 30
+
+
+def _get_multiplex_filenames(base_dir):
+    return [os.path.join(base_dir, s) for s in
+            "multiplex-server.sock", "lock-multiplex-starting",
+            "multiplex-server-log"]
+
+
+def _trylock(filename):
+    """
+    Lock filename if no other process holds its lock.
+
+    :return: The file descriptor holding the lock, or None.
+    """
+    if not os.path.exists(filename):
+        open(filename, "w").close()
+    fd = os.open(filename, os.O_RDWR)
+    try:
+        fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        os.close(fd)
+        return None
+    _set_cloexec(fd)
+    return fd
+
+
+def _set_cloexec(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+
+def _set_nonblocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+def _encode_request(a_id, echo, readers, command, cwd, env):
+    env = "\0".join("%s=%s" % item for item in env.items())
+    fields = (a_id, str(echo), ",".join(readers), command, cwd, env)
+    return "".join("%d\n%s" % (len(field), field) for field in fields)
+
+
+def _decode_request(data):
+    """
+    Each field of a request is its length, a newline and its text.
+
+    :return: (a_id, echo, readers, command, cwd, env) or None if the request
+            is incomplete.
+    :raise ValueError: If the request is invalid.
+    """
+    fields = []
+    start = 0
+    while len(fields) < 6:
+        newline = data.find("\n", start)
+        if newline < 0:
+            length = data[start:]
+        else:
+            length = data[start:newline]
+        if length and not length.isdigit():
+            raise ValueError("Invalid request field length %r" % length[:20])
+        if newline < 0:
+            return None
+        start = newline + 1 + int(length)
+        if len(data) < start:
+            return None
+        fields.append(data[newline + 1:start])
+    a_id, echo, readers, command, cwd, env = fields
+    env = dict(item.split("=", 1) for item in env.split("\0") if "=" in item)
+    readers = [reader for reader in readers.split(",") if reader]
+    return a_id, echo == "True", readers, command, cwd, env
+
+
+class _OutputBuffer(object):
+
+    """
+    Output waiting to be written to a reader pipe, kept in a ring of chunks
+    holding at most max_size bytes: when it is full, the oldest output is
+    dropped.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.dropped = 0
+        self._chunks = collections.deque()
+
+    def __len__(self):
+        return self.size
+
+    def append(self, data):
+        """
+        :return: The number of bytes of output dropped.
+        """
+        self._chunks.append(data)
+        self.size += len(data)
+        dropped = 0
+        while self.size > self.max_size:
+            chunk = self._chunks[0]
+            excess = self.size - self.max_size
+            if len(chunk) <= excess:
+                self._chunks.popleft()
+                excess = len(chunk)
+            else:
+                self._chunks[0] = chunk[excess:]
+            self.size -= excess
+            dropped += excess
+        self.dropped += dropped
+        return dropped
+
+    def write(self, fd):
+        """
+        Write as much of the output as possible to the non-blocking file
+        descriptor fd.
+        """
+        while self._chunks:
+            chunk = self._chunks[0]
+            try:
+                bytes_written = os.write(fd, chunk)
+            except OSError, e:
+                if e.errno == errno.EAGAIN:
+                    return
+                raise
+            self.size -= bytes_written
+            if bytes_written < len(chunk):
+                self._chunks[0] = chunk[bytes_written:]
+                return
+            self._chunks.popleft()
+
+
+class _Session(object):
+
+    """
+    A child process run by the multiplexing server, and its files.
+    """
+
+    def __init__(self, base_dir, a_id, echo, readers):
+        self.a_id = a_id
+        self.echo = echo
+        self.readers = readers
+        (self.shell_pid_filename,
+         self.status_filename,
+         self.output_filename,
+         self.inpipe_filename,
+         self.ctrlpipe_filename,
+         self.lock_server_running_filename,
+         self.lock_client_starting_filename,
+         _) = _get_filenames(base_dir, a_id)
+        self.reader_filenames = [_get_reader_filename(base_dir, a_id, reader)
+                                 for reader in readers]
+        self.pid = None
+        self.shell_fd = None
+        self.shell_eof = False
+        self.shell_output = False
+        self.status = None
+        self.lock_server_running = None
+        self.output_file = None
+        self.inpipe_fd = None
+        self.ctrlpipe_fd = None
+        self.ctrl_data = ""
+        self.input = collections.deque()
+        self.reader_fds = []
+        self.buffers = []
+        # The files created for the session, removed if it fails to start
+        self.created_files = []
+
+
+class _MultiplexServer(object):
+
+    """
+    Run the child processes of many clients in a single process, polling
+    their terminals and pipes with epoll.
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        (self.socket_filename,
+         self.lock_starting_filename,
+         _) = _get_multiplex_filenames(base_dir)
+        self.log = logging.getLogger()
+        self.epoll = select.epoll()
+        _set_cloexec(self.epoll.fileno())
+        # fd -> function handling its events
+        self.handlers = {}
+        self.masks = {}
+        self.sessions = {}
+        # fd -> [connected client socket, request read so far]
+        self.clients = {}
+        self.idle_since = time.time()
+
+        umask = os.umask(077)
+        try:
+            if os.path.exists(self.socket_filename):
+                os.unlink(self.socket_filename)
+            self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.listener.bind(self.socket_filename)
+        finally:
+            os.umask(umask)
+        self.listener.listen(64)
+        self.listener.setblocking(0)
+        _set_cloexec(self.listener.fileno())
+        self.socket_inode = os.stat(self.socket_filename).st_ino
+        self._register(self.listener.fileno(), select.EPOLLIN, self._accept)
+
+    def _register(self, fd, mask, handler):
+        self.epoll.register(fd, mask)
+        self.masks[fd] = mask
+        self.handlers[fd] = handler
+
+    def _modify(self, fd, mask):
+        if fd in self.masks and self.masks[fd] != mask:
+            self.epoll.modify(fd, mask)
+            self.masks[fd] = mask
+
+    def _unregister(self, fd):
+        if fd in self.masks:
+            self.epoll.unregister(fd)
+            del self.masks[fd]
+            del self.handlers[fd]
+
+    def run(self):
+        while self.listener or self.sessions or self.clients:
+            try:
+                events = self.epoll.poll(0.5)
+            except IOError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            for fd, event in events:
+                handler = self.handlers.get(fd)
+                if handler is None:
+                    continue
+                try:
+                    handler(event)
+                except Exception:
+                    self.log.exception("Error handling events of fd %s", fd)
+            for session in self.sessions.values():
+                try:
+                    self._check_termination(session)
+                except Exception:
+                    self.log.exception("Error terminating %s", session.a_id)
+                    self._close_session(session)
+            if self.sessions or self.clients:
+                self.idle_since = time.time()
+            elif (self.listener and
+                  time.time() - self.idle_since > _MULTIPLEX_IDLE_TIMEOUT):
+                self._stop_listening()
+        self.log.info("Exiting normally")
+
+    def _stop_listening(self):
+        """
+        Stop accepting new clients, unless one is starting a server.
+        """
+        lock_starting = _trylock(self.lock_starting_filename)
+        if lock_starting is None:
+            return
+        try:
+            try:
+                # a new server may have replaced the socket
+                if os.stat(self.socket_filename).st_ino == self.socket_inode:
+                    os.unlink(self.socket_filename)
+            except OSError:
+                pass
+            self._unregister(self.listener.fileno())
+            self.listener.close()
+            self.listener = None
+        finally:
+            _unlock(lock_starting)
+
+    def _accept(self, events):
+        while True:
+            try:
+                client, _ = self.listener.accept()
+            except socket.error, e:
+                if e.args[0] == errno.EAGAIN:
+                    return
+                raise
+            _set_cloexec(client.fileno())
+            # only the user running the server may run processes with it
+            pid, uid, gid = struct.unpack("3i", client.getsockopt(
+                socket.SOL_SOCKET, getattr(socket, "SO_PEERCRED", 17),
+                struct.calcsize("3i")))
+            if uid != os.getuid():
+                self.log.warning("Rejected client of uid %s", uid)
+                client.close()
+                continue
+            client.setblocking(0)
+            self.clients[client.fileno()] = [client, ""]
+            self._register(client.fileno(), select.EPOLLIN,
+                           lambda events, fd=client.fileno():
+                           self._read_request(fd))
+
+    def _close_client(self, fd):
+        self._unregister(fd)
+        self.clients.pop(fd)[0].close()
+
+    def _read_request(self, fd):
+        client = self.clients[fd][0]
+        try:
+            data = client.recv(65536)
+        except socket.error, e:
+            if e.args[0] == errno.EAGAIN:
+                return
+            data = ""
+        if not data:
+            self._close_client(fd)
+            return
+        self.clients[fd][1] += data
+        try:
+            request = _decode_request(self.clients[fd][1])
+        except ValueError, e:
+            self.log.warning("Rejected request: %s", e)
+            reply = "Server request failed: %s\n" % e
+        else:
+            if request is None:
+                return
+            a_id = request[0]
+            try:
+                self._start_session(*request)
+                reply = "Server %s ready\n" % a_id
+            except Exception, e:
+                self.log.exception("Failed to start %s", a_id)
+                reply = "Server %s failed: %s\n" % (a_id, e)
+        try:
+            client.setblocking(1)
+            client.sendall(reply)
+        except socket.error:
+            pass
+        self._close_client(fd)
+
+    def _start_session(self, a_id, echo, readers, command, cwd, env):
+        if a_id in self.sessions:
+            raise ValueError("%s is already running" % a_id)
+        command += " && echo %s > /dev/null" % a_id
+        self.log.info("Starting %s with echo: %s, readers: %s, command: %s",
+                      a_id, echo, readers, command)
+        session = _Session(self.base_dir, a_id, echo, readers)
+        session.lock_server_running = _trylock(
+            session.lock_server_running_filename)
+        if session.lock_server_running is None:
+            raise ValueError("%s is locked by another server" % a_id)
+        try:
+            self._open_session(session, command, cwd, env)
+        except Exception:
+            if session.pid:
+                try:
+                    os.kill(session.pid, signal.SIGKILL)
+                    os.waitpid(session.pid, 0)
+                except OSError:
+                    pass
+            self._close_session(session)
+            for filename in session.created_files:
+                try:
+                    os.unlink(filename)
+                except OSError:
+                    pass
+            raise
+        self.sessions[a_id] = session
+
+    def _open_session(self, session, command, cwd, env):
+        env["TERM"] = "dumb"
+        (session.pid, session.shell_fd) = pty.fork()
+        if session.pid == 0:
+            # Child process: run the command in a subshell
+            try:
+                try:
+                    os.chdir(cwd)
+                except OSError:
+                    pass
+                _exec_command(session.a_id, command, env)
+            finally:
+                os._exit(1)
+        _set_cloexec(session.shell_fd)
+        _set_nonblocking(session.shell_fd)
+        _makestandard(session.shell_fd, session.echo)
+        self._register(session.shell_fd, select.EPOLLIN,
+                       lambda events: self._shell_event(session, events))
+
+        session.created_files.append(session.output_filename)
+        session.output_file = open(session.output_filename, "w")
+        _set_cloexec(session.output_file.fileno())
+        session.inpipe_fd = self._open_pipe(session, session.inpipe_filename)
+        self._register(session.inpipe_fd, select.EPOLLIN,
+                       lambda events: self._read_input(session))
+        session.ctrlpipe_fd = self._open_pipe(session,
+                                              session.ctrlpipe_filename)
+        self._register(session.ctrlpipe_fd, select.EPOLLIN,
+                       lambda events: self._read_ctrl(session))
+        for i, filename in enumerate(session.reader_filenames):
+            fd = self._open_pipe(session, filename)
+            session.reader_fds.append(fd)
+            session.buffers.append(_OutputBuffer(_READER_BUFFER_SIZE))
+            self._register(fd, 0, lambda events, i=i:
+                           self._write_reader(session, i))
+
+        session.created_files.append(session.shell_pid_filename)
+        fileobj = open(session.shell_pid_filename, "w")
+        fileobj.write(str(session.pid))
+        fileobj.close()
+
+    def _open_pipe(self, session, filename):
+        os.mkfifo(filename)
+        session.created_files.append(filename)
+        fd = os.open(filename, os.O_RDWR | os.O_NONBLOCK)
+        _set_cloexec(fd)
+        return fd
+
+    def _shell_event(self, session, events):
+        if events & select.EPOLLOUT:
+            self._write_input(session)
+        if events & (select.EPOLLIN | select.EPOLLHUP | select.EPOLLERR):
+            self._read_output(session)
+
+    def _read_output(self, session):
+        """
+        :return: Whether some output was read.
+        """
+        try:
+            data = os.read(session.shell_fd, _READ_SIZE)
+        except OSError, e:
+            if e.errno == errno.EAGAIN:
+                return False
+            data = ""
+        if not data:
+            # The terminal was closed: stop polling it, the termination of
+            # the child process is checked every time around the loop
+            session.shell_eof = True
+            session.input.clear()
+            self._unregister(session.shell_fd)
+            return False
+        session.shell_output = True
+        # Remove carriage returns from the data -- they often cause
+        # trouble and are normally not needed
+        data = data.replace("\r", "")
+        session.output_file.write(data)
+        session.output_file.flush()
+        for i, output_buffer in enumerate(session.buffers):
+            if output_buffer.append(data) and output_buffer.dropped == \
+                    output_buffer.max_size + len(data):
+                self.log.warning("%s: reader %s is not read, dropping its "
+                                 "oldest output", session.a_id,
+                                 session.readers[i])
+            self._write_reader(session, i)
+        return True
+
+    def _write_reader(self, session, i):
+        output_buffer = session.buffers[i]
+        output_buffer.write(session.reader_fds[i])
+        if output_buffer:
+            self._modify(session.reader_fds[i], select.EPOLLOUT)
+        else:
+            self._modify(session.reader_fds[i], 0)
+
+    def _read_input(self, session):
+        try:
+            data = os.read(session.inpipe_fd, _READ_SIZE)
+        except OSError, e:
+            if e.errno == errno.EAGAIN:
+                return
+            raise
+        if not session.shell_eof:
+            session.input.append(data)
+            self._write_input(session)
+
+    def _write_input(self, session):
+        while session.input:
+            data = session.input[0]
+            try:
+                bytes_written = os.write(session.shell_fd, data)
+            except OSError, e:
+                if e.errno == errno.EAGAIN:
+                    break
+                session.input.clear()
+                break
+            if bytes_written < len(data):
+                session.input[0] = data[bytes_written:]
+            else:
+                session.input.popleft()
+        if session.input:
+            self._modify(session.shell_fd, select.EPOLLIN | select.EPOLLOUT)
+        else:
+            self._modify(session.shell_fd, select.EPOLLIN)
+
+    def _read_ctrl(self, session):
+        try:
+            session.ctrl_data += os.read(session.ctrlpipe_fd, 1024)
+        except OSError, e:
+            if e.errno == errno.EAGAIN:
+                return
+            raise
+        while len(session.ctrl_data) >= 10:
+            cmd_len = int(session.ctrl_data[:10])
+            if len(session.ctrl_data) < 10 + cmd_len:
+                break
+            data = session.ctrl_data[10:10 + cmd_len]
+            session.ctrl_data = session.ctrl_data[10 + cmd_len:]
+            if session.shell_eof:
+                continue
+            if data == "raw":
+                _makeraw(session.shell_fd)
+            elif data == "standard":
+                _makestandard(session.shell_fd, session.echo)
+
+    def _check_termination(self, session):
+        if session.status is None:
+            # As a server of its own, check whether the child process
+            # terminated when it has no output to read
+            if session.shell_output:
+                session.shell_output = False
+                return
+            pid, status = os.waitpid(session.pid, os.WNOHANG)
+            if not pid:
+                return
+            while not session.shell_eof and self._read_output(session):
+                pass
+            session.status = os.WEXITSTATUS(status)
+            self.log.info("%s terminated with status %s", session.a_id,
+                          session.status)
+            fileobj = open(session.status_filename, "w")
+            fileobj.write(str(session.status))
+            fileobj.close()
+        # Wait for the client to finish initializing
+        lock_client_starting = _trylock(session.lock_client_starting_filename)
+        if lock_client_starting is None:
+            return
+        _unlock(lock_client_starting)
+        for i in range(len(session.buffers)):
+            self._write_reader(session, i)
+        self._close_session(session)
+
+    def _close_session(self, session):
+        self.sessions.pop(session.a_id, None)
+        for i, output_buffer in enumerate(session.buffers):
+            if output_buffer.dropped:
+                self.log.warning("%s: dropped %d bytes of the output of "
+                                 "reader %s", session.a_id,
+                                 output_buffer.dropped, session.readers[i])
+        fds = [session.shell_fd, session.inpipe_fd, session.ctrlpipe_fd]
+        for fd in fds + session.reader_fds:
+            if fd is not None:
+                self._unregister(fd)
+                os.close(fd)
+        if session.output_file:
+            session.output_file.close()
+        if session.lock_server_running is not None:
+            _unlock(session.lock_server_running)
+
+
+def _run_multiplex_server():
+    (socket_filename,
+     lock_starting_filename,
+     log_filename) = _get_multiplex_filenames(BASE_DIR)
+    if not os.path.isdir(BASE_DIR):
+        os.makedirs(BASE_DIR)
+
+    logging_format = '%(asctime)s %(levelname)-5.5s| %(message)s'
+    date_format = '%m/%d %H:%M:%S'
+    logging.basicConfig(filename=log_filename, level=logging.DEBUG,
+                        format=logging_format, datefmt=date_format)
+    for handler in logging.getLogger().handlers:
+        _set_cloexec(handler.stream.fileno())
+
+    server = _MultiplexServer(BASE_DIR)
+    logging.info('Multiplex server %s listening on %s', os.getpid(),
+                 socket_filename)
+    # Print something to stdout so the client can start working
+    print "Server multiplex ready"
+    sys.stdout.flush()
+    # Leave the client's output alone from now on
+    null_fd = os.open(os.devnull, os.O_RDWR)
+    for fd in range(3):
+        os.dup2(null_fd, fd)
+    os.close(null_fd)
+    server.run()
+    sys.exit(0)
+
+
 # The following is the server part of the module.
 
+if __name__ == "__main__" and sys.argv[1:] == ["--multiplex"]:
+    _run_multiplex_server()
+
 if __name__ == "__main__":
     a_id = sys.stdin.readline().strip()
     echo = sys.stdin.readline().strip() == "True"
@@ -138,25 +773,7 @@ if __name__ == "__main__":
     (shell_pid, shell_fd) = pty.fork()
     if shell_pid == 0:
         # Child process: run the command in a subshell
-        if len(command) > 255:
-            new_stack = None
-            if len(command) > 2000000:
-                # Stack size would probably not suffice (and no open files)
-                # (1 + len(command) * 4 / 8290304) * 8196
-                # 2MB => 8196kb, 4MB => 16392, ...
-                new_stack = (1 + len(command) / 2072576) * 8196
-                command = "ulimit -s %s\nulimit -n 819200\n%s" % (new_stack,
-                                                                  command)
-            tmp_dir = os.path.join(BASE_DIR, a_id)
-            tmp_file = tempfile.mktemp(suffix='.sh',
-                                       prefix='aexpect-', dir=tmp_dir)
-            fd_cmd = open(tmp_file, "w")
-            fd_cmd.write(command)
-            fd_cmd.close()
-            os.execv("/bin/bash", ["/bin/bash", "-c", "source %s" % tmp_file])
-            os.remove(tmp_file)
-        else:
-            os.execv("/bin/bash", ["/bin/bash", "-c", command])
+        _exec_command(a_id, command)
     else:
         # Parent process
         server_log.info('Acquiring server lock on %s' % lock_server_running_filename)
@@ -191,8 +808,9 @@ if __name__ == "__main__":
         print "Server %s ready" % a_id
         sys.stdout.flush()
 
-        # Initialize buffers
-        buffers = ["" for reader in readers]
+        # Initialize buffers: the chunks of output not written yet to each
+        # reader pipe, not joined so that writing them takes linear time
+        buffers = [collections.deque() for reader in readers]
 
         # Read from child and write to files/pipes
         server_log.info('Entering main read loop')
@@ -206,8 +824,11 @@ if __name__ == "__main__":
             # If a reader pipe is ready for writing --
             for (i, fd) in enumerate(reader_fds):
                 if fd in w:
-                    bytes_written = os.write(fd, buffers[i])
-                    buffers[i] = buffers[i][bytes_written:]
+                    bytes_written = os.write(fd, buffers[i][0])
+                    if bytes_written < len(buffers[i][0]):
+                        buffers[i][0] = buffers[i][0][bytes_written:]
+                    else:
+                        buffers[i].popleft()
             if ctrlpipe_fd in r:
                 cmd_len = int(os.read(ctrlpipe_fd, 10))
                 data = os.read(ctrlpipe_fd, cmd_len)
@@ -228,8 +849,9 @@ if __name__ == "__main__":
                 data = data.replace("\r", "")
                 output_file.write(data)
                 output_file.flush()
-                for i in range(len(readers)):
-                    buffers[i] += data
+                if data:
+                    for i in range(len(readers)):
+                        buffers[i].append(data)
             # If os.read() raised an exception or there was nothing to read --
             if check_termination or shell_fd not in r:
                 pid, status = os.waitpid(shell_pid, os.WNOHANG)
@@ -265,12 +887,17 @@ if __name__ == "__main__":
 # The following is the client part of the module.
 
 import subprocess
-import time
-import signal
 import re
 import threading
 import utils
 
+# Bytes of the output read earlier searched again with newly read output by
+# read_until_output_matches(), for the matches spanning both
+_MATCH_OVERLAP = 8192
+
+# Whether new child processes are run by the multiplexing server
+_multiplex = False
+
 
 class ExpectError(Exception):
 
@@ -363,6 +990,143 @@ class ShellStatusError(ShellError):
                 (self.cmd, self.output))
 
 
+class _OutputMatcher(object):
+
+    """
+    Match the output of a child process against a list of patterns each time
+    more output is read.
+
+    This matcher applies a filter and a match function to the whole output
+    read so far.  The subclasses look only at the newly read output and at
+    the part of the earlier output a match may still depend on, so that the
+    time spent matching grows linearly with the output.
+    """
+
+    def __init__(self, patterns, filter_func=None, match_func=None):
+        """
+        :param patterns: List of strings (regular expression patterns).
+                None and empty strings are ignored.
+        :param filter_func: Function applied to the output before matching
+                it (should take and return a string).
+        :param match_func: Function returning the index of the pattern
+                matching the filtered output, or None.
+        """
+        self.patterns = patterns
+        self.filter_func = filter_func
+        self.match_func = match_func
+        self._regexes = [(i, re.compile(patterns[i]))
+                         for i in range(len(patterns)) if patterns[i]]
+
+    def _search(self, cont):
+        for i, regex in self._regexes:
+            if regex.search(cont):
+                return i
+
+    def match(self, output, start):
+        """
+        Match the output read so far against the patterns.
+
+        :param output: The output read so far.
+        :param start: Length of the output at the previous call.
+        :return: The index of the matching pattern, or None.
+        """
+        return self.match_func(self.filter_func(output), self.patterns)
+
+
+class _WindowMatcher(_OutputMatcher):
+
+    """
+    Search the new output, and the last _MATCH_OVERLAP bytes of the earlier
+    output, for a substring matching a pattern.
+    """
+
+    def match(self, output, start):
+        pos = max(0, start - _MATCH_OVERLAP)
+        for i, regex in self._regexes:
+            # unlike searching a slice, searching from pos keeps '^'
+            # matching at the beginning of the output only
+            if regex.search(output, pos):
+                return i
+
+
+class _LastWordMatcher(_OutputMatcher):
+
+    """
+    Match the last word of the output against the patterns.
+    """
+
+    def __init__(self, patterns):
+        _OutputMatcher.__init__(self, patterns)
+        # The last word, followed by a whitespace character if the output
+        # ends with whitespace
+        self._tail = ""
+
+    def match(self, output, start):
+        cont = self._tail + output[start:]
+        stripped = cont.rstrip()
+        if stripped:
+            word = stripped.rsplit(None, 1)[-1]
+        else:
+            word = ""
+        self._tail = word + cont[len(stripped):len(stripped) + 1]
+        return self._search(word)
+
+
+class _LastLineMatcher(_OutputMatcher):
+
+    """
+    Match the last non-empty line of the output against the patterns.
+    """
+
+    def __init__(self, patterns):
+        _OutputMatcher.__init__(self, patterns)
+        # The last non-empty line and the unterminated line following it
+        self._tail = ""
+
+    def match(self, output, start):
+        lines = (self._tail + output[start:]).splitlines(True)
+        partial = ""
+        if lines and not lines[-1].endswith(("\n", "\r")):
+            partial = lines[-1]
+        for i in range(len(lines) - 1, -1, -1):
+            if lines[i].strip():
+                if i < len(lines) - 1:
+                    self._tail = lines[i] + partial
+                else:
+                    self._tail = lines[i]
+                return self._search(lines[i].splitlines()[0])
+        self._tail = partial
+        return self._search("")
+
+
+class _AnyLineMatcher(_OutputMatcher):
+
+    """
+    Match each line of the output against the patterns, as
+    Expect.match_patterns_multiline() does.  The lines which did not match
+    are not matched again.
+    """
+
+    def __init__(self, patterns):
+        _OutputMatcher.__init__(self, patterns)
+        self._regexes = [(i, re.compile(patterns[i]))
+                         for i in range(-len(patterns), 0) if patterns[i]]
+        # The last line, unless it ends with a newline.  A line ending with
+        # a carriage return is kept, it may end with a CRLF.
+        self._partial = ""
+
+    def match(self, output, start):
+        lines = (self._partial + output[start:]).splitlines(True)
+        self._partial = ""
+        if lines and not lines[-1].endswith("\n"):
+            self._partial = lines[-1]
+        lines = [line.splitlines()[0] for line in lines]
+        for i, regex in self._regexes:
+            for line in lines:
+                if regex.search(line):
+                    return i
+
+
 def run_tail(command, termination_func=None, output_func=None, output_prefix="",
              timeout=1.0, auto_close=True):
     """
@@ -468,6 +1232,96 @@ def run_fg(command, output_func=None, output_prefix="", timeout=1.0):
     return (status, output)
 
 
+def use_multiplex_server(enabled=True):
+    """
+    Run the child processes of the Spawn instances created from now on in a
+    single multiplexing server process, started when needed, instead of a
+    server process each.
+
+    The Spawn instances work the same either way, and attach to their child
+    processes by ID the same way.  If the multiplexing server can't run a
+    child process, a server of its own is started as usual.
+
+    :param enabled: Whether to use the multiplexing server.
+    """
+    global _multiplex
+    _multiplex = enabled
+
+
+def _connect_multiplex_server():
+    """
+    Connect to the multiplexing server, starting it if it isn't running.
+    """
+    (socket_filename,
+     lock_starting_filename,
+     _) = _get_multiplex_filenames(BASE_DIR)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_filename)
+        return sock
+    except socket.error:
+        pass
+    lock_starting = _lock(lock_starting_filename)
+    try:
+        try:
+            sock.connect(socket_filename)
+            return sock
+        except socket.error:
+            pass
+        sub = subprocess.Popen([sys.executable, __file__, "--multiplex"],
+                               stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT,
+                               close_fds=True, preexec_fn=os.setsid)
+        sub.stdin.close()
+        # Wait for the server to complete its initialization
+        while True:
+            line = sub.stdout.readline()
+            if not line:
+                raise socket.error("multiplex server failed to start")
+            if "Server multiplex ready" in line:
+                break
+        sub.stdout.close()
+        sock.connect(socket_filename)
+        return sock
+    finally:
+        _unlock(lock_starting)
+
+
+def _start_multiplexed(a_id, echo, readers, command):
+    """
+    Run command as a child process of the multiplexing server.
+
+    :return: Whether the child process was started.
+    """
+    # like a server of its own, which reads a single line
+    command = command.split("\n", 1)[0].strip()
+    request = _encode_request(a_id, echo, readers, command, os.getcwd(),
+                              os.environ)
+    reply = ""
+    try:
+        sock = _connect_multiplex_server()
+        try:
+            sock.settimeout(_MULTIPLEX_REQUEST_TIMEOUT)
+            sock.sendall(request)
+            while not reply.endswith("\n"):
+                data = sock.recv(1024)
+                if not data:
+                    break
+                reply += data
+        finally:
+            sock.close()
+    except (socket.error, OSError), e:
+        logging.warning("Could not start %s in the multiplex server: %s",
+                        a_id, e)
+        return False
+    if "Server %s ready" % a_id not in reply:
+        logging.warning("Could not start %s in the multiplex server: %s",
+                        a_id, reply.strip())
+        return False
+    return True
+
+
 class Spawn(object):
 
     """
@@ -485,6 +1339,8 @@ class Spawn(object):
     These pipes are referred to as "readers".
     The server also receives input from the client and sends it to the child
     process.
+    The child processes of many instances may share a single multiplexing
+    server instead, see use_multiplex_server().
     An instance of this class can be pickled.  Every derived class is
     responsible for restoring its own state by properly defining
     __getinitargs__().
@@ -559,7 +1415,9 @@ class Spawn(object):
         lock_client_starting = _lock(self.lock_client_starting_filename)
 
         # Start the server (which runs the command)
-        if command:
+        if command and not (_multiplex and
+                            _start_multiplexed(self.a_id, echo, self.readers,
+                                               command)):
             sub = subprocess.Popen("%s %s" % (sys.executable, __file__),
                                    shell=True,
                                    stdin=subprocess.PIPE,
@@ -983,7 +1841,7 @@ class Tail(Spawn):
                     break
                 if fd in r:
                     # Some data is available; read it
-                    new_data = os.read(fd, 1024)
+                    new_data = os.read(fd, _READ_SIZE)
                     if not new_data:
                         break
                     bfr += new_data
@@ -1099,21 +1957,22 @@ class Expect(Tail):
         if timeout:
             end_time = time.time() + timeout
         fd = self._get_fd("expect")
-        data = ""
+        data = []
         while True:
             try:
                 r, w, x = select.select([fd], [], [], internal_timeout)
             except Exception:
-                return data
+                break
             if fd in r:
-                new_data = os.read(fd, 1024)
+                new_data = os.read(fd, _READ_SIZE)
                 if not new_data:
-                    return data
-                data += new_data
+                    break
+                data.append(new_data)
             else:
-                return data
+                break
             if end_time and time.time() > end_time:
-                return data
+                break
+        return "".join(data)
 
     def match_patterns(self, cont, patterns):
         """
@@ -1151,7 +2010,7 @@ class Expect(Tail):
                 if re.search(patterns[i], line):
                     return i
 
-    def read_until_output_matches(self, patterns, filter_func=lambda x: x,
+    def read_until_output_matches(self, patterns, filter_func=None,
                                   timeout=60, internal_timeout=None,
                                   print_func=None, match_func=None):
         """
@@ -1161,6 +2020,11 @@ class Expect(Tail):
         or until timeout expires. Before attempting to search for a match, the
         data is filtered using the filter_func function provided.
 
+        Without filter_func and match_func, only the newly read data and the
+        last _MATCH_OVERLAP bytes read before it are searched each time: a
+        match spanning more of the earlier data is not found.  Otherwise
+        both functions are applied to all the data read so far.
+
         :param patterns: List of strings (regular expression patterns)
         :param filter_func: Function to apply to the data read from the child before
                 attempting to match it against the patterns (should take and
@@ -1177,8 +2041,21 @@ class Expect(Tail):
                 terminates while waiting for output
         :raise ExpectError: Raised if an unknown error occurs
         """
-        if not match_func:
-            match_func = self.match_patterns
+        if filter_func is None and match_func is None:
+            matcher = _WindowMatcher(patterns)
+        else:
+            matcher = _OutputMatcher(patterns, filter_func or (lambda x: x),
+                                     match_func or self.match_patterns)
+        return self._read_until_matcher_matches(matcher, timeout,
+                                                internal_timeout, print_func)
+
+    def _read_until_matcher_matches(self, matcher, timeout, internal_timeout,
+                                    print_func):
+        """
+        Read from child using read_nonblocking until an _OutputMatcher
+        matches, see read_until_output_matches().
+        """
+        patterns = matcher.patterns
         fd = self._get_fd("expect")
         o = ""
         end_time = time.time() + timeout
@@ -1201,7 +2078,7 @@ class Expect(Tail):
                     print_func(line)
             # Look for patterns
             o += data
-            match = match_func(filter_func(o), patterns)
+            match = matcher.match(o, len(o) - len(data))
             if match is not None:
                 return match, o
 
@@ -1230,15 +2107,9 @@ class Expect(Tail):
                 terminates while waiting for output
         :raise ExpectError: Raised if an unknown error occurs
         """
-        def get_last_word(cont):
-            if cont:
-                return cont.split()[-1]
-            else:
-                return ""
-
-        return self.read_until_output_matches(patterns, get_last_word,
-                                              timeout, internal_timeout,
-                                              print_func)
+        return self._read_until_matcher_matches(_LastWordMatcher(patterns),
+                                                timeout, internal_timeout,
+                                                print_func)
 
     def read_until_last_line_matches(self, patterns, timeout=60,
                                      internal_timeout=None, print_func=None):
@@ -1262,16 +2133,9 @@ class Expect(Tail):
                 terminates while waiting for output
         :raise ExpectError: Raised if an unknown error occurs
         """
-        def get_last_nonempty_line(cont):
-            nonempty_lines = [l for l in cont.splitlines() if l.strip()]
-            if nonempty_lines:
-                return nonempty_lines[-1]
-            else:
-                return ""
-
-        return self.read_until_output_matches(patterns, get_last_nonempty_line,
-                                              timeout, internal_timeout,
-                                              print_func)
+        return self._read_until_matcher_matches(_LastLineMatcher(patterns),
+                                                timeout, internal_timeout,
+                                                print_func)
 
     def read_until_any_line_matches(self, patterns, timeout=60,
                                     internal_timeout=None, print_func=None):
@@ -1296,11 +2160,9 @@ class Expect(Tail):
                 terminates while waiting for output
         :raise ExpectError: Raised if an unknown error occurs
         """
-        return self.read_until_output_matches(patterns,
-                                              lambda x: x.splitlines(
-                                              ), timeout,
-                                              internal_timeout, print_func,
-                                              self.match_patterns_multiline)
+        return self._read_until_matcher_matches(_AnyLineMatcher(patterns),
+                                                timeout, internal_timeout,
+                                                print_func)
 
 
 class ShellSession(Expect):
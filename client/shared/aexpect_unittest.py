@@ -0,0 +1,172 @@
+#!/usr/bin/python
+
+import os
+import random
+import unittest
+try:
+    import autotest.common as common
+except ImportError:
+    import common
+from autotest.client.shared import aexpect
+
+# the matching methods of Expect don't use the instance
+match_patterns = aexpect.Expect.match_patterns.im_func
+match_patterns_multiline = aexpect.Expect.match_patterns_multiline.im_func
+
+
+def get_last_word(cont):
+    if cont.strip():
+        return cont.split()[-1]
+    return ""
+
+
+def get_last_nonempty_line(cont):
+    nonempty_lines = [l for l in cont.splitlines() if l.strip()]
+    if nonempty_lines:
+        return nonempty_lines[-1]
+    return ""
+
+
+class test_output_matchers(unittest.TestCase):
+
+    """
+    Compare the incremental matchers with matching all the output read so
+    far, as read_until_output_matches() did.
+    """
+
+    _PIECES = ["word", "other", " ", "  ", "\t", "\n", "\r", "\r\n", "\n\n",
+               "$ ", "# ", "login:", "prompt", "x" * 50]
+
+    def setUp(self):
+        self.random = random.Random(0)
+
+    def _chunks(self):
+        output = "".join(self.random.choice(self._PIECES)
+                         for _ in xrange(self.random.randint(0, 60)))
+        chunks = []
+        while output:
+            length = self.random.randint(1, 20)
+            chunks.append(output[:length])
+            output = output[length:]
+        return chunks
+
+    def _check(self, make_matcher, reference, patterns):
+        for _ in xrange(300):
+            matcher = make_matcher(patterns)
+            output = ""
+            for chunk in self._chunks():
+                output += chunk
+                match = matcher.match(output, len(output) - len(chunk))
+                self.assertEqual(reference(output, patterns), match,
+                                 repr(output))
+                if match is not None:
+                    break
+
+    def test_last_word(self):
+        patterns = [r"^word$", r"prompt", r"[#$]$", None, r"^$"]
+        self._check(aexpect._LastWordMatcher,
+                    lambda output, patterns: match_patterns(
+                        None, get_last_word(output), patterns),
+                    patterns)
+
+    def test_last_line(self):
+        patterns = [r"[\#\$]\s*$", r"^login:$", "", r"^\s*xx+\s*$"]
+        self._check(aexpect._LastLineMatcher,
+                    lambda output, patterns: match_patterns(
+                        None, get_last_nonempty_line(output), patterns),
+                    patterns)
+
+    def test_any_line(self):
+        patterns = [r"^$", r"^other\s*login:", r"x{80}", r"word\s+word"]
+        self._check(aexpect._AnyLineMatcher,
+                    lambda output, patterns: match_patterns_multiline(
+                        None, output.splitlines(), patterns),
+                    patterns)
+
+    def test_window(self):
+        patterns = [r"^login:", r"word\s*other", r"prompt\s*$"]
+        self._check(aexpect._WindowMatcher,
+                    lambda output, patterns: match_patterns(
+                        None, output, patterns),
+                    patterns)
+
+    def test_window_overlap(self):
+        matcher = aexpect._WindowMatcher([r"start.*end"])
+        output = "start" + "x" * aexpect._MATCH_OVERLAP
+        self.assertEqual(None, matcher.match(output, 0))
+        self.assertEqual(None, matcher.match(output + "end", len(output)))
+
+    def test_filtered(self):
+        matcher = aexpect._OutputMatcher(["^A B$"], lambda x: x.upper(),
+                                         lambda cont, patterns:
+                                         match_patterns(None, cont, patterns))
+        self.assertEqual(None, matcher.match("a", 0))
+        self.assertEqual(0, matcher.match("a b", 1))
+
+
+class test_output_buffer(unittest.TestCase):
+
+    def setUp(self):
+        self.read_fd, self.write_fd = os.pipe()
+        aexpect._set_nonblocking(self.write_fd)
+
+    def tearDown(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+    def test_drops_oldest_output(self):
+        output_buffer = aexpect._OutputBuffer(10)
+        self.assertEqual(0, output_buffer.append("0123"))
+        self.assertEqual(0, output_buffer.append("456789"))
+        self.assertEqual(3, output_buffer.append("abc"))
+        self.assertEqual(10, len(output_buffer))
+        self.assertEqual(11, output_buffer.append("x" * 11))
+        self.assertEqual(14, output_buffer.dropped)
+        output_buffer.write(self.write_fd)
+        self.assertEqual(0, len(output_buffer))
+        self.assertEqual("x" * 10, os.read(self.read_fd, 100))
+
+    def test_write_full_pipe(self):
+        output_buffer = aexpect._OutputBuffer(1024 * 1024)
+        data = "".join(chr(i % 256) for i in xrange(512 * 1024))
+        output_buffer.append(data)
+        output = []
+        while output_buffer:
+            output_buffer.write(self.write_fd)
+            output.append(os.read(self.read_fd, 1024 * 1024))
+        self.assertEqual(data, "".join(output))
+
+
+class test_multiplex_request(unittest.TestCase):
+
+    def test_decode(self):
+        request = aexpect._encode_request("a1", True, ["expect", "tail"],
+                                          "echo $FOO", "/tmp",
+                                          {"FOO": "a\nb=c", "BAR": ""})
+        self.assertEqual(None, aexpect._decode_request(request[:-1]))
+        self.assertEqual(("a1", True, ["expect", "tail"], "echo $FOO",
+                          "/tmp", {"FOO": "a\nb=c", "BAR": ""}),
+                         aexpect._decode_request(request))
+
+    def test_decode_no_readers(self):
+        request = aexpect._encode_request("a1", False, [], "true", "/", {})
+        self.assertEqual(("a1", False, [], "true", "/", {}),
+                         aexpect._decode_request(request))
+
+    def test_decode_newlines(self):
+        request = aexpect._encode_request("a1", False, [], "echo a\necho b",
+                                          "/tmp/a\nb", {})
+        for end in xrange(len(request)):
+            self.assertEqual(None, aexpect._decode_request(request[:end]))
+        self.assertEqual(("a1", False, [], "echo a\necho b", "/tmp/a\nb",
+                          {}),
+                         aexpect._decode_request(request))
+
+    def test_decode_invalid(self):
+        self.assertRaises(ValueError, aexpect._decode_request,
+                          "a1\nTrue\n\n")
+        self.assertRaises(ValueError, aexpect._decode_request, "a1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,5 @@
 import os
+import atexit
 import copy
 import logging
 import errno
@@ -212,12 +213,30 @@ class job_state(object):
     NO_DEFAULT = object()
     PICKLE_PROTOCOL = 2  # highest protocol available in python 2.4
 
+    # first record of a journaled backing file, followed by its token
+    JOURNAL_HEADER = 'job_state journal'
+    # the journal is compacted into a new snapshot once it is larger than
+    # both the snapshot and this
+    JOURNAL_MIN_COMPACT_SIZE = 64 * 1024
+
     def __init__(self):
         """Initialize the job state."""
         self._state = {}
         self._backing_file = None
         self._backing_file_initialized = False
         self._backing_file_lock = None
+        self._reset_journal()
+
+    def _reset_journal(self):
+        """Forget what is known of the journal of the backing file."""
+        # token of the snapshot the in-memory state was read from or written
+        # to, None if the backing file must be rewritten before appending
+        self._journal_token = None
+        # offsets of the end of the snapshot and of the last record applied
+        self._snapshot_end = 0
+        self._journal_end = 0
+        # changes not yet appended to the journal
+        self._pending_records = []
 
     def _lock_backing_file(self):
         """Acquire a lock on the backing file."""
@@ -232,6 +251,69 @@ class job_state(object):
             self._backing_file_lock.close()
             self._backing_file_lock = None
 
+    @staticmethod
+    def _apply_record(state, record):
+        """Apply a journal record to a state dictionary."""
+        if record[0] == 'set':
+            namespace, name, value = record[1:]
+            state.setdefault(namespace, {})[name] = value
+        elif record[0] == 'discard':
+            namespace, name = record[1:]
+            if namespace in state and name in state[namespace]:
+                del state[namespace][name]
+                if not state[namespace]:
+                    del state[namespace]
+        elif record[0] == 'discard_namespace':
+            state.pop(record[1], None)
+
+    def _replay_journal(self, state_file, state):
+        """
+        Apply the journal records read from state_file to state, up to the
+        last complete one.
+
+        :return: the offset after the last complete record.
+        """
+        offset = state_file.tell()
+        while True:
+            try:
+                record = pickle.load(state_file)
+            except EOFError:
+                break
+            except Exception, e:
+                # a record cut short by a crash while it was appended
+                logging.warning('Ignoring the end of the state journal of %s '
+                                'after byte %d: %s', state_file.name, offset,
+                                e)
+                break
+            self._apply_record(state, record)
+            offset = state_file.tell()
+        return offset
+
+    def _load_state_file(self, file_path):
+        """
+        Load a state file, either a pickled state dictionary as written by
+        write_to_file or a journaled backing file: a header with a token, a
+        snapshot of the state and the records of the changes made since.
+
+        :return: (state, journal token or None if the file isn't journaled,
+                  end of the snapshot, end of the last complete record)
+        """
+        # we can assume that the file exists
+        if os.path.getsize(file_path) == 0:
+            return {}, None, 0, 0
+        state_file = open(file_path, 'rb')
+        try:
+            first = pickle.load(state_file)
+            if not (isinstance(first, tuple) and
+                    first[:1] == (self.JOURNAL_HEADER,)):
+                return first, None, state_file.tell(), state_file.tell()
+            state = pickle.load(state_file)
+            snapshot_end = state_file.tell()
+            return (state, first[1], snapshot_end,
+                    self._replay_journal(state_file, state))
+        finally:
+            state_file.close()
+
     def read_from_file(self, file_path, merge=True):
         """
         Read in any state from the file at file_path.
@@ -252,12 +334,7 @@ class job_state(object):
         Warning: This method is intentionally concurrency-unsafe. It makes no
         attempt to control concurrent access to the file at ``file_path``.
         """
-
-        # we can assume that the file exists
-        if os.path.getsize(file_path) == 0:
-            on_disk_state = {}
-        else:
-            on_disk_state = pickle.load(open(file_path))
+        on_disk_state = self._load_state_file(file_path)[0]
 
         if merge:
             # merge the on-disk state with the in-memory state
@@ -281,6 +358,8 @@ class job_state(object):
             # just replace the in-memory state with the on-disk state
             self._state = on_disk_state
 
+        # the whole state may have changed, write a new snapshot of it
+        self._journal_token = None
         # lock the backing file before we refresh it
         with_backing_lock(self.__class__._write_to_backing_file)(self)
 
@@ -301,6 +380,26 @@ class job_state(object):
         finally:
             outfile.close()
 
+    def _journal_is_current(self):
+        """
+        Check whether the backing file is still the snapshot and journal the
+        in-memory state was read from or written to, possibly with records
+        appended since.
+        """
+        if self._journal_token is None:
+            return False
+        if os.path.getsize(self._backing_file) < self._journal_end:
+            return False
+        state_file = open(self._backing_file, 'rb')
+        try:
+            try:
+                header = pickle.load(state_file)
+            except Exception:
+                return False
+        finally:
+            state_file.close()
+        return header == (self.JOURNAL_HEADER, self._journal_token)
+
     def _read_from_backing_file(self):
         """
         Refresh the current state from the backing file.
@@ -308,16 +407,80 @@ class job_state(object):
         If the backing file has never been read before (indicated by checking
         self._backing_file_initialized) it will merge the file with the
         in-memory state, rather than overwriting it.
+
+        The in-memory state is kept between calls: when the backing file
+        only had journal records appended since, only these are read.
+        Otherwise, after another process compacted or replaced it, the whole
+        file is read again.
+
+        A journal ending with an unreadable record, cut short by a crash, is
+        replaced by a new snapshot at the next write: records appended after
+        it could never be read back.
         """
-        if self._backing_file:
-            merge_backing_file = not self._backing_file_initialized
-            self.read_from_file(self._backing_file, merge=merge_backing_file)
+        if not self._backing_file:
+            return
+        if not self._backing_file_initialized:
+            self.read_from_file(self._backing_file, merge=True)
             self._backing_file_initialized = True
+        elif self._journal_is_current():
+            if os.path.getsize(self._backing_file) > self._journal_end:
+                state_file = open(self._backing_file, 'rb')
+                try:
+                    state_file.seek(self._journal_end)
+                    self._journal_end = self._replay_journal(state_file,
+                                                             self._state)
+                finally:
+                    state_file.close()
+        else:
+            (self._state, self._journal_token, self._snapshot_end,
+             self._journal_end) = self._load_state_file(self._backing_file)
+        if self._journal_end < os.path.getsize(self._backing_file):
+            self._journal_token = None
+
+    def _write_journal_snapshot(self):
+        """Replace the backing file by a snapshot of the state."""
+        self._journal_token = '%d.%s' % (os.getpid(),
+                                         os.urandom(8).encode('hex'))
+        outfile = open(self._backing_file, 'wb')
+        try:
+            pickle.dump((self.JOURNAL_HEADER, self._journal_token), outfile,
+                        self.PICKLE_PROTOCOL)
+            pickle.dump(self._state, outfile, self.PICKLE_PROTOCOL)
+            self._snapshot_end = self._journal_end = outfile.tell()
+        finally:
+            outfile.close()
 
     def _write_to_backing_file(self):
-        """Flush the current state to the backing file."""
+        """
+        Flush the current state to the backing file.
+
+        The changes made since the last flush are appended to its journal;
+        a new snapshot is written instead when there is no usable journal or
+        when it has grown larger than the snapshot.
+        """
+        if not self._backing_file:
+            return
+        records = self._pending_records
+        self._pending_records = []
+        journal_size = self._journal_end - self._snapshot_end
+        if (self._journal_token is None or
+                journal_size > max(self._snapshot_end,
+                                   self.JOURNAL_MIN_COMPACT_SIZE)):
+            self._write_journal_snapshot()
+        elif records:
+            data = ''.join([pickle.dumps(record, self.PICKLE_PROTOCOL)
+                            for record in records])
+            outfile = open(self._backing_file, 'ab')
+            try:
+                outfile.write(data)
+            finally:
+                outfile.close()
+            self._journal_end += len(data)
+
+    def _record_change(self, *record):
+        """Queue a change of the state to be appended to the journal."""
         if self._backing_file:
-            self.write_to_file(self._backing_file)
+            self._pending_records.append(record)
 
     @with_backing_file
     def _synchronize_backing_file(self):
@@ -344,6 +507,7 @@ class job_state(object):
         self._synchronize_backing_file()
         self._backing_file = file_path
         self._backing_file_initialized = False
+        self._reset_journal()
         self._synchronize_backing_file()
 
     @with_backing_file
@@ -390,6 +554,7 @@ class job_state(object):
         """
         namespace_dict = self._state.setdefault(namespace, {})
         namespace_dict[name] = copy.deepcopy(value)
+        self._record_change('set', namespace, name, namespace_dict[name])
         logging.debug('Persistent state %s.%s now set to %r', namespace,
                       name, value)
 
@@ -425,6 +590,7 @@ class job_state(object):
             del self._state[namespace][name]
             if len(self._state[namespace]) == 0:
                 del self._state[namespace]
+            self._record_change('discard', namespace, name)
             logging.debug('Persistent state %s.%s deleted', namespace, name)
         else:
             logging.debug(
@@ -441,6 +607,7 @@ class job_state(object):
         """
         if namespace in self._state:
             del self._state[namespace]
+            self._record_change('discard_namespace', namespace)
         logging.debug('Persistent state %s.* deleted', namespace)
 
     @staticmethod
@@ -635,6 +802,134 @@ class status_indenter(object):
         """Decrease indentation by one level."""
 
 
+class status_flush_policy(object):
+
+    """
+    When the status log lines buffered by a status_writer are written out.
+
+    Whatever the policy, the lines are written out before a process forks or
+    exits through the job (see flush_status_logs) and when the job completes.
+    """
+
+    def __init__(self, entries=1, interval=None, boundaries=True):
+        """
+        :param entries: Flush once this many entries are buffered, 1 to write
+                        every entry out at once.
+        :param interval: Flush when an entry is recorded more than this many
+                         seconds after the oldest buffered one, or None.
+        :param boundaries: Flush after the START and END entries.
+        """
+        self.entries = entries
+        self.interval = interval
+        self.boundaries = boundaries
+
+    @classmethod
+    def from_settings(cls):
+        """
+        Policy of the [COMMON] status_flush_entries, status_flush_interval_ms
+        and status_flush_boundaries settings, flushing every entry by default.
+        """
+        entries = settings.get_value('COMMON', 'status_flush_entries',
+                                     type=int, default=1)
+        interval_ms = settings.get_value('COMMON', 'status_flush_interval_ms',
+                                         type=int, default=0)
+        boundaries = settings.get_value('COMMON', 'status_flush_boundaries',
+                                        type=bool, default=True)
+        return cls(max(entries, 1), interval_ms and interval_ms / 1000.0,
+                   boundaries)
+
+
+# status_writers of this process, see flush_status_logs
+_status_writers = weakref.WeakKeyDictionary()
+
+
+def flush_status_logs():
+    """
+    Write out the status log lines buffered in this process.
+
+    To be called before forking, so that the lines aren't written again by
+    the child, and before leaving a process through os._exit.
+    """
+    for writer in _status_writers.keys():
+        writer.flush()
+atexit.register(flush_status_logs)
+
+
+class status_writer(object):
+
+    """
+    Appends lines to status log files, keeping the files open between
+    entries and buffering the lines according to a status_flush_policy.
+
+    The lines of each file are written out in the order they were recorded.
+    The least recently used files are closed beyond MAX_OPEN_FILES.
+    """
+
+    MAX_OPEN_FILES = 16
+
+    def __init__(self, flush_policy=None):
+        if flush_policy is None:
+            flush_policy = status_flush_policy.from_settings()
+        self.flush_policy = flush_policy
+        # path -> file object, and paths from the least recently used
+        self._files = {}
+        self._paths = []
+        self._buffered_entries = 0
+        self._oldest_entry_time = None
+        _status_writers[self] = None
+
+    def _get_file(self, path):
+        if path in self._files:
+            if self._paths[-1] != path:
+                self._paths.remove(path)
+                self._paths.append(path)
+            return self._files[path]
+        if len(self._paths) >= self.MAX_OPEN_FILES:
+            old_path = self._paths.pop(0)
+            self._files.pop(old_path).close()
+        fileobj = open(path, 'a')
+        self._files[path] = fileobj
+        self._paths.append(path)
+        return fileobj
+
+    def write(self, paths, text, boundary=False):
+        """
+        Record an entry, rendered as text, into the files at paths.
+
+        :param boundary: Whether this is a START or END entry.
+        """
+        for path in paths:
+            self._get_file(path).write(text + '\n')
+
+        now = time.time()
+        policy = self.flush_policy
+        self._buffered_entries += 1
+        if self._oldest_entry_time is None:
+            self._oldest_entry_time = now
+        if (self._buffered_entries >= policy.entries or
+                (boundary and policy.boundaries) or
+                (policy.interval is not None and
+                 now - self._oldest_entry_time >= policy.interval)):
+            self.flush()
+
+    def flush(self):
+        """Write out the buffered lines."""
+        if not self._buffered_entries:
+            return
+        for fileobj in self._files.itervalues():
+            fileobj.flush()
+        self._buffered_entries = 0
+        self._oldest_entry_time = None
+
+    def close(self):
+        """Write out the buffered lines and close the files."""
+        self.flush()
+        for fileobj in self._files.itervalues():
+            fileobj.close()
+        self._files = {}
+        self._paths = []
+
+
 class status_logger(object):
 
     """
@@ -647,7 +942,7 @@ class status_logger(object):
 
     def __init__(self, job, indenter, global_filename='status',
                  subdir_filename='status', record_hook=None,
-                 tap_writer=None):
+                 tap_writer=None, flush_policy=None):
         """
         Construct a logger instance.
 
@@ -670,8 +965,12 @@ class status_logger(object):
 
         :param tap_writer: An instance of the class TAPReport for addionally
                            writing TAP files
+
+        :param flush_policy: An optional status_flush_policy, the one of the
+                             settings if None.
         """
         self._jobref = weakref.ref(job)
+        self._writer = status_writer(flush_policy)
         self._indenter = indenter
         self.global_filename = global_filename
         self.subdir_filename = subdir_filename
@@ -726,12 +1025,8 @@ class status_logger(object):
 
         # write out to entry to the log files
         log_text = self.render_entry(log_entry)
-        for log_file in log_files:
-            fileobj = open(log_file, 'a')
-            try:
-                print >> fileobj, log_text
-            finally:
-                fileobj.close()
+        self._writer.write(log_files, log_text,
+                           log_entry.is_start() or log_entry.is_end())
 
         # write to TAPRecord instance
         if log_entry.is_end() and self._tap_writer.do_tap_report:
@@ -743,6 +1038,133 @@ class status_logger(object):
         elif log_entry.is_end():
             self._indenter.decrement()
 
+    def flush(self):
+        """Write out the buffered status log lines."""
+        self._writer.flush()
+
+    def close(self):
+        """Write out the buffered status log lines and close the files."""
+        self._writer.close()
+
+
+class status_log_merger(object):
+
+    """
+    Merges the status logs of parallel tasks into a status log, while the
+    tasks are still writing them.
+
+    The entries of a task are merged by groups, so that the entries of
+    different tasks are never interleaved inside a START/END block: a group
+    is a top level entry of the task log, or a whole block started at the
+    top level.  Each call to merge() appends the groups completed since the
+    last one, in the order of their timestamps.
+    """
+
+    READ_SIZE = 1024 * 1024
+    _TIMESTAMP_RE = re.compile(r'\t%s=(\d+)\t' %
+                               status_log_entry.TIMESTAMP_FIELD)
+
+    def __init__(self, path):
+        """
+        :param path: The status log to merge the task logs into.
+        """
+        self.path = path
+        # task log path -> [file object or None, offset, unterminated line,
+        #                   lines of the current group, depth of the current
+        #                   group, timestamp of the last group]
+        self._logs = {}
+        # (timestamp, sequence number, lines) of the completed groups
+        self._groups = []
+        self._sequence = 0
+
+    def add(self, path):
+        """Start merging the task log at path, which may not exist yet."""
+        self._logs[path] = [None, 0, '', [], 0, 0]
+
+    def _end_group(self, log):
+        lines = log[3]
+        if not lines:
+            return
+        match = self._TIMESTAMP_RE.search(lines[0])
+        if match:
+            # keep the groups of a task in order
+            log[5] = max(log[5], int(match.group(1)))
+        self._groups.append((log[5], self._sequence, lines))
+        self._sequence += 1
+        log[3] = []
+        log[4] = 0
+
+    def _read(self, path, log):
+        if log[0] is None:
+            if not os.path.exists(path):
+                return
+            log[0] = open(path)
+        log[0].seek(log[1])
+        while True:
+            data = log[0].read(self.READ_SIZE)
+            if not data:
+                break
+            log[1] += len(data)
+            lines = (log[2] + data).split('\n')
+            log[2] = lines.pop()
+            for line in lines:
+                self._add_line(log, line + '\n')
+
+    def _add_line(self, log, line):
+        # extra message lines are always prepended with two spaces
+        if not line.lstrip('\t').startswith('  '):
+            if log[3] and log[4] == 0:
+                self._end_group(log)
+            status_code = line.lstrip('\t').split('\t', 1)[0]
+            if status_code == 'START':
+                log[4] += 1
+            elif status_code.startswith('END ') and log[4] > 0:
+                log[4] -= 1
+        log[3].append(line)
+
+    def _write_groups(self):
+        if not self._groups:
+            return
+        self._groups.sort()
+        outfile = open(self.path, 'a')
+        try:
+            for timestamp, sequence, lines in self._groups:
+                outfile.writelines(lines)
+        finally:
+            outfile.close()
+        self._groups = []
+
+    def merge(self):
+        """Append the groups completed in the task logs to the status log."""
+        for path, log in self._logs.iteritems():
+            self._read(path, log)
+        self._write_groups()
+
+    def remove(self, path):
+        """
+        Append the rest of the task log at path, written by a terminated
+        task, to the status log and delete it.
+        """
+        log = self._logs.pop(path)
+        try:
+            self._read(path, log)
+            if log[2]:
+                log[3].append(log[2] + '\n')
+            self._end_group(log)
+        finally:
+            if log[0] is not None:
+                log[0].close()
+        self.merge()
+        if os.path.exists(path):
+            os.remove(path)
+
+    def close(self):
+        """Stop merging the task logs left, without deleting them."""
+        for log in self._logs.itervalues():
+            if log[0] is not None:
+                log[0].close()
+        self._logs = {}
+
 
 class TAPReport(object):
 
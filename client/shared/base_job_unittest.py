@@ -5,6 +5,7 @@ import stat
 import tempfile
 import shutil
 import logging
+import pickle
 import unittest
 
 
@@ -70,6 +71,9 @@ class stub_job_state(base_job.job_state):
     def _unlock_backing_file(self):
         pass
 
+    def _record_change(self, *record):
+        pass
+
 
 class test_init(unittest.TestCase):
 
@@ -737,6 +741,86 @@ class test_job_state_set_backing_file(unittest.TestCase):
         self.assertRaises(KeyError, state2.get, 'n7', 'shared5')
 
 
+class test_job_state_journal(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp(suffix='unittest')
+        self.original_wd = os.getcwd()
+        os.chdir(self.testdir)
+        self.state = base_job.job_state()
+        self.state.set_backing_file('backing_file')
+        self.state.set('ns', 'var', 'value')
+
+    def tearDown(self):
+        os.chdir(self.original_wd)
+        shutil.rmtree(self.testdir, ignore_errors=True)
+
+    def _read_back(self):
+        state = base_job.job_state()
+        state.read_from_file('backing_file')
+        return state
+
+    def test_reads_do_not_write(self):
+        os.utime('backing_file', (0, 0))
+        self.assertEqual('value', self.state.get('ns', 'var'))
+        self.assertTrue(self.state.has('ns', 'var'))
+        self.assertEqual(0, os.stat('backing_file').st_mtime)
+
+    def test_changes_are_appended(self):
+        snapshot = open('backing_file', 'rb').read()
+        self.state.set('ns', 'var2', 'value2')
+        self.state.discard('ns', 'var')
+        self.assertTrue(open('backing_file', 'rb').read().startswith(snapshot))
+        state = self._read_back()
+        self.assertFalse(state.has('ns', 'var'))
+        self.assertEqual('value2', state.get('ns', 'var2'))
+
+    def test_journal_is_compacted(self):
+        for i in xrange(5000):
+            self.state.set('ns', 'counter', i)
+        self.assertTrue(os.path.getsize('backing_file') <
+                        2 * base_job.job_state.JOURNAL_MIN_COMPACT_SIZE)
+        self.assertEqual(4999, self._read_back().get('ns', 'counter'))
+
+    def test_other_writers_are_seen(self):
+        other = base_job.job_state()
+        other.set_backing_file('backing_file')
+        other.set('ns', 'var', 'other value')
+        self.assertEqual('other value', self.state.get('ns', 'var'))
+
+        # a new snapshot, then a plain state file
+        for i in xrange(5000):
+            other.set('ns', 'counter', i)
+        self.assertEqual(4999, self.state.get('ns', 'counter'))
+        plain = base_job.job_state()
+        plain.set('ns', 'plain', 1)
+        plain.write_to_file('backing_file')
+        self.assertFalse(self.state.has('ns', 'var'))
+        self.assertEqual(1, self.state.get('ns', 'plain'))
+        self.state.set('ns', 'var', 'value')
+        self.assertEqual('value', other.get('ns', 'var'))
+
+    def test_partial_record_is_ignored(self):
+        self.state.set('ns', 'var2', 'value2')
+        backing_file = open('backing_file', 'ab')
+        backing_file.write('\x80\x02(U\x03set')
+        backing_file.close()
+        self.assertEqual('value2', self._read_back().get('ns', 'var2'))
+
+    def test_partial_record_is_replaced(self):
+        other = base_job.job_state()
+        other.set_backing_file('backing_file')
+        record = pickle.dumps(('set', 'ns', 'var4', 'x' * 200), 2)
+        backing_file = open('backing_file', 'ab')
+        backing_file.write(record[:len(record) / 2])
+        backing_file.close()
+        self.state.set('ns', 'var2', 'value2')
+        self.state.set('ns', 'var3', 'value3')
+        for state in (self.state, other, self._read_back()):
+            self.assertEqual('value2', state.get('ns', 'var2'))
+            self.assertEqual('value3', state.get('ns', 'var3'))
+
+
 class test_job_state_backing_file_locking(unittest.TestCase):
 
     def setUp(self):
@@ -1221,11 +1305,130 @@ class test_status_logger(unittest.TestCase):
             self.logger.record_entry(entry)
         self.assertEqual(entries, recorded_entries)
 
+    def _buffered_logger(self, **policy_args):
+        return base_job.status_logger(
+            self.job, self.indenter,
+            flush_policy=base_job.status_flush_policy(**policy_args))
+
+    def test_flushes_every_n_entries(self):
+        self.logger = self._buffered_logger(entries=3, boundaries=False)
+        self.logger.record_entry(self.make_dummy_entry('LINE1'))
+        self.logger.record_entry(self.make_dummy_entry('LINE2', start=True))
+        self.assertEqual('', open('status').read())
+        self.logger.record_entry(self.make_dummy_entry('LINE3'))
+        self.assertEqual('LINE1\nLINE2\n\tLINE3\n', open('status').read())
+
+    def test_flushes_on_boundaries(self):
+        os.mkdir('sub')
+        self.logger = self._buffered_logger(entries=100)
+        self.logger.record_entry(self.make_dummy_entry('LINE1', subdir='sub'))
+        self.assertEqual('', open('sub/status').read())
+        self.logger.record_entry(self.make_dummy_entry('LINE2', start=True))
+        self.assertEqual('LINE1\nLINE2\n', open('status').read())
+        self.assertEqual('LINE1\n', open('sub/status').read())
+
+    def test_flushes_after_interval(self):
+        self.logger = self._buffered_logger(entries=100, interval=0)
+        self.logger.record_entry(self.make_dummy_entry('LINE1'))
+        self.assertEqual('LINE1\n', open('status').read())
+
+    def test_flush_status_logs(self):
+        self.logger = self._buffered_logger(entries=100)
+        self.logger.record_entry(self.make_dummy_entry('LINE1'))
+        base_job.flush_status_logs()
+        self.assertEqual('LINE1\n', open('status').read())
+        self.logger.record_entry(self.make_dummy_entry('LINE2'))
+        self.logger.close()
+        self.assertEqual('LINE1\nLINE2\n', open('status').read())
+
+    def test_closes_least_recently_used_files(self):
+        writer = base_job.status_writer(base_job.status_flush_policy())
+        writer.MAX_OPEN_FILES = 2
+        writer.write(['log1', 'log2'], 'LINE1')
+        writer.write(['log3', 'log2'], 'LINE2')
+        writer.write(['log1'], 'LINE3')
+        writer.close()
+        self.assertEqual('LINE1\nLINE3\n', open('log1').read())
+        self.assertEqual('LINE1\nLINE2\n', open('log2').read())
+        self.assertEqual('LINE2\n', open('log3').read())
+
     def tearDown(self):
+        self.logger.close()
         os.chdir(self.original_wd)
         shutil.rmtree(self.testdir, ignore_errors=True)
 
 
+class test_status_log_merger(unittest.TestCase):
+
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp(suffix='unittest')
+        self.status = os.path.join(self.testdir, 'status')
+        self.merger = base_job.status_log_merger(self.status)
+
+    def tearDown(self):
+        self.merger.close()
+        shutil.rmtree(self.testdir, ignore_errors=True)
+
+    def entry(self, status_code, timestamp, indent=1, message='msg'):
+        entry = base_job.status_log_entry(status_code, None, 'op', message,
+                                          {}, timestamp)
+        return '\t' * indent + entry.render() + '\n'
+
+    def append(self, name, text):
+        log = open(os.path.join(self.testdir, name), 'a')
+        log.write(text)
+        log.close()
+
+    def read_status(self):
+        if not os.path.exists(self.status):
+            return ''
+        return open(self.status).read()
+
+    def test_merges_complete_groups(self):
+        self.merger.add(os.path.join(self.testdir, 'status.0'))
+        self.merger.merge()
+        self.assertEqual('', self.read_status())
+
+        info = self.entry('INFO', 10)
+        start = self.entry('START', 11)
+        good = self.entry('GOOD', 12, indent=2, message='line1\nline2')
+        end = self.entry('END GOOD', 13)
+        self.append('status.0', info)
+        self.merger.merge()
+        # the INFO entry may still get extra message lines
+        self.assertEqual('', self.read_status())
+        self.append('status.0', start + good + end[:10])
+        self.merger.merge()
+        self.assertEqual(info, self.read_status())
+        self.append('status.0', end[10:])
+        self.merger.merge()
+        self.assertEqual(info, self.read_status())
+
+        self.merger.remove(os.path.join(self.testdir, 'status.0'))
+        self.assertEqual(info + start + good + end, self.read_status())
+        self.assertFalse(os.path.exists(os.path.join(self.testdir,
+                                                    'status.0')))
+
+    def test_merges_in_timestamp_order(self):
+        for name in ('status.0', 'status.1'):
+            self.merger.add(os.path.join(self.testdir, name))
+        first = [self.entry('INFO', 20), self.entry('START', 30),
+                 self.entry('END GOOD', 31), self.entry('INFO', 40)]
+        second = [self.entry('START', 10, message='second'),
+                  self.entry('GOOD', 11, indent=2),
+                  self.entry('END GOOD', 25, message='second'),
+                  self.entry('INFO', 35)]
+        self.append('status.0', ''.join(first))
+        self.append('status.1', ''.join(second))
+        self.merger.merge()
+        self.assertEqual(''.join(second[:3] + first[:3]), self.read_status())
+        self.merger.remove(os.path.join(self.testdir, 'status.1'))
+        self.merger.remove(os.path.join(self.testdir, 'status.0'))
+        self.assertEqual(''.join(second[:3] + first[:3] + second[3:] +
+                                 first[3:]),
+                         self.read_status())
+
+
 class test_job_tags(unittest.TestCase):
 
     def setUp(self):
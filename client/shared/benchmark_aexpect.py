@@ -0,0 +1,80 @@
+#!/usr/bin/python
+"""Time ShellSession.cmd_output() on commands printing a lot of output.
+
+The incremental matching of the prompt is compared with filtering and
+matching all the output read so far every time more is read, as
+read_until_output_matches() used to do, whose cost grows with the square of
+the output.
+"""
+
+import optparse
+import time
+try:
+    import autotest.common as common
+except ImportError:
+    import common
+from autotest.client.shared import aexpect
+
+usage = 'usage: %prog [options]'
+parser = optparse.OptionParser(usage=usage)
+parser.add_option('-s', '--size', type='int', dest='size', default=32,
+                  help='Megabytes of output of the command')
+parser.add_option('-i', '--internal-timeout', type='float',
+                  dest='internal_timeout', default=0.0,
+                  help='Time read_nonblocking() waits for more output')
+
+LINE = '[  123.456789] console: some chatty kernel or serial console output'
+
+
+def get_last_nonempty_line(cont):
+    nonempty_lines = [l for l in cont.splitlines() if l.strip()]
+    if nonempty_lines:
+        return nonempty_lines[-1]
+    else:
+        return ""
+
+
+class full_output_session(aexpect.ShellSession):
+
+    """ShellSession matching the prompt against all the output read so far."""
+
+    def read_up_to_prompt(self, timeout=60, internal_timeout=None,
+                          print_func=None):
+        return self.read_until_output_matches([self.prompt],
+                                              get_last_nonempty_line,
+                                              timeout, internal_timeout,
+                                              print_func)[1]
+
+
+def run(session_class, options):
+    session = session_class('/bin/sh')
+    try:
+        session.cmd_output('true')
+        command = "yes '%s' | head -c %d" % (LINE, options.size * 1024 * 1024)
+        start = time.time()
+        output = session.cmd_output(command, timeout=3600,
+                                    internal_timeout=options.internal_timeout)
+        return time.time() - start, len(output)
+    finally:
+        session.close()
+
+
+def main():
+    (options, args) = parser.parse_args()
+    if args:
+        parser.print_help()
+        return
+
+    reference = None
+    for name, session_class in (('full output', full_output_session),
+                                ('incremental', aexpect.ShellSession)):
+        elapsed, length = run(session_class, options)
+        if reference is None:
+            reference = elapsed
+        print '%-12s %10d bytes %8.3fs %8.2f MB/s %6.2fx' % (
+            name, length, elapsed, length / elapsed / 1024 / 1024,
+            reference / elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+"""Time many concurrent ShellSessions, with a server each or multiplexed.
+
+Reports the time to start the sessions, to run a command in each of them a
+number of times, and the memory used by the server processes.
+"""
+
+import optparse
+import time
+try:
+    import autotest.common as common
+except ImportError:
+    import common
+from autotest.client.shared import aexpect
+
+usage = 'usage: %prog [options]'
+parser = optparse.OptionParser(usage=usage)
+parser.add_option('-n', '--sessions', type='int', dest='sessions', default=50,
+                  help='Concurrent sessions')
+parser.add_option('-r', '--rounds', type='int', dest='rounds', default=10,
+                  help='Commands run in each session')
+
+
+def get_server_pids(sessions):
+    pids = set()
+    for session in sessions:
+        stat = open('/proc/%d/stat' % session.get_pid()).read()
+        pids.add(int(stat.rsplit(')', 1)[1].split()[1]))
+    return pids
+
+
+def get_rss(pid):
+    for line in open('/proc/%d/status' % pid):
+        if line.startswith('VmRSS:'):
+            return int(line.split()[1])
+    return 0
+
+
+def run(options):
+    start = time.time()
+    sessions = [aexpect.ShellSession('/bin/sh')
+                for _ in xrange(options.sessions)]
+    started = time.time()
+    try:
+        for index in xrange(options.rounds):
+            for session in sessions:
+                session.cmd_output('echo %d' % index, internal_timeout=0)
+        commands = time.time() - started
+        pids = get_server_pids(sessions)
+        rss = sum(get_rss(pid) for pid in pids)
+    finally:
+        for session in sessions:
+            session.close()
+    return started - start, commands, len(pids), rss
+
+
+def main():
+    (options, args) = parser.parse_args()
+    if args:
+        parser.print_help()
+        return
+
+    for name, multiplex in (('server each', False), ('multiplexed', True)):
+        aexpect.use_multiplex_server(multiplex)
+        start, commands, servers, rss = run(options)
+        print ('%-12s start %7.3fs  commands %7.3fs  %3d servers '
+               '%8d kB RSS' % (name, start, commands, servers, rss))
+
+
+if __name__ == '__main__':
+    main()
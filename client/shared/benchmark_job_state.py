@@ -0,0 +1,89 @@
+#!/usr/bin/python
+"""Time job_state operations on a backing file.
+
+The journaled backing file is compared with rewriting the whole state file
+and reading it back on every operation, as job_state used to do.
+"""
+
+import optparse
+import os
+import shutil
+import tempfile
+import time
+try:
+    import autotest.common as common
+except ImportError:
+    import common
+from autotest.client.shared import base_job
+
+usage = 'usage: %prog [options]'
+parser = optparse.OptionParser(usage=usage)
+parser.add_option('-n', '--operations', type='int', dest='operations',
+                  default=10000, help='State operations per run')
+parser.add_option('-s', '--state-size', type='int', dest='state_size',
+                  default=1000, help='Values in the state before the run')
+
+
+class rewriting_job_state(base_job.job_state):
+
+    """job_state reading and writing the whole backing file every time."""
+
+    def _read_from_backing_file(self):
+        if self._backing_file:
+            merge_backing_file = not self._backing_file_initialized
+            self.read_from_file(self._backing_file, merge=merge_backing_file)
+            self._backing_file_initialized = True
+
+    def _write_to_backing_file(self):
+        self._pending_records = []
+        if self._backing_file:
+            self.write_to_file(self._backing_file)
+
+
+def run(state_class, backing_file, options):
+    state = state_class()
+    for index in xrange(options.state_size):
+        state.set('initial', 'var%d' % index, 'x' * 100)
+    state.set_backing_file(backing_file)
+
+    start = time.time()
+    for index in xrange(options.operations):
+        name = 'var%d' % (index % 100)
+        operation = index % 4
+        if operation == 0:
+            state.set('ns', name, index)
+        elif operation == 1:
+            state.get('ns', name, None)
+        elif operation == 2:
+            state.has('ns', name)
+        else:
+            state.discard('ns', name)
+    elapsed = time.time() - start
+    state.set_backing_file(None)
+    return elapsed
+
+
+def main():
+    (options, args) = parser.parse_args()
+    if args:
+        parser.print_help()
+        return
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        reference = None
+        for name, state_class in (('rewrite', rewriting_job_state),
+                                  ('journal', base_job.job_state)):
+            backing_file = os.path.join(tmpdir, name)
+            elapsed = run(state_class, backing_file, options)
+            if reference is None:
+                reference = elapsed
+            print '%-8s %8.3fs %10.0f operations/s %6.2fx %8d bytes' % (
+                name, elapsed, options.operations / elapsed,
+                reference / elapsed, os.path.getsize(backing_file))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
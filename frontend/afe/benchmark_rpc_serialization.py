@@ -0,0 +1,125 @@
+#!/usr/bin/python
+"""Compare the encoding of RPC results before and after the JsonSerializer.
+
+The payloads are synthetic results of get_host_queue_entries and
+get_test_views.  For each, the time to prepare and encode the result the old
+way (prepare_for_serialization, then simplejson) and with the JsonSerializer
+alone is reported, with the size of the response, raw and gzipped.
+"""
+
+import datetime
+import optparse
+import random
+import time
+try:
+    import autotest.common as common
+except ImportError:
+    import common
+from autotest.frontend import setup_django_environment
+from autotest.frontend.afe import rpc_utils
+from autotest.frontend.afe.json_rpc import serviceHandler
+from django.utils import text
+
+usage = 'usage: %prog [options]'
+parser = optparse.OptionParser(usage=usage)
+parser.add_option('-n', '--rows', type='int', dest='rows', default=10000,
+                  help='Rows of each payload')
+parser.add_option('-r', '--repeat', type='int', dest='repeat', default=3,
+                  help='Runs of each encoder, the best one is reported')
+
+
+def _time(index):
+    return datetime.datetime(2013, 1, 1) + datetime.timedelta(seconds=index)
+
+
+def host_queue_entries(num_rows):
+    entries = []
+    for index in xrange(num_rows):
+        entries.append({
+            'id': index,
+            'status': random.choice(('Queued', 'Running', 'Completed')),
+            'started_on': _time(index),
+            'finished_on': None,
+            'active': False,
+            'complete': True,
+            'execution_subdir': 'host%d' % index,
+            'job': {'id': index / 10, 'name': 'job%d' % (index / 10),
+                    'owner': 'user', 'priority': 1,
+                    'created_on': _time(index), 'synch_count': 1,
+                    'control_file': 'job.run_test("sleeptest")\n' * 5},
+            'host': {'id': index % 500, 'hostname': 'host%d' % (index % 500),
+                     'locked': False, 'status': 'Ready',
+                     'lock_time': None},
+            'meta_host': None,
+            'atomic_group': None,
+        })
+    return entries
+
+
+def test_views(num_rows):
+    views = []
+    for index in xrange(num_rows):
+        views.append({
+            'test_idx': index, 'job_idx': index / 20,
+            'test_name': 'test%d' % (index % 100), 'subdir': 'test',
+            'status': random.choice(('GOOD', 'FAIL')),
+            'reason': 'completed successfully',
+            'hostname': 'host%d' % (index % 500), 'platform': 'x86_64',
+            'kernel': '2.6.32', 'job_tag': '%d-user/host' % (index / 20),
+            'test_started_time': _time(index),
+            'test_finished_time': _time(index + 60),
+            'job_queued_time': _time(index - 60),
+            'job_started_time': _time(index),
+            'job_finished_time': rpc_utils.NULL_DATETIME,
+        })
+    return views
+
+
+def encode_prepared(encoder, result):
+    prepared = rpc_utils.prepare_for_serialization(result)
+    return encoder.encode({'result': prepared, 'id': 1, 'error': None})
+
+
+def encode_native(serializer, result):
+    return serializer.encode({'result': result, 'id': 1, 'error': None})
+
+
+def best_time(repeat, function, *args):
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        data = function(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, data
+
+
+def main():
+    (options, args) = parser.parse_args()
+    if args:
+        parser.print_help()
+        return
+
+    print 'simplejson C speedups: %s' % serviceHandler.hasSpeedups()
+    payloads = [('get_host_queue_entries', host_queue_entries(options.rows)),
+                ('get_test_views', test_views(options.rows))]
+    encoders = [
+        ('prepare + encode', encode_prepared, serviceHandler.json_encoder),
+        ('JsonSerializer', encode_native, serviceHandler.JsonSerializer()),
+    ]
+    for payload_name, payload in payloads:
+        print '%s, %d rows' % (payload_name, len(payload))
+        reference = None
+        for name, function, encoder in encoders:
+            elapsed, data = best_time(options.repeat, function, encoder,
+                                      payload)
+            if reference is None:
+                reference = elapsed
+            print '  %-18s %8.3fs %6.2fx %10d bytes %10d gzipped' % (
+                name, elapsed, reference / elapsed, len(data),
+                len(text.compress_string(data)))
+
+
+if __name__ == '__main__':
+    main()
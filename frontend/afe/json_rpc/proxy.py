@@ -19,6 +19,8 @@
   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 """
 
+import gzip
+import StringIO
 import urllib2
 
 
@@ -46,9 +48,15 @@ class ServiceProxy(object):
         postdata = encoder.JSONEncoder().encode({"method": self.__serviceName,
                                                  'params': args + (kwargs,),
                                                  'id': 'jsonrpc'})
+        headers = dict(self.__headers)
+        headers['Accept-Encoding'] = 'gzip'
         request = urllib2.Request(self.__serviceURL, data=postdata,
-                                  headers=self.__headers)
-        respdata = urllib2.urlopen(request).read()
+                                  headers=headers)
+        response = urllib2.urlopen(request)
+        respdata = response.read()
+        if response.info().get('Content-Encoding') == 'gzip':
+            respdata = gzip.GzipFile(
+                fileobj=StringIO.StringIO(respdata)).read()
         try:
             resp = decoder.JSONDecoder().decode(respdata)
         except ValueError:
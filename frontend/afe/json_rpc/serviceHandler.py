@@ -19,6 +19,8 @@
   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 """
 
+import datetime
+import decimal
 import traceback
 
 from simplejson import decoder, encoder
@@ -49,6 +51,57 @@ def customConvertJson(value):
 json_encoder = encoder.JSONEncoder()
 json_decoder = decoder.JSONDecoder()
 
+# the largest date and datetime stand for null dates in sorted results
+_NULL_DATES = (datetime.datetime.max, datetime.date.max)
+
+
+def convertNativeValue(value):
+    """
+    Convert the values simplejson can't encode itself, as
+    rpc_utils.prepare_for_serialization does:
+    -change datetimes and dates to strs, and the null dates to None
+    -change Decimals to floats
+    -change sets to lists
+    """
+    if isinstance(value, datetime.date):
+        for null_date in _NULL_DATES:
+            if value is null_date:
+                return None
+        return str(value)
+    elif isinstance(value, decimal.Decimal):
+        return float(value)
+    elif isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError('%r is not JSON serializable' % (value,))
+
+
+def hasSpeedups():
+    """
+    :return: whether simplejson encodes with its C extension.
+    """
+    return getattr(encoder, 'c_make_encoder', None) is not None
+
+
+class JsonSerializer(object):
+
+    """
+    Encoder and decoder of the JSON-RPC messages.
+
+    The results are encoded in a single pass, by the C extension of
+    simplejson when it is built, converting the datetimes, Decimals and sets
+    met on the way with convertNativeValue.  The results need no
+    preparation beforehand.
+    """
+
+    def __init__(self):
+        self._encoder = encoder.JSONEncoder(default=convertNativeValue)
+
+    def encode(self, value):
+        return self._encoder.encode(value)
+
+    def decode(self, data):
+        return customConvertJson(json_decoder.decode(data))
+
 
 def ServiceMethod(fn):
     fn.IsServiceMethod = True
@@ -73,8 +126,15 @@ class ServiceMethodNotFound(ServiceException):
 
 class ServiceHandler(object):
 
-    def __init__(self, service):
+    def __init__(self, service, serializer=None):
+        """
+        :param serializer: object with the encode and decode methods of
+                JsonSerializer, a JsonSerializer if None.
+        """
         self.service = service
+        if serializer is None:
+            serializer = JsonSerializer()
+        self.serializer = serializer
 
     @classmethod
     def blank_result_dict(cls):
@@ -115,14 +175,11 @@ class ServiceHandler(object):
         results = self.dispatchRequest(request)
         return self.translateResult(results)
 
-    @staticmethod
-    def translateRequest(data):
+    def translateRequest(self, data):
         try:
-            req = json_decoder.decode(data)
+            return self.serializer.decode(data)
         except:
             raise ServiceRequestNotTranslatable(data)
-        req = customConvertJson(req)
-        return req
 
     def findServiceEndpoint(self, name):
         try:
@@ -134,8 +191,7 @@ class ServiceHandler(object):
     def invokeServiceEndpoint(self, meth, args):
         return meth(*args)
 
-    @staticmethod
-    def translateResult(result_dict):
+    def translateResult(self, result_dict):
         """
         :param result_dict: a dictionary containing the result, error, traceback
                             and id.
@@ -152,14 +208,15 @@ class ServiceHandler(object):
             json_dict = {'result': result_dict['result'],
                          'id': result_dict['id'],
                          'error': result_dict['err']}
-            data = json_encoder.encode(json_dict)
+            data = self.serializer.encode(json_dict)
         except TypeError, e:
             err_traceback = traceback.format_exc()
             print err_traceback
             err = {"name": "JSONEncodeException",
                    "message": "Result Object Not Serializable",
                    "traceback": err_traceback}
-            data = json_encoder.encode({"result": None, "id": result_dict['id'],
-                                        "error": err})
+            data = self.serializer.encode({"result": None,
+                                           "id": result_dict['id'],
+                                           "error": err})
 
         return data
@@ -1,5 +1,7 @@
 #!/usr/bin/python
 
+import datetime
+import decimal
 import unittest
 try:
     import autotest.common as common
@@ -68,6 +70,28 @@ class TestServiceHandler(unittest.TestCase):
         response_obj = eval(response.replace('null', 'None'))
         self.assertNotEquals(response_obj['error'], 'None')
 
+    def test_native_values(self):
+        serializer = serviceHandler.JsonSerializer()
+        value = {'date': datetime.datetime(2013, 1, 2, 3, 4, 5),
+                 'null_date': datetime.datetime.max,
+                 'day': datetime.date(2013, 1, 2),
+                 'decimal': decimal.Decimal('1.5'),
+                 'set': set([1]),
+                 'tuple': (1, 2)}
+        self.assertEquals(
+            {'date': '2013-01-02 03:04:05', 'null_date': None,
+             'day': '2013-01-02', 'decimal': 1.5, 'set': [1],
+             'tuple': [1, 2]},
+            serviceHandler.json_decoder.decode(serializer.encode(value)))
+        self.assertRaises(TypeError, serializer.encode, object())
+
+    def test_unserializable_result(self):
+        result = self.serviceHandler.blank_result_dict()
+        result['result'] = object()
+        response = self.serviceHandler.translateResult(result)
+        response_obj = serviceHandler.json_decoder.decode(response)
+        self.assertEquals('JSONEncodeException', response_obj['error']['name'])
+
 
 if __name__ == "__main__":
     unittest.main()
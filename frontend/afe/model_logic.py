@@ -389,39 +389,46 @@ class ExtendedManager(dbmodels.Manager):
         raise ValueError('%s has no relation to %s' %
                          (related_model, self.model))
 
-    def _get_pivot_iterator(self, base_objects_by_id, related_model):
+    def _get_pivot_iterator(self, base_objects_by_id, related_model,
+                            select_related=()):
         """
         Determine the relationship between this model and related_model, and
         return a pivot iterator.
         :param base_objects_by_id: dict of instances of this model indexed by
         their IDs
+        :param select_related: foreign keys of related_model to load with the
+        related objects
         :return: a pivot iterator, which yields a tuple (base_object,
         related_object) for each relationship between a base object and a
         related object.  all base_object instances come from base_objects_by_id.
         Note -- this depends on Django model internals.
         """
+        related_query = related_model.objects.all()
+        if select_related:
+            related_query = related_query.select_related(*select_related)
         relationship_type, field = self.determine_relationship(related_model)
         if relationship_type == self.MANY_TO_ONE:
             return self._many_to_one_pivot(base_objects_by_id,
-                                           related_model, field)
+                                           related_query, field)
         elif relationship_type == self.M2M_ON_RELATED_MODEL:
             return self._many_to_many_pivot(
-                base_objects_by_id, related_model, field.m2m_db_table(),
+                base_objects_by_id, related_query, field.m2m_db_table(),
                 field.m2m_reverse_name(), field.m2m_column_name())
         else:
             assert relationship_type == self.M2M_ON_THIS_MODEL
             return self._many_to_many_pivot(
-                base_objects_by_id, related_model, field.m2m_db_table(),
+                base_objects_by_id, related_query, field.m2m_db_table(),
                 field.m2m_column_name(), field.m2m_reverse_name())
 
-    def _many_to_one_pivot(self, base_objects_by_id, related_model,
+    def _many_to_one_pivot(self, base_objects_by_id, related_query,
                            foreign_key_field):
         """
+        :param related_query: query of the related model
         :return: a pivot iterator - see _get_pivot_iterator()
         """
         filter_data = {foreign_key_field.name + '__pk__in':
                        base_objects_by_id.keys()}
-        for related_object in related_model.objects.filter(**filter_data):
+        for related_object in related_query.filter(**filter_data):
             # lookup base object in the dict, rather than grabbing it from the
             # related object.  we need to return instances from the dict, not
             # fresh instances of the same models (and grabbing model instances
@@ -454,9 +461,10 @@ class ExtendedManager(dbmodels.Manager):
         cursor.execute(query)
         return cursor.fetchall()
 
-    def _many_to_many_pivot(self, base_objects_by_id, related_model,
+    def _many_to_many_pivot(self, base_objects_by_id, related_query,
                             pivot_table, pivot_from_field, pivot_to_field):
         """
+        :param related_query: query of the related model
         :param pivot_table: see _query_pivot_table
         :param pivot_from_field: see _query_pivot_table
         :param pivot_to_field: see _query_pivot_table
@@ -467,13 +475,13 @@ class ExtendedManager(dbmodels.Manager):
 
         all_related_ids = list(set(related_id for base_id, related_id
                                    in id_pivot))
-        related_objects_by_id = related_model.objects.in_bulk(all_related_ids)
+        related_objects_by_id = related_query.in_bulk(all_related_ids)
 
         for base_id, related_id in id_pivot:
             yield base_objects_by_id[base_id], related_objects_by_id[related_id]
 
     def populate_relationships(self, base_objects, related_model,
-                               related_list_name):
+                               related_list_name, select_related=()):
         """
         For each instance of this model in base_objects, add a field named
         related_list_name listing all the related objects of type related_model.
@@ -483,6 +491,8 @@ class ExtendedManager(dbmodels.Manager):
         :param related_model - model class related to this model
         :param related_list_name - attribute name in which to store the related
         object list.
+        :param select_related - foreign keys of related_model to load along
+        with the related objects.
         """
         if not base_objects:
             # if we don't bail early, we'll get a SQL error later
@@ -491,7 +501,8 @@ class ExtendedManager(dbmodels.Manager):
         base_objects_by_id = dict((base_object._get_pk_val(), base_object)
                                   for base_object in base_objects)
         pivot_iterator = self._get_pivot_iterator(base_objects_by_id,
-                                                  related_model)
+                                                  related_model,
+                                                  select_related)
 
         for base_object in base_objects:
             setattr(base_object, related_list_name, [])
@@ -499,6 +510,21 @@ class ExtendedManager(dbmodels.Manager):
         for base_object, related_object in pivot_iterator:
             getattr(base_object, related_list_name).append(related_object)
 
+    def prefetch_relations(self, base_objects, relation_names):
+        """
+        Populate relationships of base_objects declared in the
+        prefetch_relations of this model, with one query per relation.
+        :param base_objects - list of instances of this model
+        :param relation_names - names of prefetch_relations to load
+        """
+        for name in relation_names:
+            related_model, select_related = self.model.prefetch_relations[name]
+            if isinstance(related_model, basestring):
+                related_model = dbmodels.get_model(self.model._meta.app_label,
+                                                   related_model)
+            self.populate_relationships(base_objects, related_model, name,
+                                        select_related)
+
 
 class ModelWithInvalidQuerySet(dbmodels.query.QuerySet):
 
@@ -542,6 +568,11 @@ class ModelExtensions(object):
     # Manager class
 
     field_dict = None
+    # related object lists that fetch_objects() and list_objects() can load
+    # for a whole page, one query per relation: list attribute name ->
+    # (related model or model name, foreign keys of the related model to
+    # load with it)
+    prefetch_relations = {}
     # subclasses should override if they want to support smart_get() by name
     name_field = None
 
@@ -609,7 +640,8 @@ class ModelExtensions(object):
         return new_data
 
     @classmethod
-    def convert_human_readable_values(cls, data, to_human_readable=False):
+    def convert_human_readable_values(cls, data, to_human_readable=False,
+                                      related_objects=None):
         """
         Performs conversions on user-supplied field data, to make it
         easier for users to pass human-readable data.
@@ -626,6 +658,9 @@ class ModelExtensions(object):
         If to_human_readable=True, perform the inverse - i.e. convert
         numeric values to human readable values.
 
+        related_objects maps foreign key field names to objects already
+        loaded, which are used instead of calling smart_get.
+
         This method modifies data in-place.
         """
         field_dict = cls.get_field_dict()
@@ -646,8 +681,10 @@ class ModelExtensions(object):
                         break
             # convert foreign key values
             elif field_obj.rel:
-                dest_obj = field_obj.rel.to.smart_get(data[field_name],
-                                                      valid_only=False)
+                dest_obj = (related_objects or {}).get(field_name)
+                if dest_obj is None:
+                    dest_obj = field_obj.rel.to.smart_get(data[field_name],
+                                                          valid_only=False)
                 if to_human_readable:
                     if dest_obj.name_field is not None:
                         data[field_name] = getattr(dest_obj,
@@ -867,27 +904,54 @@ class ModelExtensions(object):
         return query.count()
 
     @classmethod
-    def clean_object_dicts(cls, field_dicts):
+    def clean_object_dicts(cls, field_dicts, related_objects=None):
         """
         Take a list of dicts corresponding to object (as returned by
         query.values()) and clean the data to be more suitable for
         returning to the user.
+        :param related_objects: see convert_human_readable_values()
         """
         for field_dict in field_dicts:
             cls.clean_foreign_keys(field_dict)
             cls._convert_booleans(field_dict)
             cls.convert_human_readable_values(field_dict,
-                                              to_human_readable=True)
+                                              to_human_readable=True,
+                                              related_objects=related_objects)
+
+    @classmethod
+    def fetch_objects(cls, filter_data, initial_query=None, relations=()):
+        """
+        Like query_objects, but return a list of model instances, each with
+        the related object lists named in relations (see prefetch_relations)
+        loaded.
+        """
+        objects = list(cls.query_objects(filter_data,
+                                         initial_query=initial_query))
+        if relations:
+            cls.objects.prefetch_relations(objects, relations)
+        return objects
 
     @classmethod
-    def list_objects(cls, filter_data, initial_query=None):
+    def list_objects(cls, filter_data, initial_query=None, relations=()):
         """
-        Like query_objects, but return a list of dictionaries.
+        Like query_objects, but return a list of dictionaries.  The
+        dictionary of each object also has, for each name of relations (see
+        prefetch_relations), the list of the dictionaries of its related
+        objects.
         """
         query = cls.query_objects(filter_data, initial_query=initial_query)
         extra_fields = query.query.extra_select.keys()
-        field_dicts = [model_object.get_object_dict(extra_fields=extra_fields)
-                       for model_object in query]
+        objects = list(query)
+        if relations:
+            cls.objects.prefetch_relations(objects, relations)
+        field_dicts = []
+        for model_object in objects:
+            field_dict = model_object.get_object_dict(extra_fields=extra_fields)
+            for name in relations:
+                field_dict[name] = [related_object.get_object_dict()
+                                    for related_object
+                                    in getattr(model_object, name)]
+            field_dicts.append(field_dict)
         return field_dicts
 
     @classmethod
@@ -930,12 +994,19 @@ class ModelExtensions(object):
         extra_fields: list of extra attribute names to include, in addition to
         the fields defined on this object.
         """
-        fields = self.get_field_dict().keys()
-        if extra_fields:
-            fields += extra_fields
-        object_dict = dict((field_name, getattr(self, field_name))
-                           for field_name in fields)
-        self.clean_object_dicts([object_dict])
+        object_dict = {}
+        related_objects = {}
+        for field_name, field in self.get_field_dict().iteritems():
+            # the ID of a foreign key, rather than the related object, which
+            # would cost a query per object
+            object_dict[field_name] = getattr(self, field.attname)
+            # unless it was selected along with this object
+            if field.rel and hasattr(self, field.get_cache_name()):
+                related_objects[field_name] = getattr(self,
+                                                      field.get_cache_name())
+        for field_name in extra_fields or ():
+            object_dict[field_name] = getattr(self, field_name)
+        self.clean_object_dicts([object_dict], related_objects)
         self._postprocess_object_dict(object_dict)
         return object_dict
 
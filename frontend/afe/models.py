@@ -436,6 +436,9 @@ class Host(model_logic.ModelWithInvalid, dbmodels.Model,
     name_field = 'hostname'
     objects = model_logic.ModelWithInvalidManager()
     valid_objects = model_logic.ValidObjectsManager()
+    prefetch_relations = {'label_list': ('Label', ('atomic_group',)),
+                          'acl_list': ('AclGroup', ()),
+                          'attribute_list': ('HostAttribute', ())}
 
     def __init__(self, *args, **kwargs):
         super(Host, self).__init__(*args, **kwargs)
@@ -746,6 +749,8 @@ class AclGroup(dbmodels.Model, model_logic.ModelExtensions):
 
     name_field = 'name'
     objects = model_logic.ExtendedManager()
+    prefetch_relations = {'user_list': ('User', ()),
+                          'host_list': ('Host', ())}
 
     @staticmethod
     def check_for_acl_violation_hosts(hosts, username=None):
@@ -1124,6 +1129,8 @@ class Job(dbmodels.Model, model_logic.ModelExtensions):
 
     # custom manager
     objects = JobManager()
+    prefetch_relations = {'dependencies': ('Label', ()),
+                          'keyvals': ('JobKeyval', ())}
 
     def is_server_job(self):
         return self.control_type == self.ControlType.SERVER
@@ -1300,6 +1307,25 @@ class IneligibleHostQueue(dbmodels.Model, model_logic.ModelExtensions):
         db_table = 'afe_ineligible_host_queues'
 
 
+class ShardHostClaim(dbmodels.Model, model_logic.ModelExtensions):
+
+    """
+    A host in use by one of the schedulers of a sharded deployment (see
+    scheduler/shard.py).  A host can only be claimed by one shard at a time.
+    """
+    host = dbmodels.ForeignKey(Host, unique=True)
+    shard = dbmodels.CharField(max_length=255)
+    claimed_on = dbmodels.DateTimeField()
+
+    objects = model_logic.ExtendedManager()
+
+    class Meta:
+        db_table = 'afe_shard_host_claims'
+
+    def __unicode__(self):
+        return u'%s claimed by %s' % (self.host, self.shard)
+
+
 class HostQueueEntry(dbmodels.Model, model_logic.ModelExtensions):
     Status = host_queue_entry_states.Status
     ACTIVE_STATUSES = host_queue_entry_states.ACTIVE_STATUSES
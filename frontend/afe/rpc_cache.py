@@ -0,0 +1,296 @@
+"""
+Cache of the results of read-mostly RPCs.
+
+An RPC is made cacheable with the cached() decorator, which records for how
+long its result may be served from the cache, the models it is built from
+and whether it depends on the user making the request:
+
+    @rpc_cache.cached(ttl=300, models=(models.Test,))
+    def get_tests(**filter_data):
+        ...
+
+RpcHandler.dispatch_request() looks the results of these RPCs up in an
+RpcCache before calling them.  Saving or deleting an object of one of the
+models of an RPC, or changing its many-to-many relations, invalidates all the
+cached results of the RPC.  QuerySet.update() and raw SQL send no signals:
+their changes show after the TTL.
+
+The results are kept in an in-process LRU cache unless [SERVER]
+rpc_cache_location names a memcached server, which is then shared by all the
+processes of the server.  Invalidation bumps a generation number stored in
+the cache next to the results, so that it reaches every process sharing it.
+An in-process cache only sees the changes made through its own process: the
+others show after the TTL.
+"""
+
+import threading
+import time
+
+try:
+    import autotest.common as common
+except ImportError:
+    import common
+from autotest.client.shared import utils
+from autotest.client.shared.settings import settings
+from django.db.models import signals
+from simplejson import encoder
+
+ENABLED = settings.get_value('SERVER', 'rpc_cache_enabled', type=bool,
+                             default=True)
+MAX_ENTRIES = settings.get_value('SERVER', 'rpc_cache_max_entries', type=int,
+                                 default=1000)
+LOCATION = settings.get_value('SERVER', 'rpc_cache_location', default='')
+
+# log the hit rates every so many lookups
+_STATS_INTERVAL = 1000
+
+_json_encoder = encoder.JSONEncoder(sort_keys=True)
+
+
+class CachePolicy(object):
+
+    """
+    :param ttl: seconds a result may be served from the cache.
+    :param models: models whose changes invalidate the results.
+    :param per_user: whether the results depend on the current user.
+    """
+
+    def __init__(self, ttl, models=(), per_user=False):
+        self.ttl = ttl
+        self.models = tuple(models)
+        self.per_user = per_user
+
+
+def cached(ttl, models=(), per_user=False):
+    """
+    Decorator marking an RPC whose results may be cached, see CachePolicy.
+    """
+    def decorator(function):
+        function.rpc_cache_policy = CachePolicy(ttl, models, per_user)
+        return function
+    return decorator
+
+
+def get_policy(function):
+    """
+    :return: the CachePolicy of an RPC function, None if it isn't cacheable.
+    """
+    return getattr(function, 'rpc_cache_policy', None)
+
+
+class LruCache(object):
+
+    """
+    Thread safe in-process cache with the part of the interface of the
+    Django cache backends used by RpcCache.  When full, the least recently
+    used tenth of the entries is evicted.
+    """
+
+    def __init__(self, max_entries):
+        self._max_entries = max_entries
+        # key -> [value, expiry time or None, last use]
+        self._entries = {}
+        self._uses = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.time():
+            del self._entries[key]
+            return None
+        self._uses += 1
+        entry[2] = self._uses
+        return entry
+
+    def _set(self, key, value, timeout):
+        if key not in self._entries and len(self._entries) >= self._max_entries:
+            by_use = sorted(self._entries.iteritems(),
+                            key=lambda (key, entry): entry[2])
+            for old_key, _ in by_use[:max(1, self._max_entries / 10)]:
+                del self._entries[old_key]
+        expiry = None
+        if timeout is not None:
+            expiry = time.time() + timeout
+        self._uses += 1
+        self._entries[key] = [value, expiry, self._uses]
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            entry = self._get_entry(key)
+            if entry is None:
+                return default
+            return entry[0]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value, timeout=None):
+        self._lock.acquire()
+        try:
+            self._set(key, value, timeout)
+        finally:
+            self._lock.release()
+
+    def add(self, key, value, timeout=None):
+        """
+        Set key unless it is already set.
+
+        :return: whether the key was set.
+        """
+        self._lock.acquire()
+        try:
+            if self._get_entry(key) is not None:
+                return False
+            self._set(key, value, timeout)
+            return True
+        finally:
+            self._lock.release()
+
+    def incr(self, key, delta=1):
+        """
+        :raise ValueError: if the key isn't set.
+        """
+        self._lock.acquire()
+        try:
+            entry = self._get_entry(key)
+            if entry is None:
+                raise ValueError('Key %s not found' % key)
+            entry[0] += delta
+            return entry[0]
+        finally:
+            self._lock.release()
+
+
+def _get_backend():
+    if LOCATION:
+        from django.core import cache
+        return cache.get_cache(
+            'django.core.cache.backends.memcached.MemcachedCache',
+            LOCATION=LOCATION)
+    return LruCache(MAX_ENTRIES)
+
+
+class RpcCache(object):
+
+    """
+    Results of the cacheable RPCs of an RpcHandler.
+
+    The keys of the results are made of the prefix of the handler, the name
+    of the RPC, its generation number, and a digest of its parameters and,
+    for the RPCs depending on the user, of the login of the user.
+
+    :param prefix: prefix of the keys, different for each RpcHandler sharing
+            a backend.
+    """
+
+    def __init__(self, prefix, backend=None):
+        if backend is None:
+            backend = _get_backend()
+        self._prefix = prefix
+        self._backend = backend
+        self._policies = {}
+        # model -> names of the RPCs built from it
+        self._methods_by_model = {}
+        # name -> [hits, misses]
+        self._stats = {}
+        self._lookups = 0
+        for signal in (signals.post_save, signals.post_delete,
+                       signals.m2m_changed):
+            signal.connect(self._model_changed, weak=False,
+                           dispatch_uid=(id(self), signal))
+
+    def add_method(self, name, function):
+        """
+        Register an RPC, if it is cacheable.  An RPC overridden by one that
+        isn't is no longer cached.
+        """
+        policy = get_policy(function)
+        if policy is None:
+            self._policies.pop(name, None)
+            return
+        self._policies[name] = policy
+        self._stats[name] = [0, 0]
+        senders = list(policy.models)
+        # many-to-many changes are sent by the through models
+        for model in policy.models:
+            senders.extend(field.rel.through
+                           for field in model._meta.many_to_many)
+        for sender in senders:
+            self._methods_by_model.setdefault(sender, []).append(name)
+
+    def is_cached(self, name):
+        return name in self._policies
+
+    def _generation_key(self, name):
+        return 'rpc_cache:%s:generation:%s' % (self._prefix, name)
+
+    def _generation(self, name):
+        key = self._generation_key(name)
+        generation = self._backend.get(key)
+        if generation is None:
+            # start from the clock, so that an evicted or expired generation
+            # number never comes back
+            self._backend.add(key, int(time.time() * 1000), None)
+            generation = self._backend.get(key)
+        return generation
+
+    def _key(self, name, params, user):
+        policy = self._policies[name]
+        if not policy.per_user:
+            user = None
+        digest = utils.hash('md5', _json_encoder.encode([user, params]))
+        return 'rpc_cache:%s:%s:%s:%s' % (self._prefix, name,
+                                          self._generation(name),
+                                          digest.hexdigest())
+
+    def invalidate(self, name):
+        key = self._generation_key(name)
+        try:
+            self._backend.incr(key)
+        except ValueError:
+            self._generation(name)
+
+    def _model_changed(self, sender, **kwargs):
+        for name in self._methods_by_model.get(sender, ()):
+            self.invalidate(name)
+
+    def get(self, name, params, user):
+        """
+        :return: (cache key, cached result or None)
+        """
+        key = self._key(name, params, user)
+        result = self._backend.get(key)
+        self._stats[name][result is None] += 1
+        self._lookups += 1
+        return key, result
+
+    def set(self, name, key, result):
+        self._backend.set(key, result, self._policies[name].ttl)
+
+    def hit_rates(self):
+        """
+        :return: dict mapping the names of the RPCs looked up to
+                (hits, lookups).
+        """
+        rates = {}
+        for name, (hits, misses) in self._stats.iteritems():
+            if hits or misses:
+                rates[name] = (hits, hits + misses)
+        return rates
+
+    def stats_due(self):
+        """
+        :return: whether the hit rates should be logged, every
+                _STATS_INTERVAL lookups.
+        """
+        return self._lookups and not self._lookups % _STATS_INTERVAL
+
+
+def format_hit_rates(hit_rates):
+    return ', '.join('%s %d/%d' % (name, hits, lookups)
+                     for name, (hits, lookups) in sorted(hit_rates.iteritems()))
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+
+import unittest
+try:
+    import autotest.common as common
+except ImportError:
+    import common
+from autotest.frontend import setup_django_environment
+from autotest.frontend import test_utils, thread_local
+from autotest.frontend.afe import models, model_attributes
+from autotest.frontend.afe import rpc_cache, rpc_handler, rpc_interface
+
+
+class LruCacheTest(unittest.TestCase):
+
+    def test_eviction(self):
+        cache = rpc_cache.LruCache(10)
+        for index in xrange(10):
+            cache.set(index, str(index))
+        self.assertEquals('0', cache.get(0))
+        cache.set(10, '10')
+        self.assertEquals(10, len(cache))
+        # 1 was the least recently used
+        self.assertEquals(None, cache.get(1))
+        self.assertEquals('0', cache.get(0))
+        self.assertEquals('10', cache.get(10))
+
+    def test_expiry(self):
+        cache = rpc_cache.LruCache(10)
+        cache.set('key', 'value', 0)
+        self.assertEquals(None, cache.get('key'))
+        cache.set('key', 'value', 60)
+        self.assertEquals('value', cache.get('key'))
+
+    def test_add_incr(self):
+        cache = rpc_cache.LruCache(10)
+        self.assertRaises(ValueError, cache.incr, 'key')
+        self.assertTrue(cache.add('key', 1))
+        self.assertFalse(cache.add('key', 5))
+        self.assertEquals(2, cache.incr('key'))
+        self.assertEquals(2, cache.get('key'))
+
+
+class RpcCacheTest(unittest.TestCase, test_utils.FrontendTestMixin):
+
+    def setUp(self):
+        self._frontend_common_setup()
+        self.cache = rpc_cache.RpcCache('test', rpc_cache.LruCache(100))
+        self.handler = rpc_handler.RpcHandler((rpc_interface,),
+                                              cache=self.cache)
+
+    def tearDown(self):
+        self._frontend_common_teardown()
+
+    def _dispatch(self, method, request_id=1, **kwargs):
+        return self.handler.dispatch_request(
+            {'method': method, 'params': [kwargs], 'id': request_id})
+
+    def _add_test(self, name):
+        models.Test.objects.create(name=name,
+                                   test_type=model_attributes.TestTypes.SERVER,
+                                   path='/path/to/' + name)
+
+    def test_cached(self):
+        self._add_test('test1')
+        self._dispatch('get_tests')
+        self._add_test('test2')
+        # the cache is invalidated
+        self.assertEquals(2, len(self._dispatch('get_tests')['result']))
+        cached_result = self._dispatch('get_tests', request_id=2)
+        self.assertEquals(2, cached_result['id'])
+        self.assertEquals(2, len(cached_result['result']))
+        self.assertEquals({'get_tests': (1, 3)}, self.cache.hit_rates())
+
+        # other parameters are another entry
+        self.assertEquals(
+            1, len(self._dispatch('get_tests', name='test1')['result']))
+        self.assertEquals({'get_tests': (1, 4)}, self.cache.hit_rates())
+
+    def test_per_user(self):
+        user = models.User.current_user()
+        other_user = models.User.objects.create(login='other')
+        thread_local.set_user(user)
+        request = {'method': 'get_static_data', 'params': [{}], 'id': 1}
+        self.handler.dispatch_request(request, user)
+        self.handler.dispatch_request(request, other_user)
+        self.handler.dispatch_request(request, user)
+        self.assertEquals({'get_static_data': (1, 3)}, self.cache.hit_rates())
+        self.assertEquals(user, thread_local.get_user())
+
+    def test_errors_not_cached(self):
+        def get_tests(**filter_data):
+            raise ValueError('error')
+        self.handler._rpc_methods.get_tests = (
+            rpc_handler.RpcHandler._allow_keyword_args(get_tests))
+        self.assertTrue(self._dispatch('get_tests')['err'])
+        self.assertTrue(self._dispatch('get_tests')['err'])
+        self.assertEquals({'get_tests': (0, 2)}, self.cache.hit_rates())
+
+    def test_not_cached(self):
+        self._dispatch('get_hosts')
+        self.assertEquals({}, self.cache.hit_rates())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,8 +9,9 @@ import pydoc
 import re
 import urllib
 import inspect
+from autotest.frontend import thread_local
 from autotest.frontend.afe.json_rpc import serviceHandler
-from autotest.frontend.afe import models, rpc_utils
+from autotest.frontend.afe import models, rpc_cache, rpc_utils
 from autotest.frontend.afe import rpcserver_logging
 
 LOGGING_REGEXPS = [r'.*add_.*',
@@ -33,9 +34,18 @@ class RpcMethodHolder(object):
 
 class RpcHandler(object):
 
-    def __init__(self, rpc_interface_modules, document_module=None):
+    def __init__(self, rpc_interface_modules, document_module=None,
+                 cache=None):
+        """
+        :param cache: RpcCache of the results of the cacheable RPCs (see
+                rpc_cache.cached), None for a new one unless the cache is
+                disabled in the configuration.
+        """
         self._rpc_methods = RpcMethodHolder()
         self._dispatcher = serviceHandler.ServiceHandler(self._rpc_methods)
+        if cache is None and rpc_cache.ENABLED:
+            cache = rpc_cache.RpcCache(rpc_interface_modules[0].__name__)
+        self._cache = cache
 
         # store all methods from interface modules
         for module in rpc_interface_modules:
@@ -61,8 +71,43 @@ class RpcHandler(object):
     def decode_request(self, json_request):
         return self._dispatcher.translateRequest(json_request)
 
-    def dispatch_request(self, decoded_request):
-        return self._dispatcher.dispatchRequest(decoded_request)
+    def dispatch_request(self, decoded_request, user=None):
+        """
+        Call an RPC, or get its result from the cache if it is cacheable.
+
+        :param user: User making the request, the current user if None.  The
+                RPC runs as this user, whose results are cached apart from
+                those of other users.
+        """
+        if user is None:
+            user = models.User.current_user()
+        previous_user = thread_local.get_user()
+        thread_local.set_user(user)
+        try:
+            return self._dispatch_request_as(decoded_request, user)
+        finally:
+            thread_local.set_user(previous_user)
+
+    def _dispatch_request_as(self, decoded_request, user):
+        method = decoded_request.get('method')
+        if self._cache is None or not self._cache.is_cached(method):
+            return self._dispatcher.dispatchRequest(decoded_request)
+
+        key, result = self._cache.get(method, decoded_request.get('params'),
+                                      user.login)
+        if result is not None:
+            decoded_result = self._dispatcher.blank_result_dict()
+            decoded_result['id'] = decoded_request.get('id')
+            decoded_result['result'] = result
+        else:
+            decoded_result = self._dispatcher.dispatchRequest(decoded_request)
+            if not decoded_result['err']:
+                self._cache.set(method, key, decoded_result['result'])
+        if rpcserver_logging.LOGGING_ENABLED and self._cache.stats_due():
+            rpcserver_logging.rpc_logger.info(
+                'RPC cache hits: %s',
+                rpc_cache.format_hit_rates(self._cache.hit_rates()))
+        return decoded_result
 
     def log_request(self, user, decoded_request, decoded_result,
                     log_all=False):
@@ -78,15 +123,24 @@ class RpcHandler(object):
     def encode_result(self, results):
         return self._dispatcher.translateResult(results)
 
+    def encode(self, value):
+        """Encode a value of a result in JSON."""
+        return self._dispatcher.serializer.encode(value)
+
     def handle_rpc_request(self, request):
         user = models.User.current_user()
         json_request = self.raw_request_data(request)
         decoded_request = self.decode_request(json_request)
-        decoded_result = self.dispatch_request(decoded_request)
+        # the results are converted by the encoder
+        rpc_utils.set_native_serialization(True)
+        try:
+            decoded_result = self.dispatch_request(decoded_request, user)
+        finally:
+            rpc_utils.set_native_serialization(False)
         result = self.encode_result(decoded_result)
         if rpcserver_logging.LOGGING_ENABLED:
             self.log_request(user, decoded_request, decoded_result)
-        return rpc_utils.raw_http_response(result)
+        return rpc_utils.gzip_http_response(request, result)
 
     def handle_jsonp_rpc_request(self, request):
         request_data = request.GET['request']
@@ -124,3 +178,5 @@ class RpcHandler(object):
                 continue
             decorated_function = RpcHandler._allow_keyword_args(attribute)
             setattr(self._rpc_methods, name, decorated_function)
+            if self._cache is not None:
+                self._cache.add_method(name, attribute)
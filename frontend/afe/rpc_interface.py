@@ -40,7 +40,8 @@ try:
 except ImportError:
     import common
 from autotest.frontend.afe import models, model_logic, model_attributes
-from autotest.frontend.afe import control_file, rpc_utils, reservations
+from autotest.frontend.afe import control_file, rpc_cache, rpc_utils
+from autotest.frontend.afe import reservations
 from autotest.server.hosts.remote import get_install_server_info
 from autotest.client.shared import version
 from autotest.client.shared.settings import settings
@@ -326,12 +327,8 @@ def get_hosts(multiple_labels=(), exclude_only_if_needed_labels=False,
                                      exclude_atomic_group_hosts,
                                      valid_only, filter_data)
     hosts = list(hosts)
-    models.Host.objects.populate_relationships(hosts, models.Label,
-                                               'label_list')
-    models.Host.objects.populate_relationships(hosts, models.AclGroup,
-                                               'acl_list')
-    models.Host.objects.populate_relationships(hosts, models.HostAttribute,
-                                               'attribute_list')
+    models.Host.objects.prefetch_relations(
+        hosts, ('label_list', 'acl_list', 'attribute_list'))
 
     install_server = None
     install_server_info = get_install_server_info()
@@ -561,6 +558,7 @@ def delete_test(id):
     models.Test.smart_get(id).delete()
 
 
+@rpc_cache.cached(ttl=300, models=(models.Test,))
 def get_tests(**filter_data):
     """
     Get tests.
@@ -606,6 +604,7 @@ def delete_profiler(id):
     models.Profiler.smart_get(id).delete()
 
 
+@rpc_cache.cached(ttl=300, models=(models.Profiler,))
 def get_profilers(**filter_data):
     """
     Get all profilers.
@@ -767,13 +766,13 @@ def get_acl_groups(**filter_data):
     :param filter_data: Filters out which ACL groups to get.
     :return: Sequence of ACL groups.
     """
-    acl_groups = models.AclGroup.list_objects(filter_data)
+    acl_groups = models.AclGroup.list_objects(
+        filter_data, relations=('user_list', 'host_list'))
     for acl_group in acl_groups:
-        acl_group_obj = models.AclGroup.objects.get(id=acl_group['id'])
-        acl_group['users'] = [user.login
-                              for user in acl_group_obj.users.all()]
-        acl_group['hosts'] = [host.hostname
-                              for host in acl_group_obj.hosts.all()]
+        acl_group['users'] = [user['login']
+                              for user in acl_group.pop('user_list')]
+        acl_group['hosts'] = [host['hostname']
+                              for host in acl_group.pop('host_list')]
     return rpc_utils.prepare_for_serialization(acl_groups)
 
 
@@ -1010,10 +1009,8 @@ def get_jobs(not_yet_run=False, running=False, finished=False, **filter_data):
                                                             running,
                                                             finished)
     job_dicts = []
-    jobs = list(models.Job.query_objects(filter_data))
-    models.Job.objects.populate_relationships(jobs, models.Label,
-                                              'dependencies')
-    models.Job.objects.populate_relationships(jobs, models.JobKeyval, 'keyvals')
+    jobs = models.Job.fetch_objects(filter_data,
+                                    relations=('dependencies', 'keyvals'))
     for job in jobs:
         job_dict = job.get_object_dict()
         job_dict['dependencies'] = ','.join(label.name
@@ -1058,9 +1055,14 @@ def get_info_for_clone(id, preserve_metahosts, queue_entry_filter_data=None):
                                       preserve_metahosts,
                                       queue_entry_filter_data)
 
+    host_dicts_by_id = dict(
+        (host_dict['id'], host_dict) for host_dict
+        in get_hosts(id__in=[host.id for host in job_info['hosts']]))
     host_dicts = []
     for host, profile in zip(job_info['hosts'], job_info['profiles']):
-        host_dict = get_hosts(id=host.id)[0]
+        # a host can appear more than once
+        host_dict = dict(host_dicts_by_id[host.id])
+        host_dict['labels'] = list(host_dict['labels'])
         other_labels = host_dict['labels']
         if host_dict['platform']:
             other_labels.remove(host_dict['platform'])
@@ -1232,6 +1234,7 @@ def echo(data=""):
     return data
 
 
+@rpc_cache.cached(ttl=60)
 def get_motd():
     """
     Returns the message of the day (MOTD).
@@ -1241,6 +1244,9 @@ def get_motd():
     return rpc_utils.get_motd()
 
 
+@rpc_cache.cached(ttl=60, per_user=True,
+                  models=(models.User, models.Label, models.AtomicGroup,
+                          models.Test, models.Profiler, models.DroneSet))
 def get_static_data():
     """
     Returns a dictionary containing a bunch of data that shouldn't change
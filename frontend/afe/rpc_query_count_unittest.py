@@ -0,0 +1,89 @@
+#!/usr/bin/python
+
+"""
+Bounds on the SQL statements run by the AFE RPCs listing objects, which must
+not grow with the number of objects listed.
+"""
+
+import unittest
+try:
+    import autotest.common as common
+except ImportError:
+    import common
+from autotest.frontend import setup_django_environment
+from autotest.frontend import test_utils
+from autotest.frontend.afe import models, rpc_interface
+
+_PAGE_SIZES = (10, 100, 1000)
+
+
+class RpcQueryCountTest(unittest.TestCase, test_utils.FrontendTestMixin):
+
+    def setUp(self):
+        self._frontend_common_setup()
+
+    def tearDown(self):
+        self._frontend_common_teardown()
+
+    def _create_page(self, size):
+        """
+        Create size hosts, with labels, an ACL group and attributes, and a
+        job with a dependency and a keyval for each of them.
+
+        :return: (prefix of the names of the objects, job scheduled on all
+                the hosts)
+        """
+        prefix = 'page%d-' % size
+        acl_group = models.AclGroup.objects.create(name=prefix + 'acl')
+        acl_group.users.add(models.User.current_user())
+        hosts = []
+        for index in xrange(size):
+            host = models.Host.objects.create(hostname='%shost%d' %
+                                              (prefix, index))
+            host.labels.add(self.label4, self.label6)
+            models.HostAttribute.objects.create(host=host, attribute='attr',
+                                                value=str(index))
+            hosts.append(host)
+        acl_group.hosts = hosts
+
+        for index in xrange(size):
+            job = self._create_job(hosts=[hosts[index].id])
+            job.name = prefix + 'job'
+            job.save()
+            job.dependency_labels.add(self.label6)
+            models.JobKeyval.objects.create(job=job, key='key', value='value')
+        return prefix, self._create_job(hosts=[host.id for host in hosts])
+
+    def test_query_counts(self):
+        for size in _PAGE_SIZES:
+            prefix, clone_job = self._create_page(size)
+
+            hosts = self._check_max_queries(
+                8, rpc_interface.get_hosts, hostname__startswith=prefix)
+            self.assertEquals(size, len(hosts))
+            self.assertEquals('atomic1', hosts[0]['atomic_group'])
+            self.assertEquals(['Everyone', prefix + 'acl'],
+                              sorted(hosts[0]['acls']))
+
+            jobs = self._check_max_queries(
+                6, rpc_interface.get_jobs, name=prefix + 'job')
+            self.assertEquals(size, len(jobs))
+            self.assertEquals({'key': 'value'}, jobs[0]['keyvals'])
+
+            entries = self._check_max_queries(
+                3, rpc_interface.get_host_queue_entries,
+                host__hostname__startswith=prefix, job__name=prefix + 'job')
+            self.assertEquals(size, len(entries))
+            self.assertTrue(entries[0]['host']['hostname'].startswith(prefix))
+
+            acl_groups = self._check_max_queries(
+                7, rpc_interface.get_acl_groups, name=prefix + 'acl')
+            self.assertEquals(size, len(acl_groups[0]['hosts']))
+
+            info = self._check_max_queries(
+                12, rpc_interface.get_info_for_clone, clone_job.id, False)
+            self.assertEquals(size, len(info['hosts']))
+
+
+if __name__ == '__main__':
+    unittest.main()
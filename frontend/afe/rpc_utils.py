@@ -7,14 +7,34 @@ __author__ = 'showard@google.com (Steve Howard)'
 
 import datetime
 import os
+import re
 import sys
 import inspect
+import threading
 import django.http
+from django.utils import cache, text
 from autotest.frontend.afe import models, model_logic, model_attributes
 
 NULL_DATETIME = datetime.datetime.max
 NULL_DATE = datetime.date.max
 
+# responses shorter than this are not worth compressing
+GZIP_MIN_LENGTH = 1024
+
+_accepts_gzip_re = re.compile(r'\bgzip\b')
+
+_serialization = threading.local()
+
+
+def set_native_serialization(enabled):
+    """
+    Tell prepare_for_serialization() whether the RPC results of this thread
+    are encoded by a serviceHandler.JsonSerializer, which converts the
+    datetimes, tuples and sets itself, so that they need not be converted
+    beforehand.
+    """
+    _serialization.native = enabled
+
 
 def prepare_for_serialization(objects):
     """
@@ -23,6 +43,8 @@ def prepare_for_serialization(objects):
     if (isinstance(objects, list) and len(objects) and
             isinstance(objects[0], dict) and 'id' in objects[0]):
         objects = gather_unique_dicts(objects)
+    if getattr(_serialization, 'native', False):
+        return objects
     return _prepare_data(objects)
 
 
@@ -39,7 +61,8 @@ def prepare_rows_as_nested_dicts(query, nested_dict_column_names):
     :return: An list suitable to returned in an RPC.
     """
     all_dicts = []
-    for row in query.select_related():
+    # nullable foreign keys are only followed when named
+    for row in query.select_related(*nested_dict_column_names):
         row_dict = row.get_object_dict()
         for column in nested_dict_column_names:
             if row_dict[column] is not None:
@@ -77,6 +100,42 @@ def raw_http_response(response_data, content_type=None):
     return response
 
 
+def accepts_gzip(request):
+    return bool(_accepts_gzip_re.search(
+        request.META.get('HTTP_ACCEPT_ENCODING', '')))
+
+
+def gzip_http_response(request, response_data, content_type=None):
+    """
+    Like raw_http_response, but compress the response data with gzip if the
+    client accepts it and the data is long enough.
+    """
+    compress = len(response_data) >= GZIP_MIN_LENGTH and accepts_gzip(request)
+    if compress:
+        response_data = text.compress_string(response_data)
+    response = raw_http_response(response_data, content_type)
+    if compress:
+        response['Content-Encoding'] = 'gzip'
+    cache.patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def gzip_streaming_response(request, chunks, content_type=None):
+    """
+    Streaming response of chunks of data, compressed with gzip if the client
+    accepts it.
+    """
+    compress = accepts_gzip(request)
+    if compress:
+        chunks = text.compress_sequence(chunks)
+    response = django.http.StreamingHttpResponse(chunks,
+                                                 content_type=content_type)
+    if compress:
+        response['Content-Encoding'] = 'gzip'
+    cache.patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
 def gather_unique_dicts(dict_iterable):
     """
     Pick out unique objects (by ID) from an iterable of object dicts.
@@ -405,7 +464,8 @@ def get_job_info(job, preserve_metahosts=False, queue_entry_filter_data=None):
     atomic_group = None
     hostless = False
 
-    queue_entries = job.hostqueueentry_set.all()
+    queue_entries = job.hostqueueentry_set.select_related('host', 'meta_host',
+                                                          'atomic_group')
     if queue_entry_filter_data:
         queue_entries = models.HostQueueEntry.query_objects(
             queue_entry_filter_data, initial_query=queue_entries)
@@ -443,7 +443,7 @@ class Collection(Resource):
         page = queryset[start_index:(start_index + items_per_page)]
 
         rep = self._representation(page)
-        rep.update({'total_results': len(queryset),
+        rep.update({'total_results': queryset.count(),
                     'start_index': start_index,
                     'items_per_page': items_per_page})
         return self._basic_response(rep)
@@ -4,6 +4,7 @@ try:
 except ImportError:
     import common
 from autotest.frontend import setup_test_environment
+from django.db import connection
 from autotest.frontend import thread_local
 from autotest.frontend.afe import models, model_attributes
 from autotest.client.shared.settings import settings
@@ -81,6 +82,32 @@ class FrontendTestMixin(object):
         thread_local.set_user(None)
         self.god.unstub_all()
 
+    def _count_queries(self, function, *args, **kwargs):
+        """
+        Call function, recording the SQL statements it runs.
+
+        :return: (return value of function, number of SQL statements)
+        """
+        connection.use_debug_cursor = True
+        num_queries_before = len(connection.queries)
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            connection.use_debug_cursor = None
+        return result, len(connection.queries) - num_queries_before
+
+    def _check_max_queries(self, max_queries, function, *args, **kwargs):
+        """
+        Call function and check it runs at most max_queries SQL statements.
+
+        :return: the return value of function.
+        """
+        result, num_queries = self._count_queries(function, *args, **kwargs)
+        self.assertTrue(num_queries <= max_queries,
+                        '%s ran %d SQL statements, more than %d' %
+                        (function.__name__, num_queries, max_queries))
+        return result
+
     def _create_job(self, hosts=[], metahosts=[], priority=0, active=False,
                     synchronous=False, atomic_group=None, hostless=False,
                     drone_set=None, control_file='control',
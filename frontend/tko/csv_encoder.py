@@ -1,4 +1,6 @@
 import csv
+import itertools
+import StringIO
 import django.http
 try:
     import autotest.common as common
@@ -9,6 +11,9 @@ from autotest.frontend.afe import rpc_utils
 
 class CsvEncoder(object):
 
+    # rows per chunk of a streamed response
+    _ROWS_PER_CHUNK = 1000
+
     def __init__(self, request, response):
         self._request = request
         self._response = response
@@ -25,6 +30,29 @@ class CsvEncoder(object):
         writer.writerows(self._output_rows)
         return response
 
+    def _csv_chunks(self, rows):
+        chunk = StringIO.StringIO()
+        writer = csv.writer(chunk)
+        for index, row in enumerate(rows):
+            writer.writerow(row)
+            if (index + 1) % self._ROWS_PER_CHUNK == 0:
+                yield chunk.getvalue()
+                chunk = StringIO.StringIO()
+                writer = csv.writer(chunk)
+        if chunk.getvalue():
+            yield chunk.getvalue()
+
+    def _build_streaming_response(self, rows):
+        """
+        Like _build_response, but encode the rows as they are sent, for the
+        rows of an iterator.
+        """
+        response = django.http.StreamingHttpResponse(self._csv_chunks(rows),
+                                                     content_type='text/csv')
+        response['Content-Disposition'] = (
+            'attachment; filename=tko_query.csv')
+        return response
+
     def encode(self):
         raise NotImplementedError
 
@@ -98,8 +126,14 @@ class TableCsvEncoder(CsvEncoder):
         return [row_object.get(field) for field, name in self._column_specs]
 
     def _encode_table(self, row_objects):
-        self._append_output_row([column_spec[1]  # header row
-                                 for column_spec in self._column_specs])
+        header_row = [column_spec[1] for column_spec in self._column_specs]
+        if not isinstance(row_objects, list):
+            # an iterator over a large query, see
+            # tko_rpc_utils.iterate_test_views()
+            return self._build_streaming_response(itertools.chain(
+                [header_row], itertools.imap(self._format_row, row_objects)))
+
+        self._append_output_row(header_row)
         for row_object in row_objects:
             self._append_output_row(self._format_row(row_object))
         return self._build_response()
@@ -27,7 +27,10 @@ class CsvEncodingTest(unittest.TestCase):
     def _encode_and_check_result(self, request, result, *expected_csv_rows):
         encoder = csv_encoder.encoder(request, result)
         response = encoder.encode()
-        csv_result = response.content
+        if response.streaming:
+            csv_result = ''.join(response.streaming_content)
+        else:
+            csv_result = response.content
         expected_csv = '\r\n'.join(expected_csv_rows) + '\r\n'
         self.assertEquals(csv_result, expected_csv)
 
@@ -56,6 +59,14 @@ class CsvEncodingTest(unittest.TestCase):
                                       'foo,bar',
                                       'baz,asdf')
 
+    def test_streamed_table_encoder(self):
+        request = self._make_request('get_test_views', [['col1', 'Column 1']])
+        response = iter([{'col1': 'foo'}, {'col1': 'bar'}, {'col1': 'baz'}])
+        encoder = csv_encoder.encoder(request, response)
+        encoder._ROWS_PER_CHUNK = 2
+        self.assertEquals(['Column 1\r\nfoo\r\n', 'bar\r\nbaz\r\n'],
+                          list(encoder.encode().streaming_content))
+
     def test_grouped_table_encoder(self):
         request = self._make_request('get_group_counts',
                                      [['col1', 'Column 1'],
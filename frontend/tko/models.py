@@ -1,4 +1,4 @@
-from django.db import models as dbmodels, connection
+from django.db import models as dbmodels, connection, transaction
 from autotest.frontend.afe import model_logic, readonly_connection
 from autotest.frontend.afe.models import TestEnvironment
 
@@ -705,8 +705,22 @@ class TestView(dbmodels.Model, model_logic.ModelExtensions):
     @classmethod
     def query_objects(cls, filter_data, initial_query=None,
                       apply_presentation=True):
+        """
+        Besides the parameters of ModelExtensions.query_objects, supports
+        keyset paging: with after_test_idx, only the tests with a greater
+        test_idx are returned, sorted on test_idx.  Passing the test_idx of
+        the last test of a page gives the next page, query_limit tests long,
+        whose cost doesn't grow with its position as with query_start.
+        """
+        after_test_idx = filter_data.pop('after_test_idx', None)
         if initial_query is None:
             initial_query = cls.objects.get_query_set_with_joins(filter_data)
+        if after_test_idx is not None:
+            if 'query_start' in filter_data or 'sort_by' in filter_data:
+                raise ValueError('Cannot pass query_start or sort_by with '
+                                 'after_test_idx')
+            initial_query = initial_query.filter(
+                test_idx__gt=after_test_idx).order_by('test_idx')
         return super(TestView, cls).query_objects(
             filter_data, initial_query=initial_query,
             apply_presentation=apply_presentation)
@@ -714,3 +728,145 @@ class TestView(dbmodels.Model, model_logic.ModelExtensions):
     class Meta:
         db_table = 'tko_test_view_2'
         managed = False
+
+
+class TestStatusRollupManager(model_logic.ExtendedManager):
+
+    def refresh_jobs(self, job_ids):
+        """
+        Recompute the rollup rows of the given jobs from their tests.
+
+        :return: the number of rollup rows written.
+        """
+        if not job_ids:
+            return 0
+        job_list = ','.join(str(int(job_id)) for job_id in job_ids)
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM tko_test_status_rollup '
+                       'WHERE job_idx IN (%s)' % job_list)
+        cursor.execute('INSERT INTO tko_test_status_rollup '
+                       '(job_idx, machine_idx, kernel_idx, test_name, '
+                       'status_idx, test_count, latest_test_idx) '
+                       'SELECT job_idx, machine_idx, kernel_idx, test, status, '
+                       'COUNT(1), MAX(test_idx) FROM tko_tests '
+                       'WHERE job_idx IN (%s) '
+                       'GROUP BY job_idx, machine_idx, kernel_idx, test, status'
+                       % job_list)
+        rows = cursor.rowcount
+        transaction.commit_unless_managed()
+        return rows
+
+
+class TestStatusRollup(dbmodels.Model):
+
+    """
+    Number of tests and latest test of each job, machine, kernel, test name
+    and status.
+
+    The rows of a job are recomputed by the parser whenever it writes the
+    tests of the job (see autotest.tko.dbutils), so that status and group
+    counts can be computed without scanning tko_tests.
+    """
+    job = dbmodels.ForeignKey(Job, db_column='job_idx')
+    machine = dbmodels.ForeignKey(Machine, db_column='machine_idx')
+    kernel = dbmodels.ForeignKey(Kernel, db_column='kernel_idx')
+    test_name = dbmodels.CharField(max_length=300)
+    status = dbmodels.ForeignKey(Status, db_column='status_idx')
+    test_count = dbmodels.IntegerField()
+    latest_test_idx = dbmodels.IntegerField()
+
+    objects = TestStatusRollupManager()
+
+    class Meta:
+        db_table = 'tko_test_status_rollup'
+
+
+class TestStatusRollupViewManager(TempManager):
+
+    """
+    Answers group queries with group dicts shaped like those of TestView
+    group queries.  These hold every TestView column; the ones not grouped
+    on come from one test of the group, the latest one here.
+    """
+
+    _LATEST_TEST_NAME = '_latest_test_idx'
+
+    def execute_group_query(self, query, group_by):
+        extra_select = dict((field, field) for field in group_by
+                            if '(' in field)
+        extra_select[self._LATEST_TEST_NAME] = 'MAX(latest_test_idx)'
+        # extra() refuses paged queries, the page is set again afterwards
+        limits = (query.query.low_mark, query.query.high_mark)
+        query = query.all()
+        query.query.clear_limits()
+        query = query.extra(select=extra_select)
+        fields = [field for field in group_by if field not in extra_select]
+        query = query.values(*(fields + query.query.extra_select.keys()))
+        query.query.set_limits(*limits)
+        group_dicts = super(TestStatusRollupViewManager,
+                            self).execute_group_query(query, group_by)
+
+        test_ids = [group_dict[self._LATEST_TEST_NAME]
+                    for group_dict in group_dicts]
+        tests = dict((test['test_idx'], test) for test in
+                     TestView.objects.filter(test_idx__in=test_ids).values())
+        # a test deleted without refreshing the rollups of its job leaves
+        # only the group fields
+        no_test = dict.fromkeys(field.attname
+                                for field in TestView._meta.fields)
+        for index, group_dict in enumerate(group_dicts):
+            test_dict = dict(tests.get(group_dict.pop(self._LATEST_TEST_NAME),
+                                       no_test))
+            test_dict.update(group_dict)
+            group_dicts[index] = test_dict
+        return group_dicts
+
+
+class TestStatusRollupView(dbmodels.Model, model_logic.ModelExtensions):
+
+    """
+    TestStatusRollup rows with the TestView columns they cover.
+    """
+    # TestView fields answered by the rollups
+    covered_fields = set([
+        'job_idx', 'test_name', 'kernel_idx', 'status_idx', 'machine_idx',
+        'job_tag', 'job_name', 'job_owner', 'job_queued_time',
+        'job_started_time', 'job_finished_time', 'afe_job_id', 'hostname',
+        'platform', 'machine_owner', 'kernel_hash', 'kernel_base', 'kernel',
+        'status', 'DATE(job_queued_time)',
+    ])
+
+    id = dbmodels.IntegerField(primary_key=True)
+    job_idx = dbmodels.IntegerField('job index')
+    test_name = dbmodels.CharField(blank=True, max_length=300)
+    kernel_idx = dbmodels.IntegerField('kernel index')
+    status_idx = dbmodels.IntegerField('status index')
+    machine_idx = dbmodels.IntegerField('host index')
+    test_count = dbmodels.IntegerField()
+    latest_test_idx = dbmodels.IntegerField()
+    job_tag = dbmodels.CharField(blank=True, max_length=300)
+    job_name = dbmodels.CharField(blank=True, max_length=300)
+    job_owner = dbmodels.CharField('owner', blank=True, max_length=240)
+    job_queued_time = dbmodels.DateTimeField(null=True, blank=True)
+    job_started_time = dbmodels.DateTimeField(null=True, blank=True)
+    job_finished_time = dbmodels.DateTimeField(null=True, blank=True)
+    afe_job_id = dbmodels.IntegerField(null=True)
+    hostname = dbmodels.CharField(blank=True, max_length=300)
+    platform = dbmodels.CharField(blank=True, max_length=240)
+    machine_owner = dbmodels.CharField(blank=True, max_length=240)
+    kernel_hash = dbmodels.CharField(blank=True, max_length=105)
+    kernel_base = dbmodels.CharField(blank=True, max_length=90)
+    kernel = dbmodels.CharField(blank=True, max_length=300)
+    status = dbmodels.CharField(blank=True, max_length=30)
+
+    objects = TestStatusRollupViewManager()
+
+    def save(self):
+        raise NotImplementedError('TestStatusRollupView is read-only')
+
+    def delete(self):
+        raise NotImplementedError('TestStatusRollupView is read-only')
+
+    class Meta:
+        db_table = 'tko_test_status_rollup_view'
+        managed = False
@@ -3,6 +3,7 @@ Simple utility wrappers around the TKO models
 """
 
 from autotest.frontend.tko.models import Job, Test, Machine, TestLabel
+from autotest.frontend.tko.models import TestStatusRollup
 
 
 def job_get_by_tag(tag):
@@ -79,7 +80,9 @@ def test_delete_by_idx(test_idx):
     '''
     Delete test based on its idx
     '''
-    Test.objects.get(pk=test_idx).delete()
+    test = Test.objects.get(pk=test_idx)
+    test.delete()
+    TestStatusRollup.objects.refresh_jobs([test.job_id])
     return test_get_by_idx(test_idx) is None
 
 
@@ -41,6 +41,21 @@ class TestResultCollection(resource_lib.Collection):
     queryset = models.Test.objects.order_by('-test_idx')
     entry_class = TestResult
 
+    def _query_parameters_accepted(self):
+        params = super(TestResultCollection, self)._query_parameters_accepted()
+        params.append(('before_id',
+                       'Only include tests with a lower id.  Pass the id of '
+                       'the last member of a page to get the next page, '
+                       'instead of a start_index'))
+        return params
+
+    def _filtered_queryset(self):
+        queryset = super(TestResultCollection, self)._filtered_queryset()
+        before_id = self._read_int_parameter('before_id', None)
+        if before_id is not None:
+            queryset = queryset.filter(test_idx__lt=before_id)
+        return queryset
+
 
 class ResourceDirectory(resource_lib.Resource):
     _permitted_methods = ('GET',)
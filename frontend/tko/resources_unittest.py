@@ -34,6 +34,13 @@ class TestResultTest(TkoResourceTestCase):
         self.check_collection(response, 'test_name',
                               ['kernbench', 'mytest1', 'mytest2'])
 
+    def test_keyset_paging(self):
+        response = self.request('get', 'test_results?before_id=3')
+        self.check_collection(response, 'test_name', ['mytest1', 'mytest2'])
+        response = self.request('get',
+                                'test_results?before_id=3&items_per_page=1')
+        self.check_collection(response, 'test_name', ['mytest2'])
+
     def test_filter_afe_job_id(self):
         response = self.request('get', 'test_results?afe_job_id=1')
         self.check_collection(response, 'test_name', ['mytest1', 'mytest2'])
@@ -4,7 +4,7 @@ import datetime
 import itertools
 import operator
 from django.db import models as dbmodels
-from autotest.frontend.afe import rpc_utils, model_logic
+from autotest.frontend.afe import rpc_cache, rpc_utils, model_logic
 from autotest.frontend.afe import models as afe_models, readonly_connection
 from autotest.frontend.tko import models, tko_rpc_utils, graphing_utils
 from autotest.frontend.tko import preconfigs
@@ -14,12 +14,17 @@ from autotest.frontend.tko import preconfigs
 # IMPORTANT: please update INTERFACE_VERSION with the current date whenever
 # the interface changes, so that RPC clients can handle the changes
 #
-INTERFACE_VERSION = (2013, 05, 23)
+INTERFACE_VERSION = (2026, 10, 18)
 
 
 # table/spreadsheet view support
 
 def get_test_views(**filter_data):
+    """
+    Large results should be fetched page by page with after_test_idx (see
+    TestView.query_objects) and query_limit, or through the streamed_rpc and
+    csv views.
+    """
     return rpc_utils.prepare_for_serialization(
         models.TestView.list_objects(filter_data))
 
@@ -52,7 +57,19 @@ def get_group_counts(group_by, header_groups=None, fixed_headers=None,
       total count in the group, plus keys for each of the extra_select_fields.
       The keys for the extra_select_fields are determined by the "AS" alias of
       the field.
+
+    Counts of the fields covered by the status rollups are computed from them
+    (see tko_rpc_utils.rollup_covers()).
     """
+    header_groups = header_groups or []
+    fixed_headers = fixed_headers or {}
+    if ((not extra_select_fields or
+         extra_select_fields == tko_rpc_utils.STATUS_FIELDS) and
+            tko_rpc_utils.rollup_covers(group_by, header_groups, fixed_headers,
+                                        filter_data)):
+        return _get_rollup_group_counts(group_by, header_groups, fixed_headers,
+                                        bool(extra_select_fields), filter_data)
+
     query = models.TestView.objects.get_query_set_with_joins(filter_data)
     # don't apply presentation yet, since we have extra selects to apply
     query = models.TestView.query_objects(filter_data, initial_query=query,
@@ -64,12 +81,31 @@ def get_group_counts(group_by, header_groups=None, fixed_headers=None,
     query = models.TestView.apply_presentation(query, filter_data)
 
     group_processor = tko_rpc_utils.GroupDataProcessor(query, group_by,
-                                                       header_groups or [],
-                                                       fixed_headers or {})
+                                                       header_groups,
+                                                       fixed_headers)
     group_processor.process_group_dicts()
     return rpc_utils.prepare_for_serialization(group_processor.get_info_dict())
 
 
+def _get_rollup_group_counts(group_by, header_groups, fixed_headers,
+                             status_counts, filter_data):
+    query = tko_rpc_utils.get_rollup_query(filter_data)
+    count_name = models.TestStatusRollupView.objects._GROUP_COUNT_NAME
+    select = {count_name: tko_rpc_utils.ROLLUP_COUNT_SQL}
+    if status_counts:
+        select.update(tko_rpc_utils.ROLLUP_STATUS_FIELDS)
+    query = query.extra(select=select)
+    query = models.TestStatusRollupView.apply_presentation(query, filter_data)
+
+    group_processor = tko_rpc_utils.GroupDataProcessor(query, group_by,
+                                                       header_groups,
+                                                       fixed_headers)
+    group_processor.process_group_dicts()
+    info = group_processor.get_info_dict()
+    tko_rpc_utils.fix_rollup_counts(info['groups'], select.keys())
+    return rpc_utils.prepare_for_serialization(info)
+
+
 def get_num_groups(group_by, **filter_data):
     """
     Gets the count of unique groups with the given grouping fields.
@@ -103,17 +139,27 @@ def get_latest_tests(group_by, header_groups=[], fixed_headers={},
                       with each cell. The fields are returned in the extra_info
                       field of the return dictionary.
     """
-    # find latest test per group
-    initial_query = models.TestView.objects.get_query_set_with_joins(
-        filter_data)
-    query = models.TestView.query_objects(filter_data,
-                                          initial_query=initial_query,
-                                          apply_presentation=False)
+    # find latest test per group, from the status rollups if they cover the
+    # query
+    use_rollups = tko_rpc_utils.rollup_covers(group_by, header_groups,
+                                              fixed_headers, filter_data)
+    if use_rollups:
+        initial_query = models.TestView.objects.all()
+        model = models.TestStatusRollupView
+        query = tko_rpc_utils.get_rollup_query(filter_data)
+        latest_test_sql = 'MAX(latest_test_idx)'
+    else:
+        initial_query = models.TestView.objects.get_query_set_with_joins(
+            filter_data)
+        model = models.TestView
+        query = models.TestView.query_objects(filter_data,
+                                              initial_query=initial_query,
+                                              apply_presentation=False)
+        latest_test_sql = 'MAX(%s)' % (
+            models.TestView.objects.get_key_on_this_table('test_idx'))
     query = query.exclude(status__in=tko_rpc_utils._INVALID_STATUSES)
-    query = query.extra(
-        select={'latest_test_idx': 'MAX(%s)' %
-                models.TestView.objects.get_key_on_this_table('test_idx')})
-    query = models.TestView.apply_presentation(query, filter_data)
+    query = query.extra(select={'latest_test_idx': latest_test_sql})
+    query = model.apply_presentation(query, filter_data)
 
     group_processor = tko_rpc_utils.GroupDataProcessor(query, group_by,
                                                        header_groups,
@@ -388,10 +434,13 @@ def delete_saved_queries(id_list):
 
 
 # other
+@rpc_cache.cached(ttl=60)
 def get_motd():
     return rpc_utils.get_motd()
 
 
+@rpc_cache.cached(ttl=60, per_user=True,
+                  models=(afe_models.User, models.TestLabel))
 def get_static_data():
     result = {}
     group_fields = []
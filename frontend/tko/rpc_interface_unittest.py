@@ -2,6 +2,7 @@
 
 import os
 import re
+import simplejson
 import unittest
 try:
     import autotest.common as common
@@ -11,7 +12,8 @@ from autotest.frontend import setup_django_environment
 from autotest.frontend import setup_test_environment
 from autotest.client.shared.test_utils import mock
 from django.db import connection
-from autotest.frontend.tko import models, rpc_interface
+from django.test import client
+from autotest.frontend.tko import models, rpc_interface, tko_rpc_utils, views
 
 # this will need to be updated if the table schemas change (or removed if we
 # add proper primary keys)
@@ -182,6 +184,9 @@ class TkoTestMixin(object):
         label2.tests.add(job1_test1)
         label3.tests.add(job1_test1)
 
+        # as the parser does
+        models.TestStatusRollup.objects.refresh_jobs([job1.pk, job2.pk])
+
     def _add_iteration_keyval(self, table, test, iteration, attribute, value):
         cursor = connection.cursor()
         cursor.execute('INSERT INTO %s ' 'VALUES (%%s, %%s, %%s, %%s)' % table,
@@ -263,6 +268,51 @@ class RpcInterfaceTest(unittest.TestCase, TkoTestMixin):
         self.assertEquals(
             [], rpc_interface.get_test_views(hostname='fakehost'))
 
+    def test_get_test_views_keyset_paging(self):
+        tests = rpc_interface.get_test_views(after_test_idx=1, query_limit=1)
+        self.assertEquals([2], [test['test_idx'] for test in tests])
+        self.assertEquals([], rpc_interface.get_test_views(after_test_idx=3))
+        self.assertRaises(ValueError, rpc_interface.get_test_views,
+                          after_test_idx=1, sort_by=['test_name'])
+
+    def test_iterate_test_views(self):
+        tests = tko_rpc_utils.iterate_test_views(
+            rpc_interface.get_test_views, {}, page_size=2)
+        self.assertEquals([1, 2, 3], [test['test_idx'] for test in tests])
+
+        tests = tko_rpc_utils.iterate_test_views(
+            rpc_interface.get_detailed_test_views,
+            {'sort_by': ['-test_name'], 'query_start': 1, 'query_limit': 1},
+            page_size=2)
+        self.assertEquals(['mytest1'], [test['test_name'] for test in tests])
+
+        tests = tko_rpc_utils.iterate_test_views(
+            rpc_interface.get_test_views, {'job_name': 'myjob1'}, page_size=1)
+        self._check_test_names(tests, ['mytest1', 'mytest2'])
+
+    def _streamed_rpc(self, filter_data):
+        request = client.RequestFactory().post(
+            '/streamed_rpc/', simplejson.dumps(
+                {'id': 1, 'method': 'get_test_views',
+                 'params': [filter_data]}),
+            content_type='application/json')
+        return views.handle_streamed_rpc(request)
+
+    def test_streamed_rpc(self):
+        response = self._streamed_rpc({'job_name': 'myjob1'})
+        self.assertTrue(response.streaming)
+        decoded = simplejson.loads(''.join(response))
+        self.assertEquals(None, decoded['error'])
+        self._check_test_names(decoded['result'], ['mytest1', 'mytest2'])
+
+        # invalid queries fail before the response starts
+        response = self._streamed_rpc({'after_test_idx': 1,
+                                       'sort_by': ['test_name']})
+        self.assertFalse(response.streaming)
+        decoded = simplejson.loads(response.content)
+        self.assertEquals(None, decoded['result'])
+        self.assertEquals('ValueError', decoded['error']['name'])
+
     def _check_test_names(self, tests, expected_names):
         self.assertEquals(set(test['test_name'] for test in tests),
                           set(expected_names))
@@ -342,6 +392,90 @@ class RpcInterfaceTest(unittest.TestCase, TkoTestMixin):
         self.assertEquals(group1['extra_info'], ['1-myjobtag1'])
         self.assertEquals(group2['extra_info'], ['2-myjobtag2'])
 
+    def test_rollup_covers(self):
+        self.assertTrue(tko_rpc_utils.rollup_covers(
+            ['job_name', 'DATE(job_queued_time)'], [['job_name']],
+            {'status': ['GOOD']},
+            {'hostname__in': ['myhost'], 'sort_by': ['-job_tag'],
+             'extra_where': '(kernel = "x y" OR status LIKE \'%GO%\') AND '
+                            'afe_job_id IN (1, 2)',
+             'test_label_fields': [], 'query_start': 0, 'query_limit': 5}))
+        self.assertFalse(tko_rpc_utils.rollup_covers(['reason'], [], {}, {}))
+        self.assertFalse(tko_rpc_utils.rollup_covers(
+            ['job_name'], [], {}, {'test_finished_time__gt': '2013-01-01'}))
+        self.assertFalse(tko_rpc_utils.rollup_covers(
+            ['job_name'], [], {}, {'test_label_fields': ['invalidated']}))
+        self.assertFalse(tko_rpc_utils.rollup_covers(
+            ['job_name'], [], {},
+            {'extra_where': 'test_label_invalidated.id IS NULL'}))
+
+    def _check_rollup_answers(self, rpc, compared_keys=(), **args):
+        """
+        :param compared_keys: keys to compare in all groups, in addition to
+                the group fields and counts.  Groups of one test are compared
+                whole.
+        """
+        from_rollups = rpc(**args)
+        self.god.stub_with(tko_rpc_utils, 'rollup_covers',
+                           lambda *args: False)
+        live = rpc(**args)
+        self.god.unstub(tko_rpc_utils, 'rollup_covers')
+        self.assertEquals(live['header_values'], from_rollups['header_values'])
+        self.assertEquals(len(live['groups']), len(from_rollups['groups']))
+        for live_group, rollup_group in zip(live['groups'],
+                                            from_rollups['groups']):
+            self.assertEquals(sorted(live_group), sorted(rollup_group))
+            if (rpc != rpc_interface.get_latest_tests and
+                    live_group['group_count'] == 1):
+                self.assertEquals(live_group, rollup_group)
+                continue
+            # the columns not grouped on come from any test of the group
+            for key in (['id', 'group_count', 'header_indices'] +
+                        list(compared_keys) + args['group_by'] +
+                        tko_rpc_utils.STATUS_FIELDS.keys()):
+                self.assertEquals(live_group.get(key), rollup_group.get(key))
+
+    def test_answers_from_rollups(self):
+        job2 = models.Job.objects.get(tag='2-myjobtag2')
+        for test_name in ('kernbench', 'mytest1'):
+            models.Test.objects.create(
+                job=job2, test=test_name, kernel=self.first_test.kernel,
+                status=models.Status.objects.get(word='FAILED'),
+                machine=self.first_test.machine)
+        models.TestStatusRollup.objects.refresh_jobs([job2.pk])
+
+        self._check_rollup_answers(rpc_interface.get_group_counts,
+                                   group_by=['test_name'])
+        self._check_rollup_answers(rpc_interface.get_group_counts,
+                                   group_by=['test_name'],
+                                   sort_by=['-test_name'], query_start=1,
+                                   query_limit=1)
+        self._check_rollup_answers(
+            rpc_interface.get_status_counts, group_by=['job_name', 'kernel'],
+            header_groups=[['job_name'], ['kernel']],
+            extra_where='hostname = "myhost"')
+        self._check_rollup_answers(rpc_interface.get_latest_tests,
+                                   compared_keys=['test_idx', 'extra_info'],
+                                   group_by=['test_name'],
+                                   extra_info=['job_tag'])
+
+    def test_rollup_of_deleted_test(self):
+        job2 = models.Job.objects.get(tag='2-myjobtag2')
+        test = models.Test.objects.create(
+            job=job2, test='deleted', kernel=self.first_test.kernel,
+            status=models.Status.objects.get(word='FAILED'),
+            machine=self.first_test.machine)
+        models.TestStatusRollup.objects.refresh_jobs([job2.pk])
+        models.Test.objects.filter(pk=test.pk).delete()
+
+        groups = rpc_interface.get_group_counts(group_by=['test_name'])
+        live_group = groups['groups'][0]
+        deleted_group = [group for group in groups['groups']
+                         if group['test_name'] == 'deleted'][0]
+        self.assertEquals(sorted(live_group), sorted(deleted_group))
+        self.assertEquals(1, deleted_group['group_count'])
+        self.assertEquals(None, deleted_group['test_idx'])
+
     def test_get_job_ids(self):
         self.assertEquals([1, 2], rpc_interface.get_job_ids())
         self.assertEquals([1], rpc_interface.get_job_ids(test_name='mytest2'))
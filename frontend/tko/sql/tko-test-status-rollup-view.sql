@@ -0,0 +1,32 @@
+CREATE VIEW tko_test_status_rollup_view AS
+       SELECT
+              tko_test_status_rollup.id AS id,
+              tko_test_status_rollup.job_idx AS job_idx,
+              tko_test_status_rollup.test_name AS test_name,
+              tko_test_status_rollup.kernel_idx AS kernel_idx,
+              tko_test_status_rollup.status_idx AS status_idx,
+              tko_test_status_rollup.machine_idx AS machine_idx,
+              tko_test_status_rollup.test_count AS test_count,
+              tko_test_status_rollup.latest_test_idx AS latest_test_idx,
+              tko_jobs.tag AS job_tag,
+              tko_jobs.label AS job_name,
+              tko_jobs.username AS job_owner,
+              tko_jobs.queued_time AS job_queued_time,
+              tko_jobs.started_time AS job_started_time,
+              tko_jobs.finished_time AS job_finished_time,
+              tko_jobs.afe_job_id AS afe_job_id,
+              tko_machines.hostname AS hostname,
+              tko_machines.machine_group AS platform,
+              tko_machines.owner AS machine_owner,
+              tko_kernels.kernel_hash AS kernel_hash,
+              tko_kernels.base AS kernel_base,
+              tko_kernels.printable AS kernel,
+              tko_status.word AS status
+       FROM
+              tko_test_status_rollup
+              JOIN tko_jobs ON tko_jobs.job_idx=tko_test_status_rollup.job_idx
+              JOIN tko_machines ON tko_machines.machine_idx=tko_jobs.machine_idx
+              JOIN tko_kernels ON
+                   tko_kernels.kernel_idx=tko_test_status_rollup.kernel_idx
+              JOIN tko_status ON
+                   tko_status.status_idx=tko_test_status_rollup.status_idx;
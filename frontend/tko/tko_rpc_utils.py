@@ -1,3 +1,5 @@
+import re
+
 from autotest.frontend.afe import rpc_utils
 from autotest.client.shared import kernel_versions
 from autotest.frontend.tko import models
@@ -56,6 +58,27 @@ STATUS_FIELDS = {_PASS_COUNT_NAME: _PASS_COUNT_SQL,
                  _INCOMPLETE_COUNT_NAME: _INCOMPLETE_COUNT_SQL}
 _INVALID_STATUSES = ('TEST_NA', 'NOSTATUS')
 
+# the same counts over TestStatusRollupView, where each row stands for
+# test_count tests
+ROLLUP_COUNT_SQL = 'SUM(test_count)'
+ROLLUP_STATUS_FIELDS = {
+    _PASS_COUNT_NAME: 'SUM(IF(status="GOOD", test_count, 0))',
+    _COMPLETE_COUNT_NAME: ('SUM(IF(status NOT IN ("TEST_NA", "RUNNING", '
+                           '"NOSTATUS"), test_count, 0))'),
+    _INCOMPLETE_COUNT_NAME: 'SUM(IF(status="RUNNING", test_count, 0))'}
+
+# filter_data keys of TestView queries that aren't field lookups
+_ROLLUP_PRESENTATION_PARAMS = ('query_start', 'query_limit', 'no_distinct')
+_ROLLUP_JOIN_PARAMS = ('test_attribute_fields', 'test_label_fields',
+                       'machine_label_fields', 'iteration_result_fields',
+                       'job_keyval_fields', 'iteration_attribute_fields',
+                       'include_labels', 'exclude_labels',
+                       'include_attributes_where', 'exclude_attributes_where')
+_SQL_STRING_RE = re.compile(r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'')
+_SQL_WORD_RE = re.compile(r'\b[A-Za-z_][\w.]*')
+_SQL_WHERE_KEYWORDS = set(['and', 'or', 'not', 'in', 'is', 'null', 'like',
+                           'between', 'regexp', 'date'])
+
 
 def add_status_counts(group_dict, status):
     pass_count = complete_count = incomplete_count = 0
@@ -71,6 +94,111 @@ def add_status_counts(group_dict, status):
     group_dict[models.TestView.objects._GROUP_COUNT_NAME] = 1
 
 
+def _rollup_covers_where(extra_where):
+    """
+    Whether a WHERE clause only uses TestView columns covered by the rollups,
+    compared with literals.
+    """
+    covered = models.TestStatusRollupView.covered_fields
+    for word in _SQL_WORD_RE.findall(_SQL_STRING_RE.sub('', extra_where)):
+        if word.lower() not in _SQL_WHERE_KEYWORDS and word not in covered:
+            return False
+    return True
+
+
+def rollup_covers(group_by, header_groups, fixed_headers, filter_data):
+    """
+    Whether a grouped query over TestView can be answered from
+    TestStatusRollupView: all the fields it groups, filters and sorts on
+    must be covered and it must not join labels, attributes or iterations.
+    """
+    fields = list(group_by) + list(fixed_headers)
+    for header_group in header_groups:
+        fields.extend(header_group)
+    for key, value in filter_data.iteritems():
+        if key in _ROLLUP_PRESENTATION_PARAMS:
+            continue
+        if key in _ROLLUP_JOIN_PARAMS:
+            if value:
+                return False
+        elif key == 'sort_by':
+            fields.extend(field.lstrip('-') for field in value)
+        elif key == 'extra_where':
+            if not _rollup_covers_where(value):
+                return False
+        else:
+            fields.append(key.split('__')[0])
+    covered = models.TestStatusRollupView.covered_fields
+    for field in fields:
+        if field not in covered:
+            return False
+    return True
+
+
+def get_rollup_query(filter_data):
+    """
+    Like TestView.query_objects(filter_data, apply_presentation=False), over
+    TestStatusRollupView.  Only for queries covered by the rollups.
+    """
+    filter_data = dict(filter_data, no_distinct=True)
+    return models.TestStatusRollupView.query_objects(
+        filter_data, initial_query=models.TestStatusRollupView.objects.all(),
+        apply_presentation=False)
+
+
+def fix_rollup_counts(group_dicts, count_names):
+    """
+    SUM() over the rollups is a decimal on MySQL, make the counts integers
+    as the COUNT() of the live queries.
+    """
+    for group_dict in group_dicts:
+        for name in count_names:
+            if group_dict.get(name) is not None:
+                group_dict[name] = int(group_dict[name])
+
+
+# tests fetched per query when exporting test views
+EXPORT_PAGE_SIZE = 1000
+
+
+def iterate_test_views(rpc_function, filter_data, page_size=EXPORT_PAGE_SIZE):
+    """
+    Call a TestView RPC, such as get_test_views, page by page, so that the
+    test views of a large query are never all in memory.
+
+    Pages are fetched with keyset paging on test_idx, or with query_start
+    if the query is sorted or starts at an offset, in which case test_idx is
+    added as last sort field to make the order stable.  query_start and
+    query_limit still select the tests to return.
+
+    :return: generator of the test view dicts.
+    """
+    filter_data = dict(filter_data)
+    limit = filter_data.pop('query_limit', None)
+    sort_by = filter_data.pop('sort_by', None)
+    if sort_by or 'query_start' in filter_data:
+        filter_data['sort_by'] = list(sort_by or []) + ['test_idx']
+        filter_data.setdefault('query_start', 0)
+    else:
+        filter_data.setdefault('after_test_idx', 0)
+
+    while limit is None or limit > 0:
+        if limit is None:
+            filter_data['query_limit'] = page_size
+        else:
+            filter_data['query_limit'] = min(page_size, limit)
+            limit -= filter_data['query_limit']
+        page = rpc_function(**filter_data)
+        for test_view in page:
+            yield test_view
+        if len(page) < filter_data['query_limit']:
+            return
+        if 'after_test_idx' in filter_data:
+            filter_data['after_test_idx'] = page[-1]['test_idx']
+        else:
+            filter_data['query_start'] += len(page)
+
+
 def _construct_machine_label_header_sql(machine_labels):
     """
     Example result for machine_labels=['Index', 'Diskful']:
@@ -117,7 +245,7 @@ class GroupDataProcessor(object):
 
     def _fetch_data(self):
         self._restrict_header_values()
-        self._group_dicts = models.TestView.objects.execute_group_query(
+        self._group_dicts = self._query.model.objects.execute_group_query(
             self._query, self._group_by)
 
     @staticmethod
@@ -21,6 +21,7 @@ urlpatterns += defaults.patterns(
     '',
     (r'^jsonp_rpc/', 'autotest.frontend.tko.views.handle_jsonp_rpc'),
     (r'^csv/', 'autotest.frontend.tko.views.handle_csv'),
+    (r'^streamed_rpc/', 'autotest.frontend.tko.views.handle_streamed_rpc'),
     (r'^plot/', 'autotest.frontend.tko.views.handle_plot'),
 
     (r'^resources/', defaults.include(resource_patterns)))
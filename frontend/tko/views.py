@@ -1,7 +1,10 @@
+import itertools
+import traceback
 import django.http
 from autotest.frontend.tko import rpc_interface, graphing_utils
-from autotest.frontend.tko import csv_encoder
+from autotest.frontend.tko import csv_encoder, tko_rpc_utils
 from autotest.frontend.afe import rpc_handler, rpc_utils
+from autotest.frontend.afe.json_rpc import serviceHandler
 
 rpc_handler_obj = rpc_handler.RpcHandler((rpc_interface,),
                                          document_module=rpc_interface)
@@ -15,14 +18,81 @@ def handle_jsonp_rpc(request):
     return rpc_handler_obj.handle_jsonp_rpc_request(request)
 
 
+# RPCs whose results are fetched and sent page by page by handle_csv and
+# handle_streamed_rpc
+_STREAMED_METHODS = ('get_test_views', 'get_detailed_test_views')
+
+# test views per chunk of a streamed JSON response
+_JSON_ROWS_PER_CHUNK = 1000
+
+
+def _iterate_test_views(decoded_request):
+    """
+    :return: iterator over the test views of the request.  The first page is
+            fetched before returning, so that an invalid query raises here
+            rather than once the response has started.
+    """
+    rpc_function = getattr(rpc_interface, decoded_request['method'])
+    params = decoded_request['params']
+    filter_data = params and params[-1] or {}
+    test_views = tko_rpc_utils.iterate_test_views(rpc_function, filter_data)
+    try:
+        first_test_view = test_views.next()
+    except StopIteration:
+        return iter(())
+    return itertools.chain((first_test_view,), test_views)
+
+
 def handle_csv(request):
     request_data = rpc_handler_obj.raw_request_data(request)
     decoded_request = rpc_handler_obj.decode_request(request_data)
-    result = rpc_handler_obj.dispatch_request(decoded_request)['result']
+    if decoded_request['method'] in _STREAMED_METHODS:
+        result = _iterate_test_views(decoded_request)
+    else:
+        result = rpc_handler_obj.dispatch_request(decoded_request)['result']
     encoder = csv_encoder.encoder(decoded_request, result)
     return encoder.encode()
 
 
+def _json_chunks(request_id, test_views):
+    encode = rpc_handler_obj.encode
+    yield '{"id": %s, "error": null, "result": [' % encode(request_id)
+    separator = ''
+    chunk = []
+    for test_view in test_views:
+        chunk.append(encode(test_view))
+        if len(chunk) == _JSON_ROWS_PER_CHUNK:
+            yield separator + ', '.join(chunk)
+            separator = ', '
+            chunk = []
+    if chunk:
+        yield separator + ', '.join(chunk)
+    yield ']}'
+
+
+def handle_streamed_rpc(request):
+    """
+    Like handle_rpc, but the results of get_test_views and
+    get_detailed_test_views are fetched and sent page by page, so that the
+    memory used doesn't grow with the number of tests.
+    """
+    request_data = rpc_handler_obj.raw_request_data(request)
+    decoded_request = rpc_handler_obj.decode_request(request_data)
+    if decoded_request['method'] not in _STREAMED_METHODS:
+        return rpc_handler_obj.handle_rpc_request(request)
+    try:
+        test_views = _iterate_test_views(decoded_request)
+    except Exception, err:
+        decoded_result = serviceHandler.ServiceHandler.blank_result_dict()
+        decoded_result['id'] = decoded_request['id']
+        decoded_result['err'] = err
+        decoded_result['err_traceback'] = traceback.format_exc()
+        return rpc_utils.gzip_http_response(
+            request, rpc_handler_obj.encode_result(decoded_result))
+    return rpc_utils.gzip_streaming_response(
+        request, _json_chunks(decoded_request['id'], test_views))
+
+
 def rpc_documentation(request):
     return rpc_handler_obj.get_rpc_documentation()
 
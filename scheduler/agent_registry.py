@@ -0,0 +1,177 @@
+"""
+The agents of the Dispatcher, indexed for the lookups of a scheduler tick.
+
+The dispatcher used to keep its agents in a single list, walked completely
+on every tick, with a capacity check per unstarted agent.  AgentRegistry
+keeps the started agents apart from the unstarted ones, which wait in a heap
+ordered by job priority and age, so that a tick only looks at the agents
+that are running and at the few that it starts.  It also indexes the agents
+by host and queue entry id.
+"""
+
+import heapq
+
+
+class AgentRegistry(object):
+
+    """
+    The live agents of a dispatcher.
+
+    Agents need started, host_ids and queue_entry_ids attributes and a task
+    with a num_processes attribute.  Agents of tasks that run no process
+    don't wait for capacity, they are kept apart and started first.
+    """
+
+    def __init__(self):
+        # maps agent to its sequence number, for iteration in insertion order
+        self._agents = {}
+        self._next_sequence = 0
+        self._started = set()
+        # heap of (sort key, agent) for the unstarted agents; removed agents
+        # are dropped lazily when they reach the top
+        self._unstarted_heap = []
+        self._unstarted = set()
+        self._zero_process_agents = []
+        # map object ids to sets of agents
+        self._host_agents = {}
+        self._queue_entry_agents = {}
+
+    def __len__(self):
+        return len(self._agents)
+
+    def __iter__(self):
+        """Iterate over all agents in the order they were added."""
+        agents = sorted(self._agents.iteritems(), key=lambda item: item[1])
+        return iter([agent for agent, _ in agents])
+
+    def __contains__(self, agent):
+        return agent in self._agents
+
+    @staticmethod
+    def _register_for_ids(agent_dict, object_ids, agent):
+        for object_id in object_ids:
+            agent_dict.setdefault(object_id, set()).add(agent)
+
+    @staticmethod
+    def _unregister_for_ids(agent_dict, object_ids, agent):
+        for object_id in object_ids:
+            assert object_id in agent_dict
+            agents = agent_dict[object_id]
+            agents.remove(agent)
+            if not agents:
+                del agent_dict[object_id]
+
+    def add(self, agent, priority=None):
+        """
+        :param priority: job priority of the agent, higher starts first.
+                None for agents not working for a job (host maintenance),
+                which start before any job agent.
+        """
+        sequence = self._next_sequence
+        self._next_sequence += 1
+        self._agents[agent] = sequence
+        self._register_for_ids(self._host_agents, agent.host_ids, agent)
+        self._register_for_ids(self._queue_entry_agents,
+                               agent.queue_entry_ids, agent)
+        if agent.started:
+            self._started.add(agent)
+        elif agent.task.num_processes == 0:
+            self._zero_process_agents.append(agent)
+        else:
+            sort_key = (priority is not None, -(priority or 0), sequence)
+            heapq.heappush(self._unstarted_heap, (sort_key, agent))
+            self._unstarted.add(agent)
+
+    def remove(self, agent):
+        del self._agents[agent]
+        self._unregister_for_ids(self._host_agents, agent.host_ids, agent)
+        self._unregister_for_ids(self._queue_entry_agents,
+                                 agent.queue_entry_ids, agent)
+        self._started.discard(agent)
+        self._unstarted.discard(agent)
+        if agent in self._zero_process_agents:
+            self._zero_process_agents.remove(agent)
+
+    def agents_for_host(self, host_id):
+        return list(self._host_agents.get(host_id, ()))
+
+    def agents_for_queue_entry(self, queue_entry_id):
+        return list(self._queue_entry_agents.get(queue_entry_id, ()))
+
+    def host_has_agent(self, host_id):
+        return host_id in self._host_agents
+
+    def host_ids(self):
+        """:return: list of the ids of the hosts with agents."""
+        return self._host_agents.keys()
+
+    def started_agents(self):
+        """:return: list of the agents already started."""
+        return list(self._started)
+
+    def pop_zero_process_agents(self):
+        """
+        :return: list of the unstarted agents running no process, which are
+                then considered started.
+        """
+        agents = self._zero_process_agents
+        self._zero_process_agents = []
+        self._started.update(agents)
+        return agents
+
+    def next_unstarted(self):
+        """
+        :return: the unstarted agent to start next, or None.
+        """
+        heap = self._unstarted_heap
+        while heap and heap[0][1] not in self._unstarted:
+            heapq.heappop(heap)
+        if not heap:
+            return None
+        return heap[0][1]
+
+    def mark_started(self, agent):
+        """Move the agent returned by next_unstarted() to the started ones."""
+        assert self.next_unstarted() is agent
+        heapq.heappop(self._unstarted_heap)
+        self._unstarted.remove(agent)
+        self._started.add(agent)
+
+    def num_unstarted(self):
+        return len(self._unstarted) + len(self._zero_process_agents)
+
+
+class CapacityCache(object):
+
+    """
+    Caches DroneManager.max_runnable_processes() per user and drone set for
+    the length of a tick.
+
+    Starting processes lowers the capacity of every cached entry by their
+    number, which may underestimate the capacity left for the users of other
+    drones until the next tick, but never overestimates it.
+
+    :param max_runnable_processes: function(username, drone_hostnames) as
+            DroneManager.max_runnable_processes.
+    """
+
+    def __init__(self, max_runnable_processes):
+        self._max_runnable_processes = max_runnable_processes
+        self._cache = {}
+
+    @staticmethod
+    def _key(username, drone_hostnames_allowed):
+        if drone_hostnames_allowed is not None:
+            drone_hostnames_allowed = frozenset(drone_hostnames_allowed)
+        return username, drone_hostnames_allowed
+
+    def max_runnable_processes(self, username, drone_hostnames_allowed):
+        key = self._key(username, drone_hostnames_allowed)
+        if key not in self._cache:
+            self._cache[key] = self._max_runnable_processes(
+                username, drone_hostnames_allowed)
+        return self._cache[key]
+
+    def processes_started(self, num_processes):
+        for key in self._cache:
+            self._cache[key] -= num_processes
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+
+"""Tests for autotest.scheduler.agent_registry."""
+
+import common
+from autotest.client.shared.test_utils import unittest
+from autotest.scheduler import agent_registry
+
+
+class FakeTask(object):
+
+    def __init__(self, num_processes):
+        self.num_processes = num_processes
+
+
+class FakeAgent(object):
+    started = False
+
+    def __init__(self, host_ids=(), queue_entry_ids=(), num_processes=1):
+        self.host_ids = host_ids
+        self.queue_entry_ids = queue_entry_ids
+        self.task = FakeTask(num_processes)
+
+
+class AgentRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = agent_registry.AgentRegistry()
+
+    def _start_all(self):
+        started = []
+        while True:
+            agent = self.registry.next_unstarted()
+            if agent is None:
+                return started
+            self.registry.mark_started(agent)
+            started.append(agent)
+
+    def test_indexes(self):
+        first = FakeAgent(host_ids=[1], queue_entry_ids=[10, 11])
+        second = FakeAgent(host_ids=[1, 2])
+        self.registry.add(first)
+        self.registry.add(second)
+        self.assertEqual([first, second], list(self.registry))
+        self.assertEqual(2, len(self.registry))
+        self.assertTrue(self.registry.host_has_agent(2))
+        self.assertEqual([first], self.registry.agents_for_queue_entry(11))
+        self.assertEqual(set([first, second]),
+                         set(self.registry.agents_for_host(1)))
+
+        self.registry.remove(second)
+        self.assertFalse(self.registry.host_has_agent(2))
+        self.assertEqual([first], self.registry.agents_for_host(1))
+        self.assertFalse(second in self.registry)
+        self.assertEqual([], self.registry.agents_for_queue_entry(12))
+
+    def test_start_order(self):
+        agents = [FakeAgent() for _ in xrange(5)]
+        for agent, priority in zip(agents, (1, None, 3, 1, 3)):
+            self.registry.add(agent, priority)
+        started = self._start_all()
+        self.assertEqual([agents[i] for i in (1, 2, 4, 0, 3)], started)
+        self.assertEqual(set(agents), set(self.registry.started_agents()))
+        self.assertEqual(0, self.registry.num_unstarted())
+
+    def test_removed_before_start(self):
+        agents = [FakeAgent() for _ in xrange(3)]
+        for agent in agents:
+            self.registry.add(agent)
+        self.registry.remove(agents[0])
+        self.assertEqual(agents[1:], self._start_all())
+
+    def test_zero_process_agents(self):
+        agent = FakeAgent(num_processes=0)
+        self.registry.add(agent)
+        self.assertEqual(None, self.registry.next_unstarted())
+        self.assertEqual(1, self.registry.num_unstarted())
+        self.assertEqual([agent], self.registry.pop_zero_process_agents())
+        self.assertEqual([], self.registry.pop_zero_process_agents())
+        self.assertEqual([agent], self.registry.started_agents())
+
+
+class CapacityCacheTest(unittest.TestCase):
+
+    def test_cache(self):
+        calls = []
+
+        def max_runnable_processes(username, drone_hostnames_allowed):
+            calls.append((username, drone_hostnames_allowed))
+            return 5
+        cache = agent_registry.CapacityCache(max_runnable_processes)
+        self.assertEqual(5, cache.max_runnable_processes('me', None))
+        self.assertEqual(5, cache.max_runnable_processes('me', None))
+        self.assertEqual(5, cache.max_runnable_processes('me', ['b', 'a']))
+        self.assertEqual(5, cache.max_runnable_processes('me', ['a', 'b']))
+        self.assertEqual(2, len(calls))
+
+        cache.processes_started(2)
+        self.assertEqual(3, cache.max_runnable_processes('me', None))
+        self.assertEqual(3, cache.max_runnable_processes('me', ['a', 'b']))
+        self.assertEqual(5, cache.max_runnable_processes('you', None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,7 +8,7 @@ except ImportError:
 import logging
 from autotest.client.shared import error, mail
 from autotest.client.shared.settings import settings
-from autotest.scheduler import drone_utility, drones
+from autotest.scheduler import drone_task_queue, drone_utility, drones
 from autotest.scheduler import scheduler_config
 
 
@@ -155,6 +155,15 @@ class DroneManager(object):
         self._attached_files = {}
         # heapq of _DroneHeapWrappers
         self._drone_queue = []
+        # runs calls on all drones concurrently
+        timeout_secs = settings.get_value(
+            scheduler_config.CONFIG_SECTION, 'drone_call_timeout_secs',
+            type=int, default=120)
+        self._drone_task_queue = drone_task_queue.DroneTaskQueue(
+            timeout_secs or None)
+        # maps hostname to the last refresh results received from the drone,
+        # used in place of the results of drones that don't answer in time
+        self._last_refresh_results = {}
 
     def initialize(self, base_results_dir, drone_hostnames,
                    results_repository_hostname):
@@ -259,10 +268,33 @@ class DroneManager(object):
         self._drone_queue = []
 
     def _call_all_drones(self, method, *args, **kwargs):
-        all_results = {}
-        for drone in self.get_drones():
-            all_results[drone] = drone.call(method, *args, **kwargs)
-        return all_results
+        """
+        Call method on all drones concurrently.
+
+        :param wait_for: (optional) hostnames of the drones to wait for even
+                if they exceed the drone call timeout.
+        :return: dict mapping each drone that answered in time to its results.
+        """
+        wait_for = kwargs.pop('wait_for', ())
+
+        def call_drone(drone):
+            return drone.call(method, *args, **kwargs)
+        return self._drone_task_queue.execute(self.get_drones(), call_drone,
+                                              wait_for=wait_for)
+
+    def get_drone_latencies(self):
+        """
+        :return: dict mapping drone hostnames to LatencyHistograms of the
+                calls made to them.
+        """
+        return dict(self._drone_task_queue.latencies)
+
+    def get_degraded_drones(self):
+        """
+        :return: hostnames of the drones that did not answer in time during
+                the last refresh() or execute_actions().
+        """
+        return set(self._drone_task_queue.degraded)
 
     def _parse_pidfile(self, drone, raw_contents):
         contents = PidfileContents()
@@ -330,10 +362,32 @@ class DroneManager(object):
         self._drop_old_pidfiles()
         pidfile_paths = [pidfile_id.path
                          for pidfile_id in self._registered_pidfile_info]
-        all_results = self._call_all_drones('refresh', pidfile_paths)
+        # without earlier results there is nothing to fall back on
+        never_refreshed = [hostname for hostname in self._drones
+                           if hostname not in self._last_refresh_results]
+
+        def refresh_drone(drone):
+            # drones answer with the changes since the results we have
+            previous_results = self._last_refresh_results.get(drone.hostname,
+                                                              {})
+            return drone.call('refresh', pidfile_paths,
+                              base_refresh_id=previous_results.get(
+                                  'refresh_id'))
+        all_results = self._drone_task_queue.execute(
+            self.get_drones(), refresh_drone, wait_for=never_refreshed)
 
-        for drone, results_list in all_results.iteritems():
-            results = results_list[0]
+        for drone in self.get_drones():
+            if drone in all_results:
+                results = drone_utility.decode_refresh_result(
+                    self._last_refresh_results.get(drone.hostname),
+                    all_results[drone][0])
+                self._last_refresh_results[drone.hostname] = results
+            elif drone.hostname in self._last_refresh_results:
+                logging.warning('Using previous refresh results of degraded '
+                                'drone %s', drone.hostname)
+                results = self._last_refresh_results[drone.hostname]
+            else:
+                continue
 
             for process_info in results['autoserv_processes']:
                 self._add_autoserv_process(drone, process_info)
@@ -345,7 +399,8 @@ class DroneManager(object):
                                    self._pidfiles_second_read)
 
             self._compute_active_processes(drone)
-            if drone.enabled:
+            degraded = drone.hostname in self._drone_task_queue.degraded
+            if drone.enabled and not degraded:
                 self._enqueue_drone(drone)
 
     def execute_actions(self):
@@ -353,8 +408,19 @@ class DroneManager(object):
         Called at the end of a scheduler cycle to execute all queued actions
         on drones.
         """
-        for drone in self._drones.values():
-            drone.execute_queued_calls()
+        # calls queued on a drone still busy with earlier calls are kept
+        # for the next cycle
+        calls_by_hostname = {}
+        for hostname, drone in self._drones.iteritems():
+            if not self._drone_task_queue.is_busy(drone):
+                calls_by_hostname[hostname] = drone.pop_queued_calls()
+
+        def execute_drone_calls(drone):
+            drone.execute_calls(calls_by_hostname[drone.hostname])
+        self._drone_task_queue.execute(
+            [self._drones[hostname] for hostname, calls
+             in calls_by_hostname.iteritems() if calls],
+            execute_drone_calls)
 
         try:
             self._results_drone.execute_queued_calls()
@@ -301,6 +301,49 @@ class DroneManager(unittest.TestCase):
             'write_to_file',
             os.path.join(self._DRONE_RESULTS_DIR, file_path), written_data))
 
+    def _refresh_results(self, pid):
+        process_info = {'pid': pid, 'pgid': pid, 'ppid': 1,
+                        'comm': 'autotest-remote'}
+        return [{'autoserv_processes': [process_info],
+                 'parse_processes': [],
+                 'pidfiles': {},
+                 'pidfiles_second_read': {}}]
+
+    def test_refresh_with_degraded_drone(self):
+        process = drone_manager.Process(self.mock_drone.name, 42)
+        self.god.stub_function(self.mock_drone, 'call')
+        self.mock_drone.call.expect_call(
+            'refresh', [], base_refresh_id=None).and_return(
+            self._refresh_results(42))
+        self.manager.refresh()
+        self.god.check_playback()
+        self.assertTrue(self.manager.is_process_running(process))
+        self.assertEquals(1, len(self.manager._drone_queue))
+
+        # the drone doesn't answer in time on the next refresh
+        def execute(drones, function, wait_for=()):
+            self.manager._drone_task_queue.degraded = set(
+                [self.mock_drone.name])
+            return {}
+        self.god.stub_with(self.manager._drone_task_queue, 'execute', execute)
+        self.manager.refresh()
+        self.assertTrue(self.manager.is_process_running(process))
+        self.assertEquals(0, len(self.manager._drone_queue))
+        self.assertEquals(set([self.mock_drone.name]),
+                          self.manager.get_degraded_drones())
+
+    def test_execute_actions_runs_queued_calls(self):
+        drone = drones._AbstractDrone()
+        drone.hostname = 'drone'
+        self.manager._drones = {'drone': drone}
+        self.god.stub_function(drone, '_execute_calls')
+        drone.queue_call('kill_process', 42)
+        drone._execute_calls.expect_call(
+            mock.is_instance_comparator(list)).and_return([None])
+        self.manager.execute_actions()
+        self.god.check_playback()
+        self.assertEquals([], drone._calls)
+
     def test_pidfile_expiration(self):
         self.god.stub_with(self.manager, '_get_max_pidfile_refreshes',
                            lambda: 0)
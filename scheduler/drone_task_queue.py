@@ -0,0 +1,209 @@
+"""
+Runs the same call on several drones concurrently.
+
+A call to a remote drone is a full ssh round-trip, so running them one drone
+after another makes every scheduler tick as slow as the sum of all drones.
+DroneTaskQueue runs them in threads instead, waits for each drone at most a
+given time and reports the drones that did not answer in time as degraded for
+the cycle.  A call that timed out keeps running in its thread; no new call is
+started on that drone until it has finished.
+"""
+
+import bisect
+import logging
+import sys
+import threading
+import time
+
+
+class LatencyHistogram(object):
+
+    """
+    Counts durations in fixed buckets.
+
+    :param bucket_limits: upper limits (seconds) of the buckets, in ascending
+            order.  Durations longer than the last limit are counted in an
+            extra overflow bucket.
+    """
+
+    DEFAULT_BUCKET_LIMITS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+    def __init__(self, bucket_limits=DEFAULT_BUCKET_LIMITS):
+        self.bucket_limits = tuple(bucket_limits)
+        self.counts = [0] * (len(self.bucket_limits) + 1)
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, duration):
+        self.counts[bisect.bisect_left(self.bucket_limits, duration)] += 1
+        self.total += duration
+        self.maximum = max(self.maximum, duration)
+
+    def count(self):
+        return sum(self.counts)
+
+    def as_dict(self):
+        labels = ['<=%s' % limit for limit in self.bucket_limits]
+        labels.append('>%s' % self.bucket_limits[-1])
+        return {'buckets': zip(labels, self.counts),
+                'count': self.count(),
+                'total': self.total,
+                'max': self.maximum}
+
+    def __str__(self):
+        buckets = ' '.join('%s:%d' % bucket for bucket in
+                           self.as_dict()['buckets'] if bucket[1])
+        return 'count=%d total=%.3fs max=%.3fs %s' % (
+            self.count(), self.total, self.maximum, buckets)
+
+
+class _DroneTask(object):
+
+    """A function called with a drone, possibly in its own thread."""
+
+    def __init__(self, drone, function):
+        self.drone = drone
+        self._function = function
+        self.result = None
+        self.exc_info = None
+        self.start_time = None
+        self.end_time = None
+        self._thread = None
+
+    def _run(self):
+        self.start_time = time.time()
+        try:
+            self.result = self._function(self.drone)
+        except Exception:
+            self.exc_info = sys.exc_info()
+        self.end_time = time.time()
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name='drone-%s' % self.drone.hostname)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def run_here(self):
+        self._run()
+
+    def wait(self, timeout=None):
+        """
+        :return: True if the task finished within timeout seconds.
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.is_done()
+
+    def is_done(self):
+        return self.end_time is not None
+
+    def duration(self):
+        return self.end_time - self.start_time
+
+
+class DroneTaskQueue(object):
+
+    """
+    Executes a function concurrently for a group of drones.
+
+    Drones whose concurrent_calls_allowed attribute is False are called from
+    the calling thread, while the threads of the other drones are running.
+
+    :param timeout_secs: how long to wait for each drone, None to wait as long
+            as it takes.
+    """
+
+    def __init__(self, timeout_secs=None):
+        self.timeout_secs = timeout_secs
+        # maps hostname to LatencyHistogram
+        self.latencies = {}
+        # hostnames of the drones that did not answer in the last execute()
+        self.degraded = set()
+        # maps hostname to a _DroneTask still running from a previous call
+        self._in_flight = {}
+
+    def _record_latency(self, task):
+        histogram = self.latencies.setdefault(task.drone.hostname,
+                                              LatencyHistogram())
+        histogram.add(task.duration())
+
+    def _collect_finished_in_flight(self):
+        for hostname, task in self._in_flight.items():
+            if task.is_done():
+                logging.info('Late call to drone %s finished after %.1fs',
+                             hostname, task.duration())
+                self._record_latency(task)
+                if task.exc_info:
+                    logging.error('Late call to drone %s failed',
+                                  hostname, exc_info=task.exc_info)
+                del self._in_flight[hostname]
+
+    def is_busy(self, drone):
+        """
+        :return: True if a call that timed out is still running on drone.
+        """
+        self._collect_finished_in_flight()
+        return drone.hostname in self._in_flight
+
+    def execute(self, drones, function, wait_for=()):
+        """
+        Call function(drone) for every drone and wait for the results.
+
+        If one of the calls raised an exception, the exception is re-raised
+        once all calls have finished or timed out.
+
+        :param drones: the drones to call.
+        :param function: function taking a drone as single argument.
+        :param wait_for: hostnames of drones to wait for without timeout.
+        :return: dict mapping each drone that answered in time to the return
+                value of function.  The others are listed in self.degraded.
+        """
+        self._collect_finished_in_flight()
+        self.degraded = set()
+
+        tasks = []
+        local_tasks = []
+        for drone in drones:
+            if drone.hostname in self._in_flight:
+                logging.warning('Drone %s is still busy with a previous call, '
+                                'skipping it this cycle', drone.hostname)
+                self.degraded.add(drone.hostname)
+                continue
+            task = _DroneTask(drone, function)
+            if getattr(drone, 'concurrent_calls_allowed', True):
+                task.start()
+                tasks.append(task)
+            else:
+                local_tasks.append(task)
+
+        for task in local_tasks:
+            task.run_here()
+
+        results = {}
+        exc_info = None
+        for task in local_tasks + tasks:
+            timeout = self.timeout_secs
+            if timeout is not None and task.drone.hostname not in wait_for:
+                # every drone gets timeout_secs from the start of its call
+                started = task.start_time or time.time()
+                timeout = max(0, started + timeout - time.time())
+            else:
+                timeout = None
+            if not task.wait(timeout):
+                logging.error('Drone %s did not answer within %ss, marking '
+                              'it degraded for this cycle',
+                              task.drone.hostname, self.timeout_secs)
+                self.degraded.add(task.drone.hostname)
+                self._in_flight[task.drone.hostname] = task
+                continue
+            self._record_latency(task)
+            if task.exc_info:
+                if exc_info is None:
+                    exc_info = task.exc_info
+                continue
+            results[task.drone] = task.result
+
+        if exc_info:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return results
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+"""Tests for autotest.scheduler.drone_task_queue."""
+
+import threading
+import time
+
+import common
+from autotest.client.shared.test_utils import unittest
+from autotest.scheduler import drone_task_queue
+
+
+class FakeDrone(object):
+
+    def __init__(self, hostname, concurrent_calls_allowed=True):
+        self.hostname = hostname
+        self.concurrent_calls_allowed = concurrent_calls_allowed
+
+
+class LatencyHistogramTest(unittest.TestCase):
+
+    def test_buckets(self):
+        histogram = drone_task_queue.LatencyHistogram((1, 10))
+        for duration in (0.5, 1, 5, 20, 30):
+            histogram.add(duration)
+        self.assertEqual([2, 1, 2], histogram.counts)
+        self.assertEqual(5, histogram.count())
+        self.assertEqual(30, histogram.maximum)
+        self.assertEqual([('<=1', 2), ('<=10', 1), ('>10', 2)],
+                         histogram.as_dict()['buckets'])
+
+
+class DroneTaskQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+
+    def tearDown(self):
+        # let any thread blocked by a test finish
+        self.release.set()
+
+    def test_calls_run_concurrently(self):
+        queue = drone_task_queue.DroneTaskQueue(timeout_secs=5)
+        drones = [FakeDrone('drone%d' % i) for i in xrange(5)]
+
+        def slow_call(drone):
+            time.sleep(0.2)
+            return drone.hostname
+
+        start = time.time()
+        results = queue.execute(drones, slow_call)
+        self.assertTrue(time.time() - start < 0.8)
+        self.assertEqual(dict((drone, drone.hostname) for drone in drones),
+                         results)
+        self.assertEqual(set(), queue.degraded)
+        self.assertEqual(1, queue.latencies['drone0'].count())
+
+    def test_local_drone_runs_in_calling_thread(self):
+        queue = drone_task_queue.DroneTaskQueue(timeout_secs=5)
+        local = FakeDrone('localhost', concurrent_calls_allowed=False)
+        results = queue.execute([local],
+                                lambda drone: threading.currentThread())
+        self.assertEqual(threading.currentThread(), results[local])
+
+    def test_timeout_marks_drone_degraded(self):
+        queue = drone_task_queue.DroneTaskQueue(timeout_secs=0.1)
+        fast, slow = FakeDrone('fast'), FakeDrone('slow')
+
+        def call(drone):
+            if drone is slow:
+                self.release.wait()
+            return drone.hostname
+
+        results = queue.execute([fast, slow], call)
+        self.assertEqual({fast: 'fast'}, results)
+        self.assertEqual(set(['slow']), queue.degraded)
+        self.assertTrue(queue.is_busy(slow))
+
+        # the slow drone is skipped until its call has finished
+        results = queue.execute([fast, slow], call)
+        self.assertEqual({fast: 'fast'}, results)
+        self.assertEqual(set(['slow']), queue.degraded)
+
+        self.release.set()
+        time.sleep(0.1)
+        self.assertFalse(queue.is_busy(slow))
+        self.assertEqual(1, queue.latencies['slow'].count())
+        results = queue.execute([fast, slow], call)
+        self.assertEqual({fast: 'fast', slow: 'slow'}, results)
+        self.assertEqual(set(), queue.degraded)
+
+    def test_wait_for_ignores_timeout(self):
+        queue = drone_task_queue.DroneTaskQueue(timeout_secs=0.01)
+        drone = FakeDrone('slow')
+
+        def call(drone):
+            time.sleep(0.1)
+            return 'done'
+
+        results = queue.execute([drone], call, wait_for=['slow'])
+        self.assertEqual({drone: 'done'}, results)
+
+    def test_exceptions_are_reraised(self):
+        queue = drone_task_queue.DroneTaskQueue(timeout_secs=5)
+        called = []
+
+        def call(drone):
+            called.append(drone.hostname)
+            if drone.hostname == 'bad':
+                raise ValueError('bad drone')
+
+        self.assertRaises(ValueError, queue.execute,
+                          [FakeDrone('bad'), FakeDrone('good')], call)
+        self.assertEqual(set(['bad', 'good']), set(called))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,6 +13,8 @@ import datetime
 import traceback
 import tempfile
 import itertools
+import struct
+import fcntl
 try:
     import autotest.common as common
 except ImportError:
@@ -21,7 +23,7 @@ from autotest.client.shared import utils, error
 from autotest.client.shared.settings import settings
 from autotest.client.shared import mail
 from autotest.server import hosts, subcommand
-from autotest.scheduler import scheduler_config
+from autotest.scheduler import process_tracker, scheduler_config
 
 # An environment variable we add to the environment to enable us to
 # distinguish processes we started from those that were started by
@@ -76,6 +78,13 @@ class DroneUtility(object):
 
         self.warnings = []
         self._subcommands = []
+        self._process_tracker = process_tracker.ProcessTracker()
+        self._pidfile_reader = process_tracker.PidfileReader()
+        # refresh ids must not repeat if the drone utility is restarted
+        self._refresh_id_prefix = '%d-%.6f' % (os.getpid(), time.time())
+        self._refresh_counter = itertools.count()
+        # (refresh_id, results) of the last refresh() call
+        self._last_refresh = None
 
     def initialize(self, results_dir):
         if _OUTPUT_DIR:
@@ -112,38 +121,33 @@ class DroneUtility(object):
             env_file.close()
         return DARK_MARK_ENVIRONMENT_VAR in env_data
 
-    _PS_ARGS = ('pid', 'pgid', 'ppid', 'comm', 'args')
-
-    @classmethod
-    def _get_process_info(cls):
+    def _get_process_info(self):
         """
-        :return: A generator of dicts with cls._PS_ARGS as keys and
-                string values each representing a running process.
+        :return: A list of dicts with pid, pgid, ppid, comm and args as keys
+                and string values each representing a running process.
         """
-        ps_proc = subprocess.Popen(
-            ['/bin/ps', 'x', '-o', ','.join(cls._PS_ARGS)],
-            stdout=subprocess.PIPE)
-        ps_output = ps_proc.communicate()[0]
-
-        # split each line into the columns output by ps
-        split_lines = [line.split(None, 4) for line in ps_output.splitlines()]
-        return (dict(itertools.izip(cls._PS_ARGS, line_components))
-                for line_components in split_lines)
+        return self._process_tracker.scan()
 
     def _refresh_processes(self, command_name, open=open,
-                           site_check_parse=None):
+                           site_check_parse=None, process_info=None):
         if type(command_name) == str:
             command_name = [command_name]
         # The open argument is used for test injection.
         check_mark = settings.get_value('SCHEDULER',
                                         'check_processes_for_dark_mark',
                                         bool, False)
+
+        def check_pid_for_dark_mark(pid):
+            return self._check_pid_for_dark_mark(pid, open=open)
+
+        if process_info is None:
+            process_info = self._get_process_info()
         processes = []
-        for info in self._get_process_info():
+        for info in process_info:
             is_parse = (site_check_parse and site_check_parse(info))
             if info['comm'] in command_name or is_parse:
-                if (check_mark and not
-                        self._check_pid_for_dark_mark(info['pid'], open=open)):
+                if (check_mark and not self._process_tracker.has_dark_mark(
+                        info, check_pid_for_dark_mark)):
                     self._warn('%(comm)s process pid %(pid)s has no '
                                'dark mark; ignoring.' % info)
                     continue
@@ -152,19 +156,9 @@ class DroneUtility(object):
         return processes
 
     def _read_pidfiles(self, pidfile_paths):
-        pidfiles = {}
-        for pidfile_path in pidfile_paths:
-            if not os.path.exists(pidfile_path):
-                continue
-            try:
-                file_object = open(pidfile_path, 'r')
-                pidfiles[pidfile_path] = file_object.read()
-                file_object.close()
-            except IOError:
-                continue
-        return pidfiles
-
-    def refresh(self, pidfile_paths):
+        return self._pidfile_reader.read(pidfile_paths)
+
+    def refresh(self, pidfile_paths, base_refresh_id=None):
         """
         pidfile_paths should be a list of paths to check for pidfiles.
 
@@ -177,18 +171,36 @@ class DroneUtility(object):
         * parse_processes: likewise, for parse processes.
         * pidfiles_second_read: same info as pidfiles, but gathered after the
         processes are scanned.
+        * refresh_id: identifies these results.
+
+        If base_refresh_id is the refresh_id of the results returned by the
+        previous call, only the differences to those results are returned
+        instead (see decode_refresh_result()).
         """
         site_check_parse = utils.import_site_function(
             __file__, 'autotest.scheduler.site_drone_utility',
             'check_parse', lambda x: False)
+        pidfiles = self._read_pidfiles(pidfile_paths)
+        process_info = self._get_process_info()
         results = {
-            'pidfiles': self._read_pidfiles(pidfile_paths),
-            'autoserv_processes': self._refresh_processes(['autotest-remote']),
+            'pidfiles': pidfiles,
+            'autoserv_processes': self._refresh_processes(
+                ['autotest-remote'], process_info=process_info),
             'parse_processes': self._refresh_processes(
-                'parse', site_check_parse=site_check_parse),
+                'parse', site_check_parse=site_check_parse,
+                process_info=process_info),
             'pidfiles_second_read': self._read_pidfiles(pidfile_paths),
         }
-        return results
+
+        refresh_id = '%s-%d' % (self._refresh_id_prefix,
+                                self._refresh_counter.next())
+        previous = self._last_refresh
+        self._last_refresh = (refresh_id, results)
+        if previous and base_refresh_id == previous[0]:
+            return {'refresh_id': refresh_id,
+                    'base_refresh_id': base_refresh_id,
+                    'delta': make_refresh_delta(previous[1], results)}
+        return dict(results, refresh_id=refresh_id)
 
     def kill_process(self, process):
         signal_queue = (signal.SIGCONT, signal.SIGTERM, signal.SIGKILL)
@@ -404,6 +416,65 @@ class DroneUtility(object):
         return dict(results=results, warnings=warnings)
 
 
+_REFRESH_PROCESS_KEYS = ('autoserv_processes', 'parse_processes')
+_REFRESH_PIDFILE_KEYS = ('pidfiles', 'pidfiles_second_read')
+
+
+def _refresh_items(results, key):
+    if key in _REFRESH_PROCESS_KEYS:
+        return dict((info['pid'], info) for info in results[key])
+    return dict(results[key])
+
+
+def make_refresh_delta(old_results, new_results):
+    """
+    :return: dict mapping every refresh result key to a (changed, removed)
+            tuple: the entries that are new or different in new_results
+            (keyed by pid for processes, by path for pidfiles) and the keys
+            of the entries no longer present.
+    """
+    delta = {}
+    for key in _REFRESH_PROCESS_KEYS + _REFRESH_PIDFILE_KEYS:
+        old_items = _refresh_items(old_results, key)
+        new_items = _refresh_items(new_results, key)
+        changed = dict((item_key, value)
+                       for item_key, value in new_items.iteritems()
+                       if old_items.get(item_key) != value)
+        removed = [item_key for item_key in old_items
+                   if item_key not in new_items]
+        delta[key] = (changed, removed)
+    return delta
+
+
+def decode_refresh_result(previous_results, result):
+    """
+    Turn the return value of DroneUtility.refresh() into complete results.
+
+    :param previous_results: complete results of the previous refresh of the
+            same drone, or None.
+    :param result: value returned by DroneUtility.refresh().
+    :raise ValueError: if result is a delta on other results than
+            previous_results.
+    """
+    if 'delta' not in result:
+        return result
+    if (previous_results is None or
+            previous_results.get('refresh_id') != result['base_refresh_id']):
+        raise ValueError('Refresh delta based on unknown results %s' %
+                         result['base_refresh_id'])
+    results = {'refresh_id': result['refresh_id']}
+    for key, (changed, removed) in result['delta'].iteritems():
+        items = _refresh_items(previous_results, key)
+        items.update(changed)
+        for item_key in removed:
+            del items[item_key]
+        if key in _REFRESH_PROCESS_KEYS:
+            results[key] = items.values()
+        else:
+            results[key] = items
+    return results
+
+
 def create_host(hostname):
     username = settings.get_value('SCHEDULER', hostname + '_username',
                                   default=getpass.getuser())
@@ -434,7 +505,82 @@ def return_data(data):
     print pickle.dumps(data)
 
 
+# Messages exchanged with a drone agent are a 4 byte big endian length
+# followed by that many bytes of pickled data.
+_MESSAGE_HEADER = struct.Struct('>I')
+
+
+def _read_exactly(file_object, size):
+    chunks = []
+    while size:
+        chunk = file_object.read(size)
+        if not chunk:
+            raise EOFError('Connection closed in the middle of a message')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
+
+def write_message(file_object, data):
+    file_object.write(_MESSAGE_HEADER.pack(len(data)) + data)
+    file_object.flush()
+
+
+def read_message(file_object):
+    """
+    Read one length-prefixed message.
+
+    :return: the message data, or None if the other end closed the connection
+            between two messages.
+    """
+    header = file_object.read(_MESSAGE_HEADER.size)
+    if not header:
+        return None
+    header += _read_exactly(file_object, _MESSAGE_HEADER.size - len(header))
+    (size,) = _MESSAGE_HEADER.unpack(header)
+    return _read_exactly(file_object, size)
+
+
+def run_agent(input_file, output_file):
+    """
+    Execute lists of calls read from input_file until it is closed, writing
+    the result of every list to output_file.  The DroneUtility instance is
+    kept between call lists.
+    """
+    drone_utility = DroneUtility()
+    message = read_message(input_file)
+    while message is not None:
+        calls = pickle.loads(message)
+        return_value = drone_utility.execute_calls(calls)
+        write_message(output_file,
+                      pickle.dumps(return_value, pickle.HIGHEST_PROTOCOL))
+        message = read_message(input_file)
+
+
+def _private_dup(fd):
+    new_fd = os.dup(fd)
+    flags = fcntl.fcntl(new_fd, fcntl.F_GETFD)
+    fcntl.fcntl(new_fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+    return new_fd
+
+
+def agent_main():
+    # Keep the protocol channel to ourselves: anything printed by us or by
+    # the processes we start goes to stderr, and they read from /dev/null.
+    input_file = os.fdopen(_private_dup(0), 'rb')
+    output_file = os.fdopen(_private_dup(1), 'wb')
+    sys.stdout.flush()
+    os.dup2(2, 1)
+    null_fd = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(null_fd, 0)
+    os.close(null_fd)
+    run_agent(input_file, output_file)
+
+
 def main():
+    if '--agent' in sys.argv[1:]:
+        agent_main()
+        return
     calls = parse_input()
     drone_utility = DroneUtility()
     return_value = drone_utility.execute_calls(calls)
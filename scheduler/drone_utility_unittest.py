@@ -2,6 +2,10 @@
 
 """Tests for drone_utility."""
 
+import os
+import pickle
+import shutil
+import tempfile
 import unittest
 from cStringIO import StringIO
 
@@ -80,5 +84,101 @@ class TestDroneUtility(unittest.TestCase):
         self.god.check_playback()
 
 
+class TestRefreshDelta(unittest.TestCase):
+
+    def setUp(self):
+        self.god = mock.mock_god()
+        self.drone_utility = drone_utility.DroneUtility()
+        self.god.stub_function(self.drone_utility, '_get_process_info')
+        self.god.stub_function(self.drone_utility, '_read_pidfiles')
+
+    def tearDown(self):
+        self.god.unstub_all()
+
+    def _process(self, pid, comm='autotest-remote'):
+        return {'pid': pid, 'pgid': pid, 'ppid': '1', 'comm': comm,
+                'args': comm}
+
+    def _refresh(self, processes, pidfiles, base_refresh_id=None):
+        self.drone_utility._read_pidfiles.expect_call(['a', 'b']).and_return(
+            pidfiles)
+        self.drone_utility._get_process_info.expect_call().and_return(
+            processes)
+        self.drone_utility._read_pidfiles.expect_call(['a', 'b']).and_return(
+            pidfiles)
+        return self.drone_utility.refresh(['a', 'b'],
+                                          base_refresh_id=base_refresh_id)
+
+    def test_delta(self):
+        first = self._refresh([self._process('1'), self._process('2')],
+                              {'a': '1\n', 'b': '2\n'})
+        self.assertEqual(['1', '2'], sorted(
+            info['pid'] for info in first['autoserv_processes']))
+        first = drone_utility.decode_refresh_result(None, first)
+
+        second = self._refresh([self._process('2'), self._process('3')],
+                               {'a': '1\n0\n0\n'},
+                               base_refresh_id=first['refresh_id'])
+        self.assertEqual(({'3': self._process('3')}, ['1']),
+                         second['delta']['autoserv_processes'])
+        self.assertEqual(({'a': '1\n0\n0\n'}, ['b']),
+                         second['delta']['pidfiles'])
+
+        second = drone_utility.decode_refresh_result(first, second)
+        self.assertEqual({'a': '1\n0\n0\n'}, second['pidfiles'])
+        self.assertEqual({'a': '1\n0\n0\n'}, second['pidfiles_second_read'])
+        self.assertEqual(['2', '3'], sorted(
+            info['pid'] for info in second['autoserv_processes']))
+        self.assertEqual([], second['parse_processes'])
+        self.god.check_playback()
+
+    def test_full_results_on_unknown_base(self):
+        first = self._refresh([], {})
+        second = self._refresh([], {}, base_refresh_id='other')
+        self.assertTrue('delta' not in second)
+        self.assertNotEqual(first['refresh_id'], second['refresh_id'])
+        self.assertRaises(ValueError, drone_utility.decode_refresh_result,
+                          first, {'refresh_id': 'x', 'base_refresh_id': 'y',
+                                  'delta': {}})
+        self.god.check_playback()
+
+
+class TestAgentProtocol(unittest.TestCase):
+
+    def test_message_round_trip(self):
+        stream = StringIO()
+        drone_utility.write_message(stream, 'first')
+        drone_utility.write_message(stream, '')
+        stream.seek(0)
+        self.assertEqual('first', drone_utility.read_message(stream))
+        self.assertEqual('', drone_utility.read_message(stream))
+        self.assertEqual(None, drone_utility.read_message(stream))
+
+    def test_truncated_message(self):
+        stream = StringIO()
+        drone_utility.write_message(stream, 'message')
+        stream = StringIO(stream.getvalue()[:-1])
+        self.assertRaises(EOFError, drone_utility.read_message, stream)
+
+    def test_run_agent(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        path = os.path.join(temp_dir, 'file')
+        input_stream = StringIO()
+        for calls in ([drone_utility.call('write_to_file', path, 'a')],
+                      [drone_utility.call('write_to_file', path, 'b')]):
+            drone_utility.write_message(input_stream, pickle.dumps(calls))
+        input_stream.seek(0)
+        output_stream = StringIO()
+        drone_utility.run_agent(input_stream, output_stream)
+
+        output_stream.seek(0)
+        for _ in xrange(2):
+            result = pickle.loads(drone_utility.read_message(output_stream))
+            self.assertEqual([None], result['results'])
+        self.assertEqual(None, drone_utility.read_message(output_stream))
+        self.assertEqual('ab', open(path).read())
+
+
 if __name__ == '__main__':
     unittest.main()
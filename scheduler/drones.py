@@ -1,17 +1,22 @@
 import cPickle
 import os
 import logging
+import subprocess
+import sys
+import time
 try:
     import autotest.common as common
 except ImportError:
     import common
 from autotest.scheduler import drone_utility
 from autotest.client.shared.settings import settings
-from autotest.client.shared import mail
+from autotest.client.shared import mail, utils
 
 
 AUTOTEST_INSTALL_DIR = settings.get_value('SCHEDULER',
                                           'drone_installation_directory')
+USE_DRONE_AGENTS = settings.get_value('SCHEDULER', 'use_drone_agents',
+                                      type=bool, default=False)
 
 
 class DroneUnreachable(Exception):
@@ -20,13 +25,118 @@ class DroneUnreachable(Exception):
     pass
 
 
+class DroneAgentError(Exception):
+
+    """The drone agent died while executing calls."""
+    pass
+
+
+class _DroneAgent(object):
+
+    """
+    A long-lived drone_utility.py --agent process and the pipe to it.
+
+    Call lists and their results are exchanged as length-prefixed pickles over
+    the stdin/stdout of the command, so the interpreter startup and imports
+    happen once instead of on every scheduler cycle.  The process is started
+    on the first call and restarted on the call after it died.
+
+    :param command: shell command starting the agent, e.g. through ssh.
+    """
+
+    _EXIT_TIMEOUT_SECS = 5
+
+    def __init__(self, command):
+        self.command = command
+        self._process = None
+
+    def is_running(self):
+        return self._process is not None and self._process.poll() is None
+
+    def _start(self):
+        logging.info('Starting drone agent: %s', self.command)
+        self._process = subprocess.Popen(self.command, shell=True,
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         close_fds=True)
+
+    def send_calls(self, calls):
+        """
+        Send a list of calls to the agent, starting it if needed.
+
+        :raise IOError: if the agent could not be sent the calls, in which
+                case none of them was executed.
+        """
+        if not self.is_running():
+            self.close()
+            self._start()
+        try:
+            drone_utility.write_message(
+                self._process.stdin,
+                cPickle.dumps(calls, cPickle.HIGHEST_PROTOCOL))
+        except IOError:
+            self.close()
+            raise
+
+    def receive_results(self):
+        """
+        :return: the return value of DroneUtility.execute_calls() for the
+                calls sent last.
+        :raise DroneAgentError: if the agent died before answering.
+        """
+        try:
+            message = drone_utility.read_message(self._process.stdout)
+        except (IOError, EOFError), exc:
+            message = None
+            logging.error('Reading from drone agent failed: %s', exc)
+        if message is None:
+            self.close()
+            raise DroneAgentError('Drone agent %r died while executing calls'
+                                  % self.command)
+        return cPickle.loads(message)
+
+    def execute_calls(self, calls):
+        self.send_calls(calls)
+        return self.receive_results()
+
+    def close(self):
+        if self._process is None:
+            return
+        process = self._process
+        self._process = None
+        try:
+            process.stdin.close()
+        except IOError:
+            pass
+        # the agent exits once its input is closed
+        deadline = time.time() + self._EXIT_TIMEOUT_SECS
+        while process.poll() is None and time.time() < deadline:
+            time.sleep(0.1)
+        utils.nuke_subprocess(process)
+        process.stdout.close()
+
+
+def local_agent_command():
+    """
+    :return: command running an agent from this source tree on localhost,
+            for testing.
+    """
+    return '%s %s --agent' % (sys.executable,
+                              os.path.join(os.path.dirname(
+                                  os.path.abspath(__file__)),
+                                  'drone_utility.py'))
+
+
 class _AbstractDrone(object):
 
     """
     Attributes:
     * allowed_users: set of usernames allowed to use this drone.  if None,
             any user can use this drone.
+    * concurrent_calls_allowed: whether calls to this drone may be executed
+            from a thread other than the main scheduler thread.
     """
+    concurrent_calls_allowed = True
 
     def __init__(self):
         self._calls = []
@@ -81,6 +191,20 @@ class _AbstractDrone(object):
     def clear_call_queue(self):
         self._calls = []
 
+    def pop_queued_calls(self):
+        """
+        Return the queued calls and clear the queue, so that the calls can be
+        executed while new calls are queued.
+        """
+        calls = self._calls
+        self.clear_call_queue()
+        return calls
+
+    def execute_calls(self, calls):
+        if not calls:
+            return
+        self._execute_calls(calls)
+
     def execute_queued_calls(self):
         if not self._calls:
             return
@@ -93,6 +217,9 @@ class _AbstractDrone(object):
 
 class _LocalDrone(_AbstractDrone):
 
+    # local calls fork processes, keep them in the main scheduler thread
+    concurrent_calls_allowed = False
+
     def __init__(self):
         super(_LocalDrone, self).__init__()
         self.hostname = 'localhost'
@@ -121,6 +248,7 @@ class _RemoteDrone(_AbstractDrone):
             logging.error('Drone %s is unpingable, kicking out', hostname)
             raise DroneUnreachable
         self._autotest_install_dir = AUTOTEST_INSTALL_DIR
+        self._agent = None
 
     @property
     def _drone_utility_path(self):
@@ -129,12 +257,41 @@ class _RemoteDrone(_AbstractDrone):
 
     def set_autotest_install_dir(self, path):
         self._autotest_install_dir = path
+        self._close_agent()
+
+    def _close_agent(self):
+        if self._agent is not None:
+            self._agent.close()
+            self._agent = None
+
+    def _get_agent(self):
+        if self._agent is None:
+            command = '%s "python %s --agent"' % (
+                self._host.ssh_command(connect_timeout=300),
+                self._drone_utility_path)
+            self._agent = _DroneAgent(command)
+        return self._agent
 
     def shutdown(self):
         super(_RemoteDrone, self).shutdown()
+        self._close_agent()
         self._host.close()
 
     def _execute_calls_impl(self, calls):
+        if USE_DRONE_AGENTS:
+            agent = self._get_agent()
+            try:
+                agent.send_calls(calls)
+            except IOError, exc:
+                # nothing was executed, run the calls the old way this time
+                logging.error('Could not send calls to drone agent on %s, '
+                              'falling back to drone_utility: %s',
+                              self.hostname, exc)
+            else:
+                return agent.receive_results()
+        return self._execute_calls_once(calls)
+
+    def _execute_calls_once(self, calls):
         logging.info("Running drone_utility on %s", self.hostname)
         result = self._host.run('python %s' % self._drone_utility_path,
                                 stdin=cPickle.dumps(calls), stdout_tee=None,
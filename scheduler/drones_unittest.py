@@ -3,11 +3,14 @@
 """Tests for autotest.scheduler.drones."""
 
 import cPickle
+import os
+import shutil
+import tempfile
 
 import common
 from autotest.client.shared import utils
 from autotest.client.shared.test_utils import mock, unittest
-from autotest.scheduler import drones
+from autotest.scheduler import drones, drone_utility
 from autotest.server.hosts import ssh_host
 
 
@@ -47,6 +50,81 @@ class RemoteDroneTest(unittest.TestCase):
         self.assertEqual('mock return', drone._execute_calls_impl(mock_calls))
         self.god.check_playback()
 
+    def test_execute_calls_impl_agent(self):
+        self.god.stub_with(drones, 'USE_DRONE_AGENTS', True)
+        drones.drone_utility.create_host.expect_call('fakehost').and_return(
+            self._mock_host)
+        self._mock_host.is_up.expect_call().and_return(True)
+        drone = drones._RemoteDrone('fakehost')
+        agent = self.god.create_mock_class(drones._DroneAgent, 'agent')
+        drone._agent = agent
+        agent.send_calls.expect_call(('foo',))
+        agent.receive_results.expect_call().and_return('agent return')
+
+        self.assertEqual('agent return', drone._execute_calls_impl(('foo',)))
+        self.god.check_playback()
+
+    def test_execute_calls_impl_agent_fallback(self):
+        self.god.stub_with(drones, 'USE_DRONE_AGENTS', True)
+        self.god.stub_with(drones._RemoteDrone, '_drone_utility_path',
+                           'mock-drone-utility-path')
+        drones.drone_utility.create_host.expect_call('fakehost').and_return(
+            self._mock_host)
+        self._mock_host.is_up.expect_call().and_return(True)
+        drone = drones._RemoteDrone('fakehost')
+        agent = self.god.create_mock_class(drones._DroneAgent, 'agent')
+        drone._agent = agent
+        agent.send_calls.expect_call(('foo',)).and_raises(IOError('dead'))
+        mock_result = utils.CmdResult(stdout=cPickle.dumps('mock return'))
+        self._mock_host.run.expect_call(
+            'python mock-drone-utility-path',
+            stdin=cPickle.dumps(('foo',)), stdout_tee=None,
+            connect_timeout=mock.is_instance_comparator(int)).and_return(
+            mock_result)
+
+        self.assertEqual('mock return', drone._execute_calls_impl(('foo',)))
+        self.god.check_playback()
+
+
+class DroneAgentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'file')
+        self.agent = drones._DroneAgent(drones.local_agent_command())
+
+    def tearDown(self):
+        self.agent.close()
+        shutil.rmtree(self.temp_dir)
+
+    def _write(self, contents):
+        return self.agent.execute_calls(
+            [drone_utility.call('write_to_file', self.path, contents)])
+
+    def test_execute_calls(self):
+        self.assertEqual([None], self._write('a')['results'])
+        pid = self.agent._process.pid
+        self.assertEqual([None], self._write('b')['results'])
+        self.assertEqual(pid, self.agent._process.pid)
+        self.assertEqual('ab', open(self.path).read())
+
+    def test_restart(self):
+        self._write('a')
+        self.agent._process.kill()
+        self.agent._process.wait()
+        self.assertFalse(self.agent.is_running())
+        self._write('b')
+        self.assertTrue(self.agent.is_running())
+        self.assertEqual('ab', open(self.path).read())
+
+    def test_died_while_executing(self):
+        # exits after reading part of the request, without answering
+        self.agent = drones._DroneAgent('head -c 1 >/dev/null')
+        self.agent.send_calls(
+            [drone_utility.call('write_to_file', self.path, 'a')])
+        self.assertRaises(drones.DroneAgentError, self.agent.receive_results)
+        self.assertFalse(self.agent.is_running())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,199 @@
+"""
+Bitset based host eligibility checks for the host scheduler.
+
+Every host available in a scheduling cycle gets a bit position, and the hosts
+having a label, being in an ACL, being ineligible for a job, etc. are each
+represented by a single Python long with the corresponding bits set.  Finding
+the hosts a queue entry may run on then takes a handful of AND / AND NOT
+operations on those longs (done in C, a machine word at a time) instead of
+checking every host's label and ACL sets in Python.
+"""
+
+import array
+import binascii
+
+# positions of the bits set in each hexadecimal digit
+_DIGIT_BITS = dict(('%x' % value, [bit for bit in range(4) if value >> bit & 1])
+                   for value in range(16))
+
+
+class HostBitmap(object):
+
+    """
+    Maps host ids to bit positions and back.
+
+    :param host_ids: ids of the hosts to map, bit positions are assigned in
+            ascending host id order.
+    """
+
+    def __init__(self, host_ids):
+        self._host_ids = sorted(host_ids)
+        self._positions = dict((host_id, position) for position, host_id
+                               in enumerate(self._host_ids))
+        self.all = self.from_positions(range(len(self._host_ids)))
+
+    def __len__(self):
+        return len(self._host_ids)
+
+    def position(self, host_id):
+        return self._positions[host_id]
+
+    def bit(self, host_id):
+        """:return: the bit of host_id, or 0 for unknown hosts."""
+        position = self._positions.get(host_id)
+        if position is None:
+            return 0
+        return 1 << position
+
+    def from_positions(self, positions):
+        """
+        Build a bitset in time linear in the number of hosts (setting bits one
+        at a time on a long copies it each time).
+        """
+        buf = array.array('B', [0]) * ((len(self._host_ids) + 7) // 8)
+        for position in positions:
+            buf[position >> 3] |= 1 << (position & 7)
+        if not buf:
+            return 0
+        buf.reverse()
+        return int(binascii.hexlify(buf.tostring()), 16)
+
+    def from_ids(self, host_ids):
+        positions = self._positions
+        return self.from_positions(positions[host_id] for host_id in host_ids
+                                   if host_id in positions)
+
+    def to_ids(self, bits):
+        """Yield the ids of the hosts in bits, in ascending order."""
+        host_ids = self._host_ids
+        digits = '%x' % bits
+        last = len(digits) - 1
+        for index in xrange(last, -1, -1):
+            digit = digits[index]
+            if digit != '0':
+                position = (last - index) * 4
+                for bit in _DIGIT_BITS[digit]:
+                    yield host_ids[position + bit]
+
+
+class EligibilityEngine(object):
+
+    """
+    Answers "which available hosts may run this queue entry" with bitsets.
+
+    Hosts are registered with add_host() and build() must then be called
+    before any query.  Hosts taken during the scheduling cycle are removed
+    with remove_host().
+
+    :param labels: dict mapping label ids to Label DBObjects.
+    :param everyone_acl: set with the id of the "Everyone" ACL group.
+    """
+
+    def __init__(self, labels, everyone_acl):
+        self._labels = labels
+        self._everyone_acl = everyone_acl
+        self._only_if_needed_labels = frozenset(
+            label_id for label_id, label in labels.iteritems()
+            if label.only_if_needed)
+        self._pending_hosts = []
+        self._eligible_cache = {}
+
+    def add_host(self, host_id, label_ids, acl_ids, atomic_group_id, invalid):
+        """
+        :param host_id: id of an available host.
+        :param label_ids: ids of the labels of the host.
+        :param acl_ids: ids of the ACL groups of the host.
+        :param atomic_group_id: id of the atomic group the host belongs to
+                through its labels, or None.
+        :param invalid: True for invalid (one-time) hosts.
+        """
+        self._pending_hosts.append((host_id, label_ids, acl_ids,
+                                    atomic_group_id, invalid))
+
+    def build(self):
+        hosts = self._pending_hosts
+        self._pending_hosts = []
+        self.hosts = HostBitmap(host[0] for host in hosts)
+
+        label_positions = {}
+        acl_positions = {}
+        atomic_group_positions = {}
+        invalid_positions = []
+        everyone_only_positions = []
+        for host_id, label_ids, acl_ids, atomic_group_id, invalid in hosts:
+            position = self.hosts.position(host_id)
+            for label_id in label_ids:
+                label_positions.setdefault(label_id, []).append(position)
+            for acl_id in acl_ids:
+                acl_positions.setdefault(acl_id, []).append(position)
+            atomic_group_positions.setdefault(atomic_group_id,
+                                              []).append(position)
+            if invalid:
+                invalid_positions.append(position)
+            if set(acl_ids) == self._everyone_acl:
+                everyone_only_positions.append(position)
+
+        self._label_bits = self._bits_by_key(label_positions)
+        self._acl_bits = self._bits_by_key(acl_positions)
+        self._atomic_group_bits = self._bits_by_key(atomic_group_positions)
+        self._everyone_only_bits = self.hosts.from_positions(
+            everyone_only_positions)
+        self.available_bits = self.hosts.all
+        self.usable_bits = self.hosts.all & ~self.hosts.from_positions(
+            invalid_positions)
+        self._eligible_cache.clear()
+
+    def _bits_by_key(self, positions_by_key):
+        return dict((key, self.hosts.from_positions(positions))
+                    for key, positions in positions_by_key.iteritems())
+
+    def remove_host(self, host_id):
+        """Mark a host as no longer available in this scheduling cycle."""
+        bit = self.hosts.bit(host_id)
+        self.available_bits &= ~bit
+        self.usable_bits &= ~bit
+
+    def label_bits(self, label_id):
+        return self._label_bits.get(label_id, 0)
+
+    def eligible_bits(self, job_id, meta_host, atomic_group_id, job_acls,
+                      job_dependencies):
+        """
+        Return the hosts whose labels and ACLs allow them to run a queue
+        entry.  Availability, usability and per-job ineligible hosts are not
+        taken into account, callers mask those separately.
+
+        :param job_id: id of the job of the entry.
+        :param meta_host: label id requested by the entry, or None.
+        :param atomic_group_id: atomic group id of the entry, or None.
+        :param job_acls: ids of the ACL groups of the job owner.
+        :param job_dependencies: ids of the labels the job depends on.
+        """
+        key = (job_id, meta_host, atomic_group_id)
+        bits = self._eligible_cache.get(key)
+        if bits is not None:
+            return bits
+
+        # accessible through at least one ACL group of the job owner
+        acl_bits = 0
+        for acl_id in job_acls:
+            acl_bits |= self._acl_bits.get(acl_id, 0)
+        bits = self.hosts.all & acl_bits
+
+        # having every label the job depends on
+        for label_id in job_dependencies:
+            bits &= self._label_bits.get(label_id, 0)
+
+        if meta_host:
+            # not having only_if_needed labels the job didn't ask for
+            for label_id in self._only_if_needed_labels:
+                if label_id != meta_host and label_id not in job_dependencies:
+                    bits &= ~self._label_bits.get(label_id, 0)
+            # not reserved through a user specific ACL
+            bits &= self._everyone_only_bits
+
+        # in the atomic group of the entry (or in none at all)
+        bits &= self._atomic_group_bits.get(atomic_group_id, 0)
+
+        self._eligible_cache[key] = bits
+        return bits
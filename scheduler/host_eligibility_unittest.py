@@ -0,0 +1,100 @@
+#!/usr/bin/python
+
+"""Tests for autotest.scheduler.host_eligibility."""
+
+import common
+from autotest.client.shared.test_utils import unittest
+from autotest.scheduler import host_eligibility
+
+
+class FakeLabel(object):
+
+    def __init__(self, only_if_needed=False):
+        self.only_if_needed = only_if_needed
+
+
+class HostBitmapTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        bitmap = host_eligibility.HostBitmap([30, 10, 20])
+        self.assertEqual(0x7, bitmap.all)
+        self.assertEqual(0x4, bitmap.bit(30))
+        self.assertEqual(0, bitmap.bit(40))
+        self.assertEqual(0x5, bitmap.from_ids([10, 30, 40]))
+        self.assertEqual([10, 30], list(bitmap.to_ids(0x5)))
+
+    def test_many_hosts(self):
+        host_ids = range(1, 5000)
+        bitmap = host_eligibility.HostBitmap(host_ids)
+        self.assertEqual(host_ids, list(bitmap.to_ids(bitmap.all)))
+        self.assertEqual([1, 4999],
+                         list(bitmap.to_ids(bitmap.from_ids([1, 4999]))))
+
+    def test_empty(self):
+        bitmap = host_eligibility.HostBitmap([])
+        self.assertEqual(0, bitmap.all)
+        self.assertEqual([], list(bitmap.to_ids(bitmap.all)))
+
+
+class EligibilityEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        labels = {1: FakeLabel(), 2: FakeLabel(), 3: FakeLabel(True)}
+        self.engine = host_eligibility.EligibilityEngine(labels,
+                                                         set([100]))
+        # host id, labels, acls, atomic group, invalid
+        self.engine.add_host(1, [1], [100], None, False)
+        self.engine.add_host(2, [1, 2], [100], None, False)
+        self.engine.add_host(3, [1, 3], [100], None, False)
+        self.engine.add_host(4, [1], [100, 101], None, False)
+        self.engine.add_host(5, [1], [101], None, False)
+        self.engine.add_host(6, [1], [100], 7, False)
+        self.engine.add_host(7, [], [100], None, True)
+        self.engine.build()
+        self.job_id = 0
+
+    def _eligible(self, meta_host=None, atomic_group_id=None, acls=(100,),
+                  dependencies=()):
+        # results are cached per job, use a new job for every query
+        self.job_id += 1
+        bits = self.engine.eligible_bits(self.job_id, meta_host,
+                                         atomic_group_id, set(acls),
+                                         set(dependencies))
+        return list(self.engine.hosts.to_ids(bits))
+
+    def test_acls(self):
+        self.assertEqual([1, 2, 3, 4, 7], self._eligible())
+        self.assertEqual([4, 5], self._eligible(acls=[101]))
+
+    def test_dependencies(self):
+        self.assertEqual([2], self._eligible(dependencies=[1, 2]))
+
+    def test_metahost(self):
+        # 3 has an only_if_needed label, 4 is reserved through ACL 101.
+        # 7 is invalid but unusable hosts are masked by the callers.
+        self.assertEqual([1, 2, 7], self._eligible(meta_host=1))
+        self.assertEqual([1, 2, 3, 7], self._eligible(meta_host=3))
+        self.assertEqual([3], self._eligible(meta_host=1, dependencies=[3]))
+
+    def test_cached_per_job(self):
+        self.engine.eligible_bits(1, None, None, set([100]), set())
+        bits = self.engine.eligible_bits(1, None, None, set([101]), set())
+        self.assertEqual([1, 2, 3, 4, 7], list(self.engine.hosts.to_ids(bits)))
+
+    def test_atomic_group(self):
+        self.assertEqual([6], self._eligible(atomic_group_id=7))
+
+    def test_remove_host(self):
+        self.assertEqual([1, 2, 3, 4, 5, 6],
+                         list(self.engine.hosts.to_ids(
+                             self.engine.usable_bits)))
+        self.engine.remove_host(2)
+        self.assertEqual([1, 3, 4, 5, 6, 7],
+                         list(self.engine.hosts.to_ids(
+                             self.engine.available_bits)))
+        self.assertEqual(0, self.engine.label_bits(2) &
+                         self.engine.usable_bits)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,8 +6,9 @@ import logging
 from autotest.client.shared import utils
 from autotest.client.shared.settings import settings
 from autotest.frontend.afe import models
-from autotest.scheduler import metahost_scheduler, scheduler_config
-from autotest.scheduler import scheduler_models
+from autotest.scheduler import host_eligibility, metahost_scheduler
+from autotest.scheduler import scheduler_config
+from autotest.scheduler import scheduler_models, scheduling_index
 
 
 get_site_metahost_schedulers = utils.import_site_function(
@@ -24,18 +25,22 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
 
     """Handles the logic for choosing when to run jobs and on which hosts.
 
-    This class makes several queries to the database on each tick, building up
-    some auxiliary data structures and using them to determine which hosts are
-    eligible to run which jobs, taking into account all the various factors that
-    affect that.
+    This class keeps an in-memory index of the host, label, ACL and job
+    dependency tables (see scheduling_index), bringing it up to date on each
+    tick, builds up bitsets of the available hosts from it (see
+    host_eligibility) and uses them to determine which hosts are eligible to
+    run which jobs, taking into account all the various factors that affect
+    that.
 
     In the past this was done with one or two very large, complex database
     queries.  It has proven much simpler and faster to build these auxiliary
     data structures and perform the logic in Python.
     """
 
-    def __init__(self, db):
+    def __init__(self, db, shard=None):
         self._db = db
+        # in a sharded deployment, the scheduler.shard.Shard of this scheduler
+        self._shard = shard
         self._metahost_schedulers = metahost_scheduler.get_metahost_schedulers()
 
         # load site-specific scheduler selected in settings
@@ -57,85 +62,38 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
         self.everyone_acl = set(
             [int(acl.id) for acl in
                 scheduler_models.ACLGroup.fetch(where="name like 'Everyone'")])
+        # host labels and ACLs, job ACLs, dependencies and ineligible hosts
+        # are kept in memory and only updated with what changed between ticks
+        self._index = scheduling_index.SchedulingIndex(db)
 
     def _get_ready_hosts(self):
         # avoid any host with a currently active queue entry against it
+        where = ("active_hqe.host_id IS NULL "
+                 "AND NOT afe_hosts.locked "
+                 "AND (afe_hosts.status IS NULL "
+                 "OR afe_hosts.status = 'Ready')")
+        if self._shard:
+            where += ' AND ' + self._shard.schedulable_hosts_where()
         hosts = scheduler_models.Host.fetch(
             joins='LEFT JOIN afe_host_queue_entries AS active_hqe '
                   'ON (afe_hosts.id = active_hqe.host_id AND '
             'active_hqe.active)',
-            where="active_hqe.host_id IS NULL "
-                  "AND NOT afe_hosts.locked "
-                  "AND (afe_hosts.status IS NULL "
-            "OR afe_hosts.status = 'Ready')")
+            where=where)
         return dict((host.id, host) for host in hosts)
 
-    def _get_sql_id_list(self, id_list):
-        return ','.join(str(item_id) for item_id in id_list)
-
-    def _get_many2many_dict(self, query, id_list, flip=False):
-        if not id_list:
-            return {}
-        query %= self._get_sql_id_list(id_list)
-        rows = self._db.execute(query)
-        return self._process_many2many_dict(rows, flip)
-
-    def _process_many2many_dict(self, rows, flip=False):
-        result = {}
-        for row in rows:
-            left_id, right_id = int(row[0]), int(row[1])
-            if flip:
-                left_id, right_id = right_id, left_id
-            result.setdefault(left_id, set()).add(right_id)
-        return result
-
-    def _get_job_acl_groups(self, job_ids):
-        query = """
-        SELECT afe_jobs.id, afe_acl_groups_users.aclgroup_id
-        FROM afe_jobs
-        INNER JOIN afe_users ON afe_users.login = afe_jobs.owner
-        INNER JOIN afe_acl_groups_users ON
-                afe_acl_groups_users.user_id = afe_users.id
-        WHERE afe_jobs.id IN (%s)
+    def _claim_host(self, host_id):
         """
-        return self._get_many2many_dict(query, job_ids)
+        Claim the host for our shard, if any.  A host claimed by another shard
+        is not available anymore.
 
-    def _get_job_ineligible_hosts(self, job_ids):
-        query = """
-        SELECT job_id, host_id
-        FROM afe_ineligible_host_queues
-        WHERE job_id IN (%s)
+        :return: True if the host can be used.
         """
-        return self._get_many2many_dict(query, job_ids)
-
-    def _get_job_dependencies(self, job_ids):
-        query = """
-        SELECT job_id, label_id
-        FROM afe_jobs_dependency_labels
-        WHERE job_id IN (%s)
-        """
-        return self._get_many2many_dict(query, job_ids)
-
-    def _get_host_acls(self, host_ids):
-        query = """
-        SELECT host_id, aclgroup_id
-        FROM afe_acl_groups_hosts
-        WHERE host_id IN (%s)
-        """
-        return self._get_many2many_dict(query, host_ids)
-
-    def _get_label_hosts(self, host_ids):
-        if not host_ids:
-            return {}, {}
-        query = """
-        SELECT label_id, host_id
-        FROM afe_hosts_labels
-        WHERE host_id IN (%s)
-        """ % self._get_sql_id_list(host_ids)
-        rows = self._db.execute(query)
-        labels_to_hosts = self._process_many2many_dict(rows)
-        hosts_to_labels = self._process_many2many_dict(rows, flip=True)
-        return labels_to_hosts, hosts_to_labels
+        if not self._shard or self._shard.claim_host(self._db, host_id):
+            return True
+        logging.info('Host %s is claimed by another shard', host_id)
+        if host_id in self._hosts_available:
+            self.pop_host(host_id)
+        return False
 
     def _get_labels(self):
         return dict((label.id, label) for label
@@ -145,63 +103,75 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
         for metahost_scheduler in self._metahost_schedulers:
             metahost_scheduler.recovery_on_startup()
 
+    def _build_eligibility_engine(self):
+        engine = host_eligibility.EligibilityEngine(self._labels,
+                                                    self.everyone_acl)
+        for host_id, host in self._hosts_available.iteritems():
+            host_labels = self._index.labels_for_host(host_id)
+            engine.add_host(host_id, host_labels,
+                            self._index.acls_for_host(host_id),
+                            self._get_host_atomic_group_id(host_labels),
+                            host.invalid)
+        engine.build()
+        return engine
+
     def refresh(self, pending_queue_entries):
         self._hosts_available = self._get_ready_hosts()
 
-        relevant_jobs = [queue_entry.job_id
-                         for queue_entry in pending_queue_entries]
-        self._job_acls = self._get_job_acl_groups(relevant_jobs)
-        self._ineligible_hosts = self._get_job_ineligible_hosts(relevant_jobs)
-        self._job_dependencies = self._get_job_dependencies(relevant_jobs)
-
-        host_ids = self._hosts_available.keys()
-        self._host_acls = self._get_host_acls(host_ids)
-        self._label_hosts, self._host_labels = self._get_label_hosts(host_ids)
-
+        relevant_jobs = set(queue_entry.job_id
+                            for queue_entry in pending_queue_entries)
+        self._index.refresh(relevant_jobs)
         self._labels = self._get_labels()
+        self._eligibility = self._build_eligibility_engine()
 
     def tick(self):
         for metahost_scheduler in self._metahost_schedulers:
             metahost_scheduler.tick()
 
     def hosts_in_label(self, label_id):
-        return set(self._label_hosts.get(label_id, ()))
+        return set(self._eligibility.hosts.to_ids(
+            self._eligibility.label_bits(label_id) &
+            self._eligibility.usable_bits))
 
     def remove_host_from_label(self, host_id, label_id):
-        self._label_hosts[label_id].remove(host_id)
+        # hosts_in_label() only returns usable hosts, nothing to do
+        pass
 
     def pop_host(self, host_id):
+        self._eligibility.remove_host(host_id)
         return self._hosts_available.pop(host_id)
 
     def ineligible_hosts_for_entry(self, queue_entry):
-        return set(self._ineligible_hosts.get(queue_entry.job_id, ()))
+        return set(self._index.ineligible_hosts_for_job(queue_entry.job_id))
 
-    def _is_acl_accessible(self, host_id, queue_entry):
-        job_acls = self._job_acls.get(queue_entry.job_id, set())
-        host_acls = self._host_acls.get(host_id, set())
-        return len(host_acls.intersection(job_acls)) > 0
-
-    def _check_job_dependencies(self, job_dependencies, host_labels):
-        missing = job_dependencies - host_labels
-        return len(missing) == 0
-
-    def _check_only_if_needed_labels(self, job_dependencies, host_labels,
-                                     queue_entry):
-        if not queue_entry.meta_host:
-            # bypass only_if_needed labels when a specific host is selected
-            return True
+    def _eligible_bits(self, queue_entry):
+        """
+        :return: bitset of the hosts whose labels and ACLs allow them to run
+                queue_entry (see host_eligibility.EligibilityEngine).
+        """
+        job_id = queue_entry.job_id
+        return self._eligibility.eligible_bits(
+            job_id, queue_entry.meta_host, queue_entry.atomic_group_id,
+            self._index.acls_for_job(job_id),
+            self._index.dependencies_for_job(job_id))
 
-        for label_id in host_labels:
-            label = self._labels[label_id]
-            if not label.only_if_needed:
-                # we don't care about non-only_if_needed labels
-                continue
-            if queue_entry.meta_host == label_id:
-                # if the label was requested in a metahost it's OK
-                continue
-            if label_id not in job_dependencies:
-                return False
-        return True
+    def _candidate_bits(self, queue_entry):
+        """
+        :return: bitset of the usable hosts eligible for queue_entry, minus
+                the hosts the job was blocked from.
+        """
+        ineligible_bits = self._eligibility.hosts.from_ids(
+            self._index.ineligible_hosts_for_job(queue_entry.job_id))
+        return (self._eligible_bits(queue_entry) &
+                self._eligibility.usable_bits & ~ineligible_bits)
+
+    def eligible_hosts_in_label(self, label_id, queue_entry):
+        host_ids = self._eligibility.hosts.to_ids(
+            self._candidate_bits(queue_entry) &
+            self._eligibility.label_bits(label_id))
+        if not self._shard:
+            return host_ids
+        return (host_id for host_id in host_ids if self._claim_host(host_id))
 
     def _check_atomic_group_labels(self, host_labels, queue_entry):
         """
@@ -216,20 +186,6 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
         return (self._get_host_atomic_group_id(host_labels, queue_entry) ==
                 queue_entry.atomic_group_id)
 
-    def _check_no_acl_for_metahost(self, host_id, queue_entry):
-        """
-        If the given HostQueueEntry is for a metahost, determine if the given
-        host id has any user-specific ACL set. We do not want to schedule a
-        metahost job on a reserved host.
-
-        :param host_id: host id to examine.
-        :param queue_entry: The HostQueueEntry being considered for the host.
-
-        :return: True if entry is not a metahost or the host only has the "Everyone" ACL, False otherwise.
-        """
-        host_acls = self._host_acls.get(host_id, set())
-        return (queue_entry.meta_host is None or host_acls == self.everyone_acl)
-
     def _get_host_atomic_group_id(self, host_labels, queue_entry=None):
         """
         Return the atomic group label id for a host with the given set of
@@ -265,20 +221,6 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
                 label.atomic_group_id == atomic_group_id and not
                 label.invalid)
 
-    def _get_eligible_host_ids_in_group(self, group_hosts, queue_entry):
-        """
-        :param group_hosts - A sequence of Host ids to test for usability
-                and eligibility against the Job associated with queue_entry.
-        :param queue_entry - The HostQueueEntry that these hosts are being
-                tested for eligibility against.
-
-        :return: A subset of group_hosts Host ids that are eligible for the
-                supplied queue_entry.
-        """
-        return set(host_id for host_id in group_hosts if
-                   self.is_host_usable(host_id) and
-                   self.is_host_eligible_for_job(host_id, queue_entry))
-
     def is_host_eligible_for_job(self, host_id, queue_entry):
         if self._is_host_invalid(host_id):
             # if an invalid host is scheduled for a job, it's a one-time host
@@ -287,15 +229,8 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
             # relationships cleared.
             return True
 
-        job_dependencies = self._job_dependencies.get(queue_entry.job_id, set())
-        host_labels = self._host_labels.get(host_id, set())
-
-        return (self._is_acl_accessible(host_id, queue_entry) and
-                self._check_job_dependencies(job_dependencies, host_labels) and
-                self._check_only_if_needed_labels(
-                    job_dependencies, host_labels, queue_entry) and
-                self._check_atomic_group_labels(host_labels, queue_entry) and
-                self._check_no_acl_for_metahost(host_id, queue_entry))
+        return bool(self._eligible_bits(queue_entry) &
+                    self._eligibility.hosts.bit(host_id))
 
     def _is_host_invalid(self, host_id):
         host_object = self._hosts_available.get(host_id, None)
@@ -304,6 +239,9 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
     def _schedule_non_metahost(self, queue_entry):
         if not self.is_host_eligible_for_job(queue_entry.host_id, queue_entry):
             return None
+        if not self._claim_host(queue_entry.host_id):
+            return None
+        self._eligibility.remove_host(queue_entry.host_id)
         return self._hosts_available.pop(queue_entry.host_id, None)
 
     def is_host_usable(self, host_id):
@@ -362,26 +300,24 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
                 job.id, job.synch_count, atomic_group.id,
                 atomic_group.max_number_of_machines, queue_entry.id)
             return []
-        hosts_in_label = self.hosts_in_label(queue_entry.meta_host)
-        ineligible_host_ids = self.ineligible_hosts_for_entry(queue_entry)
+        candidate_bits = self._candidate_bits(queue_entry)
+        if queue_entry.meta_host is not None:
+            # If we have a metahost label, only allow its hosts.
+            candidate_bits &= self._eligibility.label_bits(
+                queue_entry.meta_host)
+
+        # Job.synch_count is treated as "minimum synch count" when
+        # scheduling for an atomic group of hosts.  The atomic group
+        # number of machines is the maximum to pick out of a single
+        # atomic group label for scheduling at one time.
+        min_hosts = job.synch_count
+        max_hosts = atomic_group.max_number_of_machines
 
         # Look in each label associated with atomic_group until we find one with
         # enough hosts to satisfy the job.
         for atomic_label_id in self._get_atomic_group_labels(atomic_group.id):
-            group_hosts = set(self.hosts_in_label(atomic_label_id))
-            if queue_entry.meta_host is not None:
-                # If we have a metahost label, only allow its hosts.
-                group_hosts.intersection_update(hosts_in_label)
-            group_hosts -= ineligible_host_ids
-            eligible_host_ids_in_group = self._get_eligible_host_ids_in_group(
-                group_hosts, queue_entry)
-
-            # Job.synch_count is treated as "minimum synch count" when
-            # scheduling for an atomic group of hosts.  The atomic group
-            # number of machines is the maximum to pick out of a single
-            # atomic group label for scheduling at one time.
-            min_hosts = job.synch_count
-            max_hosts = atomic_group.max_number_of_machines
+            eligible_host_ids_in_group = list(self._eligibility.hosts.to_ids(
+                candidate_bits & self._eligibility.label_bits(atomic_label_id)))
 
             if len(eligible_host_ids_in_group) < min_hosts:
                 # Not enough eligible hosts in this atomic group label.
@@ -396,14 +332,16 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
             if len(eligible_hosts_in_group) > max_hosts:
                 eligible_hosts_in_group = eligible_hosts_in_group[:max_hosts]
 
+            if self._shard:
+                claimed_ids = [host.id for host in eligible_hosts_in_group
+                               if self._claim_host(host.id)]
+                if len(claimed_ids) < len(eligible_hosts_in_group):
+                    self._shard.release_hosts(self._db, claimed_ids)
+                    continue
+
             # Remove the selected hosts from our cached internal state
             # of available hosts in order to return the Host objects.
-            host_list = []
-            for host in eligible_hosts_in_group:
-                hosts_in_label.discard(host.id)
-                self._hosts_available.pop(host.id)
-                host_list.append(host)
-            return host_list
+            return [self.pop_host(host.id) for host in eligible_hosts_in_group]
 
         return []
 
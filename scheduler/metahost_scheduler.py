@@ -41,6 +41,27 @@ class HostSchedulingUtility(object):
         """
         raise NotImplementedError
 
+    def eligible_hosts_in_label(self, label_id, queue_entry):
+        """Yield usable hosts with the given label eligible for queue_entry.
+
+        This default implementation checks the hosts one at a time,
+        implementations are expected to provide a faster one.
+
+        :param queue_entry: a HostQueueEntry DBObject
+        """
+        hosts_in_label = self.hosts_in_label(label_id)
+        ineligible_host_ids = self.ineligible_hosts_for_entry(queue_entry)
+
+        for host_id in hosts_in_label:
+            if not self.is_host_usable(host_id):
+                self.remove_host_from_label(host_id, label_id)
+                continue
+            if host_id in ineligible_host_ids:
+                continue
+            if not self.is_host_eligible_for_job(host_id, queue_entry):
+                continue
+            yield host_id
+
 
 class MetahostScheduler(object):
 
@@ -81,20 +102,8 @@ class LabelMetahostScheduler(MetahostScheduler):
 
     def schedule_metahost(self, queue_entry, scheduling_utility):
         label_id = queue_entry.meta_host
-        hosts_in_label = scheduling_utility.hosts_in_label(label_id)
-        ineligible_host_ids = scheduling_utility.ineligible_hosts_for_entry(
-            queue_entry)
-
-        for host_id in hosts_in_label:
-            if not scheduling_utility.is_host_usable(host_id):
-                scheduling_utility.remove_host_from_label(host_id, label_id)
-                continue
-            if host_id in ineligible_host_ids:
-                continue
-            if not scheduling_utility.is_host_eligible_for_job(host_id,
-                                                               queue_entry):
-                continue
-
+        for host_id in scheduling_utility.eligible_hosts_in_label(
+                label_id, queue_entry):
             # Remove the host from our cached internal state before returning
             scheduling_utility.remove_host_from_label(host_id, label_id)
             host = scheduling_utility.pop_host(host_id)
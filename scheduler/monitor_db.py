@@ -28,10 +28,10 @@ from autotest.client.shared import host_protections, utils
 from autotest.database_legacy import database_connection
 from autotest.frontend.afe import models, rpc_utils, readonly_connection
 from autotest.frontend.afe import model_attributes
-from autotest.scheduler import drone_manager, drones
+from autotest.scheduler import agent_registry, drone_manager, drones
 from autotest.scheduler import gc_stats, host_scheduler, monitor_db_cleanup
-from autotest.scheduler import status_server, scheduler_config
-from autotest.scheduler import scheduler_models
+from autotest.scheduler import status_server, scheduler_config, tick_profiler
+from autotest.scheduler import scheduler_models, shard
 
 WATCHER_PID_FILE_PREFIX = 'autotest-scheduler-watcher'
 PID_FILE_PREFIX = 'autotest-scheduler'
@@ -66,6 +66,8 @@ except ValueError:
     _autoserv_path = os.path.join(drones.AUTOTEST_INSTALL_DIR, 'server', 'autotest-remote')
 _testing_mode = False
 _drone_manager = None
+# the shard.Shard run by this process in a sharded deployment
+_shard = None
 
 
 def _parser_path_default(install_dir):
@@ -175,6 +177,12 @@ def initialize():
                                 'stresstest_autotest_web')
 
     os.environ['PATH'] = AUTOTEST_SERVER_DIR + ':' + os.environ['PATH']
+    if settings.get_value(scheduler_config.CONFIG_SECTION,
+                          'profile_sql_queries', type=bool, default=False):
+        # log all queries in django.db.connection.queries, which the tick
+        # profiler reads; must be set before the connection is opened
+        django.db.connection.use_debug_cursor = True
+
     global _db
     _db = database_connection.DatabaseConnection(DB_CONFIG_SECTION)
     _db.connect(db_type='django')
@@ -190,9 +198,13 @@ def initialize():
     initialize_globals()
     scheduler_models.initialize()
 
-    drones = settings.get_value(scheduler_config.CONFIG_SECTION, 'drones',
-                                default='localhost')
-    drone_list = [hostname.strip() for hostname in drones.split(',')]
+    if _shard:
+        _shard.resolve(_db)
+        drone_list = _shard.drones
+    else:
+        drones = settings.get_value(scheduler_config.CONFIG_SECTION, 'drones',
+                                    default='localhost')
+        drone_list = [hostname.strip() for hostname in drones.split(',')]
     results_host = settings.get_value(scheduler_config.CONFIG_SECTION,
                                       'results_host', default='localhost')
     _drone_manager.initialize(RESULTS_DIR, drone_list, results_host)
@@ -215,6 +227,8 @@ def main_without_exception_handling():
     parser.add_option('--test', help='Indicate that scheduler is under ' +
                       'test and should use dummy autoserv and no parsing',
                       action='store_true')
+    parser.add_option('--shard', help='Run the given shard of a sharded '
+                      'deployment (see the shards setting)')
     (options, args) = parser.parse_args()
     if len(args) != 1:
         parser.print_usage()
@@ -252,12 +266,19 @@ def main_without_exception_handling():
         global _testing_mode
         _testing_mode = True
 
-    server = status_server.StatusServer()
+    status_port = None
+    if options.shard:
+        global _shard, PID_FILE_PREFIX
+        _shard = shard.Shard.from_settings(options.shard)
+        PID_FILE_PREFIX = '%s-%s' % (PID_FILE_PREFIX, options.shard)
+        status_port = _shard.status_port
+
+    server = status_server.StatusServer(port=status_port)
     server.start()
 
     try:
         initialize()
-        dispatcher = Dispatcher()
+        dispatcher = Dispatcher(shard=_shard)
         dispatcher.initialize(recover_hosts=options.recover_hosts)
 
         while not _shutdown and not server._shutdown_scheduler:
@@ -288,17 +309,20 @@ def main():
 
 class Dispatcher(object):
 
-    def __init__(self):
-        self._agents = []
+    def __init__(self, shard=None):
+        """
+        :param shard: the shard.Shard to schedule in a sharded deployment.
+        """
+        self._agents = agent_registry.AgentRegistry()
+        self._shard = shard
         self._last_clean_time = time.time()
-        self._host_scheduler = host_scheduler.HostScheduler(_db)
+        self._host_scheduler = host_scheduler.HostScheduler(_db, shard=shard)
         user_cleanup_time = scheduler_config.config.clean_interval
         self._periodic_cleanup = monitor_db_cleanup.UserCleanup(
             _db, user_cleanup_time)
         self._24hr_upkeep = monitor_db_cleanup.TwentyFourHourUpkeep(_db)
-        self._host_agents = {}
-        self._queue_entry_agents = {}
         self._tick_count = 0
+        self._profiler = tick_profiler.instance()
         self._last_garbage_stats_time = time.time()
         self._seconds_between_garbage_stats = 60 * (
             settings.get_value(
@@ -318,22 +342,67 @@ class Dispatcher(object):
         self._host_scheduler.recovery_on_startup()
 
     def tick(self):
-        self._garbage_collection()
-        _drone_manager.refresh()
-        self._run_cleanup()
-        self._find_aborting()
-        self._process_recurring_runs()
-        self._schedule_delay_tasks()
-        self._schedule_running_host_queue_entries()
-        self._schedule_special_tasks()
-        self._schedule_new_jobs()
-        self._handle_agents()
-        self._host_scheduler.tick()
-        _drone_manager.execute_actions()
-        mail.manager.send_queued_admin()
+        profiler = self._profiler
+        run_phase = profiler.run_phase
+        profiler.start_tick()
+        run_phase('garbage_collection', self._garbage_collection)
+        run_phase('drone_refresh', _drone_manager.refresh)
+        if self._is_coordinator():
+            run_phase('cleanup', self._run_cleanup)
+        # status changes of the scheduling phases are written in bulk, at the
+        # end of the tick or when something (DBObject or Django) reads the
+        # database
+        scheduler_models.begin_write_batch()
+        try:
+            run_phase('find_aborting', self._find_aborting)
+            if self._is_coordinator():
+                run_phase('recurring_runs', self._process_recurring_runs)
+            run_phase('delay_tasks', self._schedule_delay_tasks)
+            run_phase('running_entries',
+                      self._schedule_running_host_queue_entries)
+            run_phase('special_tasks', self._schedule_special_tasks)
+            run_phase('new_jobs', self._schedule_new_jobs)
+            run_phase('handle_agents', self._handle_agents)
+            run_phase('host_scheduler', self._host_scheduler.tick)
+        finally:
+            batch = run_phase('write_batch',
+                              scheduler_models.end_write_batch)
+        if batch.writes:
+            logging.debug('Wrote %d field updates and inserts with %d '
+                          'statements', batch.writes, batch.statements)
+        profiler.count('batched_writes', batch.writes)
+        profiler.count('batch_statements', batch.statements)
+        if self._shard:
+            run_phase('release_hosts', self._release_idle_hosts)
+        run_phase('execute_actions', _drone_manager.execute_actions)
+        run_phase('send_admin_mail', mail.manager.send_queued_admin)
+        profiler.count('agents', len(self._agents))
+        profiler.end_tick()
         django.db.reset_queries()
         self._tick_count += 1
 
+    def _is_coordinator(self):
+        return not self._shard or self._shard.is_coordinator
+
+    def _entry_where(self, where):
+        """
+        Restrict a condition on afe_host_queue_entries to our shard.
+        """
+        if not self._shard:
+            return where
+        return '(%s) AND %s' % (where, self._shard.queue_entry_where())
+
+    def _shard_special_tasks(self, special_tasks):
+        """
+        Restrict a SpecialTask query set to our shard.
+        """
+        if not self._shard:
+            return special_tasks
+        return special_tasks.extra(where=[self._shard.special_task_where()])
+
+    def _release_idle_hosts(self):
+        self._shard.release_idle_hosts(_db, self._agents.host_ids())
+
     def _run_cleanup(self):
         self._periodic_cleanup.run_cleanup_maybe()
         self._24hr_upkeep.run_cleanup_maybe()
@@ -352,41 +421,40 @@ class Dispatcher(object):
                      self._tick_count)
         gc_stats._log_garbage_collector_stats()
 
-    def _register_agent_for_ids(self, agent_dict, object_ids, agent):
-        for object_id in object_ids:
-            agent_dict.setdefault(object_id, set()).add(agent)
-
-    def _unregister_agent_for_ids(self, agent_dict, object_ids, agent):
-        for object_id in object_ids:
-            assert object_id in agent_dict
-            agent_dict[object_id].remove(agent)
+    @staticmethod
+    def _agent_priority(agent):
+        """
+        :return: the highest priority of the jobs of the agent, None if it
+                doesn't work for a job.
+        """
+        queue_entries = getattr(agent.task, 'queue_entries', None)
+        if not queue_entries:
+            queue_entries = [getattr(agent.task, 'queue_entry', None)]
+        priorities = [entry.job.priority for entry in queue_entries
+                      if entry is not None and entry.job is not None]
+        if not priorities:
+            return None
+        return max(priorities)
 
     def add_agent_task(self, agent_task):
         agent = Agent(agent_task)
-        self._agents.append(agent)
         agent.dispatcher = self
-        self._register_agent_for_ids(self._host_agents, agent.host_ids, agent)
-        self._register_agent_for_ids(self._queue_entry_agents,
-                                     agent.queue_entry_ids, agent)
+        self._agents.add(agent, self._agent_priority(agent))
 
     def get_agents_for_entry(self, queue_entry):
         """
         Find agents corresponding to the specified queue_entry.
         """
-        return list(self._queue_entry_agents.get(queue_entry.id, set()))
+        return self._agents.agents_for_queue_entry(queue_entry.id)
 
     def host_has_agent(self, host):
         """
         Determine if there is currently an Agent present using this host.
         """
-        return bool(self._host_agents.get(host.id, None))
+        return self._agents.host_has_agent(host.id)
 
     def remove_agent(self, agent):
         self._agents.remove(agent)
-        self._unregister_agent_for_ids(self._host_agents, agent.host_ids,
-                                       agent)
-        self._unregister_agent_for_ids(self._queue_entry_agents,
-                                       agent.queue_entry_ids, agent)
 
     def _host_has_scheduled_special_task(self, host):
         return bool(models.SpecialTask.objects.filter(host__id=host.id,
@@ -420,7 +488,7 @@ class Dispatcher(object):
                     models.HostQueueEntry.Status.ARCHIVING)
         status_list = ','.join("'%s'" % status for status in statuses)
         queue_entries = scheduler_models.HostQueueEntry.fetch(
-            where='status IN (%s)' % status_list)
+            where=self._entry_where('status IN (%s)' % status_list))
 
         agent_tasks = []
         used_queue_entries = set()
@@ -437,8 +505,9 @@ class Dispatcher(object):
         return agent_tasks
 
     def _get_special_task_agent_tasks(self, is_active=False):
-        special_tasks = models.SpecialTask.objects.filter(
-            is_active=is_active, is_complete=False)
+        special_tasks = self._shard_special_tasks(
+            models.SpecialTask.objects.filter(is_active=is_active,
+                                              is_complete=False))
         return [self._get_agent_task_for_special_task(task)
                 for task in special_tasks]
 
@@ -482,7 +551,7 @@ class Dispatcher(object):
         :param entry: a HostQueueEntry or a SpecialTask
         """
         if self.host_has_agent(entry.host):
-            agent = tuple(self._host_agents.get(entry.host.id))[0]
+            agent = self._agents.agents_for_host(entry.host.id)[0]
             raise host_scheduler.SchedulerError(
                 'While scheduling %s, host %s already has a host agent %s'
                 % (entry, entry.host, agent.task))
@@ -520,8 +589,8 @@ class Dispatcher(object):
         self._check_for_remaining_orphan_processes(orphans)
 
     def _get_unassigned_entries(self, status):
-        for entry in scheduler_models.HostQueueEntry.fetch(where="status = '%s'"
-                                                           % status):
+        for entry in scheduler_models.HostQueueEntry.fetch(
+                where=self._entry_where("status = '%s'" % status)):
             if entry.status == status and not self.get_agents_for_entry(entry):
                 # The status can change during iteration, e.g., if job.run()
                 # sets a group of queue entries to Starting
@@ -548,7 +617,8 @@ class Dispatcher(object):
 
     def _check_for_unrecovered_verifying_entries(self):
         queue_entries = scheduler_models.HostQueueEntry.fetch(
-            where='status = "%s"' % models.HostQueueEntry.Status.VERIFYING)
+            where=self._entry_where(
+                'status = "%s"' % models.HostQueueEntry.Status.VERIFYING))
         unrecovered_hqes = []
         for queue_entry in queue_entries:
             special_tasks = models.SpecialTask.objects.filter(
@@ -583,6 +653,7 @@ class Dispatcher(object):
             where=['(afe_host_queue_entries.id IS NULL OR '
                    'afe_host_queue_entries.id = '
                    'afe_special_tasks.queue_entry_id)'])
+        queued_tasks = self._shard_special_tasks(queued_tasks)
 
         # reorder tasks by priority
         task_priority_order = [models.SpecialTask.Task.REPAIR,
@@ -600,6 +671,9 @@ class Dispatcher(object):
         for task in self._get_prioritized_special_tasks():
             if self.host_has_agent(task.host):
                 continue
+            if self._shard and not self._shard.claim_host(_db, task.host.id):
+                # the host is in use by another shard
+                continue
             self.add_agent_task(self._get_agent_task_for_special_task(task))
 
     def _reverify_remaining_hosts(self):
@@ -614,6 +688,8 @@ class Dispatcher(object):
     def _reverify_hosts_where(self, where,
                               print_message='Reverifying host %s'):
         full_where = 'locked = 0 AND invalid = 0 AND ' + where
+        if self._shard:
+            full_where += ' AND ' + self._shard.managed_hosts_where()
         for host in scheduler_models.Host.fetch(where=full_where):
             if self.host_has_agent(host):
                 # host has already been recovered in some way
@@ -641,7 +717,8 @@ class Dispatcher(object):
         # prioritize by job priority, then non-metahost over metahost, then FIFO
         return list(scheduler_models.HostQueueEntry.fetch(
             joins='INNER JOIN afe_jobs ON (job_id=afe_jobs.id)',
-            where='NOT complete AND NOT active AND status="Queued"',
+            where=self._entry_where(
+                'NOT complete AND NOT active AND status="Queued"'),
             order_by='afe_jobs.priority DESC, meta_host, job_id'))
 
     def _refresh_pending_queue_entries(self):
@@ -720,7 +797,8 @@ class Dispatcher(object):
 
     def _schedule_delay_tasks(self):
         for entry in scheduler_models.HostQueueEntry.fetch(
-                where='status = "%s"' % models.HostQueueEntry.Status.WAITING):
+                where=self._entry_where(
+                    'status = "%s"' % models.HostQueueEntry.Status.WAITING)):
             task = entry.job.schedule_delayed_callback_task(entry)
             if task:
                 self.add_agent_task(task)
@@ -731,7 +809,7 @@ class Dispatcher(object):
     def _find_aborting(self):
         jobs_to_stop = set()
         for entry in scheduler_models.HostQueueEntry.fetch(
-                where='aborted and not complete'):
+                where=self._entry_where('aborted and not complete')):
             logging.info('Aborting %s', entry)
             for agent in self.get_agents_for_entry(entry):
                 agent.abort()
@@ -740,17 +818,9 @@ class Dispatcher(object):
         for job in jobs_to_stop:
             job.stop_if_necessary()
 
-    def _can_start_agent(self, agent, num_started_this_cycle,
-                         have_reached_limit):
-        # always allow zero-process agents to run
-        if agent.task.num_processes == 0:
-            return True
-        # don't allow any nonzero-process agents to run after we've reached a
-        # limit (this avoids starvation of many-process agents)
-        if have_reached_limit:
-            return False
+    def _can_start_agent(self, agent, num_started_this_cycle, capacity):
         # total process throttling
-        max_runnable_processes = _drone_manager.max_runnable_processes(
+        max_runnable_processes = capacity.max_runnable_processes(
             agent.task.owner_username,
             agent.task.get_drone_hostnames_allowed())
         if agent.task.num_processes > max_runnable_processes:
@@ -765,21 +835,37 @@ class Dispatcher(object):
             return False
         return True
 
+    def _tick_agent(self, agent):
+        agent.tick()
+        if agent.is_done():
+            logging.info("agent finished")
+            self.remove_agent(agent)
+            self._profiler.count('agents_finished')
+
     def _handle_agents(self):
+        for agent in self._agents.started_agents():
+            self._tick_agent(agent)
+
+        # always allow zero-process agents to run
+        for agent in self._agents.pop_zero_process_agents():
+            self._profiler.count('agents_started')
+            self._tick_agent(agent)
+
+        # start the other agents by priority until one can't run, so that
+        # many-process agents don't get starved by smaller ones
+        capacity = agent_registry.CapacityCache(
+            _drone_manager.max_runnable_processes)
         num_started_this_cycle = 0
-        have_reached_limit = False
-        # iterate over copy, so we can remove agents during iteration
-        for agent in list(self._agents):
-            if not agent.started:
-                if not self._can_start_agent(agent, num_started_this_cycle,
-                                             have_reached_limit):
-                    have_reached_limit = True
-                    continue
-                num_started_this_cycle += agent.task.num_processes
-            agent.tick()
-            if agent.is_done():
-                logging.info("agent finished")
-                self.remove_agent(agent)
+        while True:
+            agent = self._agents.next_unstarted()
+            if agent is None or not self._can_start_agent(
+                    agent, num_started_this_cycle, capacity):
+                break
+            self._agents.mark_started(agent)
+            num_started_this_cycle += agent.task.num_processes
+            capacity.processes_started(agent.task.num_processes)
+            self._profiler.count('agents_started')
+            self._tick_agent(agent)
         logging.info('%d running processes',
                      _drone_manager.total_running_processes())
 
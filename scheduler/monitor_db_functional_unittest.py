@@ -14,7 +14,7 @@ from autotest.frontend import test_utils
 from autotest.frontend.afe import models
 from autotest.frontend.afe import model_attributes
 from autotest.scheduler import drone_manager, host_scheduler
-from autotest.scheduler import monitor_db, scheduler_models
+from autotest.scheduler import monitor_db, scheduler_models, shard
 
 # translations necessary for scheduler queries to work with SQLite
 _re_translator = database_connection.TranslatingDatabase.make_regexp_translator
@@ -277,8 +277,8 @@ class MockEmailManager(NullMethodObject):
         logging.warn(message)
 
 
-class SchedulerFunctionalTest(unittest.TestCase,
-                              test_utils.FrontendTestMixin):
+class BaseSchedulerFunctionalTest(unittest.TestCase,
+                                  test_utils.FrontendTestMixin):
     # some number of ticks after which the scheduler is presumed to have
     # stabilized, given no external changes
     _A_LOT_OF_TICKS = 10
@@ -331,16 +331,6 @@ class SchedulerFunctionalTest(unittest.TestCase,
         for _ in xrange(self._A_LOT_OF_TICKS):
             self.dispatcher.tick()
 
-    def test_idle(self):
-        self._initialize_test()
-        self._run_dispatcher()
-
-    def _assert_process_executed(self, working_directory, pidfile_name):
-        process_was_executed = self.mock_drone_manager.was_process_executed(
-            'hosts/host1/1-verify', drone_manager.AUTOSERV_PID_FILE)
-        self.assert_(process_was_executed,
-                     '%s/%s not executed' % (working_directory, pidfile_name))
-
     def _update_instance(self, model_instance):
         return type(model_instance).objects.get(pk=model_instance.pk)
 
@@ -360,6 +350,19 @@ class SchedulerFunctionalTest(unittest.TestCase,
         host = self._update_instance(host)
         self.assertEquals(host.status, status)
 
+
+class SchedulerFunctionalTest(BaseSchedulerFunctionalTest):
+
+    def test_idle(self):
+        self._initialize_test()
+        self._run_dispatcher()
+
+    def _assert_process_executed(self, working_directory, pidfile_name):
+        process_was_executed = self.mock_drone_manager.was_process_executed(
+            'hosts/host1/1-verify', drone_manager.AUTOSERV_PID_FILE)
+        self.assert_(process_was_executed,
+                     '%s/%s not executed' % (working_directory, pidfile_name))
+
     def _run_pre_job_verify(self, queue_entry):
         self._run_dispatcher()  # launches verify
         self._check_statuses(queue_entry, HqeStatus.VERIFYING,
@@ -991,5 +994,114 @@ class SchedulerFunctionalTest(unittest.TestCase,
         self.assertEquals(keyval_dict['mykey'], 'myvalue')
 
 
+class ShardedSchedulerFunctionalTest(BaseSchedulerFunctionalTest):
+
+    """
+    Two shards partitioned by label on the same database: shard a owns the
+    hosts with label1 (host1), shard b is the coordinator and owns the others.
+    """
+
+    def _create_dispatcher(self, partition=shard.LABEL,
+                           shard_values=(('a', ['label1']), ('b', []))):
+        self.shards = {}
+        self.dispatchers = {}
+        for name in ('a', 'b'):
+            self.shards[name] = shard.Shard(name, partition, shard_values,
+                                            'b')
+            self.shards[name].resolve(self._database)
+            self.dispatchers[name] = monitor_db.Dispatcher(
+                shard=self.shards[name])
+
+    def _initialize_test(self):
+        for name in sorted(self.dispatchers):
+            self.dispatchers[name].initialize()
+
+    def _run_dispatcher(self, shard_names=('a', 'b')):
+        for _ in xrange(self._A_LOT_OF_TICKS):
+            for name in shard_names:
+                self.dispatchers[name].tick()
+
+    def _claims(self):
+        return dict((claim.host.hostname, claim.shard)
+                    for claim in models.ShardHostClaim.objects.all())
+
+    def _queue_entry(self, **create_job_args):
+        job = self._create_job(**create_job_args)
+        return job.hostqueueentry_set.all()[0]
+
+    def test_entries_run_by_their_shard(self):
+        self._initialize_test()
+        entry1 = self._queue_entry(hosts=[1])
+        entry2 = self._queue_entry(hosts=[2])
+        hostless_entry = self._queue_entry(hostless=True)
+
+        self._run_dispatcher(['b'])
+        self._check_statuses(entry1, HqeStatus.QUEUED)
+        self._check_statuses(entry2, HqeStatus.VERIFYING, HostStatus.VERIFYING)
+        self._check_entry_status(hostless_entry, HqeStatus.RUNNING)
+
+        self._run_dispatcher(['a'])
+        self._check_statuses(entry1, HqeStatus.VERIFYING, HostStatus.VERIFYING)
+        self.assertEquals({'host1': 'a', 'host2': 'b'}, self._claims())
+
+    def test_host_claimed_by_one_shard(self):
+        # drone set shards both run entries on any host
+        drone_sets = {}
+        for name in ('a', 'b'):
+            drone_sets[name] = models.DroneSet.objects.create(
+                name='set_' + name)
+        self._create_dispatcher(shard.DRONE_SET,
+                                [('a', ['set_a']), ('b', ['set_b'])])
+        self._initialize_test()
+        entries = {}
+        for name in ('a', 'b'):
+            entries[name] = self._queue_entry(hosts=[1],
+                                              drone_set=drone_sets[name])
+        # a is scheduling host1 in a concurrent tick: the host is claimed but
+        # still Ready
+        self.assert_(self.shards['a'].claim_host(self._database,
+                                                 self.hosts[0].id))
+        self._run_dispatcher(['b'])
+        self._check_statuses(entries['b'], HqeStatus.QUEUED, HostStatus.READY)
+
+        self._run_dispatcher()
+        self._check_statuses(entries['a'], HqeStatus.VERIFYING,
+                             HostStatus.VERIFYING)
+        self._check_entry_status(entries['b'], HqeStatus.QUEUED)
+        self.assertEquals({'host1': 'a'}, self._claims())
+
+    def test_claim_held_by_other_shard(self):
+        self._initialize_test()
+        self.assert_(self.shards['b'].claim_host(self._database,
+                                                 self.hosts[0].id))
+        entry = self._queue_entry(hosts=[1])
+        self._run_dispatcher(['a'])
+        self._check_statuses(entry, HqeStatus.QUEUED)
+
+        # b releases the idle host at the end of its next tick
+        self._run_dispatcher()
+        self._check_statuses(entry, HqeStatus.VERIFYING, HostStatus.VERIFYING)
+        self.assertEquals({'host1': 'a'}, self._claims())
+
+    def test_simple_job(self):
+        self._initialize_test()
+        entry = self._queue_entry(hosts=[1])
+        self._run_dispatcher()  # launches verify
+        self.mock_drone_manager.finish_process(_PidfileType.VERIFY)
+        self._run_dispatcher()  # launches job
+        self._check_statuses(entry, HqeStatus.RUNNING, HostStatus.RUNNING)
+        self.mock_drone_manager.finish_process(_PidfileType.JOB)
+        self._run_dispatcher()  # launches parsing + cleanup
+        self._check_statuses(entry, HqeStatus.PARSING, HostStatus.CLEANING)
+        self.mock_drone_manager.finish_process(_PidfileType.CLEANUP)
+        self.mock_drone_manager.finish_process(_PidfileType.PARSE)
+        self._run_dispatcher()
+        self._check_entry_status(entry, HqeStatus.ARCHIVING)
+        self.mock_drone_manager.finish_process(_PidfileType.ARCHIVE)
+        self._run_dispatcher()
+        self._check_statuses(entry, HqeStatus.COMPLETED, HostStatus.READY)
+        self.assertEquals({}, self._claims())
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -684,9 +684,16 @@ class DispatcherThrottlingTest(BaseSchedulerTest):
         self.god.stub_with(drone_manager.DroneManager, 'max_runnable_processes',
                            fake_max_runnable_processes)
 
-    def _setup_some_agents(self, num_agents):
+    def _setup_some_agents(self, num_agents, num_processes=None):
+        """
+        :param num_processes: dict mapping agent indexes to their number of
+                processes, 1 by default.
+        """
         self._agents = [DummyAgent() for i in xrange(num_agents)]
-        self._dispatcher._agents = list(self._agents)
+        for index, count in (num_processes or {}).iteritems():
+            self._agents[index].task.num_processes = count
+        for agent in self._agents:
+            self._dispatcher._agents.add(agent)
 
     def _run_a_few_cycles(self):
         for i in xrange(4):
@@ -714,8 +721,7 @@ class DispatcherThrottlingTest(BaseSchedulerTest):
         self._assert_agents_not_started([2])
 
     def test_throttle_with_synchronous(self):
-        self._setup_some_agents(2)
-        self._agents[0].task.num_processes = 3
+        self._setup_some_agents(2, num_processes={0: 3})
         self._run_a_few_cycles()
         self._assert_agents_started([0])
         self._assert_agents_not_started([1])
@@ -724,8 +730,7 @@ class DispatcherThrottlingTest(BaseSchedulerTest):
         """
         Ensure large agents don't get starved by lower-priority agents.
         """
-        self._setup_some_agents(3)
-        self._agents[1].task.num_processes = 3
+        self._setup_some_agents(3, num_processes={1: 3})
         self._run_a_few_cycles()
         self._assert_agents_started([0])
         self._assert_agents_not_started([1, 2])
@@ -736,12 +741,36 @@ class DispatcherThrottlingTest(BaseSchedulerTest):
         self._assert_agents_not_started([2])
 
     def test_zero_process_agent(self):
-        self._setup_some_agents(5)
-        self._agents[4].task.num_processes = 0
+        self._setup_some_agents(5, num_processes={4: 0})
         self._run_a_few_cycles()
         self._assert_agents_started([0, 1, 2, 4])
         self._assert_agents_not_started([3])
 
+    def test_priority_order(self):
+        self._agents = [DummyAgent() for i in xrange(4)]
+        for agent, priority in zip(self._agents, (0, 2, None, 2)):
+            self._dispatcher._agents.add(agent, priority)
+        self._dispatcher._handle_agents()
+        self._assert_agents_started([1, 2])
+        self._assert_agents_not_started([0, 3])
+        self._dispatcher._handle_agents()
+        self._assert_agents_started([3])
+        self._assert_agents_not_started([0])
+
+    def test_capacity_checked_once_per_user(self):
+        calls = []
+
+        def counting_max_runnable_processes(fake_self, username,
+                                            drone_hostnames_allowed):
+            calls.append(username)
+            return self._MAX_RUNNING
+        self.god.stub_with(drone_manager.DroneManager, 'max_runnable_processes',
+                           counting_max_runnable_processes)
+        self._setup_some_agents(3)
+        self._dispatcher._handle_agents()
+        self._assert_agents_started([0, 1])
+        self.assertEqual(['my_user'], calls)
+
 
 class PidfileRunMonitorTest(unittest.TestCase):
     execution_tag = 'test_tag'
@@ -982,7 +1011,7 @@ class JobSchedulingTest(BaseSchedulerTest):
 
         self._dispatcher._schedule_delay_tasks()
         self._dispatcher._schedule_running_host_queue_entries()
-        agent = self._dispatcher._agents[0]
+        agent = list(self._dispatcher._agents)[0]
 
         actual_status = models.HostQueueEntry.smart_get(1).status
         self.assertEquals(expected_status, actual_status)
@@ -1030,7 +1059,7 @@ class JobSchedulingTest(BaseSchedulerTest):
         self.assertEquals('Waiting', hqe.status)
         self._dispatcher._schedule_delay_tasks()
         self.assertEquals('Pending', hqe.status)
-        agent = self._dispatcher._agents[0]
+        agent = list(self._dispatcher._agents)[0]
         self.assert_(job._delay_ready_task)
         self.assert_(isinstance(agent, monitor_db.Agent))
         self.assert_(agent.task)
@@ -1130,7 +1159,7 @@ class JobSchedulingTest(BaseSchedulerTest):
 
         # Check that job run() and _finish_run() were called by the above:
         self._dispatcher._schedule_running_host_queue_entries()
-        agent = self._dispatcher._agents[0]
+        agent = list(self._dispatcher._agents)[0]
         self.assert_(agent.task)
         task = agent.task
         self.assert_(isinstance(task, monitor_db.QueueTask))
@@ -1197,11 +1226,9 @@ class JobSchedulingTest(BaseSchedulerTest):
         self.assert_(queue_entry.execution_subdir)
         self.god.check_playback()
 
-        class dummy_test_agent(object):
-            task = 'dummy_test_agent'
-        self._dispatcher._register_agent_for_ids(
-            self._dispatcher._host_agents, [queue_entry.host.id],
-            dummy_test_agent)
+        dummy_test_agent = DummyAgent()
+        dummy_test_agent.host_ids = [queue_entry.host.id]
+        self._dispatcher._agents.add(dummy_test_agent)
 
         # Attempted to schedule on a host that already has an agent.
         self.assertRaises(host_scheduler.SchedulerError,
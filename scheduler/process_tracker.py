@@ -0,0 +1,153 @@
+"""
+Process and pidfile information for DroneUtility.refresh(), read from /proc
+and the filesystem without starting any program.
+
+Running `ps` twice per scheduler cycle costs a fork and exec of ps, plus ps
+reading and formatting every process on the drone.  ProcessTracker lists
+/proc instead and remembers what it learned about every process between
+scans, so that only processes it has not seen before are looked at closely
+(owner, command line, environment).  PidfileReader likewise only reads the
+pidfiles that changed since the previous read.
+"""
+
+import os
+
+
+class ProcessTracker(object):
+
+    """
+    Lists the processes of the current user, like `ps x` would.
+
+    A process is identified by its pid, start time and command name: a pid
+    being reused or a process exec()ing another program gives a new
+    identity, which is examined again.
+
+    :param proc_dir: mount point of procfs, for testing.
+    """
+
+    def __init__(self, proc_dir='/proc'):
+        self._proc_dir = proc_dir
+        self._uid = os.geteuid()
+        # maps pid to (identity, info dict or None for foreign processes)
+        self._known = {}
+        # maps identity to the result of the dark mark check
+        self._dark_marks = {}
+
+    def _read(self, pid, name):
+        file_object = open(os.path.join(self._proc_dir, pid, name), 'rb')
+        try:
+            return file_object.read()
+        finally:
+            file_object.close()
+
+    @staticmethod
+    def _parse_stat(stat):
+        # the command name is in parentheses and may contain anything,
+        # including spaces and parentheses
+        comm_start = stat.index('(')
+        comm_end = stat.rindex(')')
+        comm = stat[comm_start + 1:comm_end]
+        # fields after the command name: state ppid pgrp session tty_nr
+        # tpgid flags minflt cminflt majflt cmajflt utime stime cutime
+        # cstime priority nice num_threads itrealvalue starttime ...
+        fields = stat[comm_end + 2:].split()
+        return comm, fields[1], fields[2], fields[19]
+
+    def _examine(self, pid, comm, ppid, pgid):
+        if os.stat(os.path.join(self._proc_dir, pid)).st_uid != self._uid:
+            return None
+        args = self._read(pid, 'cmdline').rstrip('\0').replace('\0', ' ')
+        if not args:
+            # kernel threads and zombies, ps shows them the same way
+            args = '[%s]' % comm
+        return {'pid': pid, 'pgid': pgid, 'ppid': ppid, 'comm': comm,
+                'args': args}
+
+    def scan(self):
+        """
+        :return: list of dicts with pid, pgid, ppid, comm and args keys and
+                string values, one per running process of the current user.
+        """
+        known = {}
+        processes = []
+        for pid in os.listdir(self._proc_dir):
+            if not pid.isdigit():
+                continue
+            try:
+                comm, ppid, pgid, start_time = self._parse_stat(
+                    self._read(pid, 'stat'))
+                identity = (pid, start_time, comm)
+                previous = self._known.get(pid)
+                if previous and previous[0] == identity:
+                    info = previous[1]
+                    # processes get reparented and change process group
+                    # (autoserv calls setpgrp()); the dicts are never
+                    # modified in place as callers may keep them around
+                    if info and (info['ppid'], info['pgid']) != (ppid, pgid):
+                        info = dict(info, ppid=ppid, pgid=pgid)
+                else:
+                    info = self._examine(pid, comm, ppid, pgid)
+            except (EnvironmentError, ValueError, IndexError):
+                # the process exited while we were looking at it
+                continue
+            known[pid] = (identity, info)
+            if info:
+                processes.append(info)
+        self._known = known
+        live_identities = set(entry[0] for entry in known.itervalues())
+        for identity in self._dark_marks.keys():
+            if identity not in live_identities:
+                del self._dark_marks[identity]
+        return processes
+
+    def has_dark_mark(self, info, check_function):
+        """
+        Return check_function(pid) for a process returned by the last
+        scan(), calling it only once per process.
+        """
+        entry = self._known.get(info['pid'])
+        if not entry or not entry[1]:
+            return check_function(info['pid'])
+        identity = entry[0]
+        if identity not in self._dark_marks:
+            self._dark_marks[identity] = check_function(info['pid'])
+        return self._dark_marks[identity]
+
+
+class PidfileReader(object):
+
+    """
+    Reads pidfiles, only reading again those whose modification time, size or
+    inode changed since the previous read.
+    """
+
+    def __init__(self):
+        # maps path to ((st_ino, st_size, st_mtime), contents)
+        self._cache = {}
+
+    def read(self, pidfile_paths):
+        """
+        :return: dict mapping the paths of the existing pidfiles to their
+                contents.
+        """
+        pidfiles = {}
+        cache = {}
+        for pidfile_path in pidfile_paths:
+            try:
+                stat = os.stat(pidfile_path)
+                signature = (stat.st_ino, stat.st_size, stat.st_mtime)
+                cached = self._cache.get(pidfile_path)
+                if cached and cached[0] == signature:
+                    contents = cached[1]
+                else:
+                    file_object = open(pidfile_path, 'r')
+                    try:
+                        contents = file_object.read()
+                    finally:
+                        file_object.close()
+            except EnvironmentError:
+                continue
+            cache[pidfile_path] = (signature, contents)
+            pidfiles[pidfile_path] = contents
+        self._cache = cache
+        return pidfiles
@@ -0,0 +1,150 @@
+#!/usr/bin/python
+
+"""Tests for autotest.scheduler.process_tracker."""
+
+import os
+import shutil
+import tempfile
+
+import common
+from autotest.client.shared.test_utils import unittest
+from autotest.scheduler import process_tracker
+
+
+class ProcessTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.proc_dir = tempfile.mkdtemp()
+        self.tracker = process_tracker.ProcessTracker(proc_dir=self.proc_dir)
+        self.reads = []
+        original_read = self.tracker._read
+
+        def read(pid, name):
+            self.reads.append((pid, name))
+            return original_read(pid, name)
+        self.tracker._read = read
+
+    def tearDown(self):
+        shutil.rmtree(self.proc_dir)
+
+    def _write(self, pid, name, contents):
+        path = os.path.join(self.proc_dir, str(pid))
+        if not os.path.isdir(path):
+            os.mkdir(path)
+        open(os.path.join(path, name), 'w').write(contents)
+
+    def _add_process(self, pid, comm, ppid=1, pgid=None, start_time=1000,
+                     cmdline=None):
+        if pgid is None:
+            pgid = pid
+        fields = ['S', ppid, pgid] + [0] * 16 + [start_time, 0, 0]
+        self._write(pid, 'stat', '%d (%s) %s\n' % (
+            pid, comm, ' '.join(str(field) for field in fields)))
+        if cmdline is None:
+            cmdline = [comm, '--flag']
+        self._write(pid, 'cmdline', '\0'.join(cmdline) + '\0')
+
+    def _examined(self):
+        examined = [pid for pid, name in self.reads if name == 'cmdline']
+        self.reads = []
+        return sorted(examined)
+
+    def test_scan(self):
+        self._add_process(10, 'autotest-remote', ppid=5)
+        self._add_process(11, 'with (odd) name', pgid=10, cmdline=[])
+        os.mkdir(os.path.join(self.proc_dir, 'self'))
+        processes = sorted(self.tracker.scan(), key=lambda info: info['pid'])
+        self.assertEqual(
+            [{'pid': '10', 'pgid': '10', 'ppid': '5',
+              'comm': 'autotest-remote', 'args': 'autotest-remote --flag'},
+             {'pid': '11', 'pgid': '10', 'ppid': '1',
+              'comm': 'with (odd) name', 'args': '[with (odd) name]'}],
+            processes)
+
+    def test_only_new_processes_examined(self):
+        self._add_process(10, 'parse')
+        self.tracker.scan()
+        self.assertEqual(['10'], self._examined())
+
+        self._add_process(11, 'parse')
+        self.tracker.scan()
+        self.assertEqual(['11'], self._examined())
+
+        shutil.rmtree(os.path.join(self.proc_dir, '10'))
+        self.assertEqual(['11'], [info['pid'] for info in self.tracker.scan()])
+        self.assertEqual([], self._examined())
+
+    def test_exec_and_pid_reuse(self):
+        self._add_process(10, 'python')
+        self.tracker.scan()
+        self._examined()
+
+        self._add_process(10, 'autotest-remote')
+        self.assertEqual('autotest-remote', self.tracker.scan()[0]['comm'])
+        self.assertEqual(['10'], self._examined())
+
+        self._add_process(10, 'autotest-remote', start_time=2000)
+        self.tracker.scan()
+        self.assertEqual(['10'], self._examined())
+
+    def test_group_and_parent_changes(self):
+        self._add_process(10, 'autotest-remote', ppid=5, pgid=5)
+        first = self.tracker.scan()[0]
+        self._add_process(10, 'autotest-remote', ppid=1, pgid=10)
+        second = self.tracker.scan()[0]
+        self.assertEqual(('1', '10'), (second['ppid'], second['pgid']))
+        self.assertEqual(('5', '5'), (first['ppid'], first['pgid']))
+
+    def test_has_dark_mark(self):
+        self._add_process(10, 'autotest-remote')
+        info = self.tracker.scan()[0]
+        checked = []
+
+        def check(pid):
+            checked.append(pid)
+            return True
+        self.assertTrue(self.tracker.has_dark_mark(info, check))
+        info = self.tracker.scan()[0]
+        self.assertTrue(self.tracker.has_dark_mark(info, check))
+        self.assertEqual(['10'], checked)
+
+
+class PidfileReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, '.autoserv_execute')
+        self.reader = process_tracker.PidfileReader()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_read(self):
+        missing = os.path.join(self.temp_dir, 'missing')
+        open(self.path, 'w').write('100\n')
+        self.assertEqual({self.path: '100\n'},
+                         self.reader.read([self.path, missing]))
+
+        # unchanged files are not read again
+        original_open = open
+        opened = []
+
+        def fake_open(path, mode='r'):
+            opened.append(path)
+            return original_open(path, mode)
+        process_tracker.open = fake_open
+        try:
+            self.assertEqual({self.path: '100\n'},
+                             self.reader.read([self.path]))
+            self.assertEqual([], opened)
+
+            open(self.path, 'a').write('0\n0\n')
+            self.assertEqual({self.path: '100\n0\n0\n'},
+                             self.reader.read([self.path]))
+            self.assertEqual([self.path], opened)
+        finally:
+            del process_tracker.open
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -20,6 +20,8 @@ _grid_admin_email: Autotest grid administrator email (list of emails or mailing
 _base_url: URL to the local AFE server, used to construct URLs for emails.
 _db: DatabaseConnection for this module.
 _drone_manager: reference to global DroneManager instance.
+_write_batch: WriteBatch collecting DBObject writes, None when writes go to
+        the database immediately.
 """
 
 import datetime
@@ -37,6 +39,7 @@ from autotest.database_legacy import database_connection
 from autotest.scheduler import drone_manager
 from autotest.scheduler import scheduler_config
 from autotest.frontend.afe import reservations
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
 
 _notify_email_statuses = []
 _notify_admin_email_statuses = []
@@ -45,6 +48,7 @@ _base_url = None
 
 _db = None
 _drone_manager = None
+_write_batch = None
 
 
 def initialize():
@@ -150,6 +154,157 @@ class DelayedCallTask(object):
         self.aborted = True
 
 
+class WriteBatch(object):
+
+    """
+    Unit of work for DBObject writes.
+
+    Field updates are kept per row, so that all the fields a tick changes in
+    a row are written with a single UPDATE, and inserts of rows whose id
+    nobody needs are grouped into multi-row INSERTs.  Everything is written
+    by flush(), in one transaction.
+
+    The DBObject instances are updated right away; flush() only brings the
+    database up to date with them.  Code reading rows the batch may have
+    changed must call flush_writes() first.  DBObject does, and while a batch
+    is active every Django query does too, through the cursor() method of the
+    Django connection.
+    """
+
+    def __init__(self):
+        # maps (table, row id) to a dict mapping field names to values
+        self._updates = {}
+        # keys of self._updates, in the order they were first changed
+        self._updated_rows = []
+        # maps (table, columns) to a list of value tuples
+        self._inserts = {}
+        self._insert_order = []
+        self.statements = 0
+        self.writes = 0
+
+    def is_empty(self):
+        return not self._updates and not self._inserts
+
+    def update(self, table, row_id, field, value):
+        key = (table, row_id)
+        fields = self._updates.get(key)
+        if fields is None:
+            fields = self._updates[key] = {}
+            self._updated_rows.append(key)
+        fields[field] = value
+        self.writes += 1
+
+    def insert(self, table, columns, values):
+        key = (table, tuple(columns))
+        rows = self._inserts.get(key)
+        if rows is None:
+            rows = self._inserts[key] = []
+            self._insert_order.append(key)
+        rows.append(tuple(values))
+        self.writes += 1
+
+    def _execute(self, query, parameters):
+        _db.execute(query, parameters)
+        self.statements += 1
+
+    def _write(self, updated_rows, updates, insert_order, inserts):
+        for table, row_id in updated_rows:
+            fields = updates[(table, row_id)]
+            names = sorted(fields)
+            assignments = ', '.join('%s = %%s' % name for name in names)
+            self._execute('UPDATE %s SET %s WHERE id = %%s' %
+                          (table, assignments),
+                          [fields[name] for name in names] + [row_id])
+        for table, columns in insert_order:
+            rows = inserts[(table, columns)]
+            row_placeholders = '(%s)' % ','.join(['%s'] * len(columns))
+            parameters = []
+            for row in rows:
+                parameters.extend(row)
+            self._execute('INSERT INTO %s (%s) VALUES %s' %
+                          (table, ','.join(columns),
+                           ','.join([row_placeholders] * len(rows))),
+                          parameters)
+
+    def flush(self):
+        """Write all pending changes."""
+        if self.is_empty():
+            return
+        # taken first, so that a flush the writes themselves trigger (through
+        # the Django cursor hook) finds nothing to do
+        pending = (self._updated_rows, self._updates, self._insert_order,
+                   self._inserts)
+        self._updates = {}
+        self._updated_rows = []
+        self._inserts = {}
+        self._insert_order = []
+        transaction.commit_on_success(self._write)(*pending)
+
+
+def begin_write_batch():
+    """
+    Collect DBObject writes in a WriteBatch until end_write_batch() is
+    called.  The Dispatcher does this around the scheduling phases of a tick.
+    """
+    global _write_batch
+    if _write_batch is None:
+        _write_batch = WriteBatch()
+        _hook_django_cursor()
+
+
+def flush_writes():
+    """Write the changes collected so far, if any."""
+    if _write_batch is not None:
+        _write_batch.flush()
+
+
+def end_write_batch():
+    """
+    Write the changes collected since begin_write_batch() and go back to
+    writing immediately.
+
+    :return: the WriteBatch, or None if no batch was active.
+    """
+    global _write_batch
+    batch = _write_batch
+    _write_batch = None
+    if batch is not None:
+        _unhook_django_cursor()
+        batch.flush()
+    return batch
+
+
+def _hook_django_cursor():
+    """
+    Make the Django connection flush the current batch before handing out
+    a cursor, so that ORM queries (the AFE models and the RPCs they call)
+    neither read rows the batch changed nor get overwritten by it.
+    """
+    connection = connections[DEFAULT_DB_ALIAS]
+    get_cursor = connection.cursor
+
+    def cursor():
+        flush_writes()
+        return get_cursor()
+    connection.cursor = cursor
+
+
+def _unhook_django_cursor():
+    connection = connections[DEFAULT_DB_ALIAS]
+    if 'cursor' in connection.__dict__:
+        del connection.cursor
+
+
+def _flushes_writes(method):
+    """Decorator for methods reading rows the current batch may change."""
+    def wrapper(*args, **kwargs):
+        flush_writes()
+        return method(*args, **kwargs)
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
 class DBError(Exception):
 
     """Raised by the DBObject constructor when its select fails."""
@@ -162,6 +317,9 @@ class DBObject(object):
     # Subclasses MUST override these:
     _table_name = ''
     _fields = ()
+    # Whether save() may leave new rows to the current WriteBatch, for
+    # classes whose code never uses the id of new rows.
+    _batch_inserts = False
 
     # A mapping from (type, id) to the instance of the object for that
     # particular id.  This prevents us from creating new Job() and Host()
@@ -217,6 +375,7 @@ class DBObject(object):
         """Used for testing, clear the internal instance cache."""
         cls._instances_by_type_and_id.clear()
 
+    @_flushes_writes
     def _fetch_row_from_db(self, row_id):
         """
         Fetch a row from the db representing a model
@@ -286,6 +445,7 @@ class DBObject(object):
         row = self._fetch_row_from_db(self.id)
         self._update_fields_from_row(row)
 
+    @_flushes_writes
     def count(self, where, table=None):
         if not table:
             table = self.__table
@@ -305,14 +465,23 @@ class DBObject(object):
         if getattr(self, field) == value:
             return
 
-        query = "UPDATE %s SET %s = %%s WHERE id = %%s" % (self.__table, field)
-        _db.execute(query, (value, self.id))
+        if _write_batch is not None:
+            _write_batch.update(self.__table, self.id, field, value)
+        else:
+            query = "UPDATE %s SET %s = %%s WHERE id = %%s" % (self.__table,
+                                                               field)
+            _db.execute(query, (value, self.id))
 
         setattr(self, field, value)
 
     def save(self):
         if self.__new_record:
             keys = self._fields[1:]  # avoid id
+            if self._batch_inserts and _write_batch is not None:
+                # nobody needs our id, let the batch insert us
+                _write_batch.insert(self.__table, keys,
+                                    [getattr(self, key) for key in keys])
+                return
             columns = ','.join([str(key) for key in keys])
             values = []
             for key in keys:
@@ -328,6 +497,7 @@ class DBObject(object):
             # Update our id to the one the database just assigned to us.
             self.id = _db.execute('SELECT LAST_INSERT_ID()')[0][0]
 
+    @_flushes_writes
     def delete(self):
         self._instances_by_type_and_id.pop((type(self), id), None)
         self._initialized = False
@@ -348,6 +518,7 @@ class DBObject(object):
 
         @yields One class instance for each row fetched.
         """
+        flush_writes()
         order_by = cls._prefix_with(order_by, 'ORDER BY ')
         where = cls._prefix_with(where, 'WHERE ')
         # construct field names table.field for all fields in a class
@@ -365,6 +536,7 @@ class DBObject(object):
 class IneligibleHostQueue(DBObject):
     _table_name = 'afe_ineligible_host_queues'
     _fields = ('id', 'job_id', 'host_id')
+    _batch_inserts = True
 
 
 class AtomicGroup(DBObject):
@@ -887,6 +1059,7 @@ class Job(DBObject):
     def tag(self):
         return "%s-%s" % (self.id, self.owner)
 
+    @_flushes_writes
     def get_host_queue_entries(self):
         rows = _db.execute("""
                 SELECT * FROM afe_host_queue_entries
@@ -174,6 +174,63 @@ class DBObjectTest(BaseSchedulerModelsTest):
         self.assertEqual(hqe.started_on, None)
 
 
+class WriteBatchTest(BaseSchedulerModelsTest):
+
+    def setUp(self):
+        super(WriteBatchTest, self).setUp()
+        self._create_job(hosts=[1])
+        self.entry = scheduler_models.HostQueueEntry(id=1)
+        scheduler_models.begin_write_batch()
+
+    def tearDown(self):
+        scheduler_models.end_write_batch()
+        super(WriteBatchTest, self).tearDown()
+
+    def _entry_row(self):
+        return self._database.execute(
+            'SELECT status, active, execution_subdir '
+            'FROM afe_host_queue_entries WHERE id = 1')[0]
+
+    def test_updates_coalesced(self):
+        self.entry.set_status(models.HostQueueEntry.Status.VERIFYING)
+        self.entry.set_execution_subdir('host1')
+        self.assertEqual('Verifying', self.entry.status)
+        self.assertEqual(('Queued', 0, ''), tuple(self._entry_row()))
+
+        batch = scheduler_models.end_write_batch()
+        self.assertEqual(3, batch.writes)
+        self.assertEqual(1, batch.statements)
+        self.assertEqual(('Verifying', 1, 'host1'), tuple(self._entry_row()))
+
+    def test_inserts_grouped(self):
+        self.entry.block_host(2)
+        self.entry.block_host(3)
+        batch = scheduler_models.end_write_batch()
+        self.assertEqual(1, batch.statements)
+        # host 1 was blocked by _create_job()
+        rows = self._database.execute(
+            'SELECT job_id, host_id FROM afe_ineligible_host_queues '
+            'WHERE host_id != 1 ORDER BY host_id')
+        self.assertEqual([(1, 2), (1, 3)], [tuple(row) for row in rows])
+
+    def test_reads_flush(self):
+        self.entry.set_status(models.HostQueueEntry.Status.VERIFYING)
+        entries = scheduler_models.HostQueueEntry.fetch(where='active')
+        self.assertEqual([self.entry], entries)
+        self.assertEqual('Verifying', self.entry.status)
+        self.assertEqual(1, self.entry.job.num_active())
+
+    def test_django_queries_flush(self):
+        self.entry.set_status(models.HostQueueEntry.Status.VERIFYING)
+        self.assertEqual('Verifying',
+                         models.HostQueueEntry.objects.get(id=1).status)
+        batch = scheduler_models.end_write_batch()
+        self.assertEqual(1, batch.statements)
+        self.entry.set_status(models.HostQueueEntry.Status.PENDING)
+        self.assertEqual('Pending',
+                         models.HostQueueEntry.objects.get(id=1).status)
+
+
 class HostTest(BaseSchedulerModelsTest):
 
     def test_cmp_for_sort(self):
@@ -0,0 +1,309 @@
+"""
+In-memory index of the host scheduling tables.
+
+The host scheduler needs to know, on every tick, which labels and ACLs each
+host has, which ACLs each job owner belongs to, which labels each job depends
+on and which hosts each job may not run on.  Querying all of that from scratch
+on every tick gets expensive with thousands of hosts and queue entries, so this
+module loads the tables once and afterwards only applies what changed.
+
+Changes are detected with a single signature query (row count, highest id and
+content checksum of every indexed table).  New rows are fetched by id, removed
+rows are found with an id-only scan of the affected table.  Per-job data that
+never changes after job creation (owner and dependency labels) is fetched once
+per job.  A full resync is still performed periodically as a safety net.
+"""
+
+import logging
+import time
+
+from autotest.client.shared.settings import settings
+from autotest.scheduler import scheduler_config
+
+
+def _get_sql_id_list(id_list):
+    return ','.join(str(item_id) for item_id in id_list)
+
+
+class Many2ManyTable(object):
+
+    """
+    In-memory copy of a table relating two kinds of ids.
+
+    :param table: name of the database table.
+    :param left_column: column used as key of the `forward` mapping.
+    :param right_column: column used as key of the `backward` mapping.
+    """
+
+    _CHECKSUM_FACTOR = 65537
+
+    def __init__(self, table, left_column, right_column):
+        self.table = table
+        self.left_column = left_column
+        self.right_column = right_column
+        self.clear()
+
+    def clear(self):
+        self.rows = {}
+        self.forward = {}
+        self.backward = {}
+        self._pair_counts = {}
+        self.count = 0
+        self.max_id = 0
+        self.checksum = 0
+
+    def signature_columns(self):
+        """
+        :return: SQL expressions for the row count, the highest row id and a
+                checksum of the row contents.
+        """
+        checksum = 'SUM(%s + %d * %s)' % (self.left_column,
+                                          self._CHECKSUM_FACTOR,
+                                          self.right_column)
+        return ['(SELECT COUNT(*) FROM %s)' % self.table,
+                '(SELECT MAX(id) FROM %s)' % self.table,
+                '(SELECT %s FROM %s)' % (checksum, self.table)]
+
+    def _row_checksum(self, left_id, right_id):
+        return left_id + self._CHECKSUM_FACTOR * right_id
+
+    def _add_row(self, row_id, left_id, right_id):
+        pair = (left_id, right_id)
+        self.rows[row_id] = pair
+        self.checksum += self._row_checksum(left_id, right_id)
+        self._pair_counts[pair] = self._pair_counts.get(pair, 0) + 1
+        self.forward.setdefault(left_id, set()).add(right_id)
+        self.backward.setdefault(right_id, set()).add(left_id)
+
+    def _remove_row(self, row_id):
+        pair = self.rows.pop(row_id)
+        self.checksum -= self._row_checksum(*pair)
+        self._pair_counts[pair] -= 1
+        # the same pair may be present more than once, keep it in that case
+        if self._pair_counts[pair]:
+            return
+        del self._pair_counts[pair]
+        left_id, right_id = pair
+        self.forward[left_id].discard(right_id)
+        if not self.forward[left_id]:
+            del self.forward[left_id]
+        self.backward[right_id].discard(left_id)
+        if not self.backward[right_id]:
+            del self.backward[right_id]
+
+    def _fetch_rows(self, db, min_id=None):
+        query = 'SELECT id, %s, %s FROM %s' % (self.left_column,
+                                               self.right_column, self.table)
+        if min_id is not None:
+            query += ' WHERE id > %d' % min_id
+        return [(int(row_id), int(left_id), int(right_id))
+                for row_id, left_id, right_id in db.execute(query)]
+
+    def load(self, db):
+        """
+        Load the whole table.
+
+        :return: number of rows loaded.
+        """
+        self.clear()
+        rows = self._fetch_rows(db)
+        for row_id, left_id, right_id in rows:
+            self._add_row(row_id, left_id, right_id)
+        self.count = len(self.rows)
+        self.max_id = max(self.rows.keys() or [0])
+        return len(rows)
+
+    def apply_changes(self, db, count, max_id, checksum):
+        """
+        Bring the in-memory copy up to date with the given table signature.
+
+        Rows are never updated in place by the frontend, only inserted and
+        deleted.  Should the table still not match the signature after
+        applying inserted and deleted rows (e.g. a row id got reused), it is
+        reloaded.
+
+        :param count: current number of rows in the table.
+        :param max_id: current highest row id in the table (or None).
+        :param checksum: current checksum of the table (or None).
+        :return: number of rows added, removed or reloaded.
+        """
+        max_id = int(max_id or 0)
+        count = int(count)
+        checksum = int(checksum or 0)
+        if (count == self.count and max_id == self.max_id and
+                checksum == self.checksum):
+            return 0
+
+        changed = 0
+        if max_id > self.max_id:
+            for row_id, left_id, right_id in self._fetch_rows(db, self.max_id):
+                self._add_row(row_id, left_id, right_id)
+                changed += 1
+        if len(self.rows) != count:
+            # some rows were deleted, find out which ones
+            current_ids = set(int(row[0]) for row in
+                              db.execute('SELECT id FROM %s' % self.table))
+            for row_id in set(self.rows).difference(current_ids):
+                self._remove_row(row_id)
+                changed += 1
+        self.count = count
+        self.max_id = max_id
+        if self.checksum != checksum:
+            logging.warning('Scheduling index of %s out of sync, reloading',
+                            self.table)
+            changed += self.load(db)
+        return changed
+
+
+class SchedulingIndex(object):
+
+    """
+    Keeps the host scheduling tables in memory between scheduler ticks.
+
+    Users call refresh() once per tick with the ids of the jobs having pending
+    queue entries and then use the lookup methods.
+
+    :param db: DatabaseConnection used to query the AFE database.
+    :param resync_interval_secs: seconds between two full reloads of the
+            index, defaults to the scheduling_index_resync_minutes setting.
+    :param now_func: time.time like function, used for testing.
+    """
+
+    def __init__(self, db, resync_interval_secs=None, now_func=time.time):
+        self._db = db
+        if resync_interval_secs is None:
+            resync_interval_secs = 60 * settings.get_value(
+                scheduler_config.CONFIG_SECTION,
+                'scheduling_index_resync_minutes', type=int, default=10)
+        self._resync_interval_secs = resync_interval_secs
+        self._now_func = now_func
+        self._last_full_refresh = None
+
+        self._host_labels = Many2ManyTable('afe_hosts_labels',
+                                           'host_id', 'label_id')
+        self._host_acls = Many2ManyTable('afe_acl_groups_hosts',
+                                         'host_id', 'aclgroup_id')
+        self._user_acls = Many2ManyTable('afe_acl_groups_users',
+                                         'user_id', 'aclgroup_id')
+        self._ineligible_hosts = Many2ManyTable('afe_ineligible_host_queues',
+                                                'job_id', 'host_id')
+        self._tables = (self._host_labels, self._host_acls, self._user_acls,
+                        self._ineligible_hosts)
+
+        # job_id -> user id of the job owner, job_id -> set of label ids.
+        # Neither changes once a job has been created.
+        self._job_owners = {}
+        self._job_dependencies = {}
+
+        self.stats = {'full_refreshes': 0,
+                      'full_refresh_secs': 0.0,
+                      'delta_refreshes': 0,
+                      'delta_refresh_secs': 0.0,
+                      'delta_rows': 0}
+
+    def _needs_full_refresh(self):
+        if self._last_full_refresh is None:
+            return True
+        elapsed = self._now_func() - self._last_full_refresh
+        return elapsed >= self._resync_interval_secs
+
+    def force_full_refresh(self):
+        """Make the next refresh() reload everything from the database."""
+        self._last_full_refresh = None
+
+    def _full_refresh(self):
+        rows = 0
+        for table in self._tables:
+            rows += table.load(self._db)
+        self._job_owners.clear()
+        self._job_dependencies.clear()
+        self._last_full_refresh = self._now_func()
+        return rows
+
+    def _delta_refresh(self):
+        columns = []
+        for table in self._tables:
+            columns.extend(table.signature_columns())
+        signature_query = 'SELECT ' + ', '.join(columns)
+        signature_row = self._db.execute(signature_query)[0]
+        changed = 0
+        for i, table in enumerate(self._tables):
+            count, max_id, checksum = signature_row[3 * i:3 * i + 3]
+            changed += table.apply_changes(self._db, count, max_id, checksum)
+        return changed
+
+    def _load_job_data(self, job_ids):
+        new_job_ids = [job_id for job_id in job_ids
+                       if job_id not in self._job_dependencies]
+        if not new_job_ids:
+            return 0
+        id_list = _get_sql_id_list(new_job_ids)
+        for job_id in new_job_ids:
+            self._job_dependencies[job_id] = set()
+        rows = self._db.execute("""
+            SELECT job_id, label_id
+            FROM afe_jobs_dependency_labels
+            WHERE job_id IN (%s)
+            """ % id_list)
+        for job_id, label_id in rows:
+            self._job_dependencies[int(job_id)].add(int(label_id))
+        owner_rows = self._db.execute("""
+            SELECT afe_jobs.id, afe_users.id
+            FROM afe_jobs
+            INNER JOIN afe_users ON afe_users.login = afe_jobs.owner
+            WHERE afe_jobs.id IN (%s)
+            """ % id_list)
+        for job_id, user_id in owner_rows:
+            self._job_owners[int(job_id)] = int(user_id)
+        return len(rows) + len(owner_rows)
+
+    def _forget_jobs_except(self, job_ids):
+        for job_id in set(self._job_dependencies).difference(job_ids):
+            del self._job_dependencies[job_id]
+            self._job_owners.pop(job_id, None)
+
+    def refresh(self, job_ids):
+        """
+        Bring the index up to date.
+
+        :param job_ids: ids of the jobs that will be looked up until the next
+                refresh.  Data of other jobs is dropped.
+        """
+        job_ids = set(job_ids)
+        start_time = time.time()
+        if self._needs_full_refresh():
+            rows = self._full_refresh()
+            rows += self._load_job_data(job_ids)
+            elapsed = time.time() - start_time
+            self.stats['full_refreshes'] += 1
+            self.stats['full_refresh_secs'] += elapsed
+            logging.info('Scheduling index fully reloaded (%d rows) in %.3fs',
+                         rows, elapsed)
+        else:
+            self._forget_jobs_except(job_ids)
+            rows = self._delta_refresh() + self._load_job_data(job_ids)
+            self.stats['delta_refreshes'] += 1
+            self.stats['delta_refresh_secs'] += time.time() - start_time
+            self.stats['delta_rows'] += rows
+
+    def labels_for_host(self, host_id):
+        return self._host_labels.forward.get(host_id, set())
+
+    def hosts_in_label(self, label_id):
+        return self._host_labels.backward.get(label_id, set())
+
+    def acls_for_host(self, host_id):
+        return self._host_acls.forward.get(host_id, set())
+
+    def hosts_in_acl(self, acl_id):
+        return self._host_acls.backward.get(acl_id, set())
+
+    def acls_for_job(self, job_id):
+        owner = self._job_owners.get(job_id)
+        return self._user_acls.forward.get(owner, set())
+
+    def dependencies_for_job(self, job_id):
+        return self._job_dependencies.get(job_id, set())
+
+    def ineligible_hosts_for_job(self, job_id):
+        return self._ineligible_hosts.forward.get(job_id, set())
@@ -0,0 +1,145 @@
+#!/usr/bin/python
+
+"""Tests for autotest.scheduler.scheduling_index."""
+
+import common
+from autotest.client.shared.test_utils import unittest
+from autotest.database_legacy import database_connection
+from autotest.scheduler import scheduling_index
+
+_SCHEMA = (
+    'CREATE TABLE afe_users (id INTEGER PRIMARY KEY, login VARCHAR(255))',
+    'CREATE TABLE afe_jobs (id INTEGER PRIMARY KEY, owner VARCHAR(255))',
+    'CREATE TABLE afe_hosts_labels (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+    'host_id INTEGER, label_id INTEGER)',
+    'CREATE TABLE afe_acl_groups_hosts (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+    'aclgroup_id INTEGER, host_id INTEGER)',
+    'CREATE TABLE afe_acl_groups_users (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+    'aclgroup_id INTEGER, user_id INTEGER)',
+    'CREATE TABLE afe_ineligible_host_queues '
+    '(id INTEGER PRIMARY KEY AUTOINCREMENT, job_id INTEGER, host_id INTEGER)',
+    'CREATE TABLE afe_jobs_dependency_labels '
+    '(id INTEGER PRIMARY KEY AUTOINCREMENT, job_id INTEGER, label_id INTEGER)',
+)
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class SchedulingIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = database_connection.DatabaseConnection.get_test_database()
+        for statement in _SCHEMA:
+            self.db.execute(statement)
+        self.db.execute("INSERT INTO afe_users VALUES (1, 'alice')")
+        self.db.execute("INSERT INTO afe_jobs VALUES (10, 'alice')")
+        self.db.execute('INSERT INTO afe_acl_groups_users (aclgroup_id, '
+                        'user_id) VALUES (100, 1)')
+        self.db.execute('INSERT INTO afe_jobs_dependency_labels (job_id, '
+                        'label_id) VALUES (10, 5)')
+        for host_id, label_id in ((1, 5), (2, 5), (2, 6)):
+            self._add_label(host_id, label_id)
+        self.clock = FakeClock()
+        self.index = scheduling_index.SchedulingIndex(
+            self.db, resync_interval_secs=60, now_func=self.clock)
+
+    def tearDown(self):
+        self.db.disconnect()
+
+    def _add_label(self, host_id, label_id):
+        self.db.execute('INSERT INTO afe_hosts_labels (host_id, label_id) '
+                        'VALUES (%d, %d)' % (host_id, label_id))
+
+    def test_initial_load(self):
+        self.index.refresh([10])
+        self.assertEqual(set([1, 2]), self.index.hosts_in_label(5))
+        self.assertEqual(set([5, 6]), self.index.labels_for_host(2))
+        self.assertEqual(set([100]), self.index.acls_for_job(10))
+        self.assertEqual(set([5]), self.index.dependencies_for_job(10))
+        self.assertEqual(set(), self.index.ineligible_hosts_for_job(10))
+        self.assertEqual(1, self.index.stats['full_refreshes'])
+        self.assertEqual(0, self.index.stats['delta_refreshes'])
+
+    def test_unchanged_refresh_is_delta(self):
+        self.index.refresh([10])
+        self.index.refresh([10])
+        self.assertEqual(1, self.index.stats['full_refreshes'])
+        self.assertEqual(1, self.index.stats['delta_refreshes'])
+        self.assertEqual(0, self.index.stats['delta_rows'])
+
+    def test_inserted_rows_are_applied(self):
+        self.index.refresh([10])
+        self._add_label(3, 5)
+        self.db.execute('INSERT INTO afe_ineligible_host_queues (job_id, '
+                        'host_id) VALUES (10, 1)')
+        self.index.refresh([10])
+        self.assertEqual(set([1, 2, 3]), self.index.hosts_in_label(5))
+        self.assertEqual(set([1]), self.index.ineligible_hosts_for_job(10))
+        self.assertEqual(2, self.index.stats['delta_rows'])
+
+    def test_deleted_rows_are_applied(self):
+        self.index.refresh([10])
+        self.db.execute('DELETE FROM afe_hosts_labels WHERE host_id = 2 AND '
+                        'label_id = 6')
+        self._add_label(4, 7)
+        self.index.refresh([10])
+        self.assertEqual(set([5]), self.index.labels_for_host(2))
+        self.assertEqual(set(), self.index.hosts_in_label(6))
+        self.assertEqual(set([4]), self.index.hosts_in_label(7))
+
+    def test_duplicate_pairs(self):
+        self._add_label(1, 5)
+        self.index.refresh([10])
+        self.db.execute('DELETE FROM afe_hosts_labels WHERE id = 1')
+        self.index.refresh([10])
+        self.assertEqual(set([5]), self.index.labels_for_host(1))
+
+    def test_reused_row_id_reloads_table(self):
+        self.index.refresh([10])
+        self.db.execute('UPDATE afe_hosts_labels SET label_id = 8 '
+                        'WHERE id = 3')
+        self.index.refresh([10])
+        self.assertEqual(set([5, 8]), self.index.labels_for_host(2))
+        self.assertEqual(set(), self.index.hosts_in_label(6))
+
+    def test_acl_membership_change(self):
+        self.index.refresh([10])
+        self.db.execute('INSERT INTO afe_acl_groups_users (aclgroup_id, '
+                        'user_id) VALUES (101, 1)')
+        self.index.refresh([10])
+        self.assertEqual(set([100, 101]), self.index.acls_for_job(10))
+
+    def test_job_data_loaded_once(self):
+        self.index.refresh([10])
+        self.db.execute('DELETE FROM afe_jobs_dependency_labels')
+        self.index.refresh([10])
+        self.assertEqual(set([5]), self.index.dependencies_for_job(10))
+
+    def test_unknown_jobs_are_dropped(self):
+        self.index.refresh([10])
+        self.index.refresh([])
+        self.assertEqual(set(), self.index.dependencies_for_job(10))
+        self.assertEqual(set(), self.index.acls_for_job(10))
+
+    def test_periodic_full_refresh(self):
+        self.index.refresh([10])
+        self.clock.now = 61
+        self.index.refresh([10])
+        self.assertEqual(2, self.index.stats['full_refreshes'])
+
+    def test_force_full_refresh(self):
+        self.index.refresh([10])
+        self.index.force_full_refresh()
+        self.index.refresh([10])
+        self.assertEqual(2, self.index.stats['full_refreshes'])
+
+
+if __name__ == '__main__':
+    unittest.main()
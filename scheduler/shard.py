@@ -0,0 +1,301 @@
+"""
+Sharded scheduler deployments.
+
+A scheduler process runs on a single core.  In a sharded deployment several
+scheduler processes (monitor_db --shard=<name>) share the AFE database, each
+of them owning a partition of the hosts and host queue entries, keyed by
+drone set or by host label (the shard_partition setting):
+
+ * drone_set: a shard runs the entries of the jobs of its drone sets, on any
+   host.
+ * label: a shard runs the metahost entries for its labels and the entries
+   of the hosts with its labels.  A host with the labels of several shards
+   belongs to the first of them in the shards setting.
+
+One shard is the coordinator.  It runs the hostless jobs, the entries that
+no other shard owns (jobs without a drone set, hosts without a shard label),
+the recurring runs and the periodic cleanups.  The entries of a job are
+expected to stay in one shard; synchronous jobs over hosts of several label
+shards are not supported.
+
+Before giving a host to an entry or a special task a shard claims it with a
+row of afe_shard_host_claims, whose host column is unique, so that two shards
+never use the same host even when their partitions overlap, as drone set
+shards do.  Claims are released once the host has no active entry, no
+pending special task and no agent of the shard left.
+
+Every shard needs drones of its own (shard_<name>_drones), as a scheduler
+kills the autoserv processes it doesn't know about on its drones.
+"""
+
+import datetime
+import logging
+import re
+
+from autotest.client.shared.settings import settings
+from autotest.scheduler import scheduler_config
+
+DRONE_SET = 'drone_set'
+LABEL = 'label'
+PARTITIONS = (DRONE_SET, LABEL)
+
+CLAIMS_TABLE = 'afe_shard_host_claims'
+
+# first status server port of the shards, see StatusServer
+_BASE_STATUS_PORT = 13468
+
+_NAME_RE = re.compile(r'^\w+$')
+
+
+class ShardError(Exception):
+
+    """Raised on an inconsistent shard configuration."""
+
+
+def _id_list(ids):
+    return ', '.join(str(int(object_id)) for object_id in ids)
+
+
+def _in_query(column, query):
+    # comparisons with NULL are neither true nor false, which would break the
+    # NOTs of the conditions below
+    return '(%s IS NOT NULL AND %s IN (%s))' % (column, column, query)
+
+
+def _in_ids(column, ids):
+    if not ids:
+        return '(0 = 1)'
+    return _in_query(column, _id_list(ids))
+
+
+def _any(conditions):
+    if not conditions:
+        return '(0 = 1)'
+    return '(%s)' % ' OR '.join(conditions)
+
+
+class Shard(object):
+
+    """
+    The partition of the hosts and queue entries of one scheduler process.
+
+    The conditions returned by the *_where() methods are SQL fragments to add
+    to the queries of the scheduler.  They are only available once resolve()
+    translated the drone set or label names to ids.
+
+    :param name: name of this shard.
+    :param partition: DRONE_SET or LABEL.
+    :param shard_values: list of (shard name, list of drone set or label
+            names) for all shards, in the order of the shards setting.
+    :param coordinator: name of the coordinator shard.
+    :param drones: hostnames of the drones of this shard.
+    :param status_port: port of the status server of this shard.
+    """
+
+    def __init__(self, name, partition, shard_values, coordinator,
+                 drones=(), status_port=None):
+        shard_names = [shard_name for shard_name, _ in shard_values]
+        for shard_name in shard_names:
+            if not _NAME_RE.match(shard_name):
+                raise ShardError('Invalid shard name %r' % shard_name)
+        if name not in shard_names:
+            raise ShardError('Unknown shard %s, shards are: %s'
+                             % (name, ', '.join(shard_names)))
+        if coordinator not in shard_names:
+            raise ShardError('The coordinator shard must be one of: %s'
+                             % ', '.join(shard_names))
+        if partition not in PARTITIONS:
+            raise ShardError('Invalid shard partition %r, should be one of %s'
+                             % (partition, ', '.join(PARTITIONS)))
+        seen_values = {}
+        for shard_name, values in shard_values:
+            for value in values:
+                if value in seen_values:
+                    raise ShardError('%s %s is in shards %s and %s'
+                                     % (partition, value, seen_values[value],
+                                        shard_name))
+                seen_values[value] = shard_name
+
+        self.name = name
+        self.partition = partition
+        self.is_coordinator = (name == coordinator)
+        self.drones = list(drones)
+        if status_port is None:
+            status_port = _BASE_STATUS_PORT + shard_names.index(name)
+        self.status_port = status_port
+        self._shard_values = [(shard_name, list(values))
+                              for shard_name, values in shard_values
+                              if shard_name != coordinator]
+        # list of (shard name, ids) of the shards other than the
+        # coordinator, see resolve()
+        self._partitions = None
+
+    @classmethod
+    def from_settings(cls, name):
+        def get_value(key, **kwargs):
+            return settings.get_value(scheduler_config.CONFIG_SECTION, key,
+                                      **kwargs)
+
+        def get_list(key):
+            return [value.strip() for value in
+                    get_value(key, default='').split(',') if value.strip()]
+
+        shard_values = [(shard_name, get_list('shard_%s_values' % shard_name))
+                        for shard_name in get_list('shards')]
+        drones = get_list('shard_%s_drones' % name)
+        if not drones:
+            raise ShardError('No drones for shard %s, set shard_%s_drones'
+                             % (name, name))
+        return cls(name, get_value('shard_partition', default=DRONE_SET),
+                   shard_values, get_value('shard_coordinator', default=''),
+                   drones=drones,
+                   status_port=get_value('shard_%s_status_port' % name,
+                                         type=int, default=None))
+
+    def resolve(self, db):
+        """Look up the ids of the drone sets or labels of the shards."""
+        table = {DRONE_SET: 'afe_drone_sets', LABEL: 'afe_labels'}
+        rows = db.execute('SELECT id, name FROM %s' % table[self.partition])
+        ids_by_name = dict((row[1], row[0]) for row in rows)
+        partitions = []
+        for shard_name, values in self._shard_values:
+            missing = [value for value in values if value not in ids_by_name]
+            if missing:
+                raise ShardError('Unknown %s for shard %s: %s'
+                                 % (self.partition, shard_name,
+                                    ', '.join(missing)))
+            partitions.append((shard_name,
+                               sorted(ids_by_name[value] for value in values)))
+        self._partitions = partitions
+        logging.info('Scheduler shard %s, partitions by %s: %s%s', self.name,
+                     self.partition, partitions,
+                     self.is_coordinator and ' (coordinator)' or '')
+
+    def _mine(self, conditions):
+        """
+        :param conditions: one condition per shard of self._partitions.
+        :return: the condition of this shard, the coordinator owning what no
+                other shard owns.
+        """
+        if self.is_coordinator:
+            return '(NOT %s)' % _any(conditions)
+        names = [shard_name for shard_name, _ in self._partitions]
+        return conditions[names.index(self.name)]
+
+    @staticmethod
+    def _host_has_label(column, label_ids):
+        if not label_ids:
+            return '(0 = 1)'
+        return _in_query(column, 'SELECT host_id FROM afe_hosts_labels '
+                                 'WHERE label_id IN (%s)' % _id_list(label_ids))
+
+    def _host_conditions(self, column):
+        conditions = []
+        for index, (_, label_ids) in enumerate(self._partitions):
+            condition = [self._host_has_label(column, label_ids)]
+            for _, earlier_ids in self._partitions[:index]:
+                condition.append(
+                    'NOT ' + self._host_has_label(column, earlier_ids))
+            conditions.append('(%s)' % ' AND '.join(condition))
+        return conditions
+
+    def _claimed(self, column, by_this_shard):
+        operator = by_this_shard and '=' or '<>'
+        return _in_query(column, "SELECT host_id FROM %s WHERE shard %s '%s'"
+                         % (CLAIMS_TABLE, operator, self.name))
+
+    def queue_entry_where(self):
+        """:return: condition on afe_host_queue_entries."""
+        conditions = []
+        if self.partition == LABEL:
+            host_conditions = self._host_conditions(
+                'afe_host_queue_entries.host_id')
+            for (_, label_ids), host_condition in zip(self._partitions,
+                                                      host_conditions):
+                conditions.append(
+                    '(%s OR (afe_host_queue_entries.meta_host IS NULL AND %s))'
+                    % (_in_ids('afe_host_queue_entries.meta_host', label_ids),
+                       host_condition))
+        else:
+            hostless = ('(afe_host_queue_entries.host_id IS NULL AND '
+                        'afe_host_queue_entries.meta_host IS NULL AND '
+                        'afe_host_queue_entries.atomic_group_id IS NULL)')
+            for _, drone_set_ids in self._partitions:
+                if not drone_set_ids:
+                    conditions.append('(0 = 1)')
+                    continue
+                conditions.append('(NOT %s AND %s)' % (hostless, _in_query(
+                    'afe_host_queue_entries.job_id',
+                    'SELECT id FROM afe_jobs WHERE drone_set_id IN (%s)'
+                    % _id_list(drone_set_ids))))
+        return self._mine(conditions)
+
+    def schedulable_hosts_where(self, column='afe_hosts.id'):
+        """:return: condition on the hosts this shard may assign to entries."""
+        condition = 'NOT ' + self._claimed(column, by_this_shard=False)
+        if self.partition == LABEL:
+            condition = '(%s AND %s)' % (
+                condition, self._mine(self._host_conditions(column)))
+        return condition
+
+    def managed_hosts_where(self, column='afe_hosts.id'):
+        """
+        :return: condition on the hosts whose special tasks not tied to a
+                queue entry this shard runs.
+        """
+        if self.partition == LABEL:
+            return self._mine(self._host_conditions(column))
+        claimed_here = self._claimed(column, by_this_shard=True)
+        if not self.is_coordinator:
+            return claimed_here
+        return '(%s OR NOT %s)' % (
+            claimed_here,
+            _in_query(column, 'SELECT host_id FROM %s' % CLAIMS_TABLE))
+
+    def special_task_where(self):
+        """:return: condition on afe_special_tasks."""
+        return ('((afe_special_tasks.queue_entry_id IS NOT NULL AND '
+                'afe_special_tasks.queue_entry_id IN '
+                '(SELECT id FROM afe_host_queue_entries WHERE %s)) OR '
+                '(afe_special_tasks.queue_entry_id IS NULL AND %s))'
+                % (self.queue_entry_where(),
+                   self.managed_hosts_where('afe_special_tasks.host_id')))
+
+    def claim_host(self, db, host_id):
+        """
+        :return: True if this shard holds the claim on the host, possibly
+                from before.
+        """
+        try:
+            db.execute('INSERT INTO %s (host_id, shard, claimed_on) '
+                       'VALUES (%%s, %%s, %%s)' % CLAIMS_TABLE,
+                       (host_id, self.name, datetime.datetime.now()))
+        except db.DatabaseError:
+            # the host is already claimed, maybe by this shard
+            pass
+        rows = db.execute('SELECT shard FROM %s WHERE host_id = %%s'
+                          % CLAIMS_TABLE, (host_id,))
+        return bool(rows) and rows[0][0] == self.name
+
+    def release_hosts(self, db, host_ids):
+        if not host_ids:
+            return
+        db.execute("DELETE FROM %s WHERE shard = '%s' AND host_id IN (%s)"
+                   % (CLAIMS_TABLE, self.name, _id_list(host_ids)))
+
+    def release_idle_hosts(self, db, busy_host_ids=()):
+        """
+        Release the claims on the hosts without active queue entry or pending
+        special task.
+
+        :param busy_host_ids: ids of the hosts with agents of this shard.
+        """
+        where = ["shard = '%s'" % self.name,
+                 'host_id NOT IN (SELECT host_id FROM afe_host_queue_entries '
+                 'WHERE active AND host_id IS NOT NULL)',
+                 'host_id NOT IN (SELECT host_id FROM afe_special_tasks '
+                 'WHERE NOT is_complete)']
+        if busy_host_ids:
+            where.append('host_id NOT IN (%s)' % _id_list(busy_host_ids))
+        db.execute('DELETE FROM %s WHERE %s'
+                   % (CLAIMS_TABLE, ' AND '.join(where)))
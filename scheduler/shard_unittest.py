@@ -0,0 +1,190 @@
+#!/usr/bin/python
+
+"""Tests for autotest.scheduler.shard."""
+
+import common
+from autotest.client.shared.test_utils import unittest
+from autotest.database_legacy import database_connection
+from autotest.scheduler import shard
+
+_SCHEMA = (
+    'CREATE TABLE afe_labels (id INTEGER PRIMARY KEY, name VARCHAR(255))',
+    'CREATE TABLE afe_drone_sets (id INTEGER PRIMARY KEY, name VARCHAR(255))',
+    'CREATE TABLE afe_hosts (id INTEGER PRIMARY KEY)',
+    'CREATE TABLE afe_hosts_labels (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+    'host_id INTEGER, label_id INTEGER)',
+    'CREATE TABLE afe_jobs (id INTEGER PRIMARY KEY, drone_set_id INTEGER)',
+    'CREATE TABLE afe_host_queue_entries (id INTEGER PRIMARY KEY, '
+    'job_id INTEGER, host_id INTEGER, meta_host INTEGER, '
+    'atomic_group_id INTEGER, active BOOLEAN DEFAULT 0)',
+    'CREATE TABLE afe_special_tasks (id INTEGER PRIMARY KEY, '
+    'host_id INTEGER, queue_entry_id INTEGER, is_complete BOOLEAN DEFAULT 0)',
+    'CREATE TABLE afe_shard_host_claims (id INTEGER PRIMARY KEY '
+    'AUTOINCREMENT, host_id INTEGER UNIQUE, shard VARCHAR(255), '
+    'claimed_on DATETIME)',
+)
+
+_SHARD_VALUES = [('a', ['a1', 'a2']), ('b', ['b1']), ('c', [])]
+
+
+class ShardConfigTest(unittest.TestCase):
+
+    def test_invalid_configurations(self):
+        self.assertRaises(shard.ShardError, shard.Shard, 'x', shard.LABEL,
+                          _SHARD_VALUES, 'c')
+        self.assertRaises(shard.ShardError, shard.Shard, 'a', shard.LABEL,
+                          _SHARD_VALUES, 'x')
+        self.assertRaises(shard.ShardError, shard.Shard, 'a', 'platform',
+                          _SHARD_VALUES, 'c')
+        self.assertRaises(shard.ShardError, shard.Shard, 'a', shard.LABEL,
+                          [('a', ['a1']), ('b', ['a1'])], 'b')
+        self.assertRaises(shard.ShardError, shard.Shard, 'a b', shard.LABEL,
+                          [('a b', [])], 'a b')
+
+    def test_status_ports(self):
+        ports = [shard.Shard(name, shard.LABEL, _SHARD_VALUES, 'c').status_port
+                 for name in ('a', 'b', 'c')]
+        self.assertEqual(3, len(set(ports)))
+
+
+class ShardTestBase(unittest.TestCase):
+
+    def setUp(self):
+        self.db = database_connection.DatabaseConnection.get_test_database()
+        for statement in _SCHEMA:
+            self.db.execute(statement)
+        for table in ('afe_labels', 'afe_drone_sets'):
+            for object_id, name in ((1, 'a1'), (2, 'a2'), (3, 'b1'),
+                                    (4, 'other')):
+                self.db.execute('INSERT INTO %s VALUES (%%s, %%s)' % table,
+                                (object_id, name))
+        for host_id in xrange(1, 6):
+            self.db.execute('INSERT INTO afe_hosts VALUES (%s)', (host_id,))
+
+    def tearDown(self):
+        self.db.disconnect()
+
+    def _shards(self, partition):
+        shards = {}
+        for name in ('a', 'b', 'c'):
+            shards[name] = shard.Shard(name, partition, _SHARD_VALUES, 'c')
+            shards[name].resolve(self.db)
+        return shards
+
+    def _add_entry(self, entry_id, job_id=1, host_id=None, meta_host=None,
+                   atomic_group_id=None, active=False):
+        self.db.execute('INSERT INTO afe_host_queue_entries VALUES '
+                        '(%s, %s, %s, %s, %s, %s)',
+                        (entry_id, job_id, host_id, meta_host,
+                         atomic_group_id, int(active)))
+
+    def _ids(self, table, where):
+        return set(row[0] for row in self.db.execute(
+            'SELECT id FROM %s WHERE %s' % (table, where)))
+
+    def _entries(self, shards):
+        return dict((name, self._ids('afe_host_queue_entries',
+                                     shards[name].queue_entry_where()))
+                    for name in shards)
+
+
+class LabelShardTest(ShardTestBase):
+
+    def setUp(self):
+        super(LabelShardTest, self).setUp()
+        # host 3 has labels of shards a and b, host 4 of no shard
+        for host_id, label_id in ((1, 1), (2, 3), (3, 3), (3, 2), (4, 4)):
+            self.db.execute('INSERT INTO afe_hosts_labels (host_id, label_id) '
+                            'VALUES (%s, %s)', (host_id, label_id))
+        self.shards = self._shards(shard.LABEL)
+
+    def test_entries(self):
+        self._add_entry(1, host_id=1)
+        self._add_entry(2, host_id=2)
+        self._add_entry(3, host_id=3)
+        self._add_entry(4, host_id=4)
+        self._add_entry(5, meta_host=3)
+        self._add_entry(6)
+        # metahost entries follow their label, not the host they got
+        self._add_entry(7, meta_host=1, host_id=2)
+        self._add_entry(8, meta_host=4)
+        self._add_entry(9, atomic_group_id=1)
+        self.assertEqual({'a': set([1, 3, 7]), 'b': set([2, 5]),
+                          'c': set([4, 6, 8, 9])},
+                         self._entries(self.shards))
+
+    def test_hosts(self):
+        self.assertEqual(set([1, 3]), self._ids(
+            'afe_hosts', self.shards['a'].schedulable_hosts_where()))
+        self.assertEqual(set([2]), self._ids(
+            'afe_hosts', self.shards['b'].managed_hosts_where()))
+        self.assertEqual(set([4, 5]), self._ids(
+            'afe_hosts', self.shards['c'].schedulable_hosts_where()))
+
+
+class DroneSetShardTest(ShardTestBase):
+
+    def setUp(self):
+        super(DroneSetShardTest, self).setUp()
+        for job_id, drone_set_id in ((1, 1), (2, 3), (3, None), (4, 4)):
+            self.db.execute('INSERT INTO afe_jobs VALUES (%s, %s)',
+                            (job_id, drone_set_id))
+        self.shards = self._shards(shard.DRONE_SET)
+
+    def test_entries(self):
+        self._add_entry(1, job_id=1, host_id=1)
+        self._add_entry(2, job_id=2, meta_host=1)
+        self._add_entry(3, job_id=3, host_id=1)
+        self._add_entry(4, job_id=4, atomic_group_id=1)
+        # hostless entries are run by the coordinator
+        self._add_entry(5, job_id=1)
+        self.assertEqual({'a': set([1]), 'b': set([2]), 'c': set([3, 4, 5])},
+                         self._entries(self.shards))
+
+    def test_claims(self):
+        shard_a, shard_b = self.shards['a'], self.shards['b']
+        self.assertTrue(shard_a.claim_host(self.db, 1))
+        self.assertTrue(shard_a.claim_host(self.db, 1))
+        self.assertFalse(shard_b.claim_host(self.db, 1))
+        self.assertEqual(set([2, 3, 4, 5]), self._ids(
+            'afe_hosts', shard_b.schedulable_hosts_where()))
+        self.assertEqual(set([1]), self._ids(
+            'afe_hosts', shard_a.managed_hosts_where()))
+        self.assertEqual(set([2, 3, 4, 5]), self._ids(
+            'afe_hosts', self.shards['c'].managed_hosts_where()))
+
+        # busy hosts stay claimed
+        self._add_entry(1, job_id=1, host_id=1, active=True)
+        shard_a.release_idle_hosts(self.db)
+        self.assertFalse(shard_b.claim_host(self.db, 1))
+        self.db.execute('UPDATE afe_host_queue_entries SET active = 0')
+        self.db.execute('INSERT INTO afe_special_tasks (host_id) VALUES (1)')
+        shard_a.release_idle_hosts(self.db)
+        self.assertFalse(shard_b.claim_host(self.db, 1))
+        self.db.execute('UPDATE afe_special_tasks SET is_complete = 1')
+        shard_a.release_idle_hosts(self.db, busy_host_ids=[1])
+        self.assertFalse(shard_b.claim_host(self.db, 1))
+
+        shard_a.release_idle_hosts(self.db)
+        self.assertTrue(shard_b.claim_host(self.db, 1))
+        shard_b.release_hosts(self.db, [1])
+        self.assertTrue(shard_a.claim_host(self.db, 1))
+
+    def test_special_tasks(self):
+        self._add_entry(1, job_id=1, host_id=1)
+        self._add_entry(2, job_id=2, host_id=2)
+        for task_id, host_id, entry_id in ((1, 1, 1), (2, 2, 2), (3, 3, None),
+                                           (4, 4, None)):
+            self.db.execute('INSERT INTO afe_special_tasks (id, host_id, '
+                            'queue_entry_id) VALUES (%s, %s, %s)',
+                            (task_id, host_id, entry_id))
+        self.shards['b'].claim_host(self.db, 3)
+        tasks = dict((name, self._ids('afe_special_tasks',
+                                      self.shards[name].special_task_where()))
+                     for name in self.shards)
+        self.assertEqual({'a': set([1]), 'b': set([2, 3]), 'c': set([4])},
+                         tasks)
+
+
+if __name__ == '__main__':
+    unittest.main()
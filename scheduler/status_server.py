@@ -4,11 +4,15 @@ import threading
 import urllib
 import fcntl
 import logging
+try:
+    import json
+except ImportError:
+    from autotest.client.shared.backports import simplejson as json
 try:
     import autotest.common as common
 except ImportError:
     import common
-from autotest.scheduler import drone_manager, scheduler_config
+from autotest.scheduler import drone_manager, scheduler_config, tick_profiler
 
 _PORT = 13467
 
@@ -19,20 +23,32 @@ _HEADER = """
 Actions:<br>
 <a href="?reparse_config=1">Reparse global config values</a><br>
 <a href="?restart_scheduler=1">Restart the scheduler</a><br>
+<a href="?profile_ticks=10">Profile the next 10 ticks</a><br>
+<br>
+Tick statistics: <a href="/ticks">text</a> <a href="/ticks.json">JSON</a>
+<a href="/profile">last profile</a><br>
 <br>
 """
 
+_DEFAULT_PROFILE_TICKS = 10
+
 _FOOTER = """
 </body>
 </html>
 """
 
 
+def _format_value(value):
+    if isinstance(value, float):
+        return '%.3f' % value
+    return str(value)
+
+
 class StatusServerRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
-    def _send_headers(self):
+    def _send_headers(self, content_type='text/html'):
         self.send_response(200, 'OK')
-        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Type', content_type)
         self.end_headers()
 
     def _parse_arguments(self):
@@ -81,9 +97,81 @@ class StatusServerRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         elif 'restart_scheduler' in arguments:
             self.server._shutdown_scheduler = True
             self._write_line('Posted the shutdown request')
+        elif 'profile_ticks' in arguments:
+            try:
+                ticks = int(arguments['profile_ticks'][0])
+            except ValueError:
+                ticks = _DEFAULT_PROFILE_TICKS
+            self.server._tick_profiler.request_profile(ticks)
+            self._write_line('Profiling the next %d ticks, see '
+                             '<a href="/profile">the profile</a>' % ticks)
         self._write_line()
 
+    def _get_tick_stats(self):
+        stats = self.server._tick_profiler.as_dict()
+        drone_manager = self.server._drone_manager
+        stats['drone_latencies'] = sorted(
+            (hostname, histogram.as_dict()) for hostname, histogram
+            in drone_manager.get_drone_latencies().iteritems())
+        stats['degraded_drones'] = sorted(drone_manager.get_degraded_drones())
+        return stats
+
+    @staticmethod
+    def _format_stats(stats):
+        return ' '.join('%s=%s' % (key, _format_value(stats[key]))
+                        for key in ('count', 'mean', 'p50', 'p90', 'p99',
+                                    'max') if key in stats)
+
+    def _write_tick_stats_text(self):
+        stats = self._get_tick_stats()
+        lines = ['ticks: %d' % stats['ticks'],
+                 'tick_secs: ' + self._format_stats(stats['tick_secs']),
+                 '']
+        lines.append('phases:')
+        for name, phase in stats['phases']:
+            lines.append('  %s' % name)
+            for key in ('wall_secs', 'sql_queries', 'sql_secs'):
+                lines.append('    %s: %s' % (key,
+                                             self._format_stats(phase[key])))
+        lines.append('')
+        lines.append('counters (per tick):')
+        for name, counter in stats['counters']:
+            lines.append('  %s: %s' % (name, self._format_stats(counter)))
+        lines.append('')
+        lines.append('drone call latencies:')
+        for hostname, latencies in stats['drone_latencies']:
+            buckets = ' '.join('%s:%d' % bucket
+                               for bucket in latencies['buckets'] if bucket[1])
+            lines.append('  %s: count=%d total=%.3fs max=%.3fs %s' % (
+                hostname, latencies['count'], latencies['total'],
+                latencies['max'], buckets))
+        lines.append('degraded drones: %s' %
+                     (', '.join(stats['degraded_drones']) or 'none'))
+        if stats['profiling']:
+            lines.append('profiling in progress')
+        self.wfile.write('\n'.join(lines) + '\n')
+
+    def _write_profile(self):
+        profile = self.server._tick_profiler.last_profile()
+        if profile is None:
+            profile = 'No profile captured yet, use ?profile_ticks=N\n'
+        self.wfile.write(profile)
+
     def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/ticks':
+            self._send_headers('text/plain')
+            self._write_tick_stats_text()
+            return
+        if path == '/ticks.json':
+            self._send_headers('application/json')
+            self.wfile.write(json.dumps(self._get_tick_stats()))
+            return
+        if path == '/profile':
+            self._send_headers('text/plain')
+            self._write_profile()
+            return
+
         self._send_headers()
         self.wfile.write(_HEADER)
 
@@ -97,13 +185,16 @@ class StatusServerRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
 class StatusServer(BaseHTTPServer.HTTPServer):
 
-    def __init__(self):
-        address = ('', _PORT)
+    def __init__(self, port=None):
+        if port is None:
+            port = _PORT
+        address = ('', port)
         # HTTPServer is an old-style class :(
         BaseHTTPServer.HTTPServer.__init__(self, address,
                                            StatusServerRequestHandler)
         self._shutting_down = False
         self._drone_manager = drone_manager.instance()
+        self._tick_profiler = tick_profiler.instance()
         self._shutdown_scheduler = False
 
         # ensure the listening socket is not inherited by child processes
@@ -116,7 +207,7 @@ class StatusServer(BaseHTTPServer.HTTPServer):
         logging.info('Shutting down server...')
         self._shutting_down = True
         # make one last request to awaken the server thread and make it exit
-        urllib.urlopen('http://localhost:%s' % _PORT)
+        urllib.urlopen('http://localhost:%s' % self.server_address[1])
 
     def _serve_until_shutdown(self):
         logging.info('Status server running on %s', self.server_address)
@@ -0,0 +1,242 @@
+"""
+Timing of the phases of Dispatcher.tick().
+
+For every phase of a tick the profiler records the wall time and the number
+and total time of the SQL queries it ran (from django.db.connection.queries,
+which Django only fills when debug cursors are in use, see the
+profile_sql_queries setting).  Ticks can also report counters, such as the
+number of agents started.  The last samples are kept per phase and
+summarized for the status server.
+
+A cProfile capture of the next ticks can be requested from another thread
+with request_profile(); the pstats report of the last capture is available
+from last_profile().
+"""
+
+import cProfile
+import logging
+import pstats
+import threading
+import time
+from cStringIO import StringIO
+
+from autotest.scheduler import drone_task_queue
+
+# number of ticks kept per phase and counter
+DEFAULT_WINDOW = 500
+
+
+class RollingStats(object):
+
+    """
+    The last samples of a value, with a histogram and percentiles.
+
+    :param window: number of samples kept.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self._window = window
+        self._samples = []
+        self._next = 0
+        self.total_count = 0
+
+    def add(self, value):
+        if len(self._samples) < self._window:
+            self._samples.append(value)
+        else:
+            self._samples[self._next] = value
+            self._next = (self._next + 1) % self._window
+        self.total_count += 1
+
+    @staticmethod
+    def _percentile(sorted_samples, fraction):
+        index = min(len(sorted_samples) - 1,
+                    int(fraction * len(sorted_samples)))
+        return sorted_samples[index]
+
+    def as_dict(self, histogram=False):
+        samples = sorted(self._samples)
+        if not samples:
+            return {'count': 0}
+        result = {'count': len(samples),
+                  'mean': sum(samples) / float(len(samples)),
+                  'p50': self._percentile(samples, 0.5),
+                  'p90': self._percentile(samples, 0.9),
+                  'p99': self._percentile(samples, 0.99),
+                  'max': samples[-1]}
+        if histogram:
+            latencies = drone_task_queue.LatencyHistogram()
+            for sample in samples:
+                latencies.add(sample)
+            result['buckets'] = latencies.as_dict()['buckets']
+        return result
+
+
+class _PhaseStats(object):
+
+    def __init__(self, window):
+        self.wall_secs = RollingStats(window)
+        self.sql_queries = RollingStats(window)
+        self.sql_secs = RollingStats(window)
+
+    def as_dict(self):
+        return {'wall_secs': self.wall_secs.as_dict(histogram=True),
+                'sql_queries': self.sql_queries.as_dict(),
+                'sql_secs': self.sql_secs.as_dict()}
+
+
+def _django_queries():
+    from django import db
+    return db.connection.queries
+
+
+class TickProfiler(object):
+
+    """
+    Collects per-phase metrics of scheduler ticks.
+
+    :param get_queries: function returning the list of the queries run so far
+            in this tick, as dicts with a 'time' key.
+    :param window: number of ticks kept in the rolling statistics.
+    """
+
+    def __init__(self, get_queries=_django_queries, window=DEFAULT_WINDOW,
+                 now_func=time.time):
+        self._get_queries = get_queries
+        self._window = window
+        self._now_func = now_func
+        # phase names in the order they first ran
+        self._phase_order = []
+        self._phases = {}
+        self._counter_order = []
+        self._counters = {}
+        self._tick_counters = {}
+        self.tick_secs = RollingStats(window)
+        self.ticks = 0
+        self._tick_start = None
+
+        self._lock = threading.Lock()
+        self._profile_ticks_requested = 0
+        self._profile_ticks_left = 0
+        self._profile = None
+        self._last_profile = None
+
+    def _query_count(self):
+        try:
+            return len(self._get_queries())
+        except Exception:
+            return 0
+
+    def _query_secs(self, start):
+        try:
+            queries = self._get_queries()[start:]
+            return sum(float(query.get('time', 0)) for query in queries)
+        except Exception:
+            return 0.0
+
+    def start_tick(self):
+        self._tick_start = self._now_func()
+        self._tick_counters = {}
+        self._start_profile_maybe()
+
+    def run_phase(self, name, function, *args, **kwargs):
+        """Call function(*args, **kwargs) and record it as phase name."""
+        phase = self._phases.get(name)
+        if phase is None:
+            phase = self._phases[name] = _PhaseStats(self._window)
+            self._phase_order.append(name)
+        first_query = self._query_count()
+        start_time = self._now_func()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            phase.wall_secs.add(self._now_func() - start_time)
+            phase.sql_queries.add(self._query_count() - first_query)
+            phase.sql_secs.add(self._query_secs(first_query))
+
+    def count(self, name, value=1):
+        """Add value to the counter name for the current tick."""
+        self._tick_counters[name] = self._tick_counters.get(name, 0) + value
+
+    def end_tick(self):
+        """
+        Record the tick; must be called before the Django query log is
+        reset.
+        """
+        self.tick_secs.add(self._now_func() - self._tick_start)
+        for name in self._counter_order:
+            self._counters[name].add(self._tick_counters.pop(name, 0))
+        for name, value in sorted(self._tick_counters.iteritems()):
+            self._counters[name] = RollingStats(self._window)
+            self._counters[name].add(value)
+            self._counter_order.append(name)
+        self.ticks += 1
+        self._stop_profile_maybe()
+
+    def as_dict(self):
+        return {'ticks': self.ticks,
+                'tick_secs': self.tick_secs.as_dict(histogram=True),
+                'phases': [(name, self._phases[name].as_dict())
+                           for name in self._phase_order],
+                'counters': [(name, self._counters[name].as_dict())
+                             for name in self._counter_order],
+                'profiling': self.is_profiling()}
+
+    def request_profile(self, ticks):
+        """Profile the next ticks with cProfile.  Callable from any thread."""
+        self._lock.acquire()
+        try:
+            self._profile_ticks_requested = max(1, ticks)
+        finally:
+            self._lock.release()
+
+    def is_profiling(self):
+        return bool(self._profile_ticks_requested or self._profile_ticks_left)
+
+    def last_profile(self):
+        """:return: pstats report of the last capture, or None."""
+        return self._last_profile
+
+    def _start_profile_maybe(self):
+        if self._profile is not None:
+            return
+        self._lock.acquire()
+        try:
+            ticks = self._profile_ticks_requested
+            self._profile_ticks_requested = 0
+        finally:
+            self._lock.release()
+        if not ticks:
+            return
+        logging.info('Profiling the next %d scheduler ticks', ticks)
+        self._profile_ticks_left = ticks
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def _stop_profile_maybe(self):
+        if self._profile is None:
+            return
+        self._profile_ticks_left -= 1
+        if self._profile_ticks_left > 0:
+            return
+        self._profile.disable()
+        output = StringIO()
+        stats = pstats.Stats(self._profile, stream=output)
+        stats.sort_stats('cumulative').print_stats(50)
+        self._last_profile = output.getvalue()
+        self._profile = None
+        logging.info('Scheduler tick profile captured')
+
+
+_the_instance = None
+
+
+def instance():
+    if _the_instance is None:
+        _set_instance(TickProfiler())
+    return _the_instance
+
+
+def _set_instance(instance):  # usable for testing
+    global _the_instance
+    _the_instance = instance
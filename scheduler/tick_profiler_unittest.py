@@ -0,0 +1,108 @@
+#!/usr/bin/python
+
+"""Tests for autotest.scheduler.tick_profiler."""
+
+import common
+from autotest.client.shared.test_utils import unittest
+from autotest.scheduler import tick_profiler
+
+
+class RollingStatsTest(unittest.TestCase):
+
+    def test_window(self):
+        stats = tick_profiler.RollingStats(window=3)
+        for value in (10, 1, 2, 3):
+            stats.add(value)
+        summary = stats.as_dict()
+        self.assertEqual(3, summary['count'])
+        self.assertEqual(4, stats.total_count)
+        self.assertEqual(3, summary['max'])
+        self.assertEqual(2, summary['p50'])
+        self.assertEqual(2.0, summary['mean'])
+
+    def test_empty(self):
+        self.assertEqual({'count': 0},
+                         tick_profiler.RollingStats().as_dict(histogram=True))
+
+    def test_histogram(self):
+        stats = tick_profiler.RollingStats()
+        stats.add(0.05)
+        stats.add(200)
+        buckets = dict(stats.as_dict(histogram=True)['buckets'])
+        self.assertEqual(1, buckets['<=0.1'])
+        self.assertEqual(1, buckets['>120'])
+
+
+class TickProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queries = []
+        self.time = 100.0
+        self.profiler = tick_profiler.TickProfiler(
+            get_queries=lambda: self.queries, now_func=lambda: self.time)
+
+    def _query(self, secs):
+        self.queries.append({'sql': 'SELECT 1', 'time': '%.3f' % secs})
+
+    def _phase(self):
+        self.time += 2
+        self._query(0.5)
+        self._query(0.25)
+        return 'result'
+
+    def test_phases(self):
+        self.profiler.start_tick()
+        self._query(1)
+        self.assertEqual('result',
+                         self.profiler.run_phase('phase', self._phase))
+        self.profiler.run_phase('other', lambda: None)
+        self.profiler.end_tick()
+
+        stats = self.profiler.as_dict()
+        self.assertEqual(1, stats['ticks'])
+        self.assertEqual(['phase', 'other'],
+                         [name for name, _ in stats['phases']])
+        phase = stats['phases'][0][1]
+        self.assertEqual(2, phase['wall_secs']['max'])
+        self.assertEqual(2, phase['sql_queries']['max'])
+        self.assertEqual(0.75, phase['sql_secs']['max'])
+        self.assertEqual(0, stats['phases'][1][1]['sql_queries']['max'])
+        self.assertEqual(2, stats['tick_secs']['max'])
+
+    def test_phase_exception_recorded(self):
+        self.profiler.start_tick()
+
+        def fail():
+            self._query(1)
+            raise ValueError
+        self.assertRaises(ValueError, self.profiler.run_phase, 'fail', fail)
+        self.assertEqual(1, self.profiler.as_dict()['phases'][0][1][
+            'sql_queries']['count'])
+
+    def test_counters(self):
+        self.profiler.start_tick()
+        self.profiler.count('agents_started')
+        self.profiler.count('agents_started', 2)
+        self.profiler.end_tick()
+        self.profiler.start_tick()
+        self.profiler.end_tick()
+
+        counters = dict(self.profiler.as_dict()['counters'])
+        self.assertEqual(2, counters['agents_started']['count'])
+        self.assertEqual(3, counters['agents_started']['max'])
+        self.assertEqual(1.5, counters['agents_started']['mean'])
+
+    def test_profile(self):
+        self.assertEqual(None, self.profiler.last_profile())
+        self.profiler.request_profile(2)
+        self.assertTrue(self.profiler.is_profiling())
+        for _ in xrange(2):
+            self.profiler.start_tick()
+            self.profiler.run_phase('phase', self._phase)
+            self.profiler.end_tick()
+        self.assertFalse(self.profiler.is_profiling())
+        self.assertTrue('_phase' in self.profiler.last_profile())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,6 +10,7 @@ import threading
 from autotest.client.shared import utils
 from autotest.server import utils as server_utils
 from autotest.server.hosts import abstract_ssh, monitors
+from autotest.server.hosts.monitors import console
 
 MONITORDIR = monitors.__path__[0]
 SUPPORTED_PYTHON_VERS = ('2.4', '2.5', '2.6', '2.7')
@@ -133,7 +134,15 @@ def launch_local_console(
 
     This will process the output from followfiles and
     fire warning messages per configuration in pattern_paths.
+
+    With the shared console monitor enabled, the output is added to it
+    instead and a console.ConsoleStream is returned in place of the process.
     """
+    if console.SHARED_MONITOR:
+        console_stream = console.add_stream(
+            input_stream.fileno(), console_log_path, pattern_paths)
+        return console_stream, console_stream.warning_stream
+
     r, w = os.pipe()
     local_script_path = os.path.join(MONITORDIR, 'console.py')
     console_cmd = [sys.executable, local_script_path]
@@ -271,7 +280,10 @@ class LogfileMonitorMixin(abstract_ssh.AbstractSSHHost):
     @_log_and_ignore_exceptions
     def __stop_loggers(self):
         if self._console_proc:
-            utils.nuke_subprocess(self._console_proc)
+            if isinstance(self._console_proc, console.ConsoleStream):
+                self._console_proc.close()
+            else:
+                utils.nuke_subprocess(self._console_proc)
             utils.nuke_subprocess(self._followfiles_proc)
             self._console_proc = self._followfile_proc = None
             if self.job:
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+"""Time the translation of console output into logs and warnings.
+
+First, matching lines against the alert hooks of console_patterns one by one,
+as process_input() used to do, is compared with the AlertMatcher.  Then the
+console streams of a number of hosts are translated by a console.py process
+each and by the shared console monitor, reporting the lines per second and
+the CPU time used per host.
+"""
+
+import fcntl
+import optparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import StringIO
+import common
+from autotest.server.hosts.monitors import console, monitors_util
+
+usage = 'usage: %prog [options]'
+parser = optparse.OptionParser(usage=usage)
+parser.add_option('-n', '--hosts', type='int', dest='hosts', default=20,
+                  help='Hosts whose console is translated')
+parser.add_option('-l', '--lines', type='int', dest='lines', default=20000,
+                  help='Console lines of each host')
+
+LINES = ['[  123.456789] usb 1-1: new high-speed USB device number 2',
+         '[  123.456790] EXT4-fs (sda1): mounted filesystem with ordered data',
+         'localhost login: ',
+         '[  123.456791] eth0: link up, 1000Mbps, full-duplex']
+# one line in a thousand raises a warning
+ALERT_LINE = '[  123.456792] Kernel panic - not syncing: Fatal exception'
+
+
+def console_lines(num_lines):
+    lines = []
+    for index in xrange(num_lines):
+        if index % 1000 == 999:
+            lines.append(ALERT_LINE + '\n')
+        else:
+            lines.append(LINES[index % len(LINES)] + '\n')
+    return lines
+
+
+def match_each(alert_hooks, lines):
+    for line in lines:
+        for regex, callback in alert_hooks:
+            match = regex.match(line.strip())
+            if match:
+                callback(*match.groups())
+
+
+def match_combined(alert_hooks, lines):
+    alert_matcher = monitors_util.AlertMatcher(alert_hooks)
+    for line in lines:
+        alert_matcher.check(line.strip())
+
+
+def get_cpu_time(pid):
+    # utime and stime, in clock ticks
+    fields = open('/proc/%d/stat' % pid).read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / float(
+        os.sysconf('SC_CLK_TCK'))
+
+
+def get_children_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def close_on_exec(fd):
+    # keeps the consoles from getting the pipes of the others
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+
+def feed(input_fds, data):
+    for fd in input_fds:
+        os.write(fd, data)
+
+
+def run_processes(tmpdir, lines, options):
+    """Translate the consoles with a console.py process each."""
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'console.py')
+    devnull = open(os.devnull, 'w')
+    procs = []
+    input_fds = []
+    warning_streams = []
+    for index in xrange(options.hosts):
+        r, w = os.pipe()
+        input_r, input_w = os.pipe()
+        close_on_exec(r)
+        close_on_exec(input_w)
+        procs.append(subprocess.Popen(
+            [sys.executable, script_path,
+             os.path.join(tmpdir, 'process%d' % index), str(w)],
+            stdin=input_r, stdout=devnull, stderr=devnull))
+        os.close(w)
+        os.close(input_r)
+        input_fds.append(input_w)
+        warning_streams.append(os.fdopen(r, 'r', 0))
+
+    cpu_time = get_children_cpu_time()
+    start = time.time()
+    for index in xrange(0, len(lines), 100):
+        feed(input_fds, ''.join(lines[index:index + 100]))
+    for fd in input_fds:
+        os.close(fd)
+    for proc in procs:
+        proc.wait()
+    elapsed = time.time() - start
+    for warning_stream in warning_streams:
+        warning_stream.close()
+    devnull.close()
+    return elapsed, get_children_cpu_time() - cpu_time
+
+
+def run_shared(tmpdir, lines, options):
+    """Translate the consoles with the shared console monitor."""
+    socket_path = os.path.join(tmpdir, 'monitor')
+    pid = console.start_monitor(socket_path, idle_timeout=1)
+    streams = []
+    input_fds = []
+    for index in xrange(options.hosts):
+        input_r, input_w = os.pipe()
+        streams.append(console.add_stream(
+            input_r, os.path.join(tmpdir, 'shared%d' % index),
+            socket_path=socket_path))
+        os.close(input_r)
+        input_fds.append(input_w)
+
+    cpu_time = get_cpu_time(pid)
+    start = time.time()
+    for index in xrange(0, len(lines), 100):
+        feed(input_fds, ''.join(lines[index:index + 100]))
+    for fd in input_fds:
+        os.close(fd)
+    for stream in streams:
+        stream.wait()
+    elapsed = time.time() - start
+    cpu_time = get_cpu_time(pid) - cpu_time
+    for stream in streams:
+        stream.close()
+        stream.warning_stream.close()
+    return elapsed, cpu_time
+
+
+def main():
+    (options, args) = parser.parse_args()
+    if args:
+        parser.print_help()
+        return
+
+    lines = console_lines(options.lines)
+    alert_hooks = monitors_util.build_alert_hooks_from_path(
+        console.PATTERNS_PATH, StringIO.StringIO())
+    print 'matching %d lines against %d alert hooks' % (len(lines),
+                                                         len(alert_hooks))
+    reference = None
+    for name, function in (('each hook', match_each),
+                           ('AlertMatcher', match_combined)):
+        start = time.time()
+        function(alert_hooks, lines)
+        elapsed = time.time() - start
+        if reference is None:
+            reference = elapsed
+        print '  %-14s %8.3fs %10.0f lines/s %6.2fx' % (
+            name, elapsed, len(lines) / elapsed, reference / elapsed)
+
+    print 'translating %d lines of %d hosts' % (len(lines), options.hosts)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for name, function in (('process each', run_processes),
+                               ('shared monitor', run_shared)):
+            elapsed, cpu_time = function(tmpdir, lines, options)
+            print '  %-14s %8.3fs %10.0f lines/s %8.4fs CPU per host' % (
+                name, elapsed, len(lines) * options.hosts / elapsed,
+                cpu_time / options.hosts)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
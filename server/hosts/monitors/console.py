@@ -2,28 +2,69 @@
 #
 # Script for translating console output (from STDIN) into Autotest
 # warning messages.
+#
+# With --serve, it runs the shared console monitor instead: a single process
+# translating the console and log streams of many hosts, added to it with
+# add_stream().
 
+import _multiprocessing
+import errno
+import fcntl
 import gzip
 import optparse
 import os
+import select
 import signal
+import socket
+import struct
+import subprocess
 import sys
+import tempfile
 import time
+import traceback
 import common
+from autotest.client.shared.settings import settings
 from autotest.server.hosts.monitors import monitors_util
 
 PATTERNS_PATH = os.path.join(os.path.dirname(__file__), 'console_patterns')
+DEFAULT_TIMESTAMP_FORMAT = '[%Y-%m-%d %H:%M:%S]'
+
+# Whether hosts add their streams to the shared console monitor instead of
+# launching a console.py process each
+SHARED_MONITOR = settings.get_value('AUTOSERV', 'shared_console_monitor',
+                                    type=bool, default=False)
+
+# Unix socket the shared console monitor of this user listens on
+SOCKET_PATH = os.path.join(tempfile.gettempdir(),
+                           'autotest-console-monitor-%d' % os.getuid())
+
+# Seconds the shared console monitor runs without any stream before exiting
+IDLE_TIMEOUT = 60
+
+_READ_SIZE = 65536
 
-usage = 'usage: %prog [options] logfile_name warn_fd'
+usage = ('usage: %prog [options] logfile_name warn_fd\n'
+         '       %prog [--idle_timeout=SECONDS] --serve=SOCKET_PATH')
 parser = optparse.OptionParser(usage=usage)
 parser.add_option(
     '-t', '--log_timestamp_format',
-    default='[%Y-%m-%d %H:%M:%S]',
+    default=DEFAULT_TIMESTAMP_FORMAT,
     help='Timestamp format for log messages')
 parser.add_option(
     '-p', '--pattern_paths',
     default=PATTERNS_PATH,
     help='Path to alert hook patterns file')
+parser.add_option(
+    '--serve',
+    help='Run the shared console monitor on this Unix socket')
+parser.add_option(
+    '--idle_timeout', type='int', default=IDLE_TIMEOUT,
+    help='Seconds the shared console monitor runs without any stream')
+
+
+class MonitorError(Exception):
+
+    """The shared console monitor failed to add a stream."""
 
 
 def _open_logfile(logfile_base_name):
@@ -66,8 +107,350 @@ def _unset_signal_handler():
     signal.signal(signal.SIGTERM, signal.SIG_DFL)
 
 
+class _MonitoredStream(object):
+
+    """A stream translated by the shared console monitor."""
+
+    def __init__(self, conn, input_fd, warn_fd, header):
+        self.conn = conn
+        self.input_fd = input_fd
+        self.warnfile = os.fdopen(warn_fd, 'w', 0)
+        self.logfile = None
+        self._partial_line = ''
+
+        try:
+            logfile_base_name, self.log_timestamp_format, pattern_paths = (
+                header.split('\t'))
+            alert_hooks = []
+            for patterns_path in pattern_paths.split(','):
+                alert_hooks.extend(monitors_util.build_alert_hooks_from_path(
+                    patterns_path, self.warnfile))
+            self.alert_matcher = monitors_util.AlertMatcher(alert_hooks)
+            self.logfile = _open_logfile(logfile_base_name)
+        except:
+            self.warnfile.close()
+            raise
+
+    def process(self, data):
+        """Process data read from the stream, line by line."""
+        lines = (self._partial_line + data).split('\n')
+        self._partial_line = lines.pop()
+        for line in lines:
+            monitors_util.process_line(line + '\n', self.logfile,
+                                       self.log_timestamp_format,
+                                       self.alert_matcher)
+
+    def close(self, eof=False):
+        """Stop processing the stream.
+
+        :param eof: Whether the end of the stream was reached, rather than
+                the host removing the stream.
+        """
+        try:
+            if self.logfile:
+                if self._partial_line:
+                    monitors_util.process_line(self._partial_line,
+                                               self.logfile,
+                                               self.log_timestamp_format,
+                                               self.alert_matcher)
+                if eof:
+                    monitors_util.write_logline(self.logfile,
+                                                monitors_util.TERM_MSG,
+                                                self.log_timestamp_format)
+        finally:
+            if self.logfile:
+                self.logfile.close()
+            self.warnfile.close()
+            os.close(self.input_fd)
+            self.conn.close()
+
+
+def _lock_monitor(socket_path):
+    """Take the lock serializing the start and exit of the shared monitor.
+
+    :return: The lock file, to close to release the lock.
+    """
+    lock_file = open(socket_path + '.lock', 'w')
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    return lock_file
+
+
+def _add_stream(conn):
+    """Receive a stream from a host connected to the shared monitor.
+
+    The host sends the descriptor of the stream, the write end of the pipe
+    to write warnings to and a line with the log file base name, timestamp
+    format and pattern paths of the stream, separated by tabs.
+    """
+    # never wait forever on a host
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO,
+                    struct.pack('ll', 10, 0))
+    input_fd = _multiprocessing.recvfd(conn.fileno())
+    try:
+        warn_fd = _multiprocessing.recvfd(conn.fileno())
+    except:
+        os.close(input_fd)
+        raise
+    header = ''
+    while not header.endswith('\n'):
+        data = conn.recv(4096)
+        if not data:
+            break
+        header += data
+    try:
+        stream = _MonitoredStream(conn, input_fd, warn_fd, header[:-1])
+    except Exception, e:
+        os.close(input_fd)
+        conn.sendall('error: %s\n' % str(e).replace('\n', ' '))
+        raise
+    conn.sendall('ok\n')
+    return stream
+
+
+def serve(listener, socket_path, idle_timeout=IDLE_TIMEOUT):
+    """Translate the streams added by hosts, until none is left for a while.
+
+    Each stream is translated as process_input() does, in a single event
+    loop for all of them.  A stream is removed when it reaches its end or
+    when the host closes its connection to the monitor.
+
+    :param listener: Unix socket bound to socket_path, listening.
+    :param socket_path: Path of the socket, removed before exiting.
+    :param idle_timeout: Seconds without any stream before exiting.
+    """
+    poller = select.poll()
+    poller.register(listener, select.POLLIN)
+    # descriptor of the stream or of the connection -> stream
+    streams_by_input = {}
+    streams_by_conn = {}
+
+    def remove(stream, eof=False):
+        for fd, streams in ((stream.input_fd, streams_by_input),
+                            (stream.conn.fileno(), streams_by_conn)):
+            poller.unregister(fd)
+            del streams[fd]
+        stream.close(eof)
+
+    last_stream_time = time.time()
+    try:
+        while True:
+            if streams_by_input:
+                timeout = None
+            else:
+                remaining = last_stream_time + idle_timeout - time.time()
+                if remaining <= 0:
+                    lock_file = _lock_monitor(socket_path)
+                    try:
+                        # hosts connect while holding the lock
+                        if not poller.poll(0):
+                            os.unlink(socket_path)
+                            return
+                    finally:
+                        lock_file.close()
+                    remaining = 0
+                timeout = remaining * 1000
+            try:
+                events = poller.poll(timeout)
+            except select.error, e:
+                if e[0] == errno.EINTR:
+                    continue
+                raise
+
+            for fd, event in events:
+                if fd == listener.fileno():
+                    conn = listener.accept()[0]
+                    try:
+                        stream = _add_stream(conn)
+                    except Exception:
+                        conn.close()
+                        traceback.print_exc()
+                        continue
+                    streams_by_input[stream.input_fd] = stream
+                    streams_by_conn[conn.fileno()] = stream
+                    poller.register(stream.input_fd, select.POLLIN)
+                    poller.register(conn, select.POLLIN)
+                elif fd in streams_by_input:
+                    stream = streams_by_input[fd]
+                    try:
+                        data = os.read(fd, _READ_SIZE)
+                        if data:
+                            stream.process(data)
+                        else:
+                            remove(stream, eof=True)
+                    except Exception:
+                        # e.g. the host closed its end of the warning pipe
+                        traceback.print_exc()
+                        if fd in streams_by_input:
+                            remove(stream)
+                elif fd in streams_by_conn:
+                    # the host closed its connection
+                    remove(streams_by_conn[fd])
+                if not streams_by_input:
+                    last_stream_time = time.time()
+    finally:
+        for stream in streams_by_input.values():
+            stream.close()
+
+
+def _run_monitor(socket_path, idle_timeout):
+    """Start the shared console monitor in the background.
+
+    Prints 'ready' and the pid of the monitor once it listens on
+    socket_path, and exits.
+    """
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(077)
+    try:
+        listener.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    listener.listen(64)
+
+    pid = os.fork()
+    if pid:
+        sys.stdout.write('ready %d\n' % pid)
+        return
+
+    os.setsid()
+    os.chdir('/')
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+    os.close(devnull)
+
+    def _on_signal_exit(unused_signal_no, unused_frame):
+        sys.exit(1)
+    signal.signal(signal.SIGTERM, _on_signal_exit)
+    try:
+        serve(listener, socket_path, idle_timeout)
+    finally:
+        os._exit(0)
+
+
+def start_monitor(socket_path=SOCKET_PATH, idle_timeout=IDLE_TIMEOUT):
+    """Start a shared console monitor listening on socket_path.
+
+    :return: The pid of the monitor.
+    """
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'console.py')
+    devnull = open(os.devnull, 'r+')
+    try:
+        proc = subprocess.Popen(
+            [sys.executable, script_path, '--serve', socket_path,
+             '--idle_timeout', str(idle_timeout)],
+            stdin=devnull, stdout=subprocess.PIPE, stderr=devnull,
+            close_fds=True)
+        output = proc.communicate()[0]
+    finally:
+        devnull.close()
+    if proc.returncode or not output.startswith('ready '):
+        raise MonitorError('The shared console monitor failed to start')
+    return int(output.split()[1])
+
+
+def _connect_monitor(socket_path):
+    """Connect to the shared monitor, starting it if it isn't running."""
+    lock_file = _lock_monitor(socket_path)
+    try:
+        for attempt in (0, 1):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(socket_path)
+                return sock
+            except socket.error:
+                sock.close()
+                if attempt:
+                    raise
+            start_monitor(socket_path)
+    finally:
+        lock_file.close()
+
+
+class ConsoleStream(object):
+
+    """A stream added to the shared console monitor.
+
+    :ivar warning_stream: File to read the warning messages from.
+    """
+
+    def __init__(self, sock, warning_stream):
+        self._sock = sock
+        self.warning_stream = warning_stream
+
+    def wait(self):
+        """Wait for the monitor to reach the end of the stream."""
+        while self._sock.recv(4096):
+            pass
+
+    def close(self):
+        """Remove the stream from the monitor.
+
+        The warning stream is left open.
+        """
+        self._sock.close()
+
+
+def add_stream(input_fd, logfile_base_name, pattern_paths=None,
+               log_timestamp_format=DEFAULT_TIMESTAMP_FORMAT,
+               socket_path=SOCKET_PATH):
+    """Add a stream to the shared console monitor, as console.py would get.
+
+    The monitor is started if it isn't running.  It gets a copy of input_fd,
+    which the caller may close.
+
+    :param input_fd: Descriptor of the console or log stream.
+    :param logfile_base_name: The log file path without a suffix.
+    :param pattern_paths: Paths to alert hook patterns files.
+    :param log_timestamp_format: Timestamp format for log messages.
+    :param socket_path: Socket of the shared monitor.
+    :return: A ConsoleStream.
+    """
+    if not pattern_paths:
+        pattern_paths = [PATTERNS_PATH]
+    header = '\t'.join([os.path.abspath(logfile_base_name),
+                        log_timestamp_format,
+                        ','.join([os.path.abspath(path)
+                                  for path in pattern_paths])])
+    r, w = os.pipe()
+    try:
+        sock = _connect_monitor(socket_path)
+        try:
+            _multiprocessing.sendfd(sock.fileno(), input_fd)
+            _multiprocessing.sendfd(sock.fileno(), w)
+            sock.sendall(header + '\n')
+            reply = ''
+            while not reply.endswith('\n'):
+                data = sock.recv(4096)
+                if not data:
+                    break
+                reply += data
+            if reply != 'ok\n':
+                raise MonitorError('Failed to add %s to the shared console '
+                                   'monitor: %s' % (logfile_base_name,
+                                                    reply.strip()))
+        except:
+            sock.close()
+            raise
+    except:
+        os.close(r)
+        os.close(w)
+        raise
+    os.close(w)
+    return ConsoleStream(sock, os.fdopen(r, 'r', 0))
+
+
 def main():
     (options, args) = parser.parse_args()
+    if options.serve:
+        if args:
+            parser.print_help()
+            sys.exit(1)
+        _run_monitor(options.serve, options.idle_timeout)
+        return
+
     if len(args) != 2:
         parser.print_help()
         sys.exit(1)
@@ -2,16 +2,18 @@
 
 """Tests for console.py"""
 
+import gzip
 import os
 import shutil
 import signal
 import StringIO
 import tempfile
+import time
 import unittest
 
 import common
 from autotest.client.shared.test_utils import mock
-from autotest.server.hosts.monitors import console
+from autotest.server.hosts.monitors import console, monitors_util
 
 
 class console_test(unittest.TestCase):
@@ -54,6 +56,55 @@ class console_test(unittest.TestCase):
         self.god.check_playback()
         self.assertTrue(logfile.closed)
 
+    def test_shared_monitor(self):
+        socket_path = os.path.join(self.tempdir, 'monitor')
+        pid = console.start_monitor(socket_path, idle_timeout=1)
+        streams = []
+        for index in xrange(2):
+            r, w = os.pipe()
+            stream = console.add_stream(
+                r, os.path.join(self.tempdir, 'log%d' % index),
+                socket_path=socket_path)
+            os.close(r)
+            os.write(w, 'line %d\n\nKernel panic - index %d\nlast' %
+                     (index, index))
+            streams.append((stream, w))
+
+        first, first_w = streams[0]
+        os.close(first_w)
+        first.wait()
+        first.close()
+        self.assertEqual("machine panic'd (- index 0)",
+                         first.warning_stream.readline().split('\t')[2][:-1])
+        first.warning_stream.close()
+        second, second_w = streams[1]
+        self.assertEqual("machine panic'd (- index 1)",
+                         second.warning_stream.readline().split('\t')[2][:-1])
+        second.close()
+        os.close(second_w)
+        self.assertEqual('', second.warning_stream.read())
+        second.warning_stream.close()
+
+        term_line = monitors_util.TERM_MSG + '\n'
+        for index, last_lines in ((0, ['last\n', term_line]),
+                                  (1, ['last\n'])):
+            [name] = [name for name in os.listdir(self.tempdir)
+                      if name.startswith('log%d.' % index)]
+            lines = gzip.open(os.path.join(self.tempdir, name)).readlines()
+            self.assertEqual(['line %d\n' % index,
+                              'Kernel panic - index %d\n' % index] +
+                             last_lines,
+                             [line.split('\t', 1)[1] for line in lines])
+
+        # the monitor exits once it has no stream left for idle_timeout
+        for _ in xrange(100):
+            if not os.path.exists(socket_path):
+                break
+            time.sleep(0.1)
+        self.assertFalse(os.path.exists(socket_path))
+        self.assertFalse(os.path.exists('/proc/%d' % pid) and
+                         open('/proc/%d/stat' % pid).read().split()[2] != 'Z')
+
 
 if __name__ == '__main__':
     unittest.main()
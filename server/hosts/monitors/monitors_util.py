@@ -11,6 +11,15 @@ import time
 
 TERM_MSG = 'Console connection unexpectedly lost. Terminating monitor.'
 
+# Seconds between two reads of the files followed by follow_files
+FOLLOW_INTERVAL = 1
+
+# Bytes read from a followed file at most each time it is polled
+_FOLLOW_READ_SIZE = 1024 * 1024
+
+# Characters ending the literal text a regex starts with
+_REGEX_SPECIAL = '.^$*+?{}[]\\|()'
+
 
 class Error(Exception):
     pass
@@ -169,6 +178,152 @@ def build_alert_hooks_from_path(patterns_path, warnfile):
         patterns_file.close()
 
 
+def _group_may_be_skipped(pattern, start):
+    """Tell whether a group of pattern may match zero times.
+
+    Args:
+      pattern: str; The regex.
+      start: int; The index following the '(' of the group.
+
+    Returns:
+      bool; True if the group is followed by '?', '*' or '{', or if its end
+      was not found.
+    """
+    depth = 1
+    index = start
+    while index < len(pattern):
+        char = pattern[index]
+        if char == '\\':
+            index += 1
+        elif char == '[':
+            # a ']' right after '[' or '[^' belongs to the set
+            index += 1
+            if pattern.startswith('^', index):
+                index += 1
+            if pattern.startswith(']', index):
+                index += 1
+            while index < len(pattern) and pattern[index] != ']':
+                if pattern[index] == '\\':
+                    index += 1
+                index += 1
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if not depth:
+                return pattern[index + 1:index + 2] in ('?', '*', '{')
+        index += 1
+    return True
+
+
+def get_required_literal(regex):
+    """Find text any string matched by regex contains.
+
+    It is the literal text the regex starts with, after any leading '^',
+    '.*' and '(', as in most console patterns: "^.*(BUG:.*)" gives "BUG:".
+
+    Args:
+      regex: compiled regex.
+
+    Returns:
+      str; The text
+      - Or -
+      None; If none was found.
+    """
+    pattern = regex.pattern
+    # flags and alternatives make the text optional
+    if regex.flags or '(?' in pattern or '|' in pattern:
+        return None
+    start = 0
+    if pattern.startswith('^'):
+        start = 1
+    group_starts = []
+    while True:
+        if pattern.startswith('.*', start):
+            start += 2
+        elif pattern.startswith('(', start):
+            start += 1
+            group_starts.append(start)
+        else:
+            break
+    # the text is optional when one of its groups is
+    for group_start in group_starts:
+        if _group_may_be_skipped(pattern, group_start):
+            return None
+    end = start
+    while end < len(pattern) and pattern[end] not in _REGEX_SPECIAL:
+        end += 1
+    following = pattern[end:end + 1]
+    if following in ('?', '*', '{'):
+        # the last character is repeated, maybe zero times
+        end -= 1
+    return pattern[start:end] or None
+
+
+class AlertMatcher(object):
+
+    """Call the alert functions of the alert hooks matching lines.
+
+    Most lines match none of the hooks.  When every hook has a required
+    literal (see get_required_literal), each line is first searched for all
+    of them at once, with a single regex: only the lines containing one are
+    matched against the hooks.
+    """
+
+    def __init__(self, alert_hooks):
+        """
+        Args:
+          alert_hooks: list; Generated from build_alert_hooks.
+              [(regex, alert_function), ...]
+        """
+        self.alert_hooks = [(re.compile(regex), callback)
+                            for regex, callback in alert_hooks]
+        self._prefilter = None
+
+        literals = []
+        for regex, callback in self.alert_hooks:
+            literal = get_required_literal(regex)
+            if literal is None:
+                return
+            literals.append(re.escape(literal))
+        if literals:
+            self._prefilter = re.compile('|'.join(literals))
+
+    def check(self, line):
+        """Call the alert functions of the hooks whose regex matches line.
+
+        Args:
+          line: str; Line to match, stripped.
+        """
+        if self._prefilter is not None and not self._prefilter.search(line):
+            return
+        for regex, callback in self.alert_hooks:
+            match = regex.match(line)
+            if match:
+                callback(*match.groups())
+
+
+def process_line(line, logfile, log_timestamp_format=None,
+                 alert_matcher=None):
+    """Write a line read from the console to log and watch for alerts.
+
+    Args:
+      line: str; Line to process, including its newline.
+      logfile: file; Log file to write to
+      log_timestamp_format: str; Format to use for timestamping entries.
+          No timestamp is added if None.
+      alert_matcher: AlertMatcher; Alert hooks to match the line against.
+    """
+    if line == '\n':
+        # If it's just an empty line we discard and continue.
+        return
+
+    write_logline(logfile, line, log_timestamp_format)
+
+    if alert_matcher:
+        alert_matcher.check(line.strip())
+
+
 def process_input(
         input, logfile, log_timestamp_format=None, alert_hooks=()):
     """Continuously read lines from input stream and:
@@ -184,6 +339,7 @@ def process_input(
       alert_hooks: list; Generated from build_alert_hooks.
           [(regex, alert_function), ...]
     """
+    alert_matcher = AlertMatcher(alert_hooks)
     while True:
         line = input.readline()
         if len(line) == 0:
@@ -193,16 +349,7 @@ def process_input(
             write_logline(logfile, TERM_MSG, log_timestamp_format)
             break
 
-        if line == '\n':
-            # If it's just an empty line we discard and continue.
-            continue
-
-        write_logline(logfile, line, log_timestamp_format)
-
-        for regex, callback in alert_hooks:
-            match = re.match(regex, line.strip())
-            if match:
-                callback(*match.groups())
+        process_line(line, logfile, log_timestamp_format, alert_matcher)
 
 
 def lookup_lastlines(lastlines_dirpath, path):
@@ -364,26 +511,169 @@ def snuff(subprocs):
             proc.wait()
 
 
+def _find_last_lines(fileobj, size, num_lines):
+    """Find the offset of the last num_lines lines of a file, as tail does.
+
+    Args:
+      fileobj: file; File to search, read backwards from size.
+      size: int; Size of the file.
+      num_lines: int; Number of lines.
+
+    Returns:
+      int; Offset of the first of the lines.
+    """
+    offset = size
+    newlines = 0
+    skip_last = True
+    while offset > 0:
+        block_size = min(offset, 65536)
+        offset -= block_size
+        fileobj.seek(offset)
+        block = fileobj.read(block_size)
+        if skip_last:
+            # the newline ending the file doesn't start a line
+            skip_last = False
+            if block.endswith('\n'):
+                block = block[:-1]
+        end = len(block)
+        while True:
+            end = block.rfind('\n', 0, end)
+            if end == -1:
+                break
+            newlines += 1
+            if newlines == num_lines:
+                return offset + end + 1
+    return 0
+
+
+class FileFollower(object):
+    """Follow files by name, as tail --follow=name --retry does.
+
+    Each file is read from the offset where the last read stopped, when its
+    size changes.  A file replaced, e.g. by log rotation, is read again from
+    the start, and a missing file is looked for every time.
+    """
+
+    def __init__(self, follow_paths, lastlines_dirpath=None):
+        """
+        Args:
+          follow_paths: list; Local paths to follow.
+          lastlines_dirpath: str; Dirpath to read and store the last lines
+              seen in.  Without, the last 10 lines of the files are read
+              first, as tail does.
+        """
+        self.lastlines_dirpath = lastlines_dirpath
+        # path -> [file or None, inode, offset, unterminated line, number
+        #          of lines to read first]
+        self._files = {}
+        for path in follow_paths:
+            num_lines = 10
+            if lastlines_dirpath:
+                num_lines = lookup_lastlines(lastlines_dirpath, path)
+                if num_lines is None:
+                    num_lines = 1
+            self._files[path] = [None, None, 0, '', num_lines]
+
+    def _open(self, path, state):
+        try:
+            fileobj = open(path)
+        except (IOError, OSError):
+            return False
+        stat = os.fstat(fileobj.fileno())
+        offset = 0
+        if state[4] is not None:
+            # the first time the file is open, start with its last lines
+            if state[4] > 0:
+                offset = _find_last_lines(fileobj, stat.st_size, state[4])
+            else:
+                offset = stat.st_size
+            state[4] = None
+        state[:4] = [fileobj, stat.st_ino, offset, '']
+        return True
+
+    def _read(self, path, state):
+        fileobj = state[0]
+        size = os.fstat(fileobj.fileno()).st_size
+        if size < state[2]:
+            # truncated
+            state[2] = 0
+        if size == state[2]:
+            return ''
+        fileobj.seek(state[2])
+        data = fileobj.read(min(size - state[2], _FOLLOW_READ_SIZE))
+        state[2] += len(data)
+        return data
+
+    def poll(self):
+        """Read the lines appended to the files since the last poll.
+
+        Returns:
+          list; ['[path]\tline\n', ...]
+        """
+        lines = []
+        for path, state in sorted(self._files.items()):
+            data = ''
+            if state[0] is not None:
+                data = self._read(path, state)
+                try:
+                    replaced = os.stat(path).st_ino != state[1]
+                except OSError:
+                    replaced = True
+                if replaced and not data:
+                    state[0].close()
+                    state[0] = None
+            if state[0] is None and self._open(path, state):
+                data = self._read(path, state)
+            if not data:
+                continue
+
+            path_lines = (state[3] + data).split('\n')
+            # keep the unterminated last line for later
+            state[3] = path_lines.pop()
+            if not path_lines:
+                continue
+            if self.lastlines_dirpath:
+                # Overwrite the lastlines file for this source path
+                write_lastlines_file(self.lastlines_dirpath, path,
+                                     '\n'.join(path_lines[-3:]) + '\n')
+            for line in path_lines:
+                lines.append('[%s]\t%s\n' % (path, line))
+        return lines
+
+    def close(self):
+        for state in self._files.values():
+            if state[0] is not None:
+                state[0].close()
+                state[0] = None
+
+
 def follow_files(follow_paths, outstream, lastlines_dirpath=None, waitsecs=5):
-    """Launch tail on a set of files and merge their output into outstream.
+    """Follow a set of files and merge their new lines into outstream.
 
     Args:
-      follow_paths: list; Local paths to launch tail on.
+      follow_paths: list; Local paths to follow.
       outstream: file; Output stream to write aggregated lines to.
       lastlines_dirpath: Local dirpath to record last lines seen in.
-      waitsecs: int; Timeout for poll_tail_pipes.
+      waitsecs: int; Seconds after which an empty line is written when the
+          files have no new lines, to find out whether outstream was closed.
     """
-    procs, pipes = launch_tails(follow_paths, lastlines_dirpath)
-    while pipes:
-        lines, bad_pipes = poll_tail_pipes(pipes, lastlines_dirpath, waitsecs)
-        for bad in bad_pipes:
-            pipes.pop(bad)
-
-        try:
-            outstream.writelines(['\n'] + lines)
-            outstream.flush()
-        except (IOError, OSError), e:
-            # Something is wrong. Stop looping.
-            break
+    if lastlines_dirpath and not os.path.exists(lastlines_dirpath):
+        os.makedirs(lastlines_dirpath)
 
-    snuff(procs.values())
+    follower = FileFollower(follow_paths, lastlines_dirpath)
+    last_write = 0
+    try:
+        while True:
+            lines = follower.poll()
+            if lines or time.time() - last_write >= waitsecs:
+                try:
+                    outstream.writelines(['\n'] + lines)
+                    outstream.flush()
+                except (IOError, OSError), e:
+                    # Something is wrong. Stop looping.
+                    break
+                last_write = time.time()
+            if len(lines) < len(follow_paths):
+                time.sleep(FOLLOW_INTERVAL)
+    finally:
+        follower.close()
@@ -2,6 +2,7 @@
 
 import fcntl
 import os
+import re
 import signal
 import subprocess
 import StringIO
@@ -93,6 +94,77 @@ class AlertHooksTestCase(unittest.TestCase):
         self.assertEquals(len(hooks), 2)
 
 
+class AlertMatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.alerts = []
+        self.patterns = [r'^.*Kernel panic ?(.*)', r'^.*Oops ?(.*)',
+                         r'^.*(BUG:.*)', r'^(\w+) (\w+) BUG',
+                         r'^.*(?i)warning']
+
+    def _callback(self, index):
+        return lambda *groups: self.alerts.append((index,) + groups)
+
+    def _check(self, patterns, lines):
+        hooks = [(re.compile(pattern), self._callback(index))
+                 for index, pattern in enumerate(patterns)]
+        # what process_input used to do
+        for line in lines:
+            for regex, callback in hooks:
+                match = re.match(regex, line)
+                if match:
+                    callback(*match.groups())
+        expected = self.alerts
+        self.alerts = []
+        matcher = monitors_util.AlertMatcher(hooks)
+        for line in lines:
+            matcher.check(line)
+        self.assertEquals(expected, self.alerts)
+        return matcher
+
+    def test_prefilter(self):
+        matcher = self._check(self.patterns[:3], [
+            'nothing to see', 'Kernel panic - not syncing', 'an Oops',
+            'a b BUG: x', 'Oops BUG: here', 'BUG', 'Kernel panic'])
+        self.assert_(matcher._prefilter)
+
+    def test_optional_groups(self):
+        self._check([r'(Kernel.*)?', r'^.*(Oops.*)*$', r'^.*(BUG:.*)'],
+                    ['nothing here', 'an Oops', 'BUG: x'])
+
+    def test_no_prefilter(self):
+        matcher = self._check(self.patterns, [
+            'a WARNING', 'x y BUG', 'Oops'])
+        self.assertEquals(None, matcher._prefilter)
+
+    def test_required_literal(self):
+        for pattern, literal in (
+                (r'^.*Kernel panic ?(.*)', 'Kernel panic'),
+                (r'^.*(BUG:.*)', 'BUG:'),
+                (r'^(.*CommandAbort.*)', 'CommandAbort'),
+                (r'^.*kdb>', 'kdb>'),
+                (r'ab+c', 'ab'),
+                (r'ab{2}', 'a'),
+                (r'^.*(ab)?c', None),
+                (r'(Kernel.*)?', None),
+                (r'^.*(Oops.*)*$', None),
+                (r'^(.*(BUG)){0,1}', None),
+                (r'^(BUG[)]x)?', None),
+                (r'^(BUG\)x)*', None),
+                (r'^((BUG)x)', 'BUG'),
+                (r'^.*(BUG:)', 'BUG:'),
+                (r'^.*(?i)warning', None),
+                (r'^.*(a|b)', None),
+                (r'^.*\d+', None)):
+            self.assertEquals(literal, monitors_util.get_required_literal(
+                re.compile(pattern)))
+        self.assertEquals(None, monitors_util.get_required_literal(
+            re.compile('abc', re.I)))
+
+    def test_no_hooks(self):
+        self._check([], ['nothing', ''])
+
+
 class ProcessInputTestCase(unittest.TestCase):
 
     def test_process_input_simple(self):
@@ -110,6 +182,19 @@ class ProcessInputTestCase(unittest.TestCase):
             '%s\n%s\n' % (input.read(), monitors_util.TERM_MSG),
             logfile.read())
 
+    def test_process_input_alerts(self):
+        input = InlineStringIO("""
+            woo yay
+
+            Kernel panic - not syncing
+            """)
+        alerts = []
+        hooks = [(re.compile(r'^.*Kernel panic ?(.*)'), alerts.append),
+                 (re.compile(r'^.*(yay)'), alerts.append)]
+        monitors_util.process_input(input, StringIO.StringIO(),
+                                    alert_hooks=hooks)
+        self.assertEquals(['yay', '- not syncing'], alerts)
+
 
 class FollowFilesTestCase(unittest.TestCase):
 
@@ -172,6 +257,60 @@ class FollowFilesTestCase(unittest.TestCase):
         last_shouldmatch = '[%s]\t%s' % (self.logfile_path, self.lastline)
         self.assertEquals(lines[-1], last_shouldmatch)
 
+    def test_file_follower_nostate(self):
+        follower = monitors_util.FileFollower([self.logfile_path])
+        lines = follower.poll()
+        follower.close()
+        self.assertEquals(5, len(lines))
+        self.assertEquals('[%s]\t%s' % (self.logfile_path, self.firstline),
+                          lines[0])
+
+    def test_file_follower(self):
+        follower = monitors_util.FileFollower([self.logfile_path],
+                                              self.lastlines_dirpath)
+        lines = follower.poll()
+        self.assertEquals(
+            ['[%s]\t%s' % (self.logfile_path, line)
+             for line in (self.line_after_lastline_seen, 'man\n',
+                          self.lastline)],
+            lines)
+        self.assertEquals([], follower.poll())
+
+        logfile = open(self.logfile_path, 'a')
+        logfile.write('new\nunterminated')
+        logfile.close()
+        self.assertEquals(['[%s]\tnew\n' % self.logfile_path],
+                          follower.poll())
+        follower.close()
+
+        # a new follower starts after the last lines seen
+        logfile = open(self.logfile_path, 'a')
+        logfile.write(' now\n')
+        logfile.close()
+        follower = monitors_util.FileFollower([self.logfile_path],
+                                              self.lastlines_dirpath)
+        self.assertEquals(['[%s]\tunterminated now\n' % self.logfile_path],
+                          follower.poll())
+
+        # log rotation
+        os.rename(self.logfile_path, self.logfile_path + '.1')
+        logfile = open(self.logfile_path, 'w')
+        logfile.write('rotated\n')
+        logfile.close()
+        self.assertEquals(['[%s]\trotated\n' % self.logfile_path],
+                          follower.poll())
+        follower.close()
+
+    def test_file_follower_missing(self):
+        path = os.path.join(self.logfile_dirpath, 'missing')
+        follower = monitors_util.FileFollower([path])
+        self.assertEquals([], follower.poll())
+        logfile = open(path, 'w')
+        logfile.write('created\n')
+        logfile.close()
+        self.assertEquals(['[%s]\tcreated\n' % path], follower.poll())
+        follower.close()
+
 
 if __name__ == '__main__':
     unittest.main()
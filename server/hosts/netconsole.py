@@ -6,6 +6,7 @@ import socket
 
 from autotest.client.shared import utils, error
 from autotest.server.hosts import remote
+from autotest.server.hosts.monitors import console
 
 
 class NetconsoleHost(remote.RemoteHost):
@@ -14,6 +15,7 @@ class NetconsoleHost(remote.RemoteHost):
         super(NetconsoleHost, self)._initialize(*args, **dargs)
 
         self.__logger = None
+        self.__console_stream = None
         self.__console_log = console_log
 
         # get a socket for us to listen on
@@ -52,29 +54,38 @@ class NetconsoleHost(remote.RemoteHost):
         if self.__netconsole_params is None:
             return
 
-        r, w = os.pipe()
-        script_path = os.path.join(self.monitordir, "console.py")
-        cmd = [sys.executable, script_path, self.__console_log, str(w)]
+        if console.SHARED_MONITOR:
+            self.__console_stream = console.add_stream(
+                self.__socket.fileno(), self.__console_log)
+            self.__warning_stream = self.__console_stream.warning_stream
+        else:
+            r, w = os.pipe()
+            script_path = os.path.join(self.monitordir, "console.py")
+            cmd = [sys.executable, script_path, self.__console_log, str(w)]
+
+            self.__warning_stream = os.fdopen(r, "r", 0)
 
-        self.__warning_stream = os.fdopen(r, "r", 0)
+            stdin = self.__socket.fileno()
+            stdout = stderr = open(os.devnull, "w")
+            self.__logger = subprocess.Popen(cmd, stdin=stdin, stdout=stdout,
+                                             stderr=stderr)
+            os.close(w)
         if self.job:
             self.job.warning_loggers.add(self.__warning_stream)
 
-        stdin = self.__socket.fileno()
-        stdout = stderr = open(os.devnull, "w")
-        self.__logger = subprocess.Popen(cmd, stdin=stdin, stdout=stdout,
-                                         stderr=stderr)
-        os.close(w)
-
         self.__unload_netconsole_module()
         self.__load_netconsole_module()
 
     def stop_loggers(self):
         super(NetconsoleHost, self).stop_loggers()
 
-        if self.__logger:
-            utils.nuke_subprocess(self.__logger)
-            self.__logger = None
+        if self.__logger or self.__console_stream:
+            if self.__logger:
+                utils.nuke_subprocess(self.__logger)
+                self.__logger = None
+            else:
+                self.__console_stream.close()
+                self.__console_stream = None
             if self.job:
                 self.job.warning_loggers.discard(self.__warning_stream)
             self.__warning_stream.close()
@@ -6,6 +6,7 @@ import logging
 from autotest.client.shared import utils, error
 from autotest.server import utils as server_utils
 from autotest.server.hosts import remote
+from autotest.server.hosts.monitors import console
 
 
 SiteHost = utils.import_site_class(
@@ -21,6 +22,7 @@ class SerialHost(SiteHost):
         super(SerialHost, self)._initialize(*args, **dargs)
 
         self.__logger = None
+        self.__console_stream = None
         self.__console_log = console_log
 
         self.conmux_server = conmux_server
@@ -77,25 +79,41 @@ class SerialHost(SiteHost):
             return
 
         r, w = os.pipe()
-        script_path = os.path.join(self.monitordir, 'console.py')
-        cmd = [self.conmux_attach, self.get_conmux_hostname(),
-               '%s %s %s %d' % (sys.executable, script_path,
-                                self.__console_log, w)]
-
-        self.__warning_stream = os.fdopen(r, 'r', 0)
-        if self.job:
-            self.job.warning_loggers.add(self.__warning_stream)
+        if console.SHARED_MONITOR:
+            # the shared console monitor reads the console from a pipe
+            cmd = [self.conmux_attach, self.get_conmux_hostname(),
+                   'cat >&%d' % w]
+        else:
+            script_path = os.path.join(self.monitordir, 'console.py')
+            cmd = [self.conmux_attach, self.get_conmux_hostname(),
+                   '%s %s %s %d' % (sys.executable, script_path,
+                                    self.__console_log, w)]
 
         stdout = stderr = open(os.devnull, 'w')
         self.__logger = subprocess.Popen(cmd, stdout=stdout, stderr=stderr)
         os.close(w)
 
+        if console.SHARED_MONITOR:
+            try:
+                self.__console_stream = console.add_stream(
+                    r, self.__console_log)
+            finally:
+                os.close(r)
+            self.__warning_stream = self.__console_stream.warning_stream
+        else:
+            self.__warning_stream = os.fdopen(r, 'r', 0)
+        if self.job:
+            self.job.warning_loggers.add(self.__warning_stream)
+
     def stop_loggers(self):
         super(SerialHost, self).stop_loggers()
 
         if self.__logger:
             utils.nuke_subprocess(self.__logger)
             self.__logger = None
+            if self.__console_stream:
+                self.__console_stream.close()
+                self.__console_stream = None
             if self.job:
                 self.job.warning_loggers.discard(self.__warning_stream)
             self.__warning_stream.close()
@@ -570,6 +570,7 @@ class base_server_job(base_job.base_job):
                 self._execute_code(CLEANUP_CONTROL_FILE, namespace)
             if install_after and machines:
                 self._execute_code(INSTALL_CONTROL_FILE, namespace)
+            self._logger.flush()
 
     def run_test(self, url, *args, **dargs):
         """
@@ -7,7 +7,7 @@ import signal
 import cPickle
 import logging
 
-from autotest.client.shared import error, utils
+from autotest.client.shared import base_job, error, utils
 
 
 # entry points that use subcommand must set this to their logging manager
@@ -155,6 +155,7 @@ class subcommand(object):
     def fork_start(self):
         sys.stdout.flush()
         sys.stderr.flush()
+        base_job.flush_status_logs()
         r, w = os.pipe()
         self.returncode = None
         self.pid = os.fork()
@@ -191,6 +192,7 @@ class subcommand(object):
         finally:
             sys.stdout.flush()
             sys.stderr.flush()
+            base_job.flush_status_logs()
             os._exit(exit_code)
 
     def _handle_exitstatus(self, sts):
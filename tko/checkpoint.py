@@ -0,0 +1,182 @@
+"""
+Checkpoints of the parsing of a status log.
+
+A checkpoint records how far into a status log a resumable parser got (see
+tko.parsers.base.parser.get_state), together with the parser state and the
+tests it produced until then.  It is stored in the results directory of the
+job, so that the next parse of the job only reads the lines appended to the
+log since then.
+
+The checkpoint is only used if the log still starts with what was parsed:
+the size of the log and a digest of the bytes before the checkpoint offset
+are checked when loading it.
+"""
+
+import cPickle
+import logging
+import os
+
+from autotest.client.shared import utils
+
+
+CHECKPOINT_FILE = '.parse.checkpoint'
+
+# bump when the parser state or the test models change incompatibly
+FORMAT_VERSION = 2
+
+# bytes before the checkpoint offset covered by the digest
+_DIGEST_BYTES = 64 * 1024
+
+
+def _digest(status_file, offset):
+    start = max(0, offset - _DIGEST_BYTES)
+    status_file.seek(start)
+    return utils.hash('md5', status_file.read(offset - start)).hexdigest()
+
+
+class Checkpoint(object):
+
+    """
+    :param offset: byte offset in the status log of the first line not
+            processed by the parser.
+    :param state: state returned by get_state() after that line.
+    :param tests: tests produced by the parser before that line.
+    """
+
+    def __init__(self, status_version, status_log, offset, state, tests):
+        self.format_version = FORMAT_VERSION
+        self.status_version = status_version
+        self.status_log = os.path.basename(status_log)
+        self.offset = offset
+        self.state = state
+        self.tests = tests
+        self.digest = None
+
+
+def load(results_dir, status_version, status_log):
+    """
+    :return: the Checkpoint of the status log in results_dir, or None if there
+            is none or the log changed since it was saved.
+    """
+    path = os.path.join(results_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return None
+    try:
+        checkpoint_file = open(path, 'rb')
+        try:
+            checkpoint = cPickle.load(checkpoint_file)
+        finally:
+            checkpoint_file.close()
+    except Exception, e:
+        logging.warning('Ignoring unreadable parse checkpoint %s: %s', path, e)
+        return None
+
+    if (getattr(checkpoint, 'format_version', None) != FORMAT_VERSION or
+            checkpoint.status_version != status_version or
+            checkpoint.status_log != os.path.basename(status_log)):
+        logging.info('Ignoring parse checkpoint %s of another parser', path)
+        return None
+    if os.path.getsize(status_log) < checkpoint.offset:
+        logging.info('Ignoring parse checkpoint %s, %s was truncated',
+                     path, status_log)
+        return None
+    status_file = open(status_log, 'rb')
+    try:
+        digest = _digest(status_file, checkpoint.offset)
+    finally:
+        status_file.close()
+    if digest != checkpoint.digest:
+        logging.info('Ignoring parse checkpoint %s, %s was rewritten',
+                     path, status_log)
+        return None
+    return checkpoint
+
+
+def save(results_dir, checkpoint, status_log):
+    """
+    Save a checkpoint of the status log in results_dir, replacing the previous
+    one atomically.
+    """
+    status_file = open(status_log, 'rb')
+    try:
+        checkpoint.digest = _digest(status_file, checkpoint.offset)
+    finally:
+        status_file.close()
+
+    path = os.path.join(results_dir, CHECKPOINT_FILE)
+    tmp_path = path + '.tmp'
+    checkpoint_file = open(tmp_path, 'wb')
+    try:
+        cPickle.dump(checkpoint, checkpoint_file, cPickle.HIGHEST_PROTOCOL)
+    finally:
+        checkpoint_file.close()
+    os.rename(tmp_path, path)
+
+
+def remove(results_dir):
+    path = os.path.join(results_dir, CHECKPOINT_FILE)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def read_lines(status_file, offset, lines_per_chunk=1000):
+    """
+    Read the complete lines of a status log from offset on, in chunks.  A
+    last line without newline, still being written, is left out.
+
+    :return: generator of (list of lines, offset after these lines).
+    """
+    status_file.seek(offset)
+    lines = []
+    for line in status_file:
+        if not line.endswith('\n'):
+            break
+        lines.append(line)
+        offset += len(line)
+        if len(lines) >= lines_per_chunk:
+            yield lines, offset
+            lines = []
+    if lines:
+        yield lines, offset
+
+
+def parse_status_log(parser, job, results_dir, status_version, status_log,
+                     from_start=False):
+    """
+    Parse a status log, resuming from the checkpoint of the previous parse
+    unless from_start is set, and save a new checkpoint before the end of the
+    log is processed.
+
+    :return: list of the tests parsed, possibly with duplicates.
+    """
+    saved = None
+    if parser.resumable and not from_start:
+        saved = load(results_dir, status_version, status_log)
+    if saved is None:
+        offset, tests = 0, []
+        parser.start(job)
+    else:
+        logging.info('Resuming parse of %s at byte %d', status_log,
+                     saved.offset)
+        offset, tests = saved.offset, saved.tests
+        parser.start(job, saved.state)
+
+    status_file = open(status_log)
+    try:
+        for lines, offset in read_lines(status_file, offset):
+            tests.extend(parser.process_lines(lines))
+        if parser.resumable:
+            try:
+                save(results_dir, Checkpoint(status_version, status_log,
+                                             offset, parser.get_state(),
+                                             tests),
+                     status_log)
+            except (IOError, OSError), e:
+                logging.warning('Unable to save the parse checkpoint: %s', e)
+        # a last line still being written
+        status_file.seek(offset)
+        rest = status_file.read()
+    finally:
+        status_file.close()
+
+    return tests + parser.end(rest and [rest] or [])
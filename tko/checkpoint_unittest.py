@@ -0,0 +1,107 @@
+#!/usr/bin/python
+
+"""Tests for autotest.tko.checkpoint."""
+
+import os
+import shutil
+import tempfile
+
+import common
+from autotest.client.shared.test_utils import unittest
+from autotest.tko import checkpoint, status_lib
+
+_STATUS_LINES = [
+    'START\t----\t----\ttimestamp=1300000000\t\n',
+    '\tSTART\tsleeptest\tsleeptest\ttimestamp=1300000001\t\n',
+    '\t\tGOOD\tsleeptest\tsleeptest\ttimestamp=1300000002\tcompleted\n',
+    '\tEND GOOD\tsleeptest\tsleeptest\ttimestamp=1300000003\t\n',
+    '\tSTART\tdbench\tdbench\ttimestamp=1300000004\t\n',
+    '\t\tFAIL\tdbench\tdbench\ttimestamp=1300000005\tbroken\n',
+    '\tEND FAIL\tdbench\tdbench\ttimestamp=1300000006\t\n',
+    'END GOOD\t----\t----\ttimestamp=1300000007\t\n',
+]
+
+
+class ParseStatusLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.results_dir = tempfile.mkdtemp()
+        keyval = open(os.path.join(self.results_dir, 'keyval'), 'w')
+        keyval.write('hostname=myhost\nstatus_version=1\n')
+        keyval.close()
+        self.status_log = os.path.join(self.results_dir, 'status.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.results_dir)
+
+    def _write_status(self, lines, mode='a'):
+        status_file = open(self.status_log, mode)
+        status_file.writelines(lines)
+        status_file.close()
+
+    def _parse(self, from_start=False):
+        parser = status_lib.parser(1)
+        job = parser.make_job(self.results_dir)
+        tests = checkpoint.parse_status_log(parser, job, self.results_dir, 1,
+                                            self.status_log, from_start)
+        results = []
+        for test in tests:
+            result = (test.testname, test.status, test.reason)
+            if result not in results:
+                results.append(result)
+        return results
+
+    def _full_parse(self):
+        checkpoint.remove(self.results_dir)
+        return self._parse()
+
+    def test_resume(self):
+        self._write_status(_STATUS_LINES[:3])
+        self._parse()
+        saved = checkpoint.load(self.results_dir, 1, self.status_log)
+        self.assertEqual(os.path.getsize(self.status_log), saved.offset)
+
+        # a line still being written is not part of the checkpoint
+        self._write_status(_STATUS_LINES[3:5] + [_STATUS_LINES[5][:10]])
+        self._parse()
+        saved = checkpoint.load(self.results_dir, 1, self.status_log)
+        self.assertEqual(len(''.join(_STATUS_LINES[:5])), saved.offset)
+
+        self._write_status([_STATUS_LINES[5][10:]] + _STATUS_LINES[6:])
+        results = self._parse()
+        self.assertEqual(self._full_parse(), results)
+        self.assertTrue(('dbench', 'FAIL', 'broken') in results)
+        self.assertTrue(('sleeptest', 'GOOD', 'completed') in results)
+
+    def test_rewritten_log_parsed_from_start(self):
+        self._write_status(_STATUS_LINES[:4])
+        self._parse()
+        self._write_status(_STATUS_LINES[4:], mode='w')
+        self.assertEqual(None, checkpoint.load(self.results_dir, 1,
+                                               self.status_log))
+        results = self._parse()
+        self.assertFalse('sleeptest' in [result[0] for result in results])
+
+    def test_from_start(self):
+        self._write_status(_STATUS_LINES)
+        self._parse()
+        saved = checkpoint.load(self.results_dir, 1, self.status_log)
+        saved.tests = []
+        checkpoint.save(self.results_dir, saved, self.status_log)
+        self.assertEqual(self._full_parse(), self._parse(from_start=True))
+
+    def test_read_lines(self):
+        self._write_status(['a\n', 'bb\n', 'ccc\n', 'partial'])
+        status_file = open(self.status_log)
+        try:
+            self.assertEqual([(['bb\n', 'ccc\n'], 9)],
+                             list(checkpoint.read_lines(status_file, 2)))
+            self.assertEqual([(['a\n', 'bb\n'], 5), (['ccc\n'], 9)],
+                             list(checkpoint.read_lines(status_file, 0,
+                                                        lines_per_chunk=2)))
+        finally:
+            status_file.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,31 +1,282 @@
+import logging
 import os
 import re
+import time
 
 from autotest.tko import utils
 from autotest.frontend import setup_django_environment
 from autotest.frontend.tko import models_utils as tko_models_utils
 from autotest.frontend.tko import models as tko_models
+from django.db import transaction
+
+
+class Ingester(object):
+
+    """
+    Writes parsed jobs into the TKO database.
+
+    The iteration keyvals, iteration results and test attributes of the
+    tests of a job are built in memory and written with multi-row INSERTs,
+    in the same transaction as the job and its tests.  Kernel, status and
+    machine lookups are cached for the life of the Ingester, so that
+    autotest-tko-parse looks each of them up once per run.  The status
+    rollups of the job (see TestStatusRollup) are recomputed in the same
+    transaction.
+
+    The rows written and the time spent writing them are accumulated in the
+    rows and seconds attributes.
+    """
+
+    # rows per INSERT statement
+    _BATCH_SIZE = 500
+
+    def __init__(self):
+        self._kernels = {}
+        self._statuses = None
+        self._machines = {}
+        self.rows = 0
+        self.seconds = 0.0
+
+    def rows_per_second(self):
+        if not self.seconds:
+            return 0.0
+        return self.rows / self.seconds
+
+    def _clear_caches(self):
+        # objects created by a rolled back transaction must not be reused
+        self._kernels = {}
+        self._statuses = None
+        self._machines = {}
+
+    def _write(self, function, *args):
+        start = time.time()
+        try:
+            rows = transaction.commit_on_success(function)(*args)
+        except Exception:
+            self._clear_caches()
+            raise
+        self.rows += rows
+        self.seconds += time.time() - start
+        return rows
+
+    def kernel(self, kernel):
+        tko_kernel = self._kernels.get(kernel.kernel_hash)
+        if tko_kernel is None:
+            tko_kernel = insert_kernel(kernel)
+            self._kernels[kernel.kernel_hash] = tko_kernel
+        return tko_kernel
 
+    def status(self, word):
+        if self._statuses is None:
+            self._statuses = dict((status.word, status) for status
+                                  in tko_models.Status.objects.all())
+        status = self._statuses.get(word)
+        if status is None:
+            status = tko_models.Status.objects.get(word=word)
+            self._statuses[word] = status
+        return status
+
+    def machine(self, hostname, machine_group=None, owner=None):
+        machine = self._machines.get(hostname)
+        if machine is None:
+            machine = tko_models_utils.machine_create(hostname)
+            self._machines[hostname] = machine
+        changed = machine.pk is None
+        if machine_group is not None and machine_group != machine.machine_group:
+            machine.machine_group = machine_group
+            changed = True
+        if owner is not None and owner != machine.owner:
+            machine.owner = owner
+            changed = True
+        if changed:
+            machine.save()
+        return machine
+
+    def _bulk_create(self, rows):
+        """
+        Insert model instances, grouped by model.
+
+        :return: the number of rows inserted.
+        """
+        rows_by_model = {}
+        models = []
+        for row in rows:
+            if row.__class__ not in rows_by_model:
+                rows_by_model[row.__class__] = []
+                models.append(row.__class__)
+            rows_by_model[row.__class__].append(row)
+        for model in models:
+            model.objects.bulk_create(rows_by_model[model],
+                                      batch_size=self._BATCH_SIZE)
+        return len(rows)
+
+    @staticmethod
+    def _delete_test_rows(test_ids):
+        """Delete the parsed rows of reparsed tests, before they are added."""
+        if not test_ids:
+            return
+        tko_models.IterationResult.objects.filter(test__in=test_ids).delete()
+        tko_models.IterationAttribute.objects.filter(
+            test__in=test_ids).delete()
+        tko_models.TestAttribute.objects.filter(test__in=test_ids,
+                                                user_created=False).delete()
 
-def insert_patch(tko_kernel, patch):
-    name = os.path.basename(patch.reference)[:80]
-    tko_patch, created = tko_models.Patch.objects.get_or_create(
-        kernel=tko_kernel,
-        name=name,
-        url=patch.reference,
-        hash=patch.hash)
-    return tko_patch
+    def _add_test(self, job, test, tko_job, tko_machine, rows,
+                  reparsed_test_ids):
+        """
+        Insert or update the row of a test and add the rows of its keyvals
+        and attributes to rows.
+        """
+        subdir = test.subdir
+        if test.subdir is None:
+            subdir = ''
+
+        tko_test_data = {
+            'job': tko_job,
+            'test': test.testname,
+            'subdir': subdir,
+            'kernel': self.kernel(test.kernel),
+            'status': self.status(test.status),
+            'reason': test.reason,
+            'machine': tko_machine,
+            'started_time': test.started_time,
+            'finished_time': test.finished_time
+        }
+
+        test_already_exists = hasattr(test, "test_idx")
+        if test_already_exists:
+            tko_models.Test.objects.filter(
+                pk=test.test_idx).update(**tko_test_data)
+            tko_test = tko_models.Test(test_idx=test.test_idx,
+                                       **tko_test_data)
+            # iteration results/attributes and test attributes are re-added
+            reparsed_test_ids.append(test.test_idx)
+        else:
+            tko_test = tko_models.Test.objects.create(**tko_test_data)
+            test.test_idx = tko_test.test_idx
+
+        for i in test.iterations:
+            for key, value in i.attr_keyval.iteritems():
+                rows.append(tko_models.IterationAttribute(
+                    test=tko_test,
+                    attribute=key,
+                    iteration=i.index,
+                    value=value))
+
+            for key, value in i.perf_keyval.iteritems():
+                rows.append(tko_models.IterationResult(
+                    test=tko_test,
+                    iteration=i.index,
+                    attribute=key,
+                    value=value))
+
+        for key, value in test.attributes.iteritems():
+            rows.append(tko_models.TestAttribute(
+                test=tko_test,
+                attribute=key,
+                value=value))
+
+        for label_index in test.labels:
+            label = tko_models_utils.test_label_get_by_idx(label_index)
+            if label is not None:
+                label.tests.add(tko_test)
+
+    def _insert_tests(self, job, tests, tko_job, tko_machine):
+        rows = []
+        reparsed_test_ids = []
+        for test in tests:
+            self._add_test(job, test, tko_job, tko_machine, rows,
+                           reparsed_test_ids)
+        self._delete_test_rows(reparsed_test_ids)
+        num_rows = len(tests) + self._bulk_create(rows)
+        # derived rows, not counted
+        tko_models.TestStatusRollup.objects.refresh_jobs([tko_job.pk])
+        return num_rows
+
+    def _insert_test(self, job, test, tko_job, tko_machine):
+        if tko_job is None:
+            tko_job = tko_models_utils.job_get_by_idx(job.index)
+
+        if tko_machine is None:
+            tko_machine = tko_models_utils.machine_get_by_idx(job.machine_idx)
+
+        return self._insert_tests(job, [test], tko_job, tko_machine)
+
+    def insert_test(self, job, test, tko_job=None, tko_machine=None):
+        self._write(self._insert_test, job, test, tko_job, tko_machine)
+
+    def _update_keyvals(self, tko_job, keyval_dict):
+        """
+        :return: the number of keyval rows inserted or updated.
+        """
+        existing = dict((keyval.key, keyval) for keyval in
+                        tko_models.JobKeyval.objects.filter(job=tko_job))
+        rows = []
+        num_updated = 0
+        for key, value in keyval_dict.iteritems():
+            job_keyval = existing.get(key)
+            if job_keyval is None:
+                rows.append(tko_models.JobKeyval(job=tko_job, key=key,
+                                                 value=value))
+            elif job_keyval.value != value:
+                tko_models.JobKeyval.objects.filter(
+                    pk=job_keyval.pk).update(value=value)
+                num_updated += 1
+        return num_updated + self._bulk_create(rows)
+
+    def _insert_job(self, jobname, job):
+        # write the job into the database
+        machine = self.machine(job.machine, job.machine_group,
+                               job.machine_owner)
+
+        # Update back machine index, used by some legacy code
+        job.machine_idx = machine.pk
+
+        afe_job_id = utils.get_afe_job_id(jobname)
+        if not afe_job_id:
+            afe_job_id = None
+
+        tko_job_data = {
+            'tag': jobname,
+            'label': job.label,
+            'machine': machine,
+            'queued_time': job.queued_time,
+            'started_time': job.started_time,
+            'finished_time': job.finished_time,
+            'afe_job_id': afe_job_id
+        }
+
+        job_already_exists = hasattr(job, 'index')
+        if job_already_exists:
+            tko_models.Job.objects.filter(pk=job.index).update(**tko_job_data)
+            tko_job = tko_models.Job(job_idx=job.index, **tko_job_data)
+        else:
+            tko_job = tko_models.Job.objects.create(**tko_job_data)
+
+        # Update back the index of the job object, used by some legacy code
+        job.index = tko_job.pk
+
+        rows = 1 + self._update_keyvals(tko_job, job.keyval_dict)
+
+        # now insert the tests
+        return rows + self._insert_tests(job, job.tests, tko_job, machine)
+
+    def insert_job(self, jobname, job):
+        start = time.time()
+        rows = self._write(self._insert_job, jobname, job)
+        logging.debug('Wrote %d rows for job %s in %.2fs', rows, jobname,
+                      time.time() - start)
 
 
 def insert_kernel(kernel):
-    tko_kernel, created = tko_models.Kernel.objects.get_or_create(
-        kernel_hash=kernel.kernel_hash)
-
-    if not created:
-        return tko_kernel
+    try:
+        return tko_models.Kernel.objects.get(kernel_hash=kernel.kernel_hash)
+    except tko_models.Kernel.DoesNotExist:
+        pass
 
-    tko_kernel.base = kernel.base
-    tko_kernel.printable = kernel.base
+    tko_kernel = tko_models.Kernel.objects.create(
+        kernel_hash=kernel.kernel_hash, base=kernel.base,
+        printable=kernel.base)
 
     # If this kernel has any significant patches, append their hash
     # as differentiator.
@@ -39,130 +290,27 @@ def insert_kernel(kernel):
     if patch_count > 0:
         tko_kernel.printable = '%s p%d' % (tko_kernel.printable,
                                            tko_kernel.kernel_idx)
+        tko_kernel.save()
 
-    for patch in kernel.patches:
-        insert_patch(tko_kernel, patch)
+    # a new kernel has no patches yet
+    tko_models.Patch.objects.bulk_create(
+        [tko_models.Patch(kernel=tko_kernel,
+                          name=os.path.basename(patch.reference)[:80],
+                          url=patch.reference,
+                          the_hash=patch.hash)
+         for patch in kernel.patches])
 
     return tko_kernel
 
 
 def insert_test(job, test, tko_job=None, tko_machine=None):
-    tko_kernel = insert_kernel(test.kernel)
-    status = tko_models.Status.objects.get(word=test.status)
-
-    if tko_job is None:
-        tko_job = tko_models_utils.job_get_by_idx(job.index)
-
-    if tko_machine is None:
-        tko_machine = tko_models_utils.machine_get_by_idx(job.machine_idx)
-
-    subdir = test.subdir
-    if test.subdir is None:
-        subdir = ''
-
-    tko_test_data = {
-        'job': tko_job,
-        'test': test.testname,
-        'subdir': subdir,
-        'kernel': tko_kernel,
-        'status': status,
-        'reason': test.reason,
-        'machine': tko_machine,
-        'started_time': test.started_time,
-        'finished_time': test.finished_time
-    }
-
-    test_already_exists = hasattr(test, "test_idx")
-    if test_already_exists:
-        tko_models.Test.objects.filter(pk=test.test_idx).update(**tko_test_data)
-        tko_test = tko_models.Test.objects.get(pk=test.test_idx)
-
-        # clean up iteration result/attributes and test attributes that will
-        # be re-added shortly
-        tko_models.IterationResult.objects.filter(
-            test=test.test_idx).delete()
-        tko_models.IterationAttribute.objects.filter(
-            test=test.test_idx).delete()
-        tko_models.TestAttribute.objects.filter(test=test.test_idx,
-                                                user_created=False).delete()
+    Ingester().insert_test(job, test, tko_job, tko_machine)
 
-    else:
-        tko_test = tko_models.Test.objects.create(**tko_test_data)
-        tko_test.save()
-        test.test_idx = tko_test.test_idx
 
-    for i in test.iterations:
-        for key, value in i.attr_keyval.iteritems():
-            tko_models.IterationAttribute.objects.create(
-                test=tko_test,
-                attribute=key,
-                iteration=i.index,
-                value=value)
-
-        for key, value in i.perf_keyval.iteritems():
-            tko_models.IterationResult.objects.create(
-                test=tko_test,
-                iteration=i.index,
-                attribute=key,
-                value=value)
-
-    for key, value in test.attributes.iteritems():
-        tko_models.TestAttribute.objects.create(
-            test=tko_test,
-            attribute=key,
-            value=value)
-
-    for label_index in test.labels:
-        label = tko_models_utils.test_label_get_by_idx(label_index)
-        if label is not None:
-            label.tests.append(tko_test)
-
-
-def insert_job(jobname, job):
-    # write the job into the database
-    machine = tko_models_utils.machine_create(job.machine,
-                                              job.machine_group,
-                                              job.machine_owner)
-
-    # Update back machine index, used by some legacy code
-    machine.save()
-    job.machine_idx = machine.pk
-
-    afe_job_id = utils.get_afe_job_id(jobname)
-    if not afe_job_id:
-        afe_job_id = None
-
-    tko_job_data = {
-        'tag': jobname,
-        'label': job.label,
-        'machine': machine,
-        'queued_time': job.queued_time,
-        'started_time': job.started_time,
-        'finished_time': job.finished_time,
-        'afe_job_id': afe_job_id
-    }
-
-    job_already_exists = hasattr(job, 'index')
-    if job_already_exists:
-        tko_models.Job.objects.filter(pk=job.index).update(**tko_job_data)
-        tko_job = tko_models.Job.objects.get(pk=job.index)
-    else:
-        tko_job = tko_models.Job.objects.create(**tko_job_data)
-
-    # Update back the index of the job object, used by some legacy code
-    tko_job.save()
-    job.index = tko_job.pk
-
-    # update job keyvals
-    for key, value in job.keyval_dict.iteritems():
-        # We find or create using job and key only
-        job_keyval, created = tko_models.JobKeyval.objects.get_or_create(
-            job=tko_job,
-            key=key)
-        # and now we have to update with value
-        job_keyval.value = value
-        job_keyval.save()
-
-    # now insert the tests
-    for test in job.tests:
-        insert_test(job, test, tko_job, machine)
+def insert_job(jobname, job, ingester=None):
+    """
+    :param ingester: Ingester whose lookup caches to use, a new one if None.
+    """
+    if ingester is None:
+        ingester = Ingester()
+    ingester.insert_job(jobname, job)
@@ -0,0 +1,146 @@
+#!/usr/bin/python
+
+"""Tests for autotest.tko.dbutils."""
+
+import common
+from autotest.frontend import setup_django_environment
+from autotest.frontend import setup_test_environment
+from autotest.client.shared.test_utils import mock, unittest
+from autotest.frontend.tko import models as tko_models
+from autotest.frontend.tko import rpc_interface_unittest
+from autotest.tko import dbutils, models
+
+
+class IngesterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.god = mock.mock_god()
+        setup_test_environment.set_up()
+        rpc_interface_unittest.fix_iteration_tables()
+        for word in ('GOOD', 'FAIL'):
+            tko_models.Status.objects.get_or_create(word=word)
+        self.kernel = models.kernel(
+            '2.6.32', [models.patch('spec', 'http://x/fix.patch', 'hash1')],
+            'kernelhash')
+        self.ingester = dbutils.Ingester()
+
+    def tearDown(self):
+        self.god.unstub_all()
+        setup_test_environment.tear_down()
+
+    def _test(self, testname, status='GOOD', perf=None, attributes=None):
+        iteration = models.iteration(1, {'iattr': 'ival'}, perf or {})
+        return models.test(testname, testname, status, '', self.kernel,
+                           'myhost', None, None, [iteration],
+                           attributes or {}, [])
+
+    def _job(self, tests, keyvals=None):
+        job = models.job('/results/1-user/myhost', 'user', 'label', 'myhost',
+                         None, None, None, 'owner', 'group', None, None,
+                         keyvals or {})
+        job.tests = tests
+        return job
+
+    def _perf_values(self, tko_test):
+        return dict(tko_models.IterationResult.objects.filter(
+            test=tko_test).values_list('attribute', 'value'))
+
+    def test_insert_job(self):
+        perf = dict(('key%d' % i, float(i)) for i in xrange(1200))
+        job = self._job([self._test('test1', perf=perf,
+                                    attributes={'attr': 'value'}),
+                         self._test('test2', status='FAIL')],
+                        keyvals={'user': 'user'})
+        self.ingester.insert_job('1-user/myhost', job)
+
+        tko_job = tko_models.Job.objects.get(tag='1-user/myhost')
+        self.assertEqual(job.index, tko_job.pk)
+        self.assertEqual(1, tko_job.afe_job_id)
+        self.assertEqual('group', tko_job.machine.machine_group)
+        tests = tko_models.Test.objects.filter(job=tko_job).order_by('test')
+        self.assertEqual(['test1', 'test2'], [test.test for test in tests])
+        self.assertEqual('FAIL', tests[1].status.word)
+        self.assertEqual(perf, self._perf_values(tests[0]))
+        self.assertEqual(2, tko_models.IterationAttribute.objects.filter(
+            test__in=tests).count())
+        self.assertEqual(['attr'], [attribute.attribute for attribute in
+                                    tko_models.TestAttribute.objects.filter(
+                                        test=tests[0])])
+        self.assertEqual(1, tko_models.Patch.objects.filter(
+            kernel=tests[0].kernel).count())
+        # job, keyval, tests, iteration rows and test attribute
+        self.assertEqual(1 + 1 + 2 + 1200 + 2 + 1, self.ingester.rows)
+
+    def test_reparse(self):
+        job = self._job([self._test('test1', perf={'key': 1.0},
+                                    attributes={'attr': 'value'})])
+        self.ingester.insert_job('1-user/myhost', job)
+        tko_test = tko_models.Test.objects.get(pk=job.tests[0].test_idx)
+        tko_test.set_attribute('user_attr', 'value')
+
+        reparsed = self._job([self._test('test1', perf={'key': 2.0},
+                                         attributes={'attr': 'value'})])
+        reparsed.index = job.index
+        reparsed.tests[0].test_idx = tko_test.pk
+        self.ingester.insert_job('1-user/myhost', reparsed)
+
+        self.assertEqual(1, tko_models.Test.objects.count())
+        self.assertEqual({'key': 2.0}, self._perf_values(tko_test))
+        self.assertEqual(1, tko_models.IterationAttribute.objects.count())
+        self.assertEqual(
+            ['attr', 'user_attr'],
+            sorted(tko_models.TestAttribute.objects.filter(
+                test=tko_test).values_list('attribute', flat=True)))
+
+    def _rollups(self):
+        return sorted(tko_models.TestStatusRollup.objects.values_list(
+            'test_name', 'status__word', 'test_count'))
+
+    def test_rollups(self):
+        job = self._job([self._test('test1'), self._test('test1'),
+                         self._test('test2', status='FAIL')])
+        self.ingester.insert_job('1-user/myhost', job)
+        self.assertEqual([('test1', 'GOOD', 2), ('test2', 'FAIL', 1)],
+                         self._rollups())
+
+        reparsed = self._job([self._test('test1'), self._test('test1'),
+                              self._test('test2')])
+        reparsed.index = job.index
+        for test, tko_test in zip(reparsed.tests, job.tests):
+            test.test_idx = tko_test.test_idx
+        self.ingester.insert_job('1-user/myhost', reparsed)
+        self.assertEqual([('test1', 'GOOD', 2), ('test2', 'GOOD', 1)],
+                         self._rollups())
+        rollup = tko_models.TestStatusRollup.objects.get(test_name='test1')
+        self.assertEqual(job.tests[1].test_idx, rollup.latest_test_idx)
+
+    def test_lookups_cached(self):
+        kernel_lookups = []
+
+        def insert_kernel(kernel):
+            kernel_lookups.append(kernel.kernel_hash)
+            return original_insert_kernel(kernel)
+        original_insert_kernel = dbutils.insert_kernel
+        self.god.stub_with(dbutils, 'insert_kernel', insert_kernel)
+
+        self.ingester.insert_job('1-user/myhost',
+                                 self._job([self._test('test1'),
+                                            self._test('test2')]))
+        self.ingester.insert_job('2-user/myhost',
+                                 self._job([self._test('test1')]))
+        self.assertEqual(['kernelhash'], kernel_lookups)
+        self.assertEqual(1, tko_models.Kernel.objects.count())
+        self.assertEqual(1, tko_models.Machine.objects.count())
+
+    def test_failed_job_rolled_back(self):
+        job = self._job([self._test('test1'),
+                         self._test('test2', status='UNKNOWN')])
+        self.assertRaises(tko_models.Status.DoesNotExist,
+                          self.ingester.insert_job, '1-user/myhost', job)
+        self.assertEqual(0, tko_models.Job.objects.count())
+        self.assertEqual(0, tko_models.Test.objects.count())
+        self.assertEqual(0, self.ingester.rows)
+
+
+if __name__ == '__main__':
+    unittest.main()
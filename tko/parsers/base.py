@@ -10,14 +10,25 @@ class parser(object):
     Abstract parser base class. Provides a generic implementation of the
     standard parser interfaction functions. The derived classes must
     implement a state_iterator method for this class to be useful.
+
+    Parsers whose state_iterator keeps its state in self.parse_state,
+    creating it if it is None, set resumable to True: their parsing can be
+    saved with get_state() and resumed by start().
     """
 
-    def start(self, job):
+    resumable = False
+
+    def start(self, job, state=None):
         """ Initialize the parser for processing the results of
-        'job'."""
+        'job'. 'state' is a state returned by get_state() on a parser of
+        the same job, to resume parsing after the lines it processed."""
+        if state is not None and not self.resumable:
+            raise ValueError("%s can't resume parsing" %
+                             self.__class__.__module__)
         # initialize all the basic parser parameters
         self.job = job
         self.finished = False
+        self.parse_state = state
         self.line_buffer = status_lib.line_buffer()
         # create and prime the parser state machine
         self.state = self.state_iterator(self.line_buffer)
@@ -53,6 +64,14 @@ class parser(object):
                          "".join(traceback.format_stack()))
             return []
 
+    def get_state(self):
+        """ Return the state of the parser after the lines processed so
+        far, which can be pickled, or None if the parser isn't resumable.
+        Only meaningful before end()."""
+        if not self.resumable:
+            return None
+        return self.parse_state
+
     @staticmethod
     def make_job(dir):
         """ Create a new instance of the job model used by the
@@ -0,0 +1,101 @@
+"""
+Single pass tokenizer of status log lines.
+
+A status line is made of tab separated fields: indentation tabs, a status,
+a subdir, a testname, optional key=value fields and a reason, which is
+everything after the first field not of the key=value form:
+
+    \t\tGOOD\tsubdir\ttestname\ttimestamp=1300000000\tlocaltime=...\treason
+
+The lexer splits a line with a single precompiled regular expression into a
+record (indent, status, subdir, testname, reason, fields), where fields is
+the raw text of the optional fields.  decode_fields() turns it into a dict
+only when the fields are needed.  lex() does the same for all the lines of a
+buffer at once.
+
+The records are the same as the ones of lex_line_split(), which splits the
+line and matches a regular expression per field, as
+version_0.status_line.parse_line() used to.
+"""
+
+import re
+
+# indent, status, subdir, testname: the same lines as
+# version_0.status_line.is_status_line()
+_FIXED_RE = r'(\t*)(\S[^\t\n]*)\t(\S[^\t\n]*)\t(\S[^\t\n]*)\t'
+# key=value fields, up to the first field of another form
+_FIELDS_RE = r'((?:\w+=[^\t\n]+(?:\t|(?=\n)|$))*)'
+
+_LINE_RE = re.compile(_FIXED_RE + _FIELDS_RE)
+_BUFFER_RE = re.compile('^' + _FIXED_RE + _FIELDS_RE + r'([^\n]*)\n*',
+                        re.MULTILINE)
+
+
+def lex_line_split(line):
+    """
+    Tokenize a status line like lex_line(), splitting it on tabs and matching
+    each optional field, as the parser used to do.  Used for the lines with
+    newlines inside, which the regular expressions don't handle, and as
+    reference for tests and benchmarks.
+    """
+    match = re.search(r"^\t*(\S[^\t]*\t){3}", line)
+    if match is None:
+        return None
+    indent = len(line) - len(line.lstrip('\t'))
+    parts = line[indent:].rstrip('\n').split('\t')
+    part_index = 3
+    fields = []
+    while part_index < len(parts):
+        if not re.search(r"^(\w+)=(.+)", parts[part_index]):
+            break
+        fields.append(parts[part_index])
+        part_index += 1
+    return (indent, parts[0], parts[1], parts[2],
+            '\t'.join(parts[part_index:]), '\t'.join(fields))
+
+
+def lex_line(line):
+    """
+    Tokenize a status line.
+
+    :return: (indent, status, subdir, testname, reason, fields) or None if
+            this isn't a status line.
+    """
+    match = _LINE_RE.match(line)
+    if match is None:
+        if '\n' in line.rstrip('\n'):
+            return lex_line_split(line)
+        return None
+    indent, status, subdir, testname, fields = match.groups()
+    reason = line[match.end():].rstrip('\n')
+    if '\n' in reason:
+        return lex_line_split(line)
+    return (len(indent), status, subdir, testname, reason,
+            fields.rstrip('\t'))
+
+
+def lex(buffer):
+    """
+    Tokenize all the status lines of a buffer, skipping the other lines.
+
+    :return: generator of the records of lex_line().
+    """
+    for match in _BUFFER_RE.finditer(buffer):
+        indent, status, subdir, testname, fields, reason = match.groups()
+        yield (len(indent), status, subdir, testname, reason,
+               fields.rstrip('\t'))
+
+
+def decode_fields(fields):
+    """
+    :param fields: fields of a record of lex_line().
+    :return: dict of the optional fields.
+    """
+    decoded = {}
+    if not fields:
+        return decoded
+    for field in fields.split('\t'):
+        key, value = field.split('=', 1)
+        # as the original parser, which stopped a value at a newline
+        decoded[key] = value.split('\n', 1)[0]
+    return decoded
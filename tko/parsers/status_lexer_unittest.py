@@ -0,0 +1,83 @@
+#!/usr/bin/python
+
+import unittest
+
+try:
+    import autotest.common as common
+except ImportError:
+    import common
+from autotest.tko.parsers import status_lexer, version_1
+
+_LINES = [
+    "START\t----\t----\ttimestamp=1300000000\tlocaltime=Mar 13 07:06:40\t\n",
+    "\t\tGOOD\tsubdir\ttestname\ttimestamp=1\tcompleted successfully\n",
+    "\tEND GOOD\tsubdir\ttestname\ttimestamp=1\n",
+    "\tEND GOOD\tsubdir\ttestname\ttimestamp=1",
+    "\tINFO\t----\t----\tkernel=2.6.32\tpatch0=a b c\tpatch1=d e f\t\n",
+    "FAIL\t----\t----\treason\tfield=after_reason\n",
+    "FAIL\t----\t----\tk=v=w\tempty=\tnot a field\n",
+    "FAIL\t----\t----\tk=v\t\t\ttabs\t\n",
+    "FAIL\t----\t----\t\n",
+    "FAIL\t----\t----\t\n\n",
+    "FAIL\t----\t----\tkey=value\n\n",
+    "FAIL\t----\t----\tk=v\tmulti\nline reason\n",
+    "FAIL\t----\t----\tk=v\nx\tmore\n",
+    "FAIL\tsub\ndir\t----\tk=v\t\n",
+    "FAIL\t----\t----\tk=v\r\n",
+    "FAIL\t----\t----\tbad key=value\n",
+    "FAIL\t----\t----",
+    "FAIL\t----\t----\n",
+    "FAIL\t\t----\t----\t\n",
+    " FAIL\t----\t----\t\n",
+    "random output\n",
+    "\t\t\n",
+    "",
+]
+
+
+class LexLineTest(unittest.TestCase):
+
+    def test_same_as_split(self):
+        for line in _LINES:
+            self.assertEqual(status_lexer.lex_line_split(line),
+                             status_lexer.lex_line(line), repr(line))
+
+    def test_record(self):
+        record = status_lexer.lex_line(_LINES[4])
+        self.assertEqual((1, "INFO", "----", "----", ""), record[:5])
+        self.assertEqual({"kernel": "2.6.32", "patch0": "a b c",
+                          "patch1": "d e f"},
+                         status_lexer.decode_fields(record[5]))
+        record = status_lexer.lex_line(_LINES[6])
+        self.assertEqual("empty=\tnot a field", record[4])
+        self.assertEqual({"k": "v=w"}, status_lexer.decode_fields(record[5]))
+        self.assertEqual({}, status_lexer.decode_fields(""))
+
+
+class LexTest(unittest.TestCase):
+
+    def test_same_as_lex_line(self):
+        # lines without newlines inside
+        lines = [line.rstrip("\n") + "\n" for line in _LINES
+                 if "\n" not in line.rstrip("\n")]
+        expected = [status_lexer.lex_line(line) for line in lines]
+        self.assertEqual([record for record in expected if record],
+                         list(status_lexer.lex("".join(lines))))
+
+
+class StatusLineTest(unittest.TestCase):
+
+    def test_fields_decoded_lazily(self):
+        line = version_1.status_line.parse_line(_LINES[1])
+        self.assertEqual("timestamp=1", line._optional_fields)
+        self.assertEqual({"timestamp": "1"}, line.optional_fields)
+        self.assertEqual({"timestamp": "1"}, line._optional_fields)
+
+    def test_info_line(self):
+        line = version_1.status_line.parse_line(_LINES[4])
+        self.assertEqual("INFO", line.type)
+        self.assertEqual("2.6.32", line.get_kernel().base)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+"""Compare the speed of the status line tokenizers on a large status log.
+
+Without a status log, a synthetic one is generated.
+"""
+
+import optparse
+import random
+import sys
+import time
+try:
+    import autotest.common as common
+except ImportError:
+    import common
+from autotest.tko import status_lib
+from autotest.tko.parsers import status_lexer, version_1
+
+usage = 'usage: %prog [options] [status_log]'
+parser = optparse.OptionParser(usage=usage)
+parser.add_option('-n', '--lines', type='int', dest='lines', default=500000,
+                  help='Lines of the synthetic status log')
+parser.add_option('-r', '--repeat', type='int', dest='repeat', default=3,
+                  help='Runs of each tokenizer, the best one is reported')
+
+
+def synthetic_status_log(num_lines):
+    lines = ['START\t----\t----\ttimestamp=1300000000\t'
+             'localtime=Mar 13 07:06:40\t\n']
+    timestamp = 1300000000
+    while len(lines) < num_lines:
+        timestamp += 1
+        test = 'test%d' % random.randint(0, 1000)
+        fields = 'timestamp=%d\tlocaltime=Mar 13 07:06:40' % timestamp
+        lines.append('\tSTART\t%s\t%s\t%s\t\n' % (test, test, fields))
+        for _ in xrange(random.randint(1, 20)):
+            lines.append('\t\tINFO\t----\t----\t%s\tcollecting sysinfo\n'
+                         % fields)
+        lines.append('\t\tGOOD\t%s\t%s\t%s\tcompleted successfully\n'
+                     % (test, test, fields))
+        lines.append('\tEND GOOD\t%s\t%s\t%s\t\n' % (test, test, fields))
+    lines.append('END GOOD\t----\t----\ttimestamp=%d\t\n' % timestamp)
+    return ''.join(lines)
+
+
+def split_parse_line(line):
+    """status_line.parse_line() before the lexer."""
+    record = status_lexer.lex_line_split(line)
+    if record is None:
+        return None
+    indent, status, subdir, testname, reason, fields = record
+    return version_1.status_line(indent, status, subdir, testname, reason,
+                                 status_lexer.decode_fields(fields))
+
+
+def parse_lines(parse_line, lines):
+    for line in lines:
+        parse_line(status_lib.clean_raw_line(line))
+
+
+def lex_buffer(buffer):
+    for _ in status_lexer.lex(buffer):
+        pass
+
+
+def best_time(repeat, function, *args):
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        function(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    (options, args) = parser.parse_args()
+    if len(args) > 1:
+        parser.print_help()
+        sys.exit(1)
+    if args:
+        buffer = open(args[0]).read()
+    else:
+        buffer = synthetic_status_log(options.lines)
+    lines = buffer.splitlines(True)
+    print '%d lines, %d bytes' % (len(lines), len(buffer))
+
+    benchmarks = [
+        ('split parse_line', parse_lines, split_parse_line, lines),
+        ('lexer parse_line', parse_lines,
+         version_1.status_line.parse_line, lines),
+        ('lex_line', parse_lines, status_lexer.lex_line, lines),
+        ('lex buffer', lex_buffer, buffer),
+    ]
+    reference = None
+    for name, function in [(b[0], b[1:]) for b in benchmarks]:
+        elapsed = best_time(options.repeat, *function)
+        if reference is None:
+            reference = elapsed
+        print '%-20s %8.3fs %10.0f lines/s %6.2fx' % (
+            name, elapsed, len(lines) / elapsed, reference / elapsed)
+
+
+if __name__ == '__main__':
+    main()
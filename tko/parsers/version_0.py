@@ -4,7 +4,7 @@ import logging
 
 from autotest.client.shared import utils as common_utils
 from autotest.tko import utils as tko_utils, models, status_lib
-from autotest.tko.parsers import base
+from autotest.tko.parsers import base, status_lexer
 
 
 class NoHostnameError(Exception):
@@ -212,6 +212,11 @@ class iteration(models.iteration):
 
 class status_line(object):
 
+    """
+    A line of a status log.  optional_fields may be given as a dict or as the
+    fields of a status_lexer record, decoded when first used.
+    """
+
     def __init__(self, indent, status, subdir, testname, reason,
                  optional_fields):
         # pull out the type & status of the line
@@ -234,6 +239,17 @@ class status_line(object):
         self.reason = reason
         self.optional_fields = optional_fields
 
+    def _get_optional_fields(self):
+        fields = self._optional_fields
+        if not isinstance(fields, dict):
+            fields = self._optional_fields = status_lexer.decode_fields(fields)
+        return fields
+
+    def _set_optional_fields(self, fields):
+        self._optional_fields = fields
+
+    optional_fields = property(_get_optional_fields, _set_optional_fields)
+
     @staticmethod
     def parse_name(name):
         if name == "----":
@@ -246,39 +262,11 @@ class status_line(object):
 
     @classmethod
     def parse_line(cls, line):
-        if not status_line.is_status_line(line):
+        record = status_lexer.lex_line(line)
+        if record is None:
             return None
-        match = re.search(r"^(\t*)(.*)$", line, flags=re.DOTALL)
-        if not match:
-            # A more useful error message than:
-            #  AttributeError: 'NoneType' object has no attribute 'groups'
-            # to help us debug WTF happens on occasion here.
-            raise RuntimeError("line %r could not be parsed." % line)
-        indent, line = match.groups()
-        indent = len(indent)
-
-        # split the line into the fixed and optional fields
-        parts = line.rstrip("\n").split("\t")
-
-        part_index = 3
-        status, subdir, testname = parts[0:part_index]
-
-        # all optional parts should be of the form "key=value". once we've found
-        # a non-matching part, treat it and the rest of the parts as the reason.
-        optional_fields = {}
-        while part_index < len(parts):
-            kv = re.search(r"^(\w+)=(.+)", parts[part_index])
-            if not kv:
-                break
-
-            optional_fields[kv.group(1)] = kv.group(2)
-            part_index += 1
-
-        reason = "\t".join(parts[part_index:])
-
         # build up a new status_line and return it
-        return cls(indent, status, subdir, testname, reason,
-                   optional_fields)
+        return cls(*record)
 
 
 class parser(base.parser):
@@ -138,8 +138,35 @@ class status_line(version_0.status_line):
 patch = version_0.patch
 
 
+class parse_state(object):
+
+    """
+    The state of the parser state machine between two status lines.  It is
+    kept out of state_iterator so that it can be saved with get_state() and
+    parsing resumed from it later.
+    """
+
+    def __init__(self):
+        # the last status line, for the timestamp of implicit aborts
+        self.line = None
+        self.job_count, self.boot_count = 0, 0
+        self.min_stack_size = 0
+        self.stack = status_lib.status_stack()
+        self.current_kernel = kernel("", [])  # UNKNOWN
+        self.current_status = status_lib.statuses[-1]
+        self.current_reason = None
+        self.started_time_stack = [None]
+        self.subdir_stack = [None]
+        self.running_test = None
+        self.running_reasons = set()
+        self.running_job = None
+        self.running_client = None
+
+
 class parser(base.parser):
 
+    resumable = True
+
     @staticmethod
     def make_job(dir):
         return job(dir)
@@ -170,35 +197,28 @@ class parser(base.parser):
         line_buffer.put_back(abort)
 
     def state_iterator(self, buffer):
-        line = None
         new_tests = []
-        job_count, boot_count = 0, 0
-        min_stack_size = 0
-        stack = status_lib.status_stack()
-        current_kernel = kernel("", [])  # UNKNOWN
-        current_status = status_lib.statuses[-1]
-        current_reason = None
-        started_time_stack = [None]
-        subdir_stack = [None]
-        running_test = None
-        running_reasons = set()
         yield []   # we're ready to start running
 
-        # create a RUNNING SERVER_JOB entry to represent the entire test
-        running_job = test.parse_partial_test(self.job, "----", "SERVER_JOB",
-                                              "", current_kernel,
-                                              self.job.started_time)
-        new_tests.append(running_job)
+        s = self.parse_state
+        if s is None:
+            s = self.parse_state = parse_state()
+            # create a RUNNING SERVER_JOB entry to represent the entire test
+            s.running_job = test.parse_partial_test(self.job, "----",
+                                                    "SERVER_JOB", "",
+                                                    s.current_kernel,
+                                                    self.job.started_time)
+            new_tests.append(s.running_job)
 
         while True:
             # are we finished with parsing?
             if buffer.size() == 0 and self.finished:
-                if stack.size() == 0:
+                if s.stack.size() == 0:
                     break
                 # we have status lines left on the stack,
                 # we need to implicitly abort them first
                 logging.debug('Unexpected end of job, aborting')
-                abort_subdir_stack = list(subdir_stack)
+                abort_subdir_stack = list(s.subdir_stack)
                 if self.job.aborted_by:
                     reason = "Job aborted by %s" % self.job.aborted_by
                     reason += self.job.aborted_on.strftime(
@@ -206,8 +226,8 @@ class parser(base.parser):
                 else:
                     reason = "Job aborted unexpectedly"
 
-                timestamp = line.optional_fields.get('timestamp')
-                for i in reversed(xrange(stack.size())):
+                timestamp = s.line.optional_fields.get('timestamp')
+                for i in reversed(xrange(s.stack.size())):
                     if abort_subdir_stack:
                         subdir = abort_subdir_stack.pop()
                     else:
@@ -233,15 +253,16 @@ class parser(base.parser):
             if line is None:
                 logging.debug('non-status line, ignoring')
                 continue
+            s.line = line
 
             # do an initial sanity check of the indentation
-            expected_indent = stack.size()
+            expected_indent = s.stack.size()
             if line.type == "END":
                 expected_indent -= 1
             if line.indent < expected_indent:
                 # ABORT the current level if indentation was unexpectedly low
                 self.put_back_line_and_abort(
-                    buffer, raw_line, stack.size() - 1, subdir_stack[-1],
+                    buffer, raw_line, s.stack.size() - 1, s.subdir_stack[-1],
                     line.optional_fields.get("timestamp"), line.reason)
                 continue
             elif line.indent > expected_indent:
@@ -251,73 +272,71 @@ class parser(base.parser):
 
             # initial line processing
             if line.type == "START":
-                stack.start()
+                s.stack.start()
                 started_time = line.get_timestamp()
                 if (line.testname is None and line.subdir is None and
-                        not running_test):
+                        not s.running_test):
                     # we just started a client, all tests are relative to here
-                    min_stack_size = stack.size()
+                    s.min_stack_size = s.stack.size()
                     # start a "RUNNING" CLIENT_JOB entry
-                    job_name = "CLIENT_JOB.%d" % job_count
-                    running_client = test.parse_partial_test(self.job, None,
-                                                             job_name,
-                                                             "", current_kernel,
-                                                             started_time)
-                    logging.debug("RUNNING: %s", running_client.status)
-                    logging.debug("Testname: %s", running_client.testname)
-                    new_tests.append(running_client)
-                elif stack.size() == min_stack_size + 1 and not running_test:
+                    job_name = "CLIENT_JOB.%d" % s.job_count
+                    s.running_client = test.parse_partial_test(
+                        self.job, None, job_name, "", s.current_kernel,
+                        started_time)
+                    logging.debug("RUNNING: %s", s.running_client.status)
+                    logging.debug("Testname: %s", s.running_client.testname)
+                    new_tests.append(s.running_client)
+                elif (s.stack.size() == s.min_stack_size + 1 and
+                      not s.running_test):
                     # we just started a new test, insert a running record
-                    running_reasons = set()
+                    s.running_reasons = set()
                     if line.reason:
-                        running_reasons.add(line.reason)
-                    running_test = test.parse_partial_test(self.job,
-                                                           line.subdir,
-                                                           line.testname,
-                                                           line.reason,
-                                                           current_kernel,
-                                                           started_time)
-                    logging.debug("RUNNING: %s", running_test.status)
-                    logging.debug("Subdir: %s", running_test.subdir)
-                    logging.debug("Testname: %s", running_test.testname)
-                    logging.debug("Reason: %s", running_test.reason)
-                    new_tests.append(running_test)
-                started_time_stack.append(started_time)
-                subdir_stack.append(line.subdir)
+                        s.running_reasons.add(line.reason)
+                    s.running_test = test.parse_partial_test(
+                        self.job, line.subdir, line.testname, line.reason,
+                        s.current_kernel, started_time)
+                    logging.debug("RUNNING: %s", s.running_test.status)
+                    logging.debug("Subdir: %s", s.running_test.subdir)
+                    logging.debug("Testname: %s", s.running_test.testname)
+                    logging.debug("Reason: %s", s.running_test.reason)
+                    new_tests.append(s.running_test)
+                s.started_time_stack.append(started_time)
+                s.subdir_stack.append(line.subdir)
                 continue
             elif line.type == "INFO":
                 fields = line.optional_fields
                 # update the current kernel if one is defined in the info
                 if "kernel" in fields:
-                    current_kernel = line.get_kernel()
+                    s.current_kernel = line.get_kernel()
                 # update the SERVER_JOB reason if one was logged for an abort
                 if "job_abort_reason" in fields:
-                    running_job.reason = fields["job_abort_reason"]
-                    new_tests.append(running_job)
+                    s.running_job.reason = fields["job_abort_reason"]
+                    new_tests.append(s.running_job)
                 continue
             elif line.type == "STATUS":
                 # update the stacks
-                if line.subdir and stack.size() > min_stack_size:
-                    subdir_stack[-1] = line.subdir
+                if line.subdir and s.stack.size() > s.min_stack_size:
+                    s.subdir_stack[-1] = line.subdir
                 # update the status, start and finished times
-                stack.update(line.status)
+                s.stack.update(line.status)
                 if status_lib.is_worse_than_or_equal_to(line.status,
-                                                        current_status):
+                                                        s.current_status):
                     if line.reason:
                         # update the status of a currently running test
-                        if running_test:
-                            running_reasons.add(line.reason)
-                            running_reasons = tko_utils.drop_redundant_messages(
-                                running_reasons)
-                            sorted_reasons = sorted(running_reasons)
-                            running_test.reason = ", ".join(sorted_reasons)
-                            current_reason = running_test.reason
-                            new_tests.append(running_test)
+                        if s.running_test:
+                            s.running_reasons.add(line.reason)
+                            s.running_reasons = (
+                                tko_utils.drop_redundant_messages(
+                                    s.running_reasons))
+                            sorted_reasons = sorted(s.running_reasons)
+                            s.running_test.reason = ", ".join(sorted_reasons)
+                            s.current_reason = s.running_test.reason
+                            new_tests.append(s.running_test)
                             logging.debug("update RUNNING reason: %s",
                                           line.reason)
                         else:
-                            current_reason = line.reason
-                    current_status = stack.current_status()
+                            s.current_reason = line.reason
+                    s.current_status = s.stack.current_status()
                 started_time = None
                 finished_time = line.get_timestamp()
                 # if this is a non-test entry there's nothing else to do
@@ -327,62 +346,63 @@ class parser(base.parser):
                 # grab the current subdir off of the subdir stack, or, if this
                 # is the end of a job, just pop it off
                 if (line.testname is None and line.subdir is None and
-                        not running_test):
-                    min_stack_size = stack.size() - 1
-                    subdir_stack.pop()
+                        not s.running_test):
+                    s.min_stack_size = s.stack.size() - 1
+                    s.subdir_stack.pop()
                 else:
-                    line.subdir = subdir_stack.pop()
-                    if not subdir_stack[-1] and stack.size() > min_stack_size:
-                        subdir_stack[-1] = line.subdir
+                    line.subdir = s.subdir_stack.pop()
+                    if (not s.subdir_stack[-1] and
+                            s.stack.size() > s.min_stack_size):
+                        s.subdir_stack[-1] = line.subdir
                 # update the status, start and finished times
-                stack.update(line.status)
-                current_status = stack.end()
-                if stack.size() > min_stack_size:
-                    stack.update(current_status)
-                    current_status = stack.current_status()
-                started_time = started_time_stack.pop()
+                s.stack.update(line.status)
+                s.current_status = s.stack.end()
+                if s.stack.size() > s.min_stack_size:
+                    s.stack.update(s.current_status)
+                    s.current_status = s.stack.current_status()
+                started_time = s.started_time_stack.pop()
                 finished_time = line.get_timestamp()
                 # update the current kernel
-                if line.is_successful_reboot(current_status):
-                    current_kernel = line.get_kernel()
+                if line.is_successful_reboot(s.current_status):
+                    s.current_kernel = line.get_kernel()
                 # adjust the testname if this is a reboot
                 if line.testname == "reboot" and line.subdir is None:
-                    line.testname = "boot.%d" % boot_count
+                    line.testname = "boot.%d" % s.boot_count
             else:
                 assert False
 
             # have we just finished a test?
-            if stack.size() <= min_stack_size:
+            if s.stack.size() <= s.min_stack_size:
                 # if there was no testname, just use the subdir
                 if line.testname is None:
                     line.testname = line.subdir
                 # if there was no testname or subdir, use 'CLIENT_JOB'
                 if line.testname is None:
-                    line.testname = "CLIENT_JOB.%d" % job_count
-                    running_test = running_client
-                    job_count += 1
+                    line.testname = "CLIENT_JOB.%d" % s.job_count
+                    s.running_test = s.running_client
+                    s.job_count += 1
                     if not status_lib.is_worse_than_or_equal_to(
-                            current_status, "ABORT"):
+                            s.current_status, "ABORT"):
                         # a job hasn't really failed just because some of the
                         # tests it ran have
-                        current_status = "GOOD"
+                        s.current_status = "GOOD"
 
-                if not current_reason:
-                    current_reason = line.reason
+                if not s.current_reason:
+                    s.current_reason = line.reason
                 new_test = test.parse_test(self.job,
                                            line.subdir,
                                            line.testname,
-                                           current_status,
-                                           current_reason,
-                                           current_kernel,
+                                           s.current_status,
+                                           s.current_reason,
+                                           s.current_kernel,
                                            started_time,
                                            finished_time,
-                                           running_test)
-                running_test = None
-                current_status = status_lib.statuses[-1]
-                current_reason = None
-                if new_test.testname == ("boot.%d" % boot_count):
-                    boot_count += 1
+                                           s.running_test)
+                s.running_test = None
+                s.current_status = status_lib.statuses[-1]
+                s.current_reason = None
+                if new_test.testname == ("boot.%d" % s.boot_count):
+                    s.boot_count += 1
 
                 logging.debug("ADD: %s", new_test.status)
                 logging.debug("Subdir: %s", new_test.subdir)
@@ -393,10 +413,11 @@ class parser(base.parser):
 
         # the job is finished, produce the final SERVER_JOB entry and exit
         final_job = test.parse_test(self.job, "----", "SERVER_JOB",
-                                    self.job.exit_status(), running_job.reason,
-                                    current_kernel,
+                                    self.job.exit_status(),
+                                    s.running_job.reason,
+                                    s.current_kernel,
                                     self.job.started_time,
                                     self.job.finished_time,
-                                    running_job)
+                                    s.running_job)
         new_tests.append(final_job)
         yield new_tests
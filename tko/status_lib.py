@@ -27,8 +27,19 @@ def is_worse_than_or_equal_to(lhs, rhs):
 DEFAULT_BLACKLIST = ('\r\x00',)
 
 
+_DEFAULT_BLACKLIST_RE = re.compile('|'.join(DEFAULT_BLACKLIST))
+
+
 def clean_raw_line(raw_line, blacklist=DEFAULT_BLACKLIST):
     """Strip blacklisted characters from raw_line."""
+    if blacklist is DEFAULT_BLACKLIST:
+        # the default patterns are plain strings, rarely found
+        for pattern in DEFAULT_BLACKLIST:
+            if pattern in raw_line:
+                break
+        else:
+            return raw_line
+        return _DEFAULT_BLACKLIST_RE.sub('', raw_line)
     return re.sub('|'.join(blacklist), '', raw_line)
 
 
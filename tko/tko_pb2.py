@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# source: tko.proto
+"""Generated protocol buffer code."""
+from google.protobuf.internal import builder as _builder
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import symbol_database as _symbol_database
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\ttko.proto\"\xe4\x05\n\x03Job\x12\x0b\n\x03\x64ir\x18\x01 \x02(\t\x12\x18\n\x05tests\x18\x02 \x03(\x0b\x32\t.Job.Test\x12\x0c\n\x04user\x18\x03 \x02(\t\x12\r\n\x05label\x18\x04 \x02(\t\x12\x0b\n\x03tag\x18\x05 \x02(\t\x12\x13\n\x0bqueued_time\x18\x06 \x02(\x03\x12\x14\n\x0cstarted_time\x18\x07 \x02(\x03\x12\x15\n\rfinished_time\x18\x08 \x02(\x03\x12\x0f\n\x07machine\x18\t \x02(\t\x12\x15\n\rmachine_owner\x18\n \x02(\t\x12\x15\n\rmachine_group\x18\x0b \x02(\t\x12\x12\n\naborted_by\x18\x0c \x02(\t\x12\x12\n\naborted_on\x18\r \x02(\x03\x12\x12\n\nafe_job_id\x18\x0e \x02(\t\x12 \n\x0bkeyval_dict\x18\x0f \x03(\x0b\x32\x0b.Job.KeyVal\x1a%\n\x06KeyVal\x12\x0c\n\x04name\x18\x01 \x02(\t\x12\r\n\x05value\x18\x02 \x02(\t\x1a+\n\x06Kernel\x12\x0c\n\x04\x62\x61se\x18\x01 \x02(\t\x12\x13\n\x0bkernel_hash\x18\x02 \x02(\t\x1a^\n\tIteration\x12\r\n\x05index\x18\x01 \x02(\x03\x12 \n\x0b\x61ttr_keyval\x18\x02 \x03(\x0b\x32\x0b.Job.KeyVal\x12 \n\x0bperf_keyval\x18\x03 \x03(\x0b\x32\x0b.Job.KeyVal\x1a\xf8\x01\n\x04Test\x12\x0e\n\x06subdir\x18\x01 \x02(\t\x12\x10\n\x08testname\x18\x02 \x02(\t\x12\x0e\n\x06status\x18\x03 \x02(\t\x12\x0e\n\x06reason\x18\x04 \x02(\t\x12\x1b\n\x06kernel\x18\x05 \x02(\x0b\x32\x0b.Job.Kernel\x12\x0f\n\x07machine\x18\x06 \x02(\t\x12\x14\n\x0cstarted_time\x18\x07 \x02(\x03\x12\x15\n\rfinished_time\x18\x08 \x02(\x03\x12\"\n\niterations\x18\t \x03(\x0b\x32\x0e.Job.Iteration\x12\x1f\n\nattributes\x18\n \x03(\x0b\x32\x0b.Job.KeyVal\x12\x0e\n\x06labels\x18\x0b \x03(\t')
+
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'tko_pb2', globals())
+if _descriptor._USE_C_DESCRIPTORS == False:
+
+  DESCRIPTOR._options = None
+  _JOB._serialized_start=14
+  _JOB._serialized_end=754
+  _JOB_KEYVAL._serialized_start=325
+  _JOB_KEYVAL._serialized_end=362
+  _JOB_KERNEL._serialized_start=364
+  _JOB_KERNEL._serialized_end=407
+  _JOB_ITERATION._serialized_start=409
+  _JOB_ITERATION._serialized_end=503
+  _JOB_TEST._serialized_start=506
+  _JOB_TEST._serialized_end=754
+# @@protoc_insertion_point(module_scope)